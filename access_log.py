@@ -0,0 +1,313 @@
+import fcntl
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+
+LOG_FORMATS = ['common', 'combined', 'json']
+
+# Records waiting for the writer thread, once full further records are dropped
+DEFAULT_QUEUE_SIZE = 10000
+
+# Most records formatted and written with a single write call
+DEFAULT_BATCH_SIZE = 256
+
+# Seconds buffered records may wait before being written
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+# Rotated files kept next to the log, as `access.log.1` (newest) to `access.log.N`
+DEFAULT_BACKUP_COUNT = 5
+
+# Fraction of the queue that must be in use before sampling kicks in
+SAMPLING_THRESHOLD = 0.5
+
+CLF_TIME_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
+
+
+class AccessRecord:
+    """The fields of one access log line, captured on the request path and formatted by the writer thread"""
+
+    __slots__ = ['timestamp', 'client', 'method', 'path', 'http_version', 'status_code', 'bytes_sent',
+                 'referer', 'user_agent', 'duration', 'handler']
+
+    def __init__(self, timestamp: float, client: str, method: str, path: str, http_version: str,
+                 status_code: int, bytes_sent: int, referer: str, user_agent: str, duration: float, handler: str):
+        self.timestamp = timestamp
+        self.client = client
+        self.method = method
+        self.path = path
+        self.http_version = http_version
+        self.status_code = status_code
+        self.bytes_sent = bytes_sent
+        self.referer = referer
+        self.user_agent = user_agent
+        self.duration = duration
+        self.handler = handler
+
+
+def format_record(record: AccessRecord, log_format: str) -> str:
+    """
+    Formats a record as one log line, without the trailing newline
+
+    Params:
+    - `record` - the record to format
+    - `log_format` - one of `LOG_FORMATS`
+    """
+    if log_format == 'json':
+        return json.dumps({
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(record.timestamp)),
+            'client': record.client,
+            'method': record.method,
+            'path': record.path,
+            'protocol': record.http_version,
+            'status': record.status_code,
+            'bytes': record.bytes_sent,
+            'duration_ms': round(record.duration * 1000, 3),
+            'referer': record.referer,
+            'user_agent': record.user_agent,
+            'handler': record.handler,
+        })
+
+    # https://httpd.apache.org/docs/2.4/logs.html#common
+    if record.method is None:
+        request_line = '-'
+    else:
+        request_line = escape(f'{record.method} {record.path} {record.http_version}')
+    status = '-' if record.status_code is None else record.status_code
+    size = record.bytes_sent if record.bytes_sent > 0 else '-'
+    logged_time = time.strftime(CLF_TIME_FORMAT, time.localtime(record.timestamp))
+    line = f'{record.client or "-"} - - [{logged_time}] "{request_line}" {status} {size}'
+    if log_format == 'combined':
+        line = f'{line} "{escape(record.referer or "-")}" "{escape(record.user_agent or "-")}"'
+    return line
+
+
+def escape(value: str) -> str:
+    """
+    Escapes a client supplied value so it can't break out of its quoted log field
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class AccessLogger:
+    """
+    Access log written by a background thread, so request handling never waits on disk I/O.
+
+    `log` captures a record and appends it to a bounded queue, a lock-free `deque` append that only wakes the
+    writer once a batch is ready. When the queue is more than half full only `sample_rate` of the records are
+    kept, and when it is full records are dropped rather than blocking the request. The writer formats
+    records in batches, writes each batch with one call, and rotates the file by size and/or age.
+
+    Worker processes forked after the logger was created start their own writer thread on first use and
+    append to the same file. A file rotated by one process is reopened by the others on their next write, and
+    rotation takes a lock on the file so processes finding it due at the same time rotate it only once.
+    """
+
+    def __init__(self, path: str, log_format: str = 'combined', queue_size: int = DEFAULT_QUEUE_SIZE,
+                 batch_size: int = DEFAULT_BATCH_SIZE, flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 max_bytes: int = 0, rotate_interval: float = 0, backup_count: int = DEFAULT_BACKUP_COUNT,
+                 sample_rate: float = 1.0):
+        """
+        Params:
+        - `path` - file to append to, `-` writes to stdout (never rotated)
+        - `log_format` - one of `LOG_FORMATS`
+        - `queue_size` - records that may wait for the writer before new ones are dropped
+        - `batch_size` - most records written per write call
+        - `flush_interval` - seconds a record may wait before being written
+        - `max_bytes` - rotate once the file reaches this size, 0 never rotates by size
+        - `rotate_interval` - rotate after this many seconds, 0 never rotates by age
+        - `backup_count` - rotated files kept
+        - `sample_rate` - fraction of records kept while the queue is more than half full
+        """
+        if log_format not in LOG_FORMATS:
+            raise ValueError(f'Unknown access log format: {log_format}')
+        self.path = path
+        self.log_format = log_format
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.sample_rate = sample_rate
+
+        self.__lock = threading.Lock()
+        self.__stats = {'written': 0, 'dropped': 0, 'sampled_out': 0}
+        self.__pid = None
+        self.__pending = deque()
+        self.__wakeup = threading.Event()
+        self.__stopping = False
+        self.__thread = None
+        self.__file = None
+        self.__rotate_at = None
+
+    def log(self, request, handler: str, duration: float):
+        """
+        Queues an access log record for a request that has been replied to, never blocks
+
+        Params:
+        - `request` - the `Request` that was replied to
+        - `handler` - the name of the handler that replied
+        - `duration` - seconds taken to reply
+        """
+        if self.__pid != os.getpid():
+            self.__start()
+
+        pending = self.__pending
+        if len(pending) >= self.queue_size:
+            self.__increment('dropped')
+            return
+        if self.sample_rate < 1.0 and len(pending) > self.queue_size * SAMPLING_THRESHOLD \
+                and random.random() >= self.sample_rate:
+            self.__increment('sampled_out')
+            return
+
+        pending.append(AccessRecord(time.time(), request.client_address, getattr(request, 'method', None),
+                                    getattr(request, 'path', None), getattr(request, 'http_version', None),
+                                    request.status_code, request.bytes_sent, request.get_header('Referer'),
+                                    request.get_header('User-Agent'), duration, handler))
+        if len(pending) == self.batch_size:
+            self.__wakeup.set()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+        Counts of records written, dropped because the queue was full, and left out by sampling
+        """
+        with self.__lock:
+            return dict(self.__stats)
+
+    def close(self):
+        """
+        Writes every queued record and stops the writer thread of this process
+        """
+        if self.__pid != os.getpid() or self.__thread is None:
+            return
+        self.__stopping = True
+        self.__wakeup.set()
+        self.__thread.join()
+        self.__thread = None
+        self.__pid = None
+
+    def __increment(self, counter: str, amount: int = 1):
+        with self.__lock:
+            self.__stats[counter] += amount
+
+    def __start(self):
+        """
+        Starts the writer thread of the current process, threads don't survive `fork` so each worker starts its own
+        """
+        with self.__lock:
+            if self.__pid == os.getpid():
+                return
+            # Records queued by the parent before the fork belong to the parent's writer
+            self.__pending = deque()
+            self.__wakeup = threading.Event()
+            self.__stopping = False
+            self.__file = None
+            self.__thread = threading.Thread(target=self.__write_loop, name='access-log', daemon=True)
+            self.__thread.start()
+            self.__pid = os.getpid()
+
+    def __write_loop(self):
+        """
+        Writer thread body, writes queued records in batches every `flush_interval` seconds (or sooner once a
+        batch is ready) until the logger is closed
+        """
+        pending = self.__pending
+        while True:
+            self.__wakeup.wait(self.flush_interval)
+            self.__wakeup.clear()
+            stopping = self.__stopping
+            while pending:
+                batch = []
+                while pending and len(batch) < self.batch_size:
+                    batch.append(pending.popleft())
+                self.__write(batch)
+            if stopping:
+                if self.__file is not None and self.__file is not sys.stdout:
+                    self.__file.close()
+                return
+
+    def __write(self, batch: list):
+        """
+        Formats and writes a batch of records with a single write call, rotating the file first if it is due
+        """
+        if len(batch) == 0:
+            return
+        text = ''.join(format_record(record, self.log_format) + '\n' for record in batch)
+        try:
+            file = self.__open()
+            file.write(text)
+            file.flush()
+        except OSError:
+            self.__increment('dropped', len(batch))
+            return
+        self.__increment('written', len(batch))
+
+    def __open(self):
+        """
+        Returns:
+        The log file to write to, (re)opened if it was rotated by this or another process
+        """
+        if self.path == '-':
+            return sys.stdout
+
+        if self.__file is not None:
+            try:
+                current = os.stat(self.path)
+                opened = os.fstat(self.__file.fileno())
+                rotated = (current.st_ino, current.st_dev) != (opened.st_ino, opened.st_dev)
+            except FileNotFoundError:
+                rotated = True
+            if rotated:
+                self.__file.close()
+                self.__file = None
+            elif (self.max_bytes > 0 and opened.st_size >= self.max_bytes) or \
+                    (self.__rotate_at is not None and time.time() >= self.__rotate_at):
+                self.__rotate_shared(opened)
+
+        if self.__file is None:
+            self.__file = open(self.path, 'a', encoding='utf-8')
+            self.__rotate_at = time.time() + self.rotate_interval if self.rotate_interval > 0 else None
+        return self.__file
+
+    def __rotate_shared(self, opened: os.stat_result):
+        """
+        Rotates the log unless another process appending to it (e.g. a prefork worker) just did, then closes it.
+        Processes that find the log due together take turns holding an exclusive lock on it, and only the
+        first one still finds `path` to be the file it has open, so no backup generation is shifted twice.
+
+        Params:
+        - `opened` - `os.fstat` of the open log file
+        """
+        file = self.__file
+        self.__file = None
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            try:
+                current = os.stat(self.path)
+                if (current.st_ino, current.st_dev) == (opened.st_ino, opened.st_dev):
+                    self.__rotate()
+            except FileNotFoundError:
+                pass
+        finally:
+            # Closing the file releases the lock
+            file.close()
+
+    def __rotate(self):
+        """
+        Shifts `path` to `path.1`, `path.1` to `path.2` and so on, removing the oldest file
+        """
+        if self.backup_count <= 0:
+            os.remove(self.path)
+            return
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f'{self.path}.{index}'
+            if os.path.exists(source):
+                os.replace(source, f'{self.path}.{index + 1}')
+        if os.path.exists(self.path):
+            os.replace(self.path, f'{self.path}.1')
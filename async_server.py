@@ -0,0 +1,766 @@
+import asyncio
+import signal
+import threading
+import time
+from collections import deque
+from concurrency import WORKER_SHUTDOWN_TIMEOUT
+from config import ServerConfig
+from connection import CONNECTION_STATS, OPEN_CONNECTIONS, BaseConnection, IncompleteRequest, RequestTimeout
+from http2 import INTERNAL_ERROR, Http2Session, Http2Stream, StreamConnection, StreamedBody, detect_http2
+from http_parser import ParsedRequest, RequestParser
+from lifecycle import Drain, hand_off, inherited_socket, notify_ready
+from limits import REJECTED_CONNECTION_REPLIES, ConnectionLimiter
+from metrics import METRICS
+from request import Request
+from response import ChunkedEncoder
+
+# File bodies are sent in slices of this many bytes, each of which the client must take within the write timeout
+SENDFILE_SLICE_BYTES = 1024 * 1024
+
+
+class QueuedStream:
+    """A streamed body waiting in the write queue of an `AsyncConnection`"""
+
+    __slots__ = ['chunks', 'encoder', 'blocking']
+
+    def __init__(self, chunks, encoder: ChunkedEncoder, blocking: bool = False):
+        """
+        Params:
+        - `chunks` - iterable or async iterable of the pieces of the body
+        - `encoder` - frames the pieces
+        - `blocking` - pull the pieces on a worker thread, for bodies queued by `run_blocking` functions
+        """
+        self.chunks = chunks
+        self.encoder = encoder
+        self.blocking = blocking
+
+
+class BlockingCall:
+    """A `run_blocking` function waiting in the write queue of an `AsyncConnection`"""
+
+    __slots__ = ['function']
+
+    def __init__(self, function):
+        self.function = function
+
+
+class AsyncConnection(BaseConnection):
+    """
+    Non-blocking connection used by the asyncio backend.
+
+    Received bytes are fed to the parser by `HttpProtocol`, reads raise `IncompleteRequest` instead of waiting,
+    and writes are queued on the transport so the event loop is never blocked on socket I/O.
+    """
+
+    def __init__(self, transport: asyncio.Transport, **kwargs):
+        """
+        Params:
+        - `transport` - the asyncio transport of the client connection
+        - see `BaseConnection` for the keep-alive settings
+        """
+        super().__init__(**kwargs)
+        self.transport = transport
+        # Writes queued behind an in-progress `loop.sendfile` or streamed body
+        self.__outgoing = deque()
+        self.__flushing = False
+        self.__close_when_flushed = False
+        # Cleared while the transport buffers more than its high-water mark, streamed bodies wait on it
+        self.__writable = asyncio.Event()
+        self.__writable.set()
+        # Set once the request being received has taken too long, the next read reports it
+        self.__timeout_error = None
+        # True while a `run_blocking` function runs on a worker thread
+        self.__blocking = False
+        # Called on the event loop once a `run_blocking` function has returned
+        self.on_unblocked = None
+
+    def feed(self, data: bytes):
+        """
+        Hands bytes received from the peer to the parser
+
+        Params:
+        - `data` - the received bytes
+        """
+        self.parser.feed(data)
+
+    def time_out(self, error: RequestTimeout):
+        """
+        Makes the next `read_request` fail with `error`, so the request that took too long to arrive is
+        answered with 408 by the usual error path
+        """
+        self.__timeout_error = error
+
+    def read_request(self) -> ParsedRequest:
+        if self.__timeout_error is not None:
+            error, self.__timeout_error = self.__timeout_error, None
+            raise error
+        started = time.perf_counter()
+        request = self.parser.parse()
+        self.parse_time = time.perf_counter() - started
+        if request is None:
+            raise IncompleteRequest()
+        return request
+
+    def send(self, data: bytes):
+        if self.closed:
+            return
+        if self.__flushing:
+            self.__outgoing.append(bytes(data))
+        else:
+            self.transport.write(data)
+
+    def send_parts(self, parts: list):
+        if self.closed:
+            return
+        if self.__flushing:
+            self.__outgoing.extend(bytes(part) for part in parts)
+        else:
+            self.transport.writelines(parts)
+
+    def send_file(self, file, offset: int, count: int, close_file: bool = True):
+        """
+        Queues `count` bytes of an open binary file to be sent with `loop.sendfile`.
+        Unless `close_file` is False, the connection takes ownership of `file` and closes it once it has been sent.
+        """
+        if self.closed:
+            if close_file:
+                file.close()
+            return
+        self.__queue((file, offset, count, close_file))
+
+    def send_stream(self, chunks, encoder: ChunkedEncoder):
+        """
+        Queues a streamed body, see `BaseConnection.send_stream`. Pieces are pulled on the event loop, and
+        no more are pulled while the transport is above its write buffer high-water mark. Async iterables
+        can wait on I/O between pieces, plain iterables must not block.
+        """
+        if self.closed:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            return
+        self.__queue(QueuedStream(chunks, encoder, blocking=self.__blocking))
+
+    def run_blocking(self, function) -> bool:
+        """
+        Queues `function` to run on a worker thread once earlier writes have been sent. Its writes are queued
+        and sent on the event loop, and bodies it streams are pulled on a worker thread too. No further
+        requests are read off the connection until it returns, so responses stay in order.
+        """
+        self.__queue(BlockingCall(function))
+        return True
+
+    def set_writable(self, writable: bool):
+        """
+        Pauses or resumes streamed bodies, called as the transport crosses its write buffer limits
+        """
+        if writable:
+            self.__writable.set()
+        else:
+            self.__writable.clear()
+
+    def __queue(self, item):
+        """
+        Queues a file or stream body, starting the task sending queued writes in order if needed
+        """
+        self.__outgoing.append(item)
+        if not self.__flushing:
+            self.__flushing = True
+            asyncio.get_running_loop().create_task(self.__flush())
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.__flushing:
+            self.__close_when_flushed = True
+        else:
+            # Closing the transport still flushes whatever it has buffered
+            self.transport.close()
+
+    def close_if_idle(self):
+        # Handlers run to completion on the event loop, so between them a connection is only busy while a
+        # response is still being flushed or a blocking call runs, or while a request is part way received
+        if not (self.__flushing or self.is_blocked() or self.has_buffered_data()):
+            self.close()
+
+    def abort(self):
+        """
+        Closes the connection immediately, discarding unsent data
+        """
+        self.closed = True
+        self.__writable.set()
+        while self.__outgoing:
+            item = self.__outgoing.popleft()
+            if isinstance(item, tuple) and item[3]:
+                item[0].close()
+        self.transport.abort()
+
+    def is_flushing(self) -> bool:
+        """
+        Returns:
+        True while queued file or streamed bodies are still being sent
+        """
+        return self.__flushing
+
+    def is_blocked(self) -> bool:
+        """
+        Returns:
+        True while a `run_blocking` function is queued or running, later requests must wait for it
+        """
+        return self.__blocking or any(isinstance(item, BlockingCall) for item in self.__outgoing)
+
+    async def __flush(self):
+        """
+        Sends queued writes in order, using `loop.sendfile` for file bodies
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while self.__outgoing:
+                item = self.__outgoing.popleft()
+                if isinstance(item, BlockingCall):
+                    await self.__run_blocking(loop, item.function)
+                elif isinstance(item, QueuedStream):
+                    await self.__send_stream(loop, item)
+                elif isinstance(item, tuple):
+                    file, offset, count, close_file = item
+                    try:
+                        await self.__send_file(loop, file, offset, count)
+                    finally:
+                        if close_file:
+                            file.close()
+                elif not self.transport.is_closing():
+                    self.transport.write(item)
+        except asyncio.TimeoutError:
+            CONNECTION_STATS.increment('write_timeouts')
+            self.abort()
+        except (ConnectionError, OSError):
+            self.abort()
+        except Exception:
+            # The handler producing a streamed body failed, end the connection without ending the body
+            self.abort()
+            raise
+        finally:
+            self.__flushing = False
+            if self.__close_when_flushed and not self.transport.is_closing():
+                self.transport.close()
+            elif OPEN_CONNECTIONS.draining:
+                # Kept alive before draining started, don't wait for another request
+                self.close_if_idle()
+
+    async def __send_file(self, loop: asyncio.AbstractEventLoop, file, offset: int, count: int):
+        """
+        Sends part of a file with `loop.sendfile`, a slice at a time so a client that stops reading is
+        dropped after `write_timeout` seconds
+
+        Raises:
+        asyncio.TimeoutError if the client didn't take a slice in time
+        """
+        end = offset + count
+        while offset < end and not self.transport.is_closing():
+            size = min(end - offset, SENDFILE_SLICE_BYTES)
+            await asyncio.wait_for(loop.sendfile(self.transport, file, offset, size), self.write_timeout)
+            offset += size
+
+    async def __run_blocking(self, loop: asyncio.AbstractEventLoop, function):
+        self.__blocking = True
+        try:
+            await loop.run_in_executor(None, function)
+        finally:
+            self.__blocking = False
+            if self.on_unblocked is not None:
+                loop.call_soon(self.on_unblocked)
+
+    async def __send_stream(self, loop: asyncio.AbstractEventLoop, stream: QueuedStream):
+        """
+        Writes a streamed body piece by piece, waiting for the transport to drain whenever it is over its
+        high-water mark
+        """
+        chunks, encoder = stream.chunks, stream.encoder
+        if stream.blocking:
+            iterator = iter(chunks)
+            try:
+                while True:
+                    data = await loop.run_in_executor(None, next, iterator, None)
+                    if data is None:
+                        break
+                    await self.__write_chunk(encoder.write(data))
+            finally:
+                if hasattr(iterator, 'close'):
+                    iterator.close()
+        elif hasattr(chunks, '__aiter__'):
+            async for data in chunks:
+                await self.__write_chunk(encoder.write(data))
+        else:
+            for data in chunks:
+                await self.__write_chunk(encoder.write(data))
+        await self.__write_chunk(encoder.finish())
+
+    async def __write_chunk(self, parts: list):
+        if not parts:
+            return
+        if self.transport.is_closing():
+            raise ConnectionError('Connection closed while streaming a response')
+        self.transport.writelines(parts)
+        await self.__writable.wait()
+
+
+class AsyncHttp2Connection:
+    """
+    Serves an HTTP/2 connection for `HttpProtocol` once its client has switched to HTTP/2.
+
+    Requests are replied to on the event loop as their streams complete, and frames are written as long as
+    the transport is under its high-water mark. `run_blocking` functions run on worker threads alongside the
+    other streams, their writes are handed back to the event loop, and bodies they stream are pulled on worker
+    threads too. The connection is closed after `keep_alive_timeout` seconds without open streams, or once a
+    client that stopped taking frames has left the transport paused for `write_timeout` seconds.
+    """
+
+    def __init__(self, config: ServerConfig, transport: asyncio.Transport, session: Http2Session, route,
+                 client_address: str = None):
+        """
+        Params:
+        - `config` - the server configuration
+        - `transport` - the asyncio transport of the client connection
+        - `session` - protocol state for the connection, leaving blocking pulls to this driver
+        - `route` - function that replies to a parsed `Request`
+        - `client_address` - IP address of the peer, if known
+        """
+        self.config = config
+        self.transport = transport
+        self.session = session
+        self.route = route
+        self.client_address = client_address
+        self.closed = False
+        self.__loop = asyncio.get_running_loop()
+        self.__loop_thread = threading.get_ident()
+        self.__writing_paused = False
+        self.__flush_scheduled = False
+        self.__idle_timer = None
+        self.__write_timer = None
+
+    def start(self, request: Request, received: bytes):
+        """
+        Takes over the connection from the request that started HTTP/2, see `Http2Session.start`
+        """
+        self.__dispatch(self.session.start(request, received))
+
+    def data_received(self, data: bytes):
+        self.__dispatch(self.session.receive(data))
+
+    def pause_writing(self):
+        self.__writing_paused = True
+        self.__write_timer = self.__loop.call_later(self.config.write_timeout, self.__on_write_timeout)
+
+    def resume_writing(self):
+        self.__writing_paused = False
+        if self.__write_timer is not None:
+            self.__write_timer.cancel()
+            self.__write_timer = None
+        self.__flush()
+
+    def connection_lost(self):
+        self.closed = True
+        self.__cancel_idle_timer()
+        if self.__write_timer is not None:
+            self.__write_timer.cancel()
+            self.__write_timer = None
+        self.session.close()
+
+    def close_if_idle(self):
+        # Streams already open are served, GOAWAY tells the client to open no more
+        self.session.go_away()
+        self.__flush()
+
+    def call(self, function, *args):
+        """
+        Runs a session method on the event loop, right away if called from it
+        """
+        if threading.get_ident() == self.__loop_thread:
+            function(*args)
+            self.__wake()
+        else:
+            self.__loop.call_soon_threadsafe(self.call, function, *args)
+
+    def run_blocking(self, function, stream: Http2Stream) -> bool:
+        future = self.__loop.run_in_executor(None, function)
+        future.add_done_callback(lambda done: self.__on_blocking_done(done, stream))
+        return True
+
+    def in_worker_thread(self) -> bool:
+        return threading.get_ident() != self.__loop_thread
+
+    def __dispatch(self, streams: list):
+        for stream in streams:
+            self.route(Request(StreamConnection(stream, self.session, self, self.client_address)))
+        self.__flush()
+
+    def __wake(self):
+        """
+        Flushes the frames the session has ready once the current callback returns
+        """
+        if not self.__flush_scheduled:
+            self.__flush_scheduled = True
+            self.__loop.call_soon(self.__flush)
+
+    def __flush(self):
+        """
+        Writes frames until the session has none ready or the transport is full, and starts pulling the
+        streamed bodies that wait on a worker thread or an async iterator
+        """
+        self.__flush_scheduled = False
+        if self.closed:
+            return
+        session = self.session
+        if OPEN_CONNECTIONS.draining:
+            session.go_away()
+        while not self.__writing_paused:
+            parts = session.output()
+            if not parts:
+                break
+            self.transport.writelines(parts)
+        for stream, body in session.take_pulls():
+            self.__loop.create_task(self.__pull(stream, body))
+        if session.finished() and not session.wants_output():
+            self.closed = True
+            self.transport.close()
+            return
+        if session.idle():
+            if self.__idle_timer is None:
+                self.__idle_timer = self.__loop.call_later(self.config.keep_alive_timeout, self.__on_idle_timeout)
+        else:
+            self.__cancel_idle_timer()
+
+    async def __pull(self, stream: Http2Stream, body: StreamedBody):
+        """
+        Pulls the next piece of a streamed body, from its async iterator or on a worker thread
+        """
+        try:
+            if hasattr(body.chunks, '__anext__'):
+                piece = await body.chunks.__anext__()
+            else:
+                piece = await self.__loop.run_in_executor(None, next, body.chunks, None)
+        except StopAsyncIteration:
+            piece = None
+        except Exception:
+            self.session.pulled(stream, body, None, failed=True)
+            self.__wake()
+            raise
+        self.session.pulled(stream, body, piece)
+        self.__wake()
+
+    def __on_blocking_done(self, future: asyncio.Future, stream: Http2Stream):
+        """
+        Resets the stream of a `run_blocking` function that raised, which would otherwise never be ended
+        """
+        if future.cancelled() or future.exception() is None:
+            return
+        self.__loop.call_exception_handler({'message': 'Blocking handler of an HTTP/2 stream failed',
+                                            'exception': future.exception()})
+        if not self.closed and not stream.local_closed:
+            self.session.reset_stream(stream, INTERNAL_ERROR)
+            self.__wake()
+
+    def __cancel_idle_timer(self):
+        if self.__idle_timer is not None:
+            self.__idle_timer.cancel()
+            self.__idle_timer = None
+
+    def __on_idle_timeout(self):
+        self.__idle_timer = None
+        if self.closed or not self.session.idle():
+            return
+        CONNECTION_STATS.increment('idle_timeouts')
+        self.session.go_away()
+        self.__flush()
+
+    def __on_write_timeout(self):
+        self.__write_timer = None
+        CONNECTION_STATS.increment('write_timeouts')
+        self.closed = True
+        self.transport.abort()
+
+
+class HttpProtocol(asyncio.Protocol):
+    """
+    asyncio protocol serving HTTP/1.1 requests, each handler call runs to completion on the event loop
+    while socket reads and writes stay non-blocking.
+
+    Write-side backpressure: once the transport buffers more than `write_buffer_high` bytes,
+    no further (pipelined) requests are processed and reading is paused until it drains below
+    `write_buffer_low`. A client that leaves the transport paused for `write_timeout` seconds is dropped.
+
+    One timer per connection enforces the read timeouts: `keep_alive_timeout` while waiting for a request,
+    then `header_timeout` from the first byte of a request and `body_timeout` from the end of its head.
+    More bytes arriving don't push back the deadline of the head or body being received.
+
+    A client that starts HTTP/2 (see `detect_http2`) is handed over to an `AsyncHttp2Connection`.
+    """
+
+    def __init__(self, config: ServerConfig, route, connection_limiter: ConnectionLimiter = None):
+        """
+        Params:
+        - `config` - the server configuration
+        - `route` - function that replies to a parsed `Request`
+        - `connection_limiter` - caps on the connections open at once, None for no caps
+        """
+        self.config = config
+        self.route = route
+        self.connection_limiter = connection_limiter
+        self.connection = None
+        self.__client = None
+        self.__writing_paused = False
+        self.__timer = None
+        # What the timer is waiting for (`idle`, `header` or `body`) and for which request
+        self.__timer_phase = None
+        self.__requests_read = 0
+        self.__write_timer = None
+        # Serves the connection once the client has switched to HTTP/2
+        self.__http2 = None
+
+    def connection_made(self, transport: asyncio.Transport):
+        peer = transport.get_extra_info('peername')
+        client = peer[0] if peer else None
+        if self.connection_limiter is not None:
+            rejection = self.connection_limiter.acquire(client)
+            if rejection is not None:
+                transport.write(REJECTED_CONNECTION_REPLIES[rejection])
+                transport.close()
+                return
+            self.__client = client
+
+        transport.set_write_buffer_limits(high=self.config.write_buffer_high, low=self.config.write_buffer_low)
+        parser = RequestParser(self.config.max_header_bytes, self.config.max_header_count,
+                               self.config.max_body_bytes)
+        self.connection = AsyncConnection(transport,
+                                          idle_timeout=self.config.keep_alive_timeout,
+                                          max_requests=self.config.max_keep_alive_requests,
+                                          parser=parser,
+                                          client_address=client,
+                                          coalesce_bytes=self.config.stream_coalesce_bytes,
+                                          header_timeout=self.config.header_timeout,
+                                          body_timeout=self.config.body_timeout,
+                                          write_timeout=self.config.write_timeout)
+        self.connection.on_unblocked = self.__resume
+        OPEN_CONNECTIONS.add(self.connection)
+        METRICS.connection_opened()
+        self.__update_timer()
+
+    def connection_lost(self, exc):
+        if self.connection is None:
+            # Turned away by the connection limiter
+            return
+        self.__cancel_timer()
+        self.__cancel_write_timer()
+        self.connection.closed = True
+        # Wake up a streamed body waiting for the transport to drain, it stops at its next write
+        self.connection.set_writable(True)
+        if self.__client is not None:
+            self.connection_limiter.release(self.__client)
+        if self.__http2 is not None:
+            self.__http2.connection_lost()
+            OPEN_CONNECTIONS.discard(self.__http2)
+        OPEN_CONNECTIONS.discard(self.connection)
+        METRICS.connection_closed()
+
+    def data_received(self, data: bytes):
+        if self.__http2 is not None:
+            self.__http2.data_received(data)
+            return
+        self.connection.feed(data)
+        if self.__timer_phase == 'idle':
+            # Any bytes show the client is still there
+            self.__cancel_timer()
+        self.__process()
+        self.__update_timer()
+
+    def eof_received(self):
+        if self.__http2 is not None:
+            # An HTTP/2 client ends the connection with GOAWAY, not by half closing it
+            return False
+        # Let close() decide when to drop the connection so queued responses are still sent
+        self.connection.close()
+        return True
+
+    def pause_writing(self):
+        if self.__http2 is not None:
+            self.__http2.pause_writing()
+            return
+        self.__writing_paused = True
+        self.connection.set_writable(False)
+        self.connection.transport.pause_reading()
+        loop = asyncio.get_running_loop()
+        self.__write_timer = loop.call_later(self.config.write_timeout, self.__on_write_timeout)
+
+    def resume_writing(self):
+        if self.__http2 is not None:
+            self.__http2.resume_writing()
+            return
+        self.__writing_paused = False
+        self.__cancel_write_timer()
+        self.connection.set_writable(True)
+        if not self.connection.closed:
+            self.connection.transport.resume_reading()
+            self.__process()
+            self.__update_timer()
+
+    def __process(self):
+        """
+        Handles every complete request in the read buffer, stopping early if the client can't keep up
+        """
+        connection = self.connection
+        while not connection.closed and not self.__writing_paused and not connection.is_blocked() \
+                and connection.has_buffered_data():
+            try:
+                request = Request(connection)
+            except IncompleteRequest:
+                return
+            self.__requests_read += 1
+            if self.config.http2 and not connection.is_flushing() and detect_http2(request) is not None:
+                self.__switch_to_http2(request)
+                return
+            self.route(request)
+
+    def __switch_to_http2(self, request: Request):
+        """
+        Hands the connection over to an `AsyncHttp2Connection`, along with the bytes received past `request`
+        """
+        self.__cancel_timer()
+        connection = self.connection
+        config = self.config
+        session = Http2Session(config.http2_max_streams, config.max_header_bytes, config.max_header_count,
+                               config.max_body_bytes, config.max_keep_alive_requests, inline_pulls=False)
+        self.__http2 = AsyncHttp2Connection(config, connection.transport, session, self.route,
+                                            connection.client_address)
+        # Drained through GOAWAY from now on
+        OPEN_CONNECTIONS.discard(connection)
+        OPEN_CONNECTIONS.add(self.__http2)
+        self.__http2.start(request, connection.parser.take_buffered())
+
+    def __resume(self):
+        """
+        Handles the requests held back while a `run_blocking` function ran
+        """
+        if not self.connection.closed:
+            self.__process()
+            self.__update_timer()
+
+    def __update_timer(self):
+        """
+        Starts the timer for what the connection is now waiting for, unless it is already running
+        """
+        if self.connection.closed or self.__http2 is not None:
+            return
+        parser = self.connection.parser
+        if parser.reading_body():
+            phase, timeout = 'body', self.config.body_timeout
+        elif parser.in_progress():
+            phase, timeout = 'header', self.config.header_timeout
+        else:
+            phase, timeout = 'idle', self.config.keep_alive_timeout
+        if self.__timer is not None and self.__timer_phase == (phase, self.__requests_read):
+            return
+        self.__cancel_timer()
+        self.__timer_phase = (phase, self.__requests_read)
+        self.__timer = asyncio.get_running_loop().call_later(timeout, self.__on_timeout)
+
+    def __cancel_timer(self):
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+
+    def __cancel_write_timer(self):
+        if self.__write_timer is not None:
+            self.__write_timer.cancel()
+            self.__write_timer = None
+
+    def __on_timeout(self):
+        self.__timer = None
+        if self.connection.closed:
+            return
+        if self.connection.is_flushing() or self.__writing_paused:
+            # Still sending a response, the client isn't the one holding things up
+            self.__timer_phase = None
+            self.__update_timer()
+            return
+        if self.__timer_phase[0] == 'idle':
+            CONNECTION_STATS.increment('idle_timeouts')
+            self.connection.close()
+            return
+        self.connection.time_out(self.connection.request_timed_out())
+        self.route(Request(self.connection))
+
+    def __on_write_timeout(self):
+        self.__write_timer = None
+        CONNECTION_STATS.increment('write_timeouts')
+        self.connection.abort()
+
+
+async def run_async_server(config: ServerConfig, route, connection_limiter: ConnectionLimiter = None,
+                           on_reload=None, on_dump=None):
+    """
+    Runs the asyncio backend until cancelled or told to stop. `SIGTERM` stops accepting and drains the open
+    connections, `SIGHUP` runs `on_reload` on a worker thread, and `SIGUSR2` starts a new server process
+    that inherits the listening socket, then stops like `SIGTERM` once that process serves. `SIGUSR1` runs
+    `on_dump` on a worker thread.
+
+    Params:
+    - `config` - the server configuration
+    - `route` - function that replies to a parsed `Request`
+    - `connection_limiter` - caps on the connections open at once, None for no caps
+    - `on_reload` - optional function that reloads the configuration
+    - `on_dump` - optional function that writes out the diagnostics gathered so far
+    """
+    loop = asyncio.get_running_loop()
+    listening_socket = inherited_socket()
+    if listening_socket is not None:
+        server = await loop.create_server(lambda: HttpProtocol(config, route, connection_limiter),
+                                          sock=listening_socket, backlog=config.backlog)
+    else:
+        server = await loop.create_server(lambda: HttpProtocol(config, route, connection_limiter),
+                                          config.host, config.port,
+                                          backlog=config.backlog, reuse_address=True)
+    stopping = asyncio.Event()
+
+    def stop():
+        loop.call_soon_threadsafe(stopping.set)
+
+    def restart():
+        threading.Thread(target=hand_off, args=(server.sockets[0].fileno(), stop), name='handoff',
+                         daemon=True).start()
+
+    loop.add_signal_handler(signal.SIGTERM, stopping.set)
+    loop.add_signal_handler(signal.SIGUSR2, restart)
+    if on_reload is not None:
+        loop.add_signal_handler(signal.SIGHUP, loop.run_in_executor, None, on_reload)
+    if on_dump is not None:
+        loop.add_signal_handler(signal.SIGUSR1, loop.run_in_executor, None, on_dump)
+    notify_ready()
+    try:
+        await stopping.wait()
+    except asyncio.CancelledError:
+        server.close()
+        return
+
+    # Closing the server only closes the listening socket, open connections are served until they finish
+    server.close()
+    drain = Drain()
+    drain.start()
+    await loop.run_in_executor(None, drain.finish, WORKER_SHUTDOWN_TIMEOUT)
+
+
+def serve_async(config: ServerConfig, route, connection_limiter: ConnectionLimiter = None, on_reload=None,
+                on_dump=None):
+    """
+    Serves connections on a single asyncio event loop
+
+    Params:
+    - `config` - the server configuration
+    - `route` - function that replies to a parsed `Request`
+    - `connection_limiter` - caps on the connections open at once, None for no caps
+    - `on_reload` - optional function that reloads the configuration, run on `SIGHUP`
+    - `on_dump` - optional function that writes out the diagnostics gathered so far, run on `SIGUSR1`
+    """
+    try:
+        asyncio.run(run_async_server(config, route, connection_limiter, on_reload, on_dump))
+    except KeyboardInterrupt:
+        pass
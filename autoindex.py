@@ -0,0 +1,289 @@
+import html
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, quote
+from constants import DEFAULT_ENCODING
+
+LISTING_FORMATS = ['html', 'json']
+
+# Sort keys, with the heading of their column in HTML listings
+SORT_KEYS = {'name': 'Name', 'size': 'Size', 'mtime': 'Modified'}
+
+# Entries per page when the client doesn't ask for a page size
+DEFAULT_PAGE_SIZE = 1000
+
+# Largest page size a client may ask for
+MAX_PAGE_SIZE = 10000
+
+# Most directory listings kept in memory
+DEFAULT_MAX_LISTINGS = 256
+
+# Listing rows rendered into one piece of the streamed body
+ROWS_PER_PIECE = 256
+
+LISTING_TIME_FORMAT = '%Y-%m-%d %H:%M'
+
+
+class ListingEntry:
+    """One file or subdirectory of a directory listing"""
+
+    __slots__ = ['name', 'is_directory', 'size', 'mtime']
+
+    def __init__(self, name: str, is_directory: bool, size: int, mtime: float):
+        self.name = name
+        self.is_directory = is_directory
+        self.size = size
+        self.mtime = mtime
+
+
+class DirectoryListing:
+    """The entries of one version of a directory, with the sort orders computed so far"""
+
+    __slots__ = ['mtime_ns', 'entries', 'orders']
+
+    def __init__(self, mtime_ns: int, entries: list):
+        """
+        Params:
+        - `mtime_ns` - modification time of the directory when it was scanned
+        - `entries` - the `ListingEntry` of every entry, sorted by name
+        """
+        self.mtime_ns = mtime_ns
+        self.entries = entries
+        # Sort key to entries in ascending order, sorted on first use
+        self.orders = {'name': entries}
+
+    def ordered(self, sort: str) -> list:
+        """
+        Returns:
+        The entries in ascending order of `sort`, ties broken by name
+        """
+        entries = self.orders.get(sort)
+        if entries is None:
+            entries = sorted(self.entries, key=lambda entry: getattr(entry, sort))
+            self.orders[sort] = entries
+        return entries
+
+
+class ListingQuery:
+    """How a client asked for a directory listing to be sorted, paginated and formatted"""
+
+    __slots__ = ['sort', 'descending', 'page', 'page_size', 'listing_format']
+
+    def __init__(self, sort: str = 'name', descending: bool = False, page: int = 1,
+                 page_size: int = DEFAULT_PAGE_SIZE, listing_format: str = 'html'):
+        self.sort = sort
+        self.descending = descending
+        self.page = page
+        self.page_size = page_size
+        self.listing_format = listing_format
+
+    def query_string(self, **changes) -> str:
+        """
+        Returns:
+        The query string asking for this listing with some fields changed (e.g. `page=2`), escaped for HTML
+        """
+        fields = {'sort': self.sort, 'order': 'desc' if self.descending else 'asc', 'page': self.page,
+                  'per_page': self.page_size, **changes}
+        return '?' + '&amp;'.join(f'{name}={value}' for name, value in fields.items())
+
+
+def parse_listing_query(query: str, accept: str = None, page_size: int = DEFAULT_PAGE_SIZE) -> ListingQuery:
+    """
+    Parses the query string of a directory listing request, e.g. `?sort=size&order=desc&page=2&per_page=100`
+
+    Params:
+    - `query` - the query string, without the `?`
+    - `accept` - value of the `Accept` request header, JSON is sent if it asks for JSON but not HTML
+    - `page_size` - entries per page if the query doesn't say
+
+    Returns:
+    The parsed query
+
+    Raises:
+    ValueError if a parameter is invalid
+    """
+    fields = {name: values[-1] for name, values in parse_qs(query).items()}
+    listing_format = fields.get('format')
+    if listing_format is None:
+        wants_json = accept is not None and 'application/json' in accept and 'text/html' not in accept
+        listing_format = 'json' if wants_json else 'html'
+    sort = fields.get('sort', 'name')
+    order = fields.get('order', 'asc')
+    if listing_format not in LISTING_FORMATS or sort not in SORT_KEYS or order not in ['asc', 'desc']:
+        raise ValueError('Unknown listing format, sort key or order')
+    try:
+        page = int(fields.get('page', 1))
+        page_size = int(fields.get('per_page', page_size))
+    except ValueError:
+        raise ValueError('page and per_page must be integers')
+    if page < 1 or not 0 < page_size <= MAX_PAGE_SIZE:
+        raise ValueError(f'Pages start at 1 and hold at most {MAX_PAGE_SIZE} entries')
+    return ListingQuery(sort, order == 'desc', page, page_size, listing_format)
+
+
+class AutoIndex:
+    """
+    Generates listings of directories that have no `index.html`.
+
+    Directories are read with `os.scandir` and the result is cached until the directory's modification
+    time changes, which happens whenever an entry is added, removed or renamed. Sizes and times of files
+    modified in place are refreshed once the directory itself changes. Listings are sorted once per sort
+    key, paginated, and rendered as a stream of pieces so a page of a huge directory is never held in
+    memory as one string.
+    """
+
+    def __init__(self, max_listings: int = DEFAULT_MAX_LISTINGS, page_size: int = DEFAULT_PAGE_SIZE):
+        """
+        Params:
+        - `max_listings` - most directory listings cached, least recently used ones are dropped first
+        - `page_size` - entries per page when the client doesn't ask for a page size
+        """
+        self.max_listings = max_listings
+        self.page_size = page_size
+        self.__listings = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__stats = {'hits': 0, 'misses': 0}
+
+    def listing(self, directory_path: str) -> DirectoryListing:
+        """
+        Params:
+        - `directory_path` - the directory to list
+
+        Returns:
+        The current listing of the directory
+
+        Raises:
+        OSError (e.g. FileNotFoundError) if the directory can't be read
+        """
+        mtime_ns = os.stat(directory_path).st_mtime_ns
+        key = os.path.normpath(directory_path)
+        with self.__lock:
+            listing = self.__listings.get(key)
+            if listing is not None and listing.mtime_ns == mtime_ns:
+                self.__listings.move_to_end(key)
+                self.__stats['hits'] += 1
+                return listing
+            self.__stats['misses'] += 1
+
+        listing = DirectoryListing(mtime_ns, scan_directory(directory_path))
+        with self.__lock:
+            self.__listings[key] = listing
+            self.__listings.move_to_end(key)
+            while len(self.__listings) > self.max_listings:
+                self.__listings.popitem(last=False)
+        return listing
+
+    def stats(self) -> dict:
+        """
+        Returns:
+        Hit and miss counts of the listing cache along with the number of listings cached
+        """
+        with self.__lock:
+            return {**self.__stats, 'listings': len(self.__listings)}
+
+    def render(self, listing: DirectoryListing, url_path: str, query: ListingQuery):
+        """
+        Renders one page of a listing
+
+        Params:
+        - `listing` - the directory listing
+        - `url_path` - the URL path of the directory, ending in `/`
+        - `query` - the requested order, page and format
+
+        Returns:
+        A generator of the encoded pieces of the page
+        """
+        ordered = listing.ordered(query.sort)
+        total = len(ordered)
+        start = (query.page - 1) * query.page_size
+        if query.descending:
+            # Slice the ascending order from the end instead of copying it reversed
+            stop = max(0, total - start)
+            page = ordered[max(0, stop - query.page_size):stop][::-1]
+        else:
+            page = ordered[start:start + query.page_size]
+        if query.listing_format == 'json':
+            return render_json(page, url_path, query, total)
+        return render_html(page, url_path, query, total)
+
+
+def scan_directory(directory_path: str) -> list:
+    """
+    Returns:
+    The `ListingEntry` of every entry of a directory, sorted by name. Entries that vanish or can't be
+    stat-ed while scanning (e.g. broken symbolic links) are left out.
+    """
+    entries = []
+    with os.scandir(directory_path) as iterator:
+        for entry in iterator:
+            try:
+                is_directory = entry.is_dir()
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append(ListingEntry(entry.name, is_directory, 0 if is_directory else stat.st_size,
+                                        stat.st_mtime))
+    entries.sort(key=lambda entry: entry.name)
+    return entries
+
+
+def render_html(page: list, url_path: str, query: ListingQuery, total: int):
+    """
+    Generates an HTML page of a listing, piece by piece
+    """
+    title = html.escape(f'Index of {url_path}')
+    header_links = []
+    for key, heading in SORT_KEYS.items():
+        # Clicking the current sort key again flips the order
+        order = 'desc' if key == query.sort and not query.descending else 'asc'
+        header_links.append(f'<th><a href="{query.query_string(sort=key, order=order, page=1)}">'
+                            f'{heading}</a></th>')
+    parent = '<tr><td><a href="../">../</a></td><td></td><td></td></tr>\n' if url_path != '/' else ''
+    yield encode(f'<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>{title}</title>\n</head>\n'
+                 f'<body>\n<h1>{title}</h1>\n<table>\n<tr>{"".join(header_links)}</tr>\n{parent}')
+
+    for offset in range(0, len(page), ROWS_PER_PIECE):
+        rows = []
+        for entry in page[offset:offset + ROWS_PER_PIECE]:
+            suffix = '/' if entry.is_directory else ''
+            size = '-' if entry.is_directory else entry.size
+            modified = time.strftime(LISTING_TIME_FORMAT, time.gmtime(entry.mtime))
+            link = quote(entry.name, errors='surrogateescape')
+            rows.append(f'<tr><td><a href="{link}{suffix}">{html.escape(entry.name)}{suffix}</a></td>'
+                        f'<td>{size}</td><td>{modified}</td></tr>\n')
+        yield encode(''.join(rows))
+
+    pages = max(1, -(-total // query.page_size))
+    links = []
+    if query.page > 1:
+        links.append(f'<a href="{query.query_string(page=query.page - 1)}">Previous</a>')
+    if query.page < pages:
+        links.append(f'<a href="{query.query_string(page=query.page + 1)}">Next</a>')
+    yield encode(f'</table>\n<p>Page {query.page} of {pages}, {total} entries {" ".join(links)}</p>\n'
+                 f'</body>\n</html>\n')
+
+
+def render_json(page: list, url_path: str, query: ListingQuery, total: int):
+    """
+    Generates a JSON page of a listing, piece by piece
+    """
+    head = {'path': url_path, 'total': total, 'page': query.page, 'per_page': query.page_size,
+            'sort': query.sort, 'order': 'desc' if query.descending else 'asc'}
+    # Open the object and its entries array, the entries are streamed in between
+    yield encode(json.dumps(head)[:-1] + ', "entries": [')
+    for offset in range(0, len(page), ROWS_PER_PIECE):
+        rows = [json.dumps({'name': entry.name, 'type': 'directory' if entry.is_directory else 'file',
+                            'size': entry.size, 'mtime': entry.mtime})
+                for entry in page[offset:offset + ROWS_PER_PIECE]]
+        yield encode((', ' if offset > 0 else '') + ', '.join(rows))
+    yield b']}'
+
+
+def encode(text: str) -> bytes:
+    """
+    Encodes part of a listing, file names that aren't valid UTF-8 are shown with replacement characters
+    """
+    return text.encode(DEFAULT_ENCODING, 'replace')
@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+# Load-testing harness: starts server.py on a scratch copy of the document root, drives it with
+# concurrent keep-alive and non-keep-alive connections, and reports req/s, latency percentiles,
+# bytes/sec and server RSS. Results can be written to JSON and compared with an earlier run.
+#
+# run: python benchmarks/load_test.py --connections 1,16,64 --output results.json
+#      python benchmarks/load_test.py --compare results.json
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Scenario name mapped to the path requested, the PNGs are copied into the scratch document root
+SCENARIOS = {
+    'html': '/index.html',
+    'css': '/base.css',
+    'png-root': '/root.png',
+    'png-deep': '/deep/deep.png',
+    'not-found': '/do-not-implement-this-page-it-is-not-found',
+    'redirect': '/deep',
+}
+
+# Extra images served by the benchmark, copied from the repository root
+IMAGES = {
+    'root.png': 'root.png',
+    'deep.png': os.path.join('deep', 'deep.png'),
+}
+
+# How long to wait for the server to start accepting connections
+STARTUP_TIMEOUT = 10
+
+# Metrics compared by `--compare`, and whether a higher value is better
+COMPARED_METRICS = {
+    'requests_per_second': True,
+    'p50_ms': False,
+    'p95_ms': False,
+    'p99_ms': False,
+    'bytes_per_second': True,
+    'peak_rss_kib': False,
+}
+
+
+class ServerProcess:
+    """Runs `server.py` in a subprocess for the duration of a benchmark"""
+
+    def __init__(self, directory_path: str, port: int, server_args: list):
+        """
+        Params:
+        - `directory_path` - the document root to serve
+        - `port` - the port to listen on
+        - `server_args` - extra command line arguments for `server.py` (e.g. `--mode asyncio`)
+        """
+        self.port = port
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT_DIRECTORY, 'server.py'), '--host', '127.0.0.1',
+             '--port', str(port), '--directory', directory_path, *server_args],
+            cwd=ROOT_DIRECTORY, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.__wait_until_ready()
+
+    def __wait_until_ready(self):
+        """
+        Blocks until the server accepts connections
+        """
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'server.py exited with status {self.process.returncode}')
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.05)
+        self.stop()
+        raise RuntimeError('server.py did not start accepting connections')
+
+    def rss_kib(self) -> int:
+        """
+        Returns:
+        The resident set size of the server and all its worker processes in KiB, or None if it
+        can't be read on this platform
+        """
+        total = 0
+        pending = [self.process.pid]
+        while len(pending) > 0:
+            pid = pending.pop()
+            try:
+                with open(f'/proc/{pid}/status') as status:
+                    for line in status:
+                        if line.startswith('VmRSS:'):
+                            total += int(line.split()[1])
+                for thread_id in os.listdir(f'/proc/{pid}/task'):
+                    with open(f'/proc/{pid}/task/{thread_id}/children') as children:
+                        pending += [int(child) for child in children.read().split()]
+            except (FileNotFoundError, ProcessLookupError):
+                continue
+            except OSError:
+                return None
+        return total if total > 0 else None
+
+    def stop(self):
+        """
+        Stops the server, letting prefork and reuseport workers shut down gracefully
+        """
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=STARTUP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class LoadResult:
+    """Latencies and byte counts collected by the clients of one benchmark run"""
+
+    def __init__(self):
+        self.latencies = []
+        self.bytes_received = 0
+        self.errors = 0
+        self.status_codes = {}
+
+    def record(self, latency: float, status_code: int, size: int):
+        """
+        Params:
+        - `latency` - seconds from sending the request to receiving the whole response
+        - `status_code` - the response status
+        - `size` - response bytes received, head included
+        """
+        self.latencies.append(latency)
+        self.bytes_received += size
+        self.status_codes[status_code] = self.status_codes.get(status_code, 0) + 1
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """
+    Params:
+    - `sorted_values` - samples in ascending order
+    - `fraction` - the percentile as a fraction (e.g. 0.95)
+
+    Returns:
+    The nearest-rank percentile, or None if there are no samples
+    """
+    if len(sorted_values) == 0:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def read_response(reader: asyncio.StreamReader) -> tuple:
+    """
+    Reads one response off a connection
+
+    Returns:
+    A `(status code, bytes received, server closes the connection)` tuple
+    """
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status_code = int(lines[0].split(' ')[1])
+    content_length = None
+    closing = False
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        name = name.strip().lower()
+        if name == 'content-length':
+            content_length = int(value)
+        elif name == 'connection' and value.strip().lower() == 'close':
+            closing = True
+
+    if content_length is None:
+        # Without a length the body runs until the server closes the connection
+        body = await reader.read() if closing else b''
+        return status_code, len(head) + len(body), True
+    await reader.readexactly(content_length)
+    return status_code, len(head) + content_length, closing
+
+
+async def run_client(port: int, path: str, keep_alive: bool, deadline: float, result: LoadResult):
+    """
+    Sends requests for `path` back to back until `deadline`, reconnecting whenever the server closes
+    the connection (or after every request if `keep_alive` is False)
+    """
+    connection_header = 'keep-alive' if keep_alive else 'close'
+    request = (f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nUser-Agent: load-test\r\n'
+               f'Connection: {connection_header}\r\n\r\n').encode('latin-1')
+    writer = None
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(request)
+            status_code, size, closing = await read_response(reader)
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+            result.errors += 1
+            closing = True
+        else:
+            result.record(time.perf_counter() - start, status_code, size)
+
+        if (closing or not keep_alive) and writer is not None:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run_load(port: int, path: str, connections: int, keep_alive: bool, duration: float) -> tuple:
+    """
+    Returns:
+    A `(LoadResult, elapsed seconds)` tuple for `connections` clients running for `duration` seconds
+    """
+    result = LoadResult()
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*(run_client(port, path, keep_alive, deadline, result) for _ in range(connections)))
+    return result, time.perf_counter() - start
+
+
+def to_ms(seconds: float) -> float:
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def summarize(result: LoadResult, elapsed: float) -> dict:
+    """
+    Returns:
+    The reported metrics of one run
+    """
+    latencies = sorted(result.latencies)
+    return {
+        'requests': len(latencies),
+        'errors': result.errors,
+        'status_codes': {str(code): count for code, count in sorted(result.status_codes.items())},
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': to_ms(percentile(latencies, 0.50)),
+        'p95_ms': to_ms(percentile(latencies, 0.95)),
+        'p99_ms': to_ms(percentile(latencies, 0.99)),
+        'bytes_per_second': round(result.bytes_received / elapsed),
+    }
+
+
+def prepare_document_root(directory_path: str) -> str:
+    """
+    Copies the document root and the repository's PNGs into a scratch directory, so the benchmark
+    doesn't depend on (or modify) `./www`
+
+    Returns:
+    The path of the scratch directory
+    """
+    scratch_path = tempfile.mkdtemp(prefix='load-test-')
+    document_root = os.path.join(scratch_path, 'www')
+    shutil.copytree(directory_path, document_root)
+    for source, destination in IMAGES.items():
+        shutil.copyfile(os.path.join(ROOT_DIRECTORY, source), os.path.join(document_root, destination))
+    return scratch_path
+
+
+def free_port() -> int:
+    """
+    Returns:
+    A TCP port that was free a moment ago
+    """
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def git_revision() -> str:
+    """
+    Returns:
+    The commit being benchmarked, or None outside a git checkout
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIRECTORY, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args) -> dict:
+    """
+    Runs every combination of scenario, connection count and keep-alive setting against one server
+
+    Returns:
+    The report written by `--output`
+    """
+    keep_alive_settings = {'on': [True], 'off': [False], 'both': [True, False]}[args.keep_alive]
+    scratch_path = prepare_document_root(args.directory)
+    server_args = args.server_args
+    if args.bundle:
+        # Serve the same files packed into a bundle
+        bundle_path = os.path.join(scratch_path, 'site.bundle')
+        subprocess.run([sys.executable, os.path.join(ROOT_DIRECTORY, 'bundle.py'), os.path.join(scratch_path, 'www'),
+                        bundle_path], check=True, stdout=subprocess.DEVNULL)
+        server_args = [*server_args, '--bundle', bundle_path]
+    server = ServerProcess(os.path.join(scratch_path, 'www'), free_port(), server_args)
+    runs = []
+    try:
+        for name in args.scenarios:
+            for connections in args.connections:
+                for keep_alive in keep_alive_settings:
+                    if args.warmup > 0:
+                        asyncio.run(run_load(server.port, SCENARIOS[name], connections, keep_alive, args.warmup))
+                    result, elapsed = asyncio.run(
+                        run_load(server.port, SCENARIOS[name], connections, keep_alive, args.duration))
+                    run = {'scenario': name, 'path': SCENARIOS[name], 'connections': connections,
+                           'keep_alive': keep_alive, **summarize(result, elapsed), 'peak_rss_kib': server.rss_kib()}
+                    runs.append(run)
+                    print(format_run(run), flush=True)
+    finally:
+        server.stop()
+        shutil.rmtree(scratch_path, ignore_errors=True)
+
+    return {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'server_args': server_args,
+        'duration': args.duration,
+        'runs': runs,
+    }
+
+
+def run_key(run: dict) -> tuple:
+    return run['scenario'], run['connections'], run['keep_alive']
+
+
+def format_latency(milliseconds: float) -> str:
+    return '-' if milliseconds is None else f'{milliseconds:.2f}'
+
+
+def format_run(run: dict) -> str:
+    """
+    Returns:
+    One line of the results table
+    """
+    keep_alive = 'ka' if run['keep_alive'] else 'close'
+    rss = '-' if run['peak_rss_kib'] is None else f'{run["peak_rss_kib"] / 1024:.1f}M'
+    return (f'{run["scenario"]:<10}{run["connections"]:>6} {keep_alive:<6}{run["requests_per_second"]:>10.0f}'
+            f'{format_latency(run["p50_ms"]):>9}{format_latency(run["p95_ms"]):>9}{format_latency(run["p99_ms"]):>9}'
+            f'{run["bytes_per_second"] / 1024 / 1024:>10.2f}{rss:>9}{run["errors"]:>7}')
+
+
+def compare_reports(baseline: dict, current: dict):
+    """
+    Prints the relative change of each metric between two reports, for the runs they have in common
+    """
+    previous_runs = {run_key(run): run for run in baseline['runs']}
+    print(f'\nchange since {baseline.get("revision") or "baseline"} (positive is better)')
+    for run in current['runs']:
+        previous = previous_runs.get(run_key(run))
+        if previous is None:
+            continue
+        changes = []
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            before, after = previous.get(metric), run.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            changes.append(f'{metric} {change if higher_is_better else -change:+.1f}%')
+        keep_alive = 'ka' if run['keep_alive'] else 'close'
+        print(f'{run["scenario"]:<10}{run["connections"]:>6} {keep_alive:<6}' + ', '.join(changes))
+
+
+def parse_list(value: str, convert=str) -> list:
+    return [convert(item) for item in value.split(',') if item != '']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark server.py under concurrent load')
+    parser.add_argument('--connections', type=lambda value: parse_list(value, int), default=[1, 16, 64],
+                        help='comma separated concurrent connection counts (default: 1,16,64)')
+    parser.add_argument('--scenarios', type=parse_list, default=list(SCENARIOS),
+                        help=f'comma separated scenarios out of {",".join(SCENARIOS)} (default: all)')
+    parser.add_argument('--keep-alive', choices=['on', 'off', 'both'], default='both',
+                        help='reuse connections, open one per request, or run both (default: both)')
+    parser.add_argument('--duration', type=float, default=5, help='seconds per run (default: 5)')
+    parser.add_argument('--warmup', type=float, default=1, help='seconds of unmeasured load before each run')
+    parser.add_argument('--directory', default=os.path.join(ROOT_DIRECTORY, 'www'),
+                        help='document root copied for the benchmark (default: ./www)')
+    parser.add_argument('--bundle', action='store_true',
+                        help='pack the document root with bundle.py and serve the bundle instead')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('server_args', nargs=argparse.REMAINDER,
+                        help='arguments after -- are passed to server.py, e.g. -- --mode asyncio')
+    args = parser.parse_args()
+    if args.server_args[:1] == ['--']:
+        args.server_args = args.server_args[1:]
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if len(unknown) > 0:
+        parser.error(f'unknown scenarios: {", ".join(unknown)}')
+
+    print(f'{"scenario":<10}{"conns":>6} {"":<6}{"req/s":>10}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}'
+          f'{"MiB/s":>10}{"rss":>9}{"errors":>7}')
+    report = run_benchmarks(args)
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as file:
+            compare_reports(json.load(file), report)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# Micro-benchmark comparing the incremental RequestParser against the original
+# Request.__parse_request loop, which appended every recv to a bytes object and
+# rescanned and decoded the whole payload after each read.
+#
+# run: python benchmarks/parser_bench.py
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from http_parser import RequestParser  # noqa: E402
+
+RECV_SIZE = 1024
+
+SCENARIOS = {
+    'small GET': (b'GET /index.html HTTP/1.1\r\nHost: 127.0.0.1:8080\r\nUser-Agent: bench\r\n'
+                  b'Accept: */*\r\nAccept-Encoding: gzip\r\n\r\n'),
+    'browser GET': (b'GET /deep/index.html HTTP/1.1\r\nHost: 127.0.0.1:8080\r\n'
+                    b'User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:96.0) Gecko/20100101 Firefox/96.0\r\n'
+                    b'Accept: text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,*/*;q=0.8\r\n'
+                    b'Accept-Language: en-CA,en-US;q=0.7,en;q=0.3\r\nAccept-Encoding: gzip, deflate, br\r\n'
+                    b'Connection: keep-alive\r\nCookie: ' + b'x' * 400 + b'\r\nUpgrade-Insecure-Requests: 1\r\n'
+                    b'If-None-Match: "11e02e-1d6-16ce8e24dc221e00"\r\nCache-Control: max-age=0\r\n\r\n'),
+    '64 KiB POST': b'POST /upload HTTP/1.1\r\nHost: 127.0.0.1:8080\r\nContent-Length: 65536\r\n\r\n' + b'a' * 65536,
+}
+
+
+def legacy_parse(chunks: list):
+    """
+    The parsing loop `Request.__parse_request` used before the incremental parser, reading from a list
+    of received chunks instead of a socket
+    """
+    raw_payload = b''
+    headers = None
+    chunks = iter(chunks)
+    while True:
+        chunk = next(chunks)
+        raw_payload += chunk
+
+        if raw_payload.find(b'\r\n\r\n') == -1:
+            continue
+
+        payload = raw_payload.decode('utf-8')
+        # The original only split on the first pass and then compared against that stale body, which never
+        # finished for bodies spanning several reads, so the split is redone on every read here
+        headers_and_body = payload.split('\r\n\r\n')
+
+        if headers is None:
+            lines = headers_and_body[0].split('\r\n')
+            method, path, http_version = lines[0].split(' ')
+            headers = {}
+            for header in lines[1:]:
+                key, value = header.split(': ')
+                headers[key] = value
+
+        if 'Content-Length' not in headers:
+            return headers
+
+        body = headers_and_body[1]
+        if len(body) == int(headers['Content-Length']):
+            return headers
+
+
+def incremental_parse(chunks: list, parser: RequestParser = RequestParser()):
+    """
+    Parses one request with `RequestParser`, feeding it the same received chunks. The parser is reused
+    like it is across the requests of a keep-alive connection.
+    """
+    for chunk in chunks:
+        parser.feed(chunk)
+        request = parser.parse()
+        if request is not None:
+            return request
+
+
+def measure(parse, chunks: list, iterations: int) -> tuple:
+    """
+    Returns:
+    `(requests per second, peak bytes allocated while parsing one request)`
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        parse(chunks)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    parse(chunks)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return iterations / elapsed, peak
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description='Compare the old and new request parsers')
+    argument_parser.add_argument('--iterations', type=int, default=20000, help='parses per scenario')
+    args = argument_parser.parse_args()
+
+    scenarios = dict(SCENARIOS)
+    # Slow clients deliver the head a few bytes at a time
+    scenarios['trickled GET'] = SCENARIOS['browser GET']
+    print(f'{"scenario":<14}{"parser":<13}{"req/s":>12}{"peak alloc":>14}')
+    for name, raw in scenarios.items():
+        recv_size = 16 if name == 'trickled GET' else RECV_SIZE
+        chunks = [raw[offset:offset + recv_size] for offset in range(0, len(raw), recv_size)]
+        # Large bodies make the old parser quadratic, keep its run time reasonable
+        iterations = args.iterations if len(chunks) < 4 else max(1, args.iterations // 100)
+        for parser_name, parse in [('legacy', legacy_parse), ('incremental', incremental_parse)]:
+            rate, peak = measure(parse, chunks, iterations)
+            print(f'{name:<14}{parser_name:<13}{rate:>12.0f}{peak / 1024:>11.1f} KiB')
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# Micro-benchmark comparing how responses were serialized before the response module (status line
+# rebuilt per reply, nested joins, bytearray concatenation of head and body, one sendall) against the
+# precomputed status lines and header blocks, prebuilt error replies and `Connection.send_parts`.
+#
+# run: python benchmarks/response_bench.py
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from connection import Connection  # noqa: E402
+from constants import STATUS_CODES  # noqa: E402
+from response import connection_headers, encode_response_head, prebuilt_json  # noqa: E402
+
+ALLOW_HEADER = 'Allow: GET, HEAD, OPTIONS'
+HTML_BODY = b'<!DOCTYPE html>\n<html><body>' + b'x' * 400 + b'</body></html>\n'
+LARGE_BODY = b'x' * 64 * 1024
+HTML_CONTENT_TYPE = 'text/html; charset=utf-8'
+FILE_HEADERS = ('Accept-Ranges: bytes\r\nETag: "11e02e-1d6-16ce8e24dc221e00"\r\n'
+                'Last-Modified: Fri, 28 Jan 2022 22:00:03 GMT')
+
+
+def legacy_status_line(status_code: int) -> str:
+    http_version = 'HTTP/1.1'
+    reason_phrase = STATUS_CODES[status_code]
+    return f'{http_version} {status_code} {reason_phrase}'
+
+
+def legacy_head(status_code: int, content_length: int, content_type: str, extra_headers: str = None) -> bytes:
+    entity_headers = [
+        f'Content-Length: {content_length}',
+        'Server: sumitro-server/1.0',
+    ]
+    if content_type is not None:
+        entity_headers.append(f'Content-Type: {content_type}')
+    if extra_headers is not None:
+        entity_headers.append(extra_headers)
+    return '\r\n'.join([legacy_status_line(status_code), *entity_headers]).encode('utf-8')
+
+
+def legacy_connection_headers(timeout: int, remaining: int) -> bytes:
+    return (f'\r\nConnection: keep-alive\r\nKeep-Alive: timeout={timeout}, '
+            f'max={remaining}\r\n\r\n').encode('utf-8')
+
+
+def legacy_reply(connection: Connection, status_code: int, body: bytes, content_type: str, extra_headers: str = None):
+    response = bytearray(legacy_head(status_code, len(body), content_type, extra_headers))
+    response += legacy_connection_headers(5, 99)
+    response += body
+    connection.send(response)
+
+
+def legacy_reply_json(connection: Connection, obj: dict, status_code: int, extra_headers: str = None):
+    legacy_reply(connection, status_code, bytearray(json.dumps(obj), 'utf-8'), 'application/json', extra_headers)
+
+
+def fast_reply(connection: Connection, head: bytes, body: bytes):
+    """
+    What `Request.reply_prebuilt` sends, `head` comes from `encode_response_head` or a `PrebuiltResponse`
+    """
+    connection.send_parts([head, connection_headers(True, 5, 99), body])
+
+
+NOT_FOUND = prebuilt_json({'err': 'No such file or directory'}, 404)
+METHOD_NOT_ALLOWED = prebuilt_json({'err': 'Method not allowed'}, 405, ALLOW_HEADER)
+BINARY_CONTENT_TYPE = 'application/octet-stream'
+
+SCENARIOS = {
+    '404 JSON': (
+        lambda connection: legacy_reply_json(connection, {'err': 'No such file or directory'}, 404),
+        lambda connection: fast_reply(connection, NOT_FOUND.head, NOT_FOUND.body),
+    ),
+    '405 JSON': (
+        lambda connection: legacy_reply_json(connection, {'err': 'Method not allowed'}, 405, ALLOW_HEADER),
+        lambda connection: fast_reply(connection, METHOD_NOT_ALLOWED.head, METHOD_NOT_ALLOWED.body),
+    ),
+    '200 html': (
+        lambda connection: legacy_reply(connection, 200, HTML_BODY, HTML_CONTENT_TYPE, FILE_HEADERS),
+        lambda connection: fast_reply(connection, encode_response_head(200, len(HTML_BODY), HTML_CONTENT_TYPE,
+                                                                       FILE_HEADERS), HTML_BODY),
+    ),
+    '200 64 KiB': (
+        lambda connection: legacy_reply(connection, 200, LARGE_BODY, BINARY_CONTENT_TYPE, FILE_HEADERS),
+        lambda connection: fast_reply(connection, encode_response_head(200, len(LARGE_BODY), BINARY_CONTENT_TYPE,
+                                                                       FILE_HEADERS), LARGE_BODY),
+    ),
+}
+
+
+def drain(sock: socket.socket):
+    while sock.recv(1024 * 1024):
+        pass
+
+
+def measure(reply, iterations: int) -> float:
+    """
+    Returns:
+    Microseconds of CPU spent by the replying thread per response, socket writes included
+    """
+    sender, receiver = socket.socketpair()
+    reader = threading.Thread(target=drain, args=(receiver,), daemon=True)
+    reader.start()
+    connection = Connection(sender)
+    try:
+        start = time.thread_time()
+        for _ in range(iterations):
+            reply(connection)
+        elapsed = time.thread_time() - start
+    finally:
+        sender.close()
+        reader.join()
+        receiver.close()
+    return elapsed / iterations * 1e6
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description='Compare the old and new response serialization')
+    argument_parser.add_argument('--iterations', type=int, default=50000, help='responses per scenario')
+    args = argument_parser.parse_args()
+
+    print(f'{"scenario":<12}{"legacy µs":>12}{"fast µs":>12}{"saved":>9}')
+    for name, (legacy, fast) in SCENARIOS.items():
+        legacy_time = measure(legacy, args.iterations)
+        fast_time = measure(fast, args.iterations)
+        print(f'{name:<12}{legacy_time:>12.2f}{fast_time:>12.2f}{1 - fast_time / legacy_time:>9.0%}')
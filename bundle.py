@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+# Packs a document root into a single indexed bundle file that FileServer serves from one memory map,
+# without a directory walk, path checks or an open per request. Deploy by building the new bundle next to
+# the served one and renaming it over it, the server swaps it in atomically.
+#
+# run: python bundle.py ./www site.bundle
+import argparse
+import hashlib
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+import zlib
+from compression import available_encodings, compress
+from constants import DEFAULT_ENCODING
+from file_index import IndexEntry
+from lifecycle import log
+from precompress import OFFLINE_LEVELS
+
+# Identifies a bundle file and the version of its layout
+BUNDLE_MAGIC = b'SUMBNDL\x00'
+BUNDLE_VERSION = 1
+
+# Layout of a bundle, all integers little-endian:
+# - header: magic, version, slot count, entry count, offset of the slot table, size of the whole file
+# - slot table: a power of two of slots holding the CRC-32 of a URL path and the offset of its record,
+#   an offset of 0 marks an empty slot, the table is at most half full so probes end quickly
+# - records: the URL path, content type, modification time and content digest of each entry, followed by
+#   one `VARIANT` per representation of its body
+# - bodies: the contents of the files and their precompressed variants, each stored once however many
+#   paths share it
+HEADER = struct.Struct('<8sIII4xQQ')
+SLOT = struct.Struct('<I4xQ')
+RECORD = struct.Struct('<BBHH2xd16s')
+VARIANT = struct.Struct('<8sQQ')
+
+# Set in the flags of a record for a directory path without a trailing `/`, redirected to the path with one
+REDIRECT_FLAG = 1
+
+# Name of the representation of a body that is sent as-is
+IDENTITY = 'identity'
+
+# Seconds between checks for a new bundle renamed over the served one
+DEFAULT_BUNDLE_CHECK_INTERVAL = 1.0
+
+# Bytes read at a time while digesting and copying files into a bundle
+COPY_BUFFER_BYTES = 1024 * 1024
+
+
+def path_hash(path: bytes) -> int:
+    """
+    Returns:
+    The hash of an encoded URL path that picks its slot, stable across processes and Python versions
+    """
+    return zlib.crc32(path)
+
+
+class BundleEntry:
+    """What a URL path of a bundle resolves to, its bodies are zero-copy slices of the bundle's memory map"""
+
+    __slots__ = ['path', 'redirect', 'content_type', 'mtime', 'digest', 'variants']
+
+    def __init__(self, path: str, redirect: bool, content_type: str, mtime: float, digest: str, variants: dict):
+        """
+        Params:
+        - `path` - the URL path relative to the document root, starting with `/`
+        - `redirect` - the path names a directory and should be redirected to the same path with a trailing `/`
+        - `content_type` - the value of the 'Content-Type' header
+        - `mtime` - modification time of the file when it was bundled, in seconds since the epoch
+        - `digest` - hex digest of the file contents
+        - `variants` - mapping of content coding (`IDENTITY` for the file as-is) to body
+        """
+        self.path = path
+        self.redirect = redirect
+        self.content_type = content_type
+        self.mtime = mtime
+        self.digest = digest
+        self.variants = variants
+
+    def etag(self, encoding: str = None) -> str:
+        """
+        Params:
+        - `encoding` - the content coding of the body sent, None if sent as-is
+
+        Returns:
+        The strong entity tag of one representation of the entry, built from the contents so it doesn't
+        change when an unchanged file is bundled again
+        """
+        if encoding is not None:
+            return f'"{self.digest}-{encoding}"'
+        return f'"{self.digest}"'
+
+
+class Bundle:
+    """
+    One bundle file mapped read-only into memory.
+
+    Opening it reads the fixed-size header only, however many files it holds, and a lookup hashes the path
+    and probes the slot table in the map, so nothing is parsed into the Python heap. Worker processes share
+    the pages of the map through the page cache. The map is released once the bundle and every body sliced
+    out of it are garbage, so a replaced bundle stays valid for the responses still sending from it.
+    """
+
+    def __init__(self, bundle_path: str):
+        """
+        Params:
+        - `bundle_path` - the bundle file
+
+        Raises:
+        OSError if the file can't be read, ValueError if it isn't a bundle
+        """
+        with open(bundle_path, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            if stat.st_size < HEADER.size:
+                raise ValueError(f'Not a bundle: {bundle_path}')
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.slot_count, self.entry_count, self.slots_offset, size = HEADER.unpack_from(self.map)
+        if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+            raise ValueError(f'Not a version {BUNDLE_VERSION} bundle: {bundle_path}')
+        if size != stat.st_size:
+            raise ValueError(f'Truncated bundle, expected {size} bytes: {bundle_path}')
+        self.size = size
+        self.inode = stat.st_ino
+        self.device = stat.st_dev
+        self.mtime_ns = stat.st_mtime_ns
+        self.view = memoryview(self.map)
+        self.__mask = self.slot_count - 1
+
+    def matches(self, stat: os.stat_result) -> bool:
+        """
+        Returns:
+        True if the file described by `stat` is the bundle that was mapped
+        """
+        return (self.inode == stat.st_ino and self.device == stat.st_dev and self.mtime_ns == stat.st_mtime_ns
+                and self.size == stat.st_size)
+
+    def lookup(self, path: str) -> BundleEntry:
+        """
+        Params:
+        - `path` - the URL path relative to the document root, starting with `/`
+
+        Returns:
+        The entry for the path, or None if nothing is served there
+        """
+        key = path.encode(DEFAULT_ENCODING, 'surrogateescape')
+        key_hash = path_hash(key)
+        slot = key_hash & self.__mask
+        while True:
+            slot_hash, offset = SLOT.unpack_from(self.map, self.slots_offset + slot * SLOT.size)
+            if offset == 0:
+                return None
+            if slot_hash == key_hash:
+                flags, variant_count, path_length, type_length, mtime, digest = RECORD.unpack_from(self.map, offset)
+                start = offset + RECORD.size
+                if self.map[start:start + path_length] == key:
+                    return self.__entry(path, start + path_length, flags, variant_count, type_length, mtime, digest)
+            slot = (slot + 1) & self.__mask
+
+    def __entry(self, path: str, offset: int, flags: int, variant_count: int, type_length: int, mtime: float,
+                digest: bytes) -> BundleEntry:
+        """
+        Decodes the rest of a record found by `lookup`
+
+        Params:
+        - `offset` - where the content type of the record starts
+        - the others - fields of the `RECORD`
+        """
+        content_type = self.map[offset:offset + type_length].decode(DEFAULT_ENCODING)
+        offset += type_length
+        variants = {}
+        for _ in range(variant_count):
+            encoding, body_offset, length = VARIANT.unpack_from(self.map, offset)
+            variants[encoding.rstrip(b'\0').decode()] = self.view[body_offset:body_offset + length]
+            offset += VARIANT.size
+        return BundleEntry(path, bool(flags & REDIRECT_FLAG), content_type, mtime, digest.rstrip(b'\0').decode(),
+                           variants)
+
+
+class BundleStore:
+    """
+    The bundle a `FileServer` serves, swapped for a new one when a new file is renamed over it.
+
+    At most every `check_interval` seconds a lookup stats the bundle path, and if it is a different file the
+    new bundle is opened and replaces the current one with a single assignment, so every request is served
+    entirely from one bundle. A new file that can't be opened is retried on the next check while the current
+    bundle keeps serving.
+    """
+
+    def __init__(self, bundle_path: str, check_interval: float = DEFAULT_BUNDLE_CHECK_INTERVAL):
+        """
+        Params:
+        - `bundle_path` - the bundle file
+        - `check_interval` - seconds between checks for a new bundle
+
+        Raises:
+        OSError if the file can't be read, ValueError if it isn't a bundle
+        """
+        self.bundle_path = bundle_path
+        self.check_interval = check_interval
+        self.bundle = Bundle(bundle_path)
+        self.__next_check = time.monotonic() + check_interval
+        self.__lock = threading.Lock()
+        self.__stats = {'swaps': 0, 'swap_failures': 0}
+
+    def lookup(self, path: str) -> BundleEntry:
+        """
+        Params:
+        - `path` - the URL path relative to the document root, starting with `/`
+
+        Returns:
+        The entry for the path in the current bundle, or None if nothing is served there
+        """
+        if time.monotonic() >= self.__next_check:
+            self.__check()
+        return self.bundle.lookup(path)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+        Swap counts along with the number of entries and bytes of the current bundle
+        """
+        bundle = self.bundle
+        return {**self.__stats, 'entries': bundle.entry_count, 'bytes': bundle.size}
+
+    def __check(self):
+        """
+        Swaps in the bundle file if it changed, one thread checks while the others keep serving
+        """
+        if not self.__lock.acquire(blocking=False):
+            return
+        try:
+            self.__next_check = time.monotonic() + self.check_interval
+            try:
+                stat = os.stat(self.bundle_path)
+            except OSError:
+                # Removed or not renamed in place yet, keep serving the current bundle
+                return
+            if self.bundle.matches(stat):
+                return
+            try:
+                bundle = Bundle(self.bundle_path)
+            except (OSError, ValueError) as err:
+                self.__stats['swap_failures'] += 1
+                log(f'Could not swap in the new bundle, keeping the current one: {err}')
+                return
+            self.bundle = bundle
+            self.__stats['swaps'] += 1
+            log(f'Swapped in the bundle {self.bundle_path} with {bundle.entry_count} entries')
+        finally:
+            self.__lock.release()
+
+
+def scan_directory(directory_path: str) -> dict:
+    """
+    Walks a document root the way `FileIndex` indexes it: every regular file inside it, `dir/` for the
+    `index.html` of a directory and `dir` redirecting to `dir/`
+
+    Params:
+    - `directory_path` - the document root
+
+    Returns:
+    Mapping of URL path to the file it serves, None for redirects, in a stable order
+    """
+    root_path = os.path.realpath(directory_path)
+    entries = {}
+    for current_path, directory_names, file_names in os.walk(directory_path):
+        directory_names.sort()
+        resolved = os.path.realpath(current_path)
+        if resolved != root_path and not resolved.startswith(root_path + os.sep):
+            directory_names.clear()
+            continue
+        relative = os.path.relpath(current_path, directory_path)
+        current_url = '/' if relative == '.' else f'/{relative.replace(os.sep, "/")}/'
+        if current_url != '/':
+            entries[current_url[:-1]] = None
+        for file_name in sorted(file_names):
+            file_path = os.path.join(current_path, file_name)
+            resolved = os.path.realpath(file_path)
+            if not os.path.isfile(file_path) or not resolved.startswith(root_path + os.sep):
+                continue
+            entries[current_url + file_name] = file_path
+            if file_name == 'index.html':
+                entries[current_url] = file_path
+    return entries
+
+
+def digest_file(file_path: str) -> str:
+    """
+    Returns:
+    A 16 character hex digest of the file contents
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    with open(file_path, 'br') as file:
+        for block in iter(lambda: file.read(COPY_BUFFER_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_bundle(directory_path: str, bundle_path: str, encodings: list) -> int:
+    """
+    Packs a document root into a bundle. Text files (see `TEXT_CONTENT_TYPES`) get a precompressed variant
+    for each coding that makes them smaller.
+
+    Params:
+    - `directory_path` - the document root
+    - `bundle_path` - the bundle file to write
+    - `encodings` - content codings to precompress text files with
+
+    Returns:
+    The number of URL paths in the bundle
+    """
+    paths = scan_directory(directory_path)
+
+    # Describe every file once, however many paths serve it
+    files = {}
+    for file_path in paths.values():
+        if file_path is None or file_path in files:
+            continue
+        stat = os.stat(file_path)
+        index_entry = IndexEntry(file_path, stat.st_size)
+        compressed = {}
+        if index_entry.extension is not None and encodings:
+            with open(file_path, 'br') as file:
+                data = file.read()
+            for encoding in encodings:
+                body = compress(data, encoding, OFFLINE_LEVELS[encoding])
+                if len(body) < len(data):
+                    compressed[encoding] = body
+        files[file_path] = (index_entry.content_type, stat.st_mtime, stat.st_size, digest_file(file_path),
+                            compressed)
+
+    # Lay out the records after the slot table, and the bodies after the records, bodies shared by files
+    # with the same contents are stored once
+    slot_count = 8
+    while slot_count < 2 * len(paths):
+        slot_count *= 2
+    slots_offset = HEADER.size
+    offset = slots_offset + slot_count * SLOT.size
+    records = []
+    for url_path, file_path in paths.items():
+        key = url_path.encode(DEFAULT_ENCODING, 'surrogateescape')
+        variant_count = 0
+        if file_path is not None:
+            variant_count = 1 + len(files[file_path][4])
+            content_type = files[file_path][0].encode(DEFAULT_ENCODING)
+        else:
+            content_type = b''
+        records.append((key, offset, file_path, content_type))
+        offset += RECORD.size + len(key) + len(content_type) + variant_count * VARIANT.size
+    bodies = {}
+    for file_path, (_, _, size, digest, compressed) in files.items():
+        for encoding, length in [(IDENTITY, size), *((name, len(body)) for name, body in compressed.items())]:
+            if (digest, encoding) not in bodies:
+                bodies[(digest, encoding)] = (offset, length, file_path)
+                offset += length
+    size = offset
+
+    slots = bytearray(slot_count * SLOT.size)
+    for key, record_offset, _, _ in records:
+        key_hash = path_hash(key)
+        slot = key_hash & (slot_count - 1)
+        while SLOT.unpack_from(slots, slot * SLOT.size)[1] != 0:
+            slot = (slot + 1) & (slot_count - 1)
+        SLOT.pack_into(slots, slot * SLOT.size, key_hash, record_offset)
+
+    # Write then rename so the server never sees a partially written bundle
+    temporary_path = f'{bundle_path}.tmp'
+    with open(temporary_path, 'bw') as bundle:
+        bundle.write(HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, slot_count, len(paths), slots_offset, size))
+        bundle.write(slots)
+        for key, _, file_path, content_type in records:
+            if file_path is None:
+                bundle.write(RECORD.pack(REDIRECT_FLAG, 0, len(key), 0, 0.0, b'\0' * 16) + key)
+                continue
+            _, mtime, file_size, digest, compressed = files[file_path]
+            bundle.write(RECORD.pack(0, 1 + len(compressed), len(key), len(content_type), mtime, digest.encode()))
+            bundle.write(key + content_type)
+            for encoding in [IDENTITY, *compressed]:
+                body_offset, length, _ = bodies[(digest, encoding)]
+                bundle.write(VARIANT.pack(encoding.encode(), body_offset, length))
+        for (digest, encoding), (_, _, file_path) in bodies.items():
+            if encoding != IDENTITY:
+                bundle.write(files[file_path][4][encoding])
+                continue
+            with open(file_path, 'br') as file:
+                shutil.copyfileobj(file, bundle, COPY_BUFFER_BYTES)
+        if bundle.tell() != size:
+            raise OSError(f'Files changed while they were bundled, expected {size} bytes: {bundle_path}')
+    os.replace(temporary_path, bundle_path)
+    return len(paths)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pack a document root into a bundle served with --bundle')
+    parser.add_argument('directory', help='document root, e.g. ./www')
+    parser.add_argument('bundle', help='bundle file to write, replaced atomically if it exists')
+    parser.add_argument('--no-compression', action='store_true', help="don't precompress text files")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    count = build_bundle(args.directory, args.bundle, [] if args.no_compression else available_encodings())
+    print(f'{args.bundle}: {count} paths, {os.path.getsize(args.bundle)} bytes '
+          f'in {time.perf_counter() - started:.3f}s')
@@ -0,0 +1,152 @@
+import uuid
+from email.utils import parsedate_to_datetime
+from constants import DEFAULT_ENCODING
+from helpers import is_decimal
+
+# Requests asking for more (non-overlapping) ranges than this get the whole file instead
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when none of the requested byte ranges overlap the file"""
+
+
+def parse_range_header(header: str, size: int) -> list:
+    """
+    Parses a `Range` request header, see [RFC 7233](https://datatracker.ietf.org/doc/html/rfc7233#section-2.1)
+
+    Params:
+    - `header` - value of the `Range` header (e.g. `bytes=0-499,-500`)
+    - `size` - size of the file in bytes
+
+    Returns:
+    Sorted list of non-overlapping, inclusive `(start, end)` byte positions, or None if the header is
+    malformed or asks for too many ranges, in which case it should be ignored and the whole file sent
+
+    Raises:
+    RangeNotSatisfiable if the header is valid but no range overlaps the file
+    """
+    unit, separator, specs = header.partition('=')
+    if separator == '' or unit.strip().lower() != 'bytes':
+        return None
+
+    ranges = []
+    for spec in specs.split(','):
+        first, separator, last = spec.strip().partition('-')
+        if separator == '':
+            return None
+        if first == '':
+            # Suffix range, the last N bytes of the file
+            if not is_decimal(last):
+                return None
+            length = int(last)
+            if length == 0 or size == 0:
+                continue
+            ranges.append((max(0, size - length), size - 1))
+            continue
+
+        if not is_decimal(first) or (last != '' and not is_decimal(last)):
+            return None
+        start = int(first)
+        end = int(last) if last != '' else size - 1
+        if last != '' and end < start:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+
+    if len(ranges) == 0:
+        raise RangeNotSatisfiable()
+
+    # Coalesce overlapping and adjacent ranges
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        previous_start, previous_end = merged[-1]
+        if start <= previous_end + 1:
+            merged[-1] = (previous_start, max(previous_end, end))
+        else:
+            merged.append((start, end))
+
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def if_range_matches(if_range: str, etag: str, mtime: float) -> bool:
+    """
+    Evaluates an `If-Range` header against the current version of a file
+
+    Params:
+    - `if_range` - value of the `If-Range` header, or None
+    - `etag` - the current ETag of the file
+    - `mtime` - the current modification time of the file in seconds since the epoch
+
+    Returns:
+    True if the `Range` header should be honoured
+    """
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # Requires a strong comparison, so weak tags never match
+        return if_range == etag
+    try:
+        return parsedate_to_datetime(if_range).timestamp() == int(mtime)
+    except (TypeError, ValueError):
+        return False
+
+
+def content_range_header(start: int, end: int, size: int) -> str:
+    """
+    Params:
+    - `start` - first byte position of the range
+    - `end` - last byte position of the range (inclusive)
+    - `size` - size of the file in bytes
+
+    Returns:
+    The `Content-Range` header line for one range
+    """
+    return f'Content-Range: bytes {start}-{end}/{size}'
+
+
+def unsatisfiable_range_header(size: int) -> str:
+    """
+    Params:
+    - `size` - size of the file in bytes
+
+    Returns:
+    The `Content-Range` header line sent with 416 responses
+    """
+    return f'Content-Range: bytes */{size}'
+
+
+def multipart_byteranges(ranges: list, size: int, content_type: str) -> tuple:
+    """
+    Lays out a `multipart/byteranges` body without reading any of the file
+
+    Params:
+    - `ranges` - list of inclusive `(start, end)` byte positions
+    - `size` - size of the file in bytes
+    - `content_type` - the content type of the file
+
+    Returns:
+    A `(content_type, segments, content_length)` tuple. `content_type` is the multipart content type
+    including the boundary, `segments` lists the encoded part headers and `(offset, count)` file slices
+    in the order they are sent, and `content_length` is the total body size
+    """
+    boundary = uuid.uuid4().hex
+    segments = []
+    content_length = 0
+    for index, (start, end) in enumerate(ranges):
+        separator = '\r\n' if index > 0 else ''
+        part_head = (f'{separator}--{boundary}\r\nContent-Type: {content_type}\r\n'
+                     f'{content_range_header(start, end, size)}\r\n\r\n').encode(DEFAULT_ENCODING)
+        segments.append(part_head)
+        segments.append((start, end - start + 1))
+        content_length += len(part_head) + end - start + 1
+
+    closing = f'\r\n--{boundary}--\r\n'.encode(DEFAULT_ENCODING)
+    segments.append(closing)
+    content_length += len(closing)
+    return f'multipart/byteranges; boundary={boundary}', segments, content_length
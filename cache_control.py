@@ -0,0 +1,138 @@
+import os
+from email.utils import formatdate, parsedate_to_datetime
+
+
+def make_etag(stat: os.stat_result, variant: str = None) -> str:
+    """
+    Builds a strong entity tag identifying one version of a file
+
+    Params:
+    - `stat` - result of `os.stat` on the file
+    - `variant` - name of the representation (e.g. a content coding) if the file isn't sent as-is
+
+    Returns:
+    The quoted ETag value built from the file's inode, size and modification time
+    """
+    if variant is not None:
+        return f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}-{variant}"'
+    return f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def http_date(timestamp: float) -> str:
+    """
+    Formats a timestamp as an [HTTP-date](https://datatracker.ietf.org/doc/html/rfc2616#section-3.3.1)
+
+    Params:
+    - `timestamp` - seconds since the epoch
+    """
+    return formatdate(timestamp, usegmt=True)
+
+
+def validator_headers(etag: str, mtime: float) -> str:
+    """
+    Params:
+    - `etag` - value returned by `make_etag`
+    - `mtime` - modification time of the file in seconds since the epoch
+
+    Returns:
+    The `ETag` and `Last-Modified` headers joined by CRLF
+    """
+    return f'ETag: {etag}\r\nLast-Modified: {http_date(mtime)}'
+
+
+def is_not_modified(if_none_match: str, if_modified_since: str, etag: str, mtime: float) -> bool:
+    """
+    Evaluates the conditional GET headers of a request against the current version of a file.
+    As required by [RFC 7232](https://datatracker.ietf.org/doc/html/rfc7232#section-6),
+    `If-Modified-Since` is ignored when `If-None-Match` is present.
+
+    Params:
+    - `if_none_match` - value of the `If-None-Match` request header, or None
+    - `if_modified_since` - value of the `If-Modified-Since` request header, or None
+    - `etag` - the current ETag of the file
+    - `mtime` - the current modification time of the file in seconds since the epoch
+
+    Returns:
+    True if the client's copy is current and a 304 Not Modified should be sent
+    """
+    if if_none_match is not None:
+        if if_none_match.strip() == '*':
+            return True
+        # Weak comparison, a W/ prefix doesn't matter for GET
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag == etag:
+                return True
+        return False
+
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            # Invalid dates are ignored
+            return False
+        # HTTP dates have one second resolution
+        return int(mtime) <= since
+
+    return False
+
+
+class CacheControlRules:
+    """
+    Picks the `Cache-Control: max-age` to send for a file based on its path or extension.
+
+    Rules are a mapping of pattern to max-age in seconds, where a pattern is either
+    a path prefix starting with `/` (e.g. `/deep/`) or an extension starting with `.` (e.g. `.css`).
+    The longest matching path prefix wins, then a matching extension, then `default_max_age`.
+    """
+
+    def __init__(self, rules: dict = None, default_max_age: int = None):
+        """
+        Params:
+        - `rules` - mapping of path prefix or extension to max-age in seconds
+        - `default_max_age` - max-age for files matching no rule, None to send no `Cache-Control` header
+        """
+        rules = rules or {}
+        for pattern in rules:
+            if not pattern.startswith('/') and not pattern.startswith('.'):
+                raise ValueError(f'Cache-Control rule must start with "/" or ".": {pattern}')
+
+        # Longest prefix first so the first match is the most specific one
+        self.__prefixes = sorted(((pattern, max_age) for pattern, max_age in rules.items() if pattern.startswith('/')),
+                                 key=lambda rule: len(rule[0]), reverse=True)
+        self.__extensions = {pattern[1:]: max_age for pattern, max_age in rules.items() if pattern.startswith('.')}
+        self.default_max_age = default_max_age
+
+    def max_age(self, path: str) -> int:
+        """
+        Params:
+        - `path` - URL path of the file relative to the served directory (e.g. `/deep/deep.css`)
+
+        Returns:
+        The max-age in seconds, or None if no rule applies
+        """
+        for prefix, max_age in self.__prefixes:
+            if path.startswith(prefix):
+                return max_age
+
+        file_name = path.rsplit('/', 1)[-1]
+        extension = file_name.rsplit('.', 1)[-1] if '.' in file_name else None
+        if extension in self.__extensions:
+            return self.__extensions[extension]
+
+        return self.default_max_age
+
+    def header(self, path: str) -> str:
+        """
+        Params:
+        - `path` - URL path of the file relative to the served directory
+
+        Returns:
+        The `Cache-Control` header line, or None if no rule applies
+        """
+        max_age = self.max_age(path)
+        if max_age is None:
+            return None
+        return f'Cache-Control: max-age={max_age}'
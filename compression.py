@@ -0,0 +1,114 @@
+import gzip
+from file_cache import FileCache
+
+try:
+    import brotli
+except ImportError:
+    # Brotli is optional, only gzip is offered without it
+    brotli = None
+
+# Content codings in order of preference, mapped to the extension of precompressed siblings
+ENCODING_EXTENSIONS = {
+    'br': '.br',
+    'gzip': '.gz',
+}
+
+# Files smaller than this aren't worth compressing on the fly
+DEFAULT_MIN_COMPRESS_BYTES = 256
+
+# Files larger than this are only served compressed if a precompressed sibling exists
+DEFAULT_MAX_COMPRESS_BYTES = 1024 * 1024
+
+# Memory budget of the cache holding compressed responses
+DEFAULT_COMPRESSION_CACHE_BYTES = 8 * 1024 * 1024
+
+
+def available_encodings() -> list:
+    """
+    Returns:
+    The content codings this server can produce, in order of preference
+    """
+    return [encoding for encoding in ENCODING_EXTENSIONS if encoding != 'br' or brotli is not None]
+
+
+def parse_accept_encoding(header: str) -> list:
+    """
+    Parses an `Accept-Encoding` request header,
+    see [RFC 7231](https://datatracker.ietf.org/doc/html/rfc7231#section-5.3.4)
+
+    Params:
+    - `header` - value of the header (e.g. `gzip, deflate, br;q=0.5`), or None
+
+    Returns:
+    The codings from `ENCODING_EXTENSIONS` the client accepts, most preferred first
+    """
+    if header is None:
+        return []
+
+    weights = {}
+    for item in header.split(','):
+        coding, _, parameters = item.strip().partition(';')
+        coding = coding.strip().lower()
+        weight = 1.0
+        parameter = parameters.strip()
+        if parameter.startswith('q='):
+            try:
+                weight = float(parameter[2:])
+            except ValueError:
+                weight = 0.0
+        if coding == 'x-gzip':
+            coding = 'gzip'
+        weights[coding] = weight
+
+    wildcard = weights.get('*', 0.0)
+    accepted = [(weights.get(coding, wildcard), index, coding) for index, coding in enumerate(ENCODING_EXTENSIONS)]
+    # Highest weight first, ties broken by our own preference order
+    return [coding for weight, index, coding in sorted(accepted, key=lambda item: (-item[0], item[1])) if weight > 0]
+
+
+def compress(data: bytes, encoding: str, level: int = None) -> bytes:
+    """
+    Compresses data with the given content coding
+
+    Params:
+    - `data` - the bytes to compress
+    - `encoding` - `gzip` or `br`
+    - `level` - compression level (gzip 1-9, brotli quality 0-11), a fast default is used if None
+    """
+    if encoding == 'gzip':
+        # mtime=0 keeps the output identical across runs
+        return gzip.compress(data, compresslevel=6 if level is None else level, mtime=0)
+    if encoding == 'br' and brotli is not None:
+        return brotli.compress(data, quality=5 if level is None else level)
+    raise ValueError(f'Unsupported content coding: {encoding}')
+
+
+class Compression:
+    """
+    Content negotiation settings for `FileServer`, along with the cache of compressed file responses
+    so each version of a file is only compressed once per coding
+    """
+
+    def __init__(self, min_bytes: int = DEFAULT_MIN_COMPRESS_BYTES, max_bytes: int = DEFAULT_MAX_COMPRESS_BYTES,
+                 cache_bytes: int = DEFAULT_COMPRESSION_CACHE_BYTES):
+        """
+        Params:
+        - `min_bytes` - smallest file compressed on the fly
+        - `max_bytes` - largest file compressed on the fly
+        - `cache_bytes` - memory budget for compressed responses
+        """
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.encodings = available_encodings()
+        self.cache = FileCache(cache_bytes, max_bytes)
+
+    def should_compress(self, encoding: str, size: int) -> bool:
+        """
+        Params:
+        - `encoding` - the content coding
+        - `size` - the size of the uncompressed file in bytes
+
+        Returns:
+        True if a file of this size is compressed on the fly with `encoding`
+        """
+        return encoding in self.encodings and self.min_bytes <= size <= self.max_bytes
@@ -0,0 +1,449 @@
+import os
+import queue
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+from config import ServerConfig
+from lifecycle import Drain, hand_off, inherited_socket, log, notify_ready
+from limits import REJECTED_CONNECTION_REPLIES, ConnectionLimiter
+from metrics import METRICS
+
+# Seconds a worker process is given to finish in-flight requests before it is killed
+WORKER_SHUTDOWN_TIMEOUT = 10
+
+
+class ReusableTCPServer(socketserver.TCPServer):
+    """
+    TCP server that allows quick rebinding and a configurable listen backlog.
+
+    With a `ConnectionLimiter`, connections over its caps are answered with a canned 503 or 429 and closed
+    as soon as they are accepted, without waiting for their request or for a free worker.
+    """
+
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, backlog: int = 128, reuse_port: bool = False,
+                 bind_and_activate: bool = True, connection_limiter: ConnectionLimiter = None,
+                 listening_socket: socket.socket = None):
+        """
+        Params:
+        - `server_address` - `(host, port)` tuple to listen on
+        - `handler_class` - `socketserver.BaseRequestHandler` subclass used for each connection
+        - `backlog` - size of the kernel queue of connections waiting to be accepted
+        - `reuse_port` - set `SO_REUSEPORT` so several processes can bind the same port
+        - `connection_limiter` - caps on the connections open at once, None for no caps
+        - `listening_socket` - an already listening socket to accept on instead of binding `server_address`,
+           e.g. one inherited from the process this one replaces
+        """
+        self.request_queue_size = backlog
+        self.reuse_port = reuse_port
+        self.connection_limiter = connection_limiter
+        # Client address of each admitted connection, released once the connection is shut down
+        self.__admitted = {}
+        if listening_socket is None:
+            super().__init__(server_address, handler_class, bind_and_activate)
+            return
+        super().__init__(server_address, handler_class, bind_and_activate=False)
+        self.socket.close()
+        self.socket = listening_socket
+        self.server_address = listening_socket.getsockname()
+
+    def verify_request(self, request, client_address) -> bool:
+        if self.connection_limiter is None:
+            return True
+        rejection = self.connection_limiter.acquire(client_address[0])
+        if rejection is not None:
+            reject_connection(request, rejection)
+            return False
+        self.__admitted[request] = client_address[0]
+        return True
+
+    def shutdown_request(self, request):
+        client = self.__admitted.pop(request, None)
+        if client is not None:
+            self.connection_limiter.release(client)
+        super().shutdown_request(request)
+
+    def server_bind(self):
+        if self.reuse_port:
+            if not hasattr(socket, 'SO_REUSEPORT'):
+                raise OSError('SO_REUSEPORT is not supported on this platform')
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+def reject_connection(client_socket: socket.socket, status_code: int):
+    """
+    Sends the canned reply to a connection turned away by a `ConnectionLimiter`, without blocking:
+    if the client's receive window can't take it at once, the connection is just closed
+
+    Params:
+    - `client_socket` - the accepted socket, closed by the caller
+    - `status_code` - the status returned by `ConnectionLimiter.acquire`
+    """
+    try:
+        client_socket.setblocking(False)
+        client_socket.send(REJECTED_CONNECTION_REPLIES[status_code])
+    except OSError:
+        pass
+
+
+class ThreadPoolTCPServer(ReusableTCPServer):
+    """
+    TCP server that hands accepted connections to a fixed pool of worker threads.
+
+    Unlike `socketserver.ThreadingMixIn`, the number of threads is bounded. Once every worker is busy
+    and `queue_size` connections are waiting, the accept loop blocks so further clients wait in the
+    kernel backlog instead of spawning more threads.
+    """
+
+    def __init__(self, server_address, handler_class, workers: int, queue_size: int, **kwargs):
+        """
+        Params:
+        - `server_address` - `(host, port)` tuple to listen on
+        - `handler_class` - `socketserver.BaseRequestHandler` subclass used for each connection
+        - `workers` - number of worker threads
+        - `queue_size` - number of accepted connections that may wait for a free worker
+        """
+        super().__init__(server_address, handler_class, **kwargs)
+        self.__pending = queue.Queue(maxsize=queue_size)
+        self.__threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self.__work, name=f'http-worker-{index}', daemon=True)
+            thread.start()
+            self.__threads.append(thread)
+
+    def process_request(self, request, client_address):
+        self.__pending.put((request, client_address, time.perf_counter()))
+
+    def server_close(self):
+        super().server_close()
+        # One sentinel per worker, each exits once the connections queued before it are served
+        for _ in self.__threads:
+            self.__pending.put(None)
+        for thread in self.__threads:
+            thread.join(WORKER_SHUTDOWN_TIMEOUT)
+
+    def __work(self):
+        """
+        Worker thread loop, serving queued connections until a `None` sentinel is received
+        """
+        while True:
+            item = self.__pending.get()
+            if item is None:
+                return
+            request, client_address, accepted = item
+            # Time the connection waited for a free worker
+            METRICS.observe_phase('accept', time.perf_counter() - accepted)
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+
+class WorkerSupervisor:
+    """
+    Forks and supervises worker processes, each running its own `serve_forever` loop.
+
+    Signals handled by the supervising process:
+    - `SIGTERM`/`SIGINT` - gracefully stop all workers and exit
+    - `SIGHUP` - reload the configuration (`on_reload`), then gracefully restart workers one at a time so
+      the new workers are forked with it
+    - `SIGUSR2` - start a new server process that takes over the listening socket, then stop
+    - `SIGUSR1` - passed on to every worker, which calls `on_dump`
+    Workers that die unexpectedly are restarted.
+    """
+
+    def __init__(self, workers: int, make_server, on_worker_exit=None, on_reload=None,
+                 listening_socket: socket.socket = None, on_dump=None):
+        """
+        Params:
+        - `workers` - number of worker processes to keep running
+        - `make_server` - function called inside each worker that returns the server it should run
+        - `on_worker_exit` - optional function called inside each worker once it has stopped serving
+        - `on_reload` - optional function called in the supervisor on `SIGHUP`, before workers are restarted
+        - `listening_socket` - the socket shared by the workers, handed over on `SIGUSR2`, None if every
+           worker binds its own
+        - `on_dump` - optional function called inside each worker on `SIGUSR1`, on a thread of its own
+        """
+        self.workers = workers
+        self.make_server = make_server
+        self.on_worker_exit = on_worker_exit
+        self.on_reload = on_reload
+        self.listening_socket = listening_socket
+        self.on_dump = on_dump
+        self.__pids = set()
+        self.__stopping = False
+        self.__restart_requested = False
+        self.__handoff_requested = False
+
+    def run(self):
+        """
+        Starts the workers and supervises them until the supervisor is told to stop
+        """
+        signal.signal(signal.SIGTERM, self.__request_stop)
+        signal.signal(signal.SIGINT, self.__request_stop)
+        signal.signal(signal.SIGHUP, self.__request_restart)
+        signal.signal(signal.SIGUSR2, self.__request_handoff)
+        signal.signal(signal.SIGUSR1, self.__forward_dump)
+
+        for _ in range(self.workers):
+            self.__spawn()
+
+        while not self.__stopping:
+            if self.__restart_requested:
+                self.__restart_requested = False
+                if self.on_reload is not None:
+                    self.on_reload()
+                self.__rolling_restart()
+            if self.__handoff_requested:
+                self.__handoff_requested = False
+                listening_fd = self.listening_socket.fileno() if self.listening_socket is not None else None
+                threading.Thread(target=hand_off, args=(listening_fd, self.__hand_over), name='handoff',
+                                 daemon=True).start()
+            self.__reap(block=False)
+            while len(self.__pids) < self.workers and not self.__stopping:
+                self.__spawn()
+            time.sleep(0.1)
+
+        self.__stop_all()
+
+    def __hand_over(self):
+        """
+        Stops the supervisor once its replacement serves, the workers drain as they are stopped
+        """
+        self.__stopping = True
+
+    def __spawn(self) -> int:
+        """
+        Forks a new worker process
+
+        Returns:
+        The pid of the new worker
+        """
+        pid = os.fork()
+        if pid == 0:
+            self.__run_worker()
+        self.__pids.add(pid)
+        return pid
+
+    def __run_worker(self):
+        """
+        Body of a worker process, never returns
+        """
+        exit_code = 0
+        try:
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+            signal.signal(signal.SIGUSR1, signal.SIG_IGN if self.on_dump is None else self.__dump)
+            server = self.make_server()
+            drain = Drain()
+
+            def stop(signum, frame):
+                # shutdown() waits for serve_forever to return, so it can't be called from this thread
+                threading.Thread(target=stop_serving, args=(server, drain), daemon=True).start()
+
+            signal.signal(signal.SIGTERM, stop)
+            notify_ready()
+            server.serve_forever()
+            server.server_close()
+            drain.finish(WORKER_SHUTDOWN_TIMEOUT)
+            if self.on_worker_exit is not None:
+                self.on_worker_exit()
+        except Exception:
+            exit_code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exit_code)
+
+    def __reap(self, block: bool) -> list:
+        """
+        Collects exited worker processes
+
+        Params:
+        - `block` - wait for at least one worker to exit
+
+        Returns:
+        The pids of the workers that exited
+        """
+        exited = []
+        while self.__pids:
+            try:
+                pid, _ = os.waitpid(-1, 0 if block else os.WNOHANG)
+            except ChildProcessError:
+                self.__pids.clear()
+                break
+            if pid == 0:
+                break
+            self.__pids.discard(pid)
+            exited.append(pid)
+            block = False
+        return exited
+
+    def __terminate(self, pids: list):
+        """
+        Asks the given workers to stop and waits for them, killing any that exceed `WORKER_SHUTDOWN_TIMEOUT`
+
+        Params:
+        - `pids` - the workers to stop
+        """
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.monotonic() + WORKER_SHUTDOWN_TIMEOUT
+        remaining = set(pids)
+        while remaining and time.monotonic() < deadline:
+            for pid in list(remaining):
+                try:
+                    if os.waitpid(pid, os.WNOHANG)[0] != 0:
+                        remaining.discard(pid)
+                except ChildProcessError:
+                    remaining.discard(pid)
+            time.sleep(0.05)
+
+        for pid in remaining:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.__pids.difference_update(pids)
+
+    def __rolling_restart(self):
+        """
+        Replaces every worker with a fresh one, starting each replacement before stopping the old worker
+        so there is never a moment without a process accepting connections
+        """
+        for pid in list(self.__pids):
+            self.__spawn()
+            self.__terminate([pid])
+
+    def __stop_all(self):
+        """
+        Gracefully stops every worker
+        """
+        started = time.monotonic()
+        self.__terminate(list(self.__pids))
+        log(f'Workers stopped in {time.monotonic() - started:.3f}s')
+
+    def __request_stop(self, signum, frame):
+        self.__stopping = True
+
+    def __request_restart(self, signum, frame):
+        self.__restart_requested = True
+
+    def __request_handoff(self, signum, frame):
+        self.__handoff_requested = True
+
+    def __forward_dump(self, signum, frame):
+        for pid in list(self.__pids):
+            try:
+                os.kill(pid, signal.SIGUSR1)
+            except ProcessLookupError:
+                pass
+
+    def __dump(self, signum, frame):
+        # Writing files from a signal handler would block the worker's serving loop
+        threading.Thread(target=self.on_dump, name='dump', daemon=True).start()
+
+
+def stop_serving(server: socketserver.BaseServer, drain: Drain):
+    """
+    Stops a server from accepting connections and drains the ones it has open, blocking until its
+    `serve_forever` has returned
+
+    Params:
+    - `server` - the server
+    - `drain` - started before the server stops accepting, so a connection it is serving in its own
+      thread (`single` mode) isn't kept alive
+    """
+    drain.start()
+    server.shutdown()
+
+
+def serve(config: ServerConfig, handler_class, on_worker_exit=None, connection_limiter: ConnectionLimiter = None,
+          on_reload=None, on_dump=None):
+    """
+    Serves connections with `handler_class` using the concurrency model chosen in `config.mode`:
+    - `single` - one thread handles one connection at a time
+    - `threaded` - a bounded pool of `config.workers` threads
+    - `prefork` - `config.workers` processes accepting on one shared listening socket
+    - `reuseport` - `config.workers` processes, each with its own `SO_REUSEPORT` listening socket
+
+    `SIGHUP` calls `on_reload` (on a thread of its own in `single`/`threaded` mode). `SIGUSR2` starts a new
+    server process that inherits the listening socket, and once it serves this one stops accepting and
+    drains its connections. `SIGTERM` stops gracefully the same way. `SIGUSR1` calls `on_dump` in every
+    process serving requests.
+
+    Params:
+    - `config` - the server configuration
+    - `handler_class` - `socketserver.BaseRequestHandler` subclass used for each connection
+    - `on_worker_exit` - optional function called inside each worker process once it has stopped serving
+    - `connection_limiter` - caps on the connections open at once, each worker process keeps its own copy
+    - `on_reload` - optional function that reloads the configuration
+    - `on_dump` - optional function that writes out the diagnostics gathered by a serving process
+    """
+    address = (config.host, config.port)
+    listening_socket = inherited_socket()
+
+    if config.mode == 'single':
+        server = ReusableTCPServer(address, handler_class, backlog=config.backlog,
+                                   connection_limiter=connection_limiter, listening_socket=listening_socket)
+    elif config.mode == 'threaded':
+        server = ThreadPoolTCPServer(address, handler_class, config.workers, config.queue_size,
+                                     backlog=config.backlog, connection_limiter=connection_limiter,
+                                     listening_socket=listening_socket)
+    elif config.mode == 'prefork':
+        # Bind once in the supervisor, forked workers inherit and share the listening socket
+        shared = ReusableTCPServer(address, handler_class, backlog=config.backlog,
+                                   connection_limiter=connection_limiter, listening_socket=listening_socket)
+        WorkerSupervisor(config.workers, lambda: shared, on_worker_exit, on_reload, shared.socket,
+                         on_dump).run()
+        shared.server_close()
+        return
+    else:
+        if listening_socket is not None:
+            # Taking over from a process in another mode, the workers bind sockets of their own
+            listening_socket.close()
+
+        def make_server():
+            return ReusableTCPServer(address, handler_class, backlog=config.backlog, reuse_port=True,
+                                     connection_limiter=connection_limiter)
+        WorkerSupervisor(config.workers, make_server, on_worker_exit, on_reload, on_dump=on_dump).run()
+        return
+
+    drain = Drain()
+
+    def stop(signum=None, frame=None):
+        # shutdown() waits for serve_forever to return, so it can't be called from this thread
+        threading.Thread(target=stop_serving, args=(server, drain), daemon=True).start()
+
+    def reload(signum, frame):
+        if on_reload is not None:
+            threading.Thread(target=on_reload, name='reload', daemon=True).start()
+
+    def dump(signum, frame):
+        if on_dump is not None:
+            threading.Thread(target=on_dump, name='dump', daemon=True).start()
+
+    def restart(signum, frame):
+        threading.Thread(target=hand_off, args=(server.fileno(), stop), name='handoff', daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGHUP, reload)
+    signal.signal(signal.SIGUSR2, restart)
+    signal.signal(signal.SIGUSR1, dump)
+    notify_ready()
+    with server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    drain.finish(WORKER_SHUTDOWN_TIMEOUT)
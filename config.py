@@ -0,0 +1,426 @@
+import argparse
+import json
+import os
+from constants import DEFAULT_BODY_TIMEOUT, DEFAULT_HEADER_TIMEOUT, DEFAULT_KEEP_ALIVE_TIMEOUT, \
+    DEFAULT_MAX_KEEP_ALIVE_REQUESTS, DEFAULT_WRITE_TIMEOUT
+from access_log import DEFAULT_BACKUP_COUNT, DEFAULT_QUEUE_SIZE, LOG_FORMATS
+from autoindex import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from bundle import DEFAULT_BUNDLE_CHECK_INTERVAL
+from compression import DEFAULT_COMPRESSION_CACHE_BYTES, DEFAULT_MAX_COMPRESS_BYTES, DEFAULT_MIN_COMPRESS_BYTES
+from file_cache import DEFAULT_CACHE_BYTES, DEFAULT_MAX_ENTRY_BYTES
+from file_index import DEFAULT_POLL_INTERVAL, INDEX_REFRESH_MODES
+from http2 import DEFAULT_MAX_CONCURRENT_STREAMS
+from http_parser import DEFAULT_MAX_BODY_BYTES, DEFAULT_MAX_HEADER_BYTES, DEFAULT_MAX_HEADER_COUNT
+from limits import DEFAULT_REQUEST_BURST
+from mmap_pool import DEFAULT_MAX_MAPPED_FILE_BYTES, DEFAULT_MAX_MAPPED_FILES, DEFAULT_MMAP_BYTES
+from profiling import DEFAULT_DUMP_PREFIX, DEFAULT_PROFILE_PATH, DEFAULT_SLOW_REQUESTS_PATH, \
+    DEFAULT_SLOW_REQUESTS_WINDOW
+from proxy import BALANCING_METHODS, DEFAULT_CONNECT_TIMEOUT, DEFAULT_FAIL_TIMEOUT, DEFAULT_HEALTH_CHECK_INTERVAL, \
+    DEFAULT_MAX_FAILS, DEFAULT_MAX_IDLE_CONNECTIONS, DEFAULT_READ_TIMEOUT, parse_upstreams
+from response import DEFAULT_COALESCE_BYTES
+
+SERVING_MODES = ['single', 'threaded', 'prefork', 'reuseport', 'asyncio']
+
+# Settings of the listening socket, the serving backend, connections, the access log and profiling, only
+# applied when the server starts: changing them takes a restart (SIGUSR2) rather than a reload (SIGHUP)
+STARTUP_SETTINGS = [
+    'host', 'port', 'mode', 'workers', 'backlog', 'queue_size', 'write_buffer_high', 'write_buffer_low',
+    'keep_alive_timeout', 'max_keep_alive_requests', 'header_timeout', 'body_timeout', 'write_timeout',
+    'max_connections', 'max_connections_per_ip', 'max_header_bytes', 'max_header_count', 'max_body_bytes',
+    'stream_coalesce_bytes', 'http2', 'http2_max_streams', 'access_log', 'access_log_format', 'access_log_queue_size',
+    'access_log_max_bytes', 'access_log_rotate_seconds', 'access_log_backups', 'access_log_sample_rate',
+    'profile_sample_rate', 'slow_requests', 'slow_requests_window', 'profile_dump_prefix',
+]
+
+
+class ServerConfig:
+    """Settings used to start the web server, read from the command line and an optional JSON config file"""
+
+    def __init__(self, **settings):
+        """
+        Creates a new configuration, any setting not given falls back to its default
+
+        Params:
+        - `host` - interface to bind the listening socket to
+        - `port` - TCP port to listen on
+        - `mode` - concurrency model, one of `SERVING_MODES` (`asyncio` runs a single event loop)
+        - `workers` - number of worker threads (threaded) or processes (prefork, reuseport)
+        - `backlog` - size of the kernel queue of connections waiting to be accepted
+        - `queue_size` - connections accepted but waiting for a free worker thread (threaded mode)
+        - `write_buffer_high` - bytes buffered for a client before the asyncio backend stops producing output
+        - `write_buffer_low` - bytes buffered for a client below which the asyncio backend resumes
+        - `keep_alive_timeout` - seconds an idle persistent connection is kept open
+        - `max_keep_alive_requests` - requests served on a connection before it is closed
+        - `header_timeout` - seconds a client is given to send a request head once it has started (408 otherwise)
+        - `body_timeout` - seconds a client is given to send a request body once its head arrived (408 otherwise)
+        - `write_timeout` - seconds a client may go without accepting response bytes before it is dropped
+        - `max_connections` - most connections open at once (per process), more get 503, 0 for no limit
+        - `max_connections_per_ip` - most connections open at once from one IP address, more get 429,
+           0 for no limit
+        - `request_rate` - requests per second one IP address may sustain, more get 429, 0 for no limit
+        - `request_burst` - requests one IP address may send back to back before `request_rate` applies
+        - `max_header_bytes` - largest request line plus headers accepted (431 otherwise)
+        - `max_header_count` - most request header fields accepted (431 otherwise)
+        - `max_body_bytes` - largest request body accepted (413 otherwise)
+        - `stream_coalesce_bytes` - streamed response bytes gathered into one chunk before it is sent
+        - `http2` - serve HTTP/2 to clients that start it with prior knowledge or upgrade to h2c, off by default
+           so connections only ever speak HTTP/1.1 unless the operator opts in
+        - `http2_max_streams` - streams an HTTP/2 client may have open at once
+        - `directory` - directory of static files to serve at the site root
+        - `mounts` - mapping of path prefix (`/docs`) to another directory of static files served under it
+        - `redirects` - mapping of path prefix to the location it redirects to, the rest of the path is appended
+        - `proxies` - mapping of path prefix to the upstream servers requests under it are forwarded to,
+           as comma separated `HOST:PORT` addresses
+        - `proxy_balance` - how proxied requests are spread over upstream servers, one of `BALANCING_METHODS`
+        - `proxy_connect_timeout` - seconds allowed to connect to an upstream server (502/504 otherwise)
+        - `proxy_read_timeout` - seconds an upstream server may take to answer or go quiet mid-response (504)
+        - `proxy_max_idle_connections` - idle keep-alive connections kept open per upstream server
+        - `proxy_max_fails` - consecutive failures after which an upstream server is left out
+        - `proxy_fail_timeout` - seconds a failing upstream server is left out
+        - `proxy_health_check_path` - path probed on every upstream server in the background, None disables it
+        - `proxy_health_check_interval` - seconds between health checks
+        - `autoindex` - list the entries of directories that have no `index.html` instead of replying 404
+        - `autoindex_page_size` - entries per page of a directory listing, unless the client asks otherwise
+        - `file_index` - index the directory in memory at startup and keep it fresh with `inotify`, `poll`
+           or `auto` (inotify if supported), None resolves every request on disk
+        - `file_index_poll_interval` - seconds between rescans when the index is polled
+        - `bundle` - bundle file built with `bundle.py` to serve at the site root instead of `directory`,
+           None serves the directory
+        - `bundle_check_interval` - seconds between checks for a new bundle renamed over `bundle`
+        - `cache_bytes` - memory budget of the file response cache, 0 disables the cache
+        - `cache_max_entry_bytes` - largest file kept in the file response cache
+        - `mmap_bytes` - total size of the files kept memory-mapped for files too large to cache, 0 disables it
+        - `mmap_max_file_bytes` - largest file memory-mapped, larger files are streamed with sendfile
+        - `mmap_max_files` - most files kept memory-mapped at once
+        - `cache_control` - mapping of path prefix (`/deep/`) or extension (`.css`) to `Cache-Control` max-age
+        - `default_max_age` - max-age for files matching no `cache_control` rule, None sends no header
+        - `compression` - negotiate gzip/brotli content coding for text files, off by default so responses stay
+           byte-for-byte the files served
+        - `compression_min_bytes` - smallest file compressed on the fly
+        - `compression_max_bytes` - largest file compressed on the fly
+        - `compression_cache_bytes` - memory budget of the compressed response cache
+        - `metrics_path` - path serving the Prometheus metrics (e.g. `/-/metrics`), empty to keep them private
+        - `access_log` - file the access log is appended to, `-` for stdout, None disables it
+        - `access_log_format` - one of `LOG_FORMATS`
+        - `access_log_queue_size` - access log records buffered before new ones are dropped
+        - `access_log_max_bytes` - rotate the access log at this size, 0 disables size-based rotation
+        - `access_log_rotate_seconds` - rotate the access log after this many seconds, 0 disables it
+        - `access_log_backups` - rotated access logs kept
+        - `access_log_sample_rate` - fraction of records kept while the access log queue is more than half full
+        - `profile_sample_rate` - fraction of requests profiled with cProfile, 0 disables profiling
+        - `profile_path` - path serving the aggregated profile
+        - `slow_requests` - slowest recent requests kept with their phase timings, 0 disables the log
+        - `slow_requests_path` - path serving the slowest recent requests
+        - `slow_requests_window` - seconds after which requests start dropping out of the slow request log
+        - `profile_dump_prefix` - start of the names of the files the profile and slow requests are written
+           to on SIGUSR1
+        """
+        self.host = 'localhost'
+        self.port = 8080
+        self.mode = 'single'
+        self.workers = os.cpu_count() or 1
+        self.backlog = 128
+        self.queue_size = 256
+        self.write_buffer_high = 256 * 1024
+        self.write_buffer_low = 64 * 1024
+        self.keep_alive_timeout = DEFAULT_KEEP_ALIVE_TIMEOUT
+        self.max_keep_alive_requests = DEFAULT_MAX_KEEP_ALIVE_REQUESTS
+        self.header_timeout = DEFAULT_HEADER_TIMEOUT
+        self.body_timeout = DEFAULT_BODY_TIMEOUT
+        self.write_timeout = DEFAULT_WRITE_TIMEOUT
+        self.max_connections = 0
+        self.max_connections_per_ip = 0
+        self.request_rate = 0
+        self.request_burst = DEFAULT_REQUEST_BURST
+        self.max_header_bytes = DEFAULT_MAX_HEADER_BYTES
+        self.max_header_count = DEFAULT_MAX_HEADER_COUNT
+        self.max_body_bytes = DEFAULT_MAX_BODY_BYTES
+        self.stream_coalesce_bytes = DEFAULT_COALESCE_BYTES
+        self.http2 = False
+        self.http2_max_streams = DEFAULT_MAX_CONCURRENT_STREAMS
+        self.directory = './www'
+        self.mounts = {}
+        self.autoindex = False
+        self.autoindex_page_size = DEFAULT_PAGE_SIZE
+        self.redirects = {}
+        self.proxies = {}
+        self.proxy_balance = 'round_robin'
+        self.proxy_connect_timeout = DEFAULT_CONNECT_TIMEOUT
+        self.proxy_read_timeout = DEFAULT_READ_TIMEOUT
+        self.proxy_max_idle_connections = DEFAULT_MAX_IDLE_CONNECTIONS
+        self.proxy_max_fails = DEFAULT_MAX_FAILS
+        self.proxy_fail_timeout = DEFAULT_FAIL_TIMEOUT
+        self.proxy_health_check_path = None
+        self.proxy_health_check_interval = DEFAULT_HEALTH_CHECK_INTERVAL
+        self.file_index = None
+        self.file_index_poll_interval = DEFAULT_POLL_INTERVAL
+        self.bundle = None
+        self.bundle_check_interval = DEFAULT_BUNDLE_CHECK_INTERVAL
+        self.cache_bytes = DEFAULT_CACHE_BYTES
+        self.cache_max_entry_bytes = DEFAULT_MAX_ENTRY_BYTES
+        self.mmap_bytes = DEFAULT_MMAP_BYTES
+        self.mmap_max_file_bytes = DEFAULT_MAX_MAPPED_FILE_BYTES
+        self.mmap_max_files = DEFAULT_MAX_MAPPED_FILES
+        self.cache_control = {}
+        self.default_max_age = None
+        self.compression = False
+        self.compression_min_bytes = DEFAULT_MIN_COMPRESS_BYTES
+        self.compression_max_bytes = DEFAULT_MAX_COMPRESS_BYTES
+        self.compression_cache_bytes = DEFAULT_COMPRESSION_CACHE_BYTES
+        self.metrics_path = ''
+        self.access_log = None
+        self.access_log_format = 'combined'
+        self.access_log_queue_size = DEFAULT_QUEUE_SIZE
+        self.access_log_max_bytes = 0
+        self.access_log_rotate_seconds = 0
+        self.access_log_backups = DEFAULT_BACKUP_COUNT
+        self.access_log_sample_rate = 1.0
+        self.profile_sample_rate = 0.0
+        self.profile_path = DEFAULT_PROFILE_PATH
+        self.slow_requests = 0
+        self.slow_requests_path = DEFAULT_SLOW_REQUESTS_PATH
+        self.slow_requests_window = DEFAULT_SLOW_REQUESTS_WINDOW
+        self.profile_dump_prefix = DEFAULT_DUMP_PREFIX
+        self.config_path = None
+
+        self.update(settings)
+
+    def update(self, settings: dict):
+        """
+        Overrides settings with the given values, ignoring values that are `None`
+
+        Params:
+        - `settings` - mapping of setting name to value
+
+        Raises:
+        ValueError if a setting is unknown or invalid
+        """
+        for key, value in settings.items():
+            if not hasattr(self, key):
+                raise ValueError(f'Unknown setting: {key}')
+            if value is not None:
+                setattr(self, key, value)
+
+        if self.mode not in SERVING_MODES:
+            raise ValueError(f'Unknown serving mode: {self.mode}')
+        if self.workers < 1:
+            raise ValueError('There must be at least one worker')
+        if min(self.keep_alive_timeout, self.header_timeout, self.body_timeout, self.write_timeout) <= 0:
+            raise ValueError('Timeouts must be positive')
+        if min(self.max_connections, self.max_connections_per_ip, self.request_rate) < 0:
+            raise ValueError('Connection and request rate limits must not be negative')
+        if self.request_burst < 1:
+            raise ValueError('The request burst must be at least 1')
+        if self.http2_max_streams < 1:
+            raise ValueError('HTTP/2 clients must be allowed at least one stream')
+        for prefix in [*self.mounts, *self.redirects, *self.proxies]:
+            if not prefix.startswith('/'):
+                raise ValueError(f'Route prefixes must start with /: {prefix}')
+        for upstreams in self.proxies.values():
+            parse_upstreams(upstreams)
+        if self.proxy_balance not in BALANCING_METHODS:
+            raise ValueError(f'Unknown proxy balancing method: {self.proxy_balance}')
+        if min(self.proxy_connect_timeout, self.proxy_read_timeout, self.proxy_health_check_interval) <= 0:
+            raise ValueError('Proxy timeouts and the health check interval must be positive')
+        if self.proxy_max_fails < 1:
+            raise ValueError('Upstream servers must be allowed at least one failure')
+        if not 0 < self.autoindex_page_size <= MAX_PAGE_SIZE:
+            raise ValueError(f'The directory listing page size must be in (0, {MAX_PAGE_SIZE}]')
+        if self.file_index is not None and self.file_index not in INDEX_REFRESH_MODES:
+            raise ValueError(f'Unknown file index refresh mode: {self.file_index}')
+        if self.bundle_check_interval <= 0:
+            raise ValueError('The bundle check interval must be positive')
+        if self.access_log_format not in LOG_FORMATS:
+            raise ValueError(f'Unknown access log format: {self.access_log_format}')
+        if not 0 < self.access_log_sample_rate <= 1:
+            raise ValueError('The access log sample rate must be in (0, 1]')
+        if not 0 <= self.profile_sample_rate <= 1:
+            raise ValueError('The profile sample rate must be in [0, 1]')
+        if self.slow_requests < 0 or self.slow_requests_window <= 0:
+            raise ValueError('The slow request log size must not be negative and its window must be positive')
+        for path in [self.profile_path, self.slow_requests_path, *filter(None, [self.metrics_path])]:
+            if not path.startswith('/'):
+                raise ValueError(f'Admin paths must start with /: {path}')
+
+
+def load_config(path: str) -> dict:
+    """
+    Reads settings from a JSON config file
+
+    Params:
+    - `path` - path to the JSON file, whose keys match the `ServerConfig` settings
+    """
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def parse_args(argv: list = None) -> ServerConfig:
+    """
+    Builds the server configuration from command line arguments.
+    Arguments take precedence over values in the config file given by `--config`.
+
+    Params:
+    - `argv` - command line arguments, defaults to `sys.argv[1:]`
+    """
+    parser = argparse.ArgumentParser(description='Serve static files over HTTP/1.1 and HTTP/2')
+    parser.add_argument('--config', dest='config_path', help='path to a JSON config file')
+    parser.add_argument('--host', help='interface to listen on (default: localhost)')
+    parser.add_argument('--port', type=int, help='port to listen on (default: 8080)')
+    parser.add_argument('--mode', choices=SERVING_MODES, help='concurrency model (default: single)')
+    parser.add_argument('--workers', type=int, help='worker threads or processes (default: CPU count)')
+    parser.add_argument('--backlog', type=int, help='listen backlog (default: 128)')
+    parser.add_argument('--queue-size', type=int, help='pending connections per thread pool (default: 256)')
+    parser.add_argument('--keep-alive-timeout', type=float, help='idle connection timeout in seconds')
+    parser.add_argument('--max-keep-alive-requests', type=int, help='requests served per connection')
+    parser.add_argument('--header-timeout', type=float,
+                        help=f'seconds allowed to send a request head (default: {DEFAULT_HEADER_TIMEOUT})')
+    parser.add_argument('--body-timeout', type=float,
+                        help=f'seconds allowed to send a request body (default: {DEFAULT_BODY_TIMEOUT})')
+    parser.add_argument('--write-timeout', type=float,
+                        help=f'seconds a client may stop reading a response (default: {DEFAULT_WRITE_TIMEOUT})')
+    parser.add_argument('--max-connections', type=int, help='connections open at once, 0 for no limit (default)')
+    parser.add_argument('--max-connections-per-ip', type=int,
+                        help='connections open at once from one IP address, 0 for no limit (default)')
+    parser.add_argument('--request-rate', type=float,
+                        help='requests per second per IP address, 0 for no limit (default)')
+    parser.add_argument('--request-burst', type=int,
+                        help=f'requests per IP address allowed back to back (default: {DEFAULT_REQUEST_BURST})')
+    parser.add_argument('--max-header-bytes', type=int, help='largest request head accepted (default: 8 KiB)')
+    parser.add_argument('--max-header-count', type=int, help='most request header fields accepted (default: 100)')
+    parser.add_argument('--max-body-bytes', type=int, help='largest request body accepted (default: 1 MiB)')
+    parser.add_argument('--stream-coalesce-bytes', type=int,
+                        help='streamed response bytes gathered into one chunk (default: 8 KiB)')
+    parser.add_argument('--http2', action='store_const', const=True,
+                        help='also serve HTTP/2 to clients starting it by prior knowledge or an h2c upgrade')
+    parser.add_argument('--http2-max-streams', type=int,
+                        help=f'streams open at once per HTTP/2 connection (default: {DEFAULT_MAX_CONCURRENT_STREAMS})')
+    parser.add_argument('--directory', help='directory to serve files from (default: ./www)')
+    parser.add_argument('--mount', dest='mounts', action='append', metavar='PREFIX=DIRECTORY',
+                        help='serve another directory under a path prefix, e.g. /docs=./docs (repeatable)')
+    parser.add_argument('--redirect', dest='redirects', action='append', metavar='PREFIX=LOCATION',
+                        help='redirect a path prefix, e.g. /old=/new (repeatable)')
+    parser.add_argument('--proxy', dest='proxies', action='append', metavar='PREFIX=HOST:PORT[,HOST:PORT...]',
+                        help='forward a path prefix to upstream servers, e.g. /api=127.0.0.1:9000 (repeatable)')
+    parser.add_argument('--proxy-balance', choices=BALANCING_METHODS,
+                        help='spread proxied requests round-robin or to the least busy server (default: round_robin)')
+    parser.add_argument('--proxy-connect-timeout', type=float,
+                        help=f'seconds to connect to an upstream server (default: {DEFAULT_CONNECT_TIMEOUT})')
+    parser.add_argument('--proxy-read-timeout', type=float,
+                        help=f'seconds an upstream server may go quiet (default: {DEFAULT_READ_TIMEOUT})')
+    parser.add_argument('--proxy-max-idle-connections', type=int,
+                        help=f'idle connections kept per upstream server (default: {DEFAULT_MAX_IDLE_CONNECTIONS})')
+    parser.add_argument('--proxy-max-fails', type=int,
+                        help=f'failures in a row that take an upstream server out (default: {DEFAULT_MAX_FAILS})')
+    parser.add_argument('--proxy-fail-timeout', type=float,
+                        help=f'seconds a failing upstream server is left out (default: {DEFAULT_FAIL_TIMEOUT})')
+    parser.add_argument('--proxy-health-check-path', metavar='PATH',
+                        help='probe upstream servers with GET PATH in the background, leaving out failing ones')
+    parser.add_argument('--proxy-health-check-interval', type=float,
+                        help=f'seconds between health checks (default: {DEFAULT_HEALTH_CHECK_INTERVAL})')
+    parser.add_argument('--autoindex', action='store_const', const=True,
+                        help='list directories that have no index.html')
+    parser.add_argument('--autoindex-page-size', type=int,
+                        help=f'entries per directory listing page (default: {DEFAULT_PAGE_SIZE})')
+    parser.add_argument('--file-index', choices=INDEX_REFRESH_MODES,
+                        help='resolve paths from an in-memory index of the directory, '
+                             'refreshed with inotify or polling')
+    parser.add_argument('--file-index-poll-interval', type=float, help='seconds between index rescans when polling')
+    parser.add_argument('--bundle',
+                        help='serve the site root from a bundle built with bundle.py instead of --directory')
+    parser.add_argument('--bundle-check-interval', type=float,
+                        help=f'seconds between checks for a new bundle (default: {DEFAULT_BUNDLE_CHECK_INTERVAL})')
+    parser.add_argument('--cache-bytes', type=int, help='file cache memory budget, 0 disables it (default: 16 MiB)')
+    parser.add_argument('--cache-max-entry-bytes', type=int, help='largest cached file (default: 1 MiB)')
+    parser.add_argument('--mmap-bytes', type=int,
+                        help='memory-map files too large to cache, up to this many bytes in total (default: off)')
+    parser.add_argument('--mmap-max-file-bytes', type=int, help='largest file memory-mapped (default: 16 MiB)')
+    parser.add_argument('--mmap-max-files', type=int, help='most files memory-mapped at once (default: 128)')
+    parser.add_argument('--cache-control', action='append', metavar='PATTERN=SECONDS',
+                        help='Cache-Control max-age for a path prefix or extension, e.g. .css=3600 (repeatable)')
+    parser.add_argument('--default-max-age', type=int, help='Cache-Control max-age for other files')
+    parser.add_argument('--compression', action='store_const', const=True,
+                        help='negotiate gzip/brotli content coding for text files')
+    parser.add_argument('--compression-min-bytes', type=int, help='smallest file compressed on the fly')
+    parser.add_argument('--compression-max-bytes', type=int, help='largest file compressed on the fly')
+    parser.add_argument('--compression-cache-bytes', type=int, help='compressed response cache memory budget')
+    parser.add_argument('--metrics-path',
+                        help='path serving Prometheus metrics, e.g. /-/metrics (default: not served)')
+    parser.add_argument('--access-log', metavar='PATH', help='append an access log to PATH, - for stdout')
+    parser.add_argument('--access-log-format', choices=LOG_FORMATS, help='access log line format (default: combined)')
+    parser.add_argument('--access-log-queue-size', type=int, help='access log records buffered before dropping')
+    parser.add_argument('--access-log-max-bytes', type=int, help='rotate the access log at this size')
+    parser.add_argument('--access-log-rotate-seconds', type=float, help='rotate the access log after this long')
+    parser.add_argument('--access-log-backups', type=int, help='rotated access logs kept (default: 5)')
+    parser.add_argument('--access-log-sample-rate', type=float,
+                        help='fraction of requests logged once the access log queue is half full (default: 1)')
+    parser.add_argument('--profile-sample-rate', type=float,
+                        help='fraction of requests profiled with cProfile, 0 disables profiling (default)')
+    parser.add_argument('--profile-path',
+                        help=f'path serving the aggregated profile (default: {DEFAULT_PROFILE_PATH})')
+    parser.add_argument('--slow-requests', type=int, metavar='N',
+                        help='keep the N slowest recent requests with phase timings, 0 disables it (default)')
+    parser.add_argument('--slow-requests-path',
+                        help=f'path serving the slowest recent requests (default: {DEFAULT_SLOW_REQUESTS_PATH})')
+    parser.add_argument('--slow-requests-window', type=float,
+                        help=f'seconds slow requests are kept for (default: {DEFAULT_SLOW_REQUESTS_WINDOW})')
+    parser.add_argument('--profile-dump-prefix', metavar='PREFIX',
+                        help=f'files the profile and slow requests are written to on SIGUSR1, followed by the '
+                             f'process id (default: {DEFAULT_DUMP_PREFIX})')
+    args = vars(parser.parse_args(argv))
+    if args['cache_control'] is not None:
+        args['cache_control'] = parse_cache_control_rules(args['cache_control'])
+    for key, metavar in [('mounts', 'PREFIX=DIRECTORY'), ('redirects', 'PREFIX=LOCATION'),
+                         ('proxies', 'PREFIX=HOST:PORT')]:
+        if args[key] is not None:
+            args[key] = parse_route_rules(args[key], metavar)
+
+    config = ServerConfig()
+    if args['config_path'] is not None:
+        config.update(load_config(args['config_path']))
+    if args['cache_control'] is not None:
+        # Command line rules add to the ones from the config file
+        args['cache_control'] = {**config.cache_control, **args['cache_control']}
+    for key in ['mounts', 'redirects', 'proxies']:
+        if args[key] is not None:
+            args[key] = {**getattr(config, key), **args[key]}
+    config.update(args)
+    return config
+
+
+def parse_cache_control_rules(rules: list) -> dict:
+    """
+    Parses `--cache-control` arguments
+
+    Params:
+    - `rules` - list of `PATTERN=SECONDS` strings
+
+    Returns:
+    Mapping of pattern to max-age in seconds
+    """
+    parsed = {}
+    for rule in rules:
+        pattern, separator, max_age = rule.partition('=')
+        if separator == '' or not max_age.isdigit():
+            raise ValueError(f'Invalid Cache-Control rule, expected PATTERN=SECONDS: {rule}')
+        parsed[pattern] = int(max_age)
+    return parsed
+
+
+def parse_route_rules(rules: list, metavar: str) -> dict:
+    """
+    Parses `--mount`, `--redirect` and `--proxy` arguments
+
+    Params:
+    - `rules` - list of `PREFIX=TARGET` strings
+    - `metavar` - the expected form, used in the error message
+
+    Returns:
+    Mapping of path prefix to target
+    """
+    parsed = {}
+    for rule in rules:
+        prefix, separator, target = rule.partition('=')
+        if separator == '' or prefix == '' or target == '':
+            raise ValueError(f'Invalid route, expected {metavar}: {rule}')
+        parsed[prefix] = target
+    return parsed
@@ -0,0 +1,585 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+from socket import SHUT_RD, SHUT_WR, SocketType
+from constants import DEFAULT_BODY_TIMEOUT, DEFAULT_HEADER_TIMEOUT, DEFAULT_KEEP_ALIVE_TIMEOUT, \
+    DEFAULT_MAX_KEEP_ALIVE_REQUESTS, DEFAULT_WRITE_TIMEOUT
+from http_parser import ParseError, ParsedRequest, RequestParser
+from response import DEFAULT_COALESCE_BYTES, ChunkedEncoder
+
+RECV_BUFFER_SIZE = 4096
+
+# Size of the reusable buffer used to stream files when the platform has no sendfile
+FILE_CHUNK_SIZE = 64 * 1024
+
+SENDFILE_AVAILABLE = hasattr(os, 'sendfile')
+
+# Responses smaller than this are joined into one buffer, copying them costs less than setting up a sendmsg
+SMALL_WRITE_BYTES = 2048
+
+
+class ConnectionStats:
+    """Thread-safe counters describing how TCP connections are reused across HTTP requests"""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__counters = {
+            'connections_opened': 0,
+            'requests_served': 0,
+            'requests_reused': 0,
+            'requests_pipelined': 0,
+            'idle_timeouts': 0,
+            'header_timeouts': 0,
+            'body_timeouts': 0,
+            'write_timeouts': 0,
+            'max_requests_reached': 0,
+            'http2_connections': 0,
+            'http2_streams': 0,
+        }
+
+    def increment(self, counter: str, amount: int = 1):
+        """
+        Increments a single counter
+
+        Params:
+        - `counter` - name of the counter to increment
+        - `amount` - how much to add to the counter
+        """
+        with self.__lock:
+            self.__counters[counter] += amount
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+        A copy of all counters at this point in time
+        """
+        with self.__lock:
+            return dict(self.__counters)
+
+
+CONNECTION_STATS = ConnectionStats()
+
+
+class OpenConnections:
+    """
+    Thread-safe registry of the client connections open in this process, so a server that stops accepting
+    can wind them down: once draining, no connection is kept alive past its current response and
+    connections waiting for their next request are closed right away.
+    """
+
+    def __init__(self):
+        self.__connections = set()
+        self.__changed = threading.Condition()
+        self.draining = False
+
+    def add(self, connection: 'BaseConnection'):
+        with self.__changed:
+            self.__connections.add(connection)
+
+    def discard(self, connection: 'BaseConnection'):
+        with self.__changed:
+            self.__connections.discard(connection)
+            self.__changed.notify_all()
+
+    def drain(self) -> int:
+        """
+        Stops keeping connections alive and closes the idle ones. With the asyncio backend this must be
+        called on the event loop.
+
+        Returns:
+        The number of connections open when draining started
+        """
+        with self.__changed:
+            self.draining = True
+            connections = list(self.__connections)
+        for connection in connections:
+            connection.close_if_idle()
+        return len(connections)
+
+    def wait_closed(self, timeout: float) -> bool:
+        """
+        Waits for every connection to be closed
+
+        Params:
+        - `timeout` - most seconds to wait
+
+        Returns:
+        True if every connection was closed in time
+        """
+        with self.__changed:
+            return self.__changed.wait_for(lambda: not self.__connections, timeout)
+
+    def __len__(self) -> int:
+        with self.__changed:
+            return len(self.__connections)
+
+
+OPEN_CONNECTIONS = OpenConnections()
+
+
+class IncompleteRequest(Exception):
+    """Raised by non-blocking connections when the received bytes don't hold a full request yet"""
+
+
+class RequestTimeout(ParseError):
+    """Raised when a client takes too long to send the head or body of a request, which is answered with 408"""
+
+    def __init__(self, phase: str):
+        """
+        Params:
+        - `phase` - `header` or `body`, the part of the request that wasn't received in time
+        """
+        super().__init__(408, f'Timed out reading the request {phase}')
+        self.phase = phase
+
+
+class BaseConnection:
+    """
+    Transport-independent part of a client connection, shared by the blocking socket and asyncio backends.
+
+    `Request` only talks to a connection through this interface, subclasses implement the I/O methods
+    `read_request`, `send`, `send_parts`, `send_file`, `send_stream`, `run_blocking` and `close`.
+    """
+
+    def __init__(self, idle_timeout: float = DEFAULT_KEEP_ALIVE_TIMEOUT,
+                 max_requests: int = DEFAULT_MAX_KEEP_ALIVE_REQUESTS,
+                 parser: RequestParser = None, client_address: str = None,
+                 coalesce_bytes: int = DEFAULT_COALESCE_BYTES, header_timeout: float = DEFAULT_HEADER_TIMEOUT,
+                 body_timeout: float = DEFAULT_BODY_TIMEOUT, write_timeout: float = DEFAULT_WRITE_TIMEOUT):
+        """
+        Params:
+        - `idle_timeout` - seconds to wait for the next request before closing the connection
+        - `max_requests` - maximum number of requests served before the connection is closed
+        - `parser` - parser for the bytes received on this connection, one with the default limits if None
+        - `client_address` - IP address of the peer, if known
+        - `coalesce_bytes` - streamed body bytes gathered into one chunk before it is sent
+        - `header_timeout` - seconds a client is given to send a request head once it has started sending it
+        - `body_timeout` - seconds a client is given to send a request body once its head has been received
+        - `write_timeout` - seconds a client may go without accepting any response bytes before the
+           connection is dropped
+        """
+        self.idle_timeout = idle_timeout
+        self.header_timeout = header_timeout
+        self.body_timeout = body_timeout
+        self.write_timeout = write_timeout
+        self.max_requests = max_requests
+        self.parser = parser if parser is not None else RequestParser()
+        self.client_address = client_address
+        self.coalesce_bytes = coalesce_bytes
+        self.requests_served = 0
+        self.closed = False
+        # Seconds spent parsing the last request read, not counting time waiting for its bytes
+        self.parse_time = 0.0
+
+        CONNECTION_STATS.increment('connections_opened')
+
+    def can_keep_alive(self) -> bool:
+        """
+        Returns:
+        True if the connection may serve another request after the current one
+        """
+        return not self.closed and not OPEN_CONNECTIONS.draining and self.requests_served + 1 < self.max_requests
+
+    def start_request(self, pipelined: bool):
+        """
+        Records that a request has been read off this connection
+
+        Params:
+        - `pipelined` - whether the request was already buffered before it was read
+        """
+        CONNECTION_STATS.increment('requests_served')
+        if self.requests_served > 0:
+            CONNECTION_STATS.increment('requests_reused')
+        if pipelined:
+            CONNECTION_STATS.increment('requests_pipelined')
+        if self.requests_served + 1 >= self.max_requests:
+            CONNECTION_STATS.increment('max_requests_reached')
+
+    def request_timed_out(self) -> RequestTimeout:
+        """
+        Records that the client didn't send the request being read in time
+
+        Returns:
+        The error to reply to the request with
+        """
+        phase = 'body' if self.parser.reading_body() else 'header'
+        CONNECTION_STATS.increment(f'{phase}_timeouts')
+        return RequestTimeout(phase)
+
+    def finish_request(self):
+        """
+        Records that a response has been fully sent on this connection
+        """
+        self.requests_served += 1
+
+    def read_request(self) -> ParsedRequest:
+        """
+        Reads the next request off the connection
+
+        Returns:
+        The parsed request, or None if the peer closed the connection (or stayed idle past `idle_timeout`)
+        before sending anything
+
+        Raises:
+        ParseError if the request is malformed, RequestTimeout if its head or body took longer than
+        `header_timeout` or `body_timeout` to arrive, ConnectionError if the peer closed the connection part
+        way through, IncompleteRequest on non-blocking connections that haven't received the whole request yet
+        """
+        raise NotImplementedError
+
+    def has_buffered_data(self) -> bool:
+        """
+        Returns:
+        True if bytes of a following request have already been received
+        """
+        return self.parser.in_progress()
+
+    def send(self, data: bytes):
+        raise NotImplementedError
+
+    def send_parts(self, parts: list):
+        """
+        Sends several buffers back to back, without joining them into one buffer first
+        """
+        raise NotImplementedError
+
+    def send_file(self, file, offset: int, count: int, close_file: bool = True):
+        """
+        Sends `count` bytes of an open binary file, starting at `offset`.
+        Unless `close_file` is False, the connection takes ownership of `file` and closes it once it has been sent.
+        """
+        raise NotImplementedError
+
+    def send_stream(self, chunks, encoder: ChunkedEncoder):
+        """
+        Sends a body produced piece by piece with the chunked transfer coding, pulling the next piece only
+        once the previous ones have been handed to the socket.
+        If producing the body fails, the connection is closed without ending the body, so the client can
+        tell the response is incomplete.
+
+        Params:
+        - `chunks` - iterable or async iterable of bytes-like pieces of the body
+        - `encoder` - frames the pieces: a `ChunkedEncoder`, or an `IdentityEncoder` for bodies of known length
+        """
+        raise NotImplementedError
+
+    def run_blocking(self, function) -> bool:
+        """
+        Runs `function()`, which replies to the current request but blocks on I/O of its own
+        (e.g. a request to another server)
+
+        Returns:
+        True if `function` was deferred to run once earlier responses have been sent, False if it has already run
+        """
+        raise NotImplementedError
+
+    def close_if_idle(self):
+        """
+        Closes the connection if it is waiting for the client's next request, rather than receiving a
+        request or sending a response. May be called from another thread than the one serving the connection.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+
+class Connection(BaseConnection):
+    """
+    Wrapper around a blocking client TCP socket that buffers received bytes so that several
+    (possibly pipelined) HTTP requests can be read from the same connection
+    """
+
+    def __init__(self, client_socket: SocketType, **kwargs):
+        """
+        Params:
+        - `client_socket` - the accepted TCP socket
+        - see `BaseConnection` for the keep-alive settings
+        """
+        super().__init__(**kwargs)
+        self.socket = client_socket
+        # Reused for every recv, the parser copies what was received into its own buffer
+        self.__recv_buffer = bytearray(RECV_BUFFER_SIZE)
+        # Timeout currently set on the socket, so it is only changed when switching between reads and writes
+        self.__timeout = None
+        # True while waiting for the first byte of the next request
+        self.__idle = False
+
+        # Responses are often written as separate head and body writes, don't let Nagle's algorithm
+        # hold the body back waiting for the client's (delayed) ACK of the head
+        try:
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+
+    def read_request(self) -> ParsedRequest:
+        """
+        Reads from the socket until the parser has a complete request, see `BaseConnection.read_request`.
+        The head and the body each have a deadline set when they start arriving, which receiving more bytes
+        doesn't push back, so a client can't hold the connection by trickling a request in byte by byte.
+        """
+        self.parse_time = 0.0
+        phase = None
+        deadline = None
+        while True:
+            started = time.perf_counter()
+            request = self.parser.parse()
+            self.parse_time += time.perf_counter() - started
+            if request is not None:
+                return request
+
+            if self.parser.reading_body():
+                if phase != 'body':
+                    phase, deadline = 'body', time.monotonic() + self.body_timeout
+            elif self.parser.in_progress() and phase is None:
+                phase, deadline = 'header', time.monotonic() + self.header_timeout
+            timeout = self.idle_timeout if phase is None else deadline - time.monotonic()
+            if timeout <= 0:
+                raise self.request_timed_out()
+
+            self.__idle = phase is None and not self.parser.in_progress()
+            if self.__idle and OPEN_CONNECTIONS.draining:
+                # Kept alive before draining started, don't wait for another request
+                self.__idle = False
+                return None
+            try:
+                received = self.__fill(timeout)
+            except socket.timeout:
+                if phase is None:
+                    CONNECTION_STATS.increment('idle_timeouts')
+                    return None
+                raise self.request_timed_out()
+            finally:
+                self.__idle = False
+            if not received:
+                if not self.parser.in_progress():
+                    return None
+                raise ConnectionError('Connection closed before end of request')
+
+    def receive(self, timeout: float, idle: bool = False) -> bytes:
+        """
+        Receives the next bytes the peer sends, for a protocol that took over the connection from the parser
+
+        Params:
+        - `timeout` - seconds to wait for bytes to arrive
+        - `idle` - whether the protocol is waiting for a new request, so `close_if_idle` may end the wait
+
+        Returns:
+        The bytes received, empty if the peer closed the connection (or it is idle and draining)
+
+        Raises:
+        socket.timeout if nothing arrived within `timeout`
+        """
+        if self.closed or (idle and OPEN_CONNECTIONS.draining):
+            return b''
+        self.__set_timeout(timeout)
+        self.__idle = idle
+        try:
+            received = self.socket.recv_into(self.__recv_buffer)
+        except socket.timeout:
+            raise
+        except OSError:
+            return b''
+        finally:
+            self.__idle = False
+        return bytes(self.__recv_buffer[:received])
+
+    def send(self, data: bytes):
+        """
+        Sends all of `data` to the peer
+
+        Params:
+        - `data` - the bytes to send
+        """
+        self.__set_timeout(self.write_timeout)
+        try:
+            self.socket.sendall(data)
+        except socket.timeout:
+            raise self.__write_timed_out()
+
+    def send_parts(self, parts: list):
+        """
+        Sends several buffers back to back with scatter/gather `sendmsg`, so they are never
+        concatenated in Python. Small responses are joined and sent with one `sendall` instead.
+
+        Params:
+        - `parts` - list of bytes-like objects to send in order
+        """
+        self.__set_timeout(self.write_timeout)
+        try:
+            self.__send_parts(parts)
+        except socket.timeout:
+            raise self.__write_timed_out()
+
+    def __send_parts(self, parts: list):
+        total = sum(map(len, parts))
+        if total < SMALL_WRITE_BYTES:
+            self.socket.sendall(b''.join(parts))
+            return
+        if not hasattr(self.socket, 'sendmsg'):
+            for part in parts:
+                self.socket.sendall(part)
+            return
+
+        sent = self.socket.sendmsg(parts)
+        if sent == total:
+            return
+        # The socket buffer filled up, drop the buffers that were fully sent and trim the one partially sent
+        views = [memoryview(part).cast('B') for part in parts if len(part) > 0]
+        while views:
+            while views and sent >= len(views[0]):
+                sent -= len(views[0])
+                views.pop(0)
+            if views and sent > 0:
+                views[0] = views[0][sent:]
+            if views:
+                sent = self.socket.sendmsg(views)
+
+    def send_file(self, file, offset: int, count: int, close_file: bool = True):
+        """
+        Sends `count` bytes of an open binary file, starting at `offset`, then closes the file.
+        Uses zero-copy `sendfile` where available and otherwise streams through a fixed-size buffer,
+        so memory use doesn't grow with the size of the file.
+
+        Params:
+        - `file` - a file object opened in binary mode
+        - `offset` - position in the file to start sending from
+        - `count` - number of bytes to send
+        - `close_file` - close the file once sent, False to send more slices of it afterwards
+        """
+        self.__set_timeout(self.write_timeout)
+        try:
+            if SENDFILE_AVAILABLE:
+                self.socket.sendfile(file, offset, count)
+            else:
+                send_file_in_chunks(self.socket, file, offset, count)
+        except socket.timeout:
+            raise self.__write_timed_out()
+        finally:
+            if close_file:
+                file.close()
+
+    def send_stream(self, chunks, encoder: ChunkedEncoder):
+        """
+        Sends a streamed body, see `BaseConnection.send_stream`. Blocking writes hold back the next piece
+        until the client has taken the previous ones. Async iterables are run on a private event loop.
+        If sending fails, `chunks` is closed (if it can be) so its producer can let go of what it holds.
+        """
+        try:
+            if hasattr(chunks, '__aiter__'):
+                asyncio.run(self.__send_async_stream(chunks, encoder))
+            else:
+                for data in chunks:
+                    parts = encoder.write(data)
+                    if parts:
+                        self.send_parts(parts)
+            self.send_parts(encoder.finish())
+        except BaseException:
+            self.close()
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            raise
+
+    def run_blocking(self, function) -> bool:
+        """
+        Runs `function` right away, blocking this connection's worker is what it is there for
+        """
+        function()
+        return False
+
+    async def __send_async_stream(self, chunks, encoder: ChunkedEncoder):
+        async for data in chunks:
+            parts = encoder.write(data)
+            if parts:
+                self.send_parts(parts)
+
+    def close_if_idle(self):
+        if self.__idle:
+            try:
+                # Wakes the thread waiting in recv, which sees the end of the connection and closes it
+                self.socket.shutdown(SHUT_RD)
+            except OSError:
+                pass
+
+    def close(self):
+        """
+        Closes the underlying socket, if it isn't closed already
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.socket.shutdown(SHUT_WR)
+        except OSError:
+            # Peer may have already gone away
+            pass
+        self.socket.close()
+
+    def __fill(self, timeout: float) -> bool:
+        """
+        Receives more bytes into the parser
+
+        Params:
+        - `timeout` - seconds to wait for bytes to arrive
+
+        Returns:
+        True if bytes were received, False if the peer closed the connection
+
+        Raises:
+        socket.timeout if nothing arrived within `timeout`
+        """
+        if self.closed:
+            return False
+
+        self.__set_timeout(timeout)
+        try:
+            received = self.socket.recv_into(self.__recv_buffer)
+        except socket.timeout:
+            raise
+        except OSError:
+            return False
+
+        if received == 0:
+            return False
+        self.parser.feed(memoryview(self.__recv_buffer)[:received])
+        return True
+
+    def __set_timeout(self, timeout: float):
+        if timeout != self.__timeout:
+            self.socket.settimeout(timeout)
+            self.__timeout = timeout
+
+    def __write_timed_out(self) -> ConnectionError:
+        """
+        Drops the connection to a client that stopped accepting the response
+
+        Returns:
+        The error to raise to the handler sending the response
+        """
+        CONNECTION_STATS.increment('write_timeouts')
+        self.close()
+        return ConnectionError(f'Client accepted no response bytes for {self.write_timeout} seconds')
+
+
+def send_file_in_chunks(client_socket: SocketType, file, offset: int, count: int):
+    """
+    Sends part of a file by reading it into one reusable `FILE_CHUNK_SIZE` buffer at a time
+
+    Params:
+    - `client_socket` - the socket to send to
+    - `file` - a file object opened in binary mode
+    - `offset` - position in the file to start sending from
+    - `count` - number of bytes to send
+    """
+    buffer = bytearray(min(FILE_CHUNK_SIZE, count))
+    view = memoryview(buffer)
+    file.seek(offset)
+    remaining = count
+    while remaining > 0:
+        read = file.readinto(view[:min(remaining, len(buffer))])
+        if not read:
+            raise EOFError('File is shorter than expected')
+        client_socket.sendall(view[:read])
+        remaining -= read
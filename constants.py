@@ -34,6 +34,10 @@ STATUS_CODES = {
     415: 'Unsupported Media Type',
     416: 'Requested range not satisfiable',
     417: 'Expectation Failed',
+    # https://datatracker.ietf.org/doc/html/rfc6585
+    428: 'Precondition Required',
+    429: 'Too Many Requests',
+    431: 'Request Header Fields Too Large',
     500: 'Internal Server Error',
     501: 'Not Implemented',
     502: 'Bad Gateway',
@@ -61,4 +65,22 @@ HTTP_METHODS = [
     'CONNECT',
 ]
 
+# Protocol versions of the requests served, HTTP/2 requests are read off their frames rather than a request line
+HTTP_VERSIONS = ['HTTP/1.1', 'HTTP/2.0']
+
 DEFAULT_ENCODING = 'utf-8'
+
+# Seconds an idle persistent connection is kept open waiting for the next request
+DEFAULT_KEEP_ALIVE_TIMEOUT = 5
+
+# Seconds a client is given to send a request head once it has started sending it
+DEFAULT_HEADER_TIMEOUT = 10
+
+# Seconds a client is given to send a request body once the head has been received
+DEFAULT_BODY_TIMEOUT = 30
+
+# Seconds a client may go without accepting any bytes of a response
+DEFAULT_WRITE_TIMEOUT = 30
+
+# Maximum number of requests served over a single persistent connection
+DEFAULT_MAX_KEEP_ALIVE_REQUESTS = 100
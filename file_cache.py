@@ -0,0 +1,188 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from cache_control import make_etag
+
+# Default total size of cached response bodies and headers
+DEFAULT_CACHE_BYTES = 16 * 1024 * 1024
+
+# Files larger than this are always streamed from disk instead of cached
+DEFAULT_MAX_ENTRY_BYTES = 1024 * 1024
+
+
+class CacheEntry:
+    """A ready-to-send response for one file, along with the file identity it was built from"""
+
+    __slots__ = ['head', 'body', 'size', 'mtime', 'mtime_ns', 'inode', 'device', 'etag']
+
+    def __init__(self, head: bytes, body: bytes, stat: os.stat_result, variant: str = None):
+        """
+        Params:
+        - `head` - encoded status line and headers, without the connection headers or the final blank line
+        - `body` - the contents of the file, possibly transformed (e.g. compressed)
+        - `stat` - result of `os.stat` on the file when it was read
+        - `variant` - name of the transformation applied to the file, if any
+        """
+        self.head = head
+        self.body = body
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.mtime_ns = stat.st_mtime_ns
+        self.inode = stat.st_ino
+        self.device = stat.st_dev
+        self.etag = make_etag(stat, variant)
+
+    def matches(self, stat: os.stat_result) -> bool:
+        """
+        Returns:
+        True if the file described by `stat` is the same version the entry was built from
+        """
+        return (self.mtime_ns == stat.st_mtime_ns and self.size == stat.st_size
+                and self.inode == stat.st_ino and self.device == stat.st_dev)
+
+    def cost(self) -> int:
+        """
+        Returns:
+        The number of bytes the entry counts against the cache budget
+        """
+        return len(self.head) + len(self.body)
+
+
+class FileCache:
+    """
+    Bounded least-recently-used cache of file responses keyed by resolved file path.
+
+    Each lookup costs one `os.stat`, entries are dropped as soon as the file's
+    mtime, size or inode no longer match the cached version.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES, max_entry_bytes: int = DEFAULT_MAX_ENTRY_BYTES):
+        """
+        Params:
+        - `max_bytes` - total byte budget for all entries
+        - `max_entry_bytes` - largest file that will be cached
+        """
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.__entries = OrderedDict()
+        self.__size = 0
+        self.__lock = threading.Lock()
+        self.__stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, file_path: str, build_head, variant: str = None, transform=None, on_phase=None) -> CacheEntry:
+        """
+        Looks up the response for a file, reading and caching the file if it isn't cached yet
+
+        Params:
+        - `file_path` - path to the file
+        - `build_head` - function taking the body length and the file's `os.stat_result`,
+           returning the encoded response head
+        - `variant` - name of a transformed representation of the file, cached separately (e.g. `gzip`)
+        - `transform` - function applied to the file contents to build `variant` (e.g. compression)
+        - `on_phase` - optional function called with a phase name and its duration in seconds: `open` for
+           stat-ing the file, then on a miss `read` for reading it and `compress` for transforming it
+
+        Returns:
+        The cache entry, or None if the file is too large to be cached and should be streamed
+
+        Raises:
+        OSError (e.g. FileNotFoundError) if the file can't be read
+        """
+        started = time.perf_counter()
+        stat = os.stat(file_path)
+        if on_phase is not None:
+            on_phase('open', time.perf_counter() - started)
+        key = (os.path.normpath(file_path), variant)
+
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                if entry.matches(stat):
+                    self.__entries.move_to_end(key)
+                    self.__stats['hits'] += 1
+                    return entry
+                self.__remove(key)
+                self.__stats['invalidations'] += 1
+            self.__stats['misses'] += 1
+
+        if stat.st_size > self.max_entry_bytes:
+            return None
+
+        started = time.perf_counter()
+        with open(file_path, 'br') as file:
+            stat = os.fstat(file.fileno())
+            body = file.read()
+        complete = len(body) == stat.st_size
+        if on_phase is not None:
+            on_phase('read', time.perf_counter() - started)
+        if transform is not None:
+            started = time.perf_counter()
+            body = transform(body)
+            if on_phase is not None:
+                on_phase('compress', time.perf_counter() - started)
+
+        entry = CacheEntry(build_head(len(body), stat), body, stat, variant)
+        if complete:
+            # Otherwise the file changed while it was read, serve what was read but don't cache it
+            with self.__lock:
+                self.__insert(key, entry)
+        return entry
+
+    def peek(self, file_path: str, variant: str = None) -> CacheEntry:
+        """
+        Looks up the response for a file without reading the file if it isn't cached (e.g. to answer HEAD)
+
+        Params:
+        - see `get`
+
+        Returns:
+        The cache entry if the current version of the file is cached, None otherwise
+
+        Raises:
+        OSError (e.g. FileNotFoundError) if the file can't be stat-ed
+        """
+        stat = os.stat(file_path)
+        key = (os.path.normpath(file_path), variant)
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None or not entry.matches(stat):
+                return None
+            self.__entries.move_to_end(key)
+            self.__stats['hits'] += 1
+            return entry
+
+    def clear(self):
+        """
+        Drops every entry
+        """
+        with self.__lock:
+            self.__entries.clear()
+            self.__size = 0
+
+    def stats(self) -> dict:
+        """
+        Returns:
+        Hit, miss, eviction and invalidation counts along with the current number of entries and bytes used
+        """
+        with self.__lock:
+            return {**self.__stats, 'entries': len(self.__entries), 'bytes': self.__size}
+
+    def __insert(self, key: tuple, entry: CacheEntry):
+        """
+        Adds an entry, evicting the least recently used entries until it fits in the budget
+        """
+        if key in self.__entries:
+            self.__remove(key)
+        while self.__entries and self.__size + entry.cost() > self.max_bytes:
+            oldest_key = next(iter(self.__entries))
+            self.__remove(oldest_key)
+            self.__stats['evictions'] += 1
+        if entry.cost() > self.max_bytes:
+            return
+        self.__entries[key] = entry
+        self.__size += entry.cost()
+
+    def __remove(self, key: tuple):
+        entry = self.__entries.pop(key)
+        self.__size -= entry.cost()
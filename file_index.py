@@ -0,0 +1,299 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import weakref
+from constants import TEXT_CONTENT_TYPES
+from helpers import text_content_type
+
+INDEX_REFRESH_MODES = ['auto', 'inotify', 'poll']
+
+# Seconds between rescans of the directory when inotify isn't available
+DEFAULT_POLL_INTERVAL = 2.0
+
+# https://man7.org/linux/man-pages/man7/inotify.7.html
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+    IN_DELETE_SELF | IN_ONLYDIR
+REMOVED_MASK = IN_DELETE | IN_MOVED_FROM | IN_DELETE_SELF
+
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+INOTIFY_EVENT = struct.Struct('iIII')
+
+# Bytes read from the inotify descriptor at a time, enough for hundreds of events
+INOTIFY_READ_SIZE = 64 * 1024
+
+
+def load_inotify():
+    """
+    Returns:
+    The C library exposing the inotify system calls, or None if the platform has no inotify
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class IndexEntry:
+    """What a URL path of the document root resolves to, computed once when the index is built"""
+
+    __slots__ = ['file_path', 'extension', 'content_type', 'size', 'redirect']
+
+    def __init__(self, file_path: str, size: int = 0, redirect: bool = False):
+        """
+        Params:
+        - `file_path` - the file to send, `index.html` for directory paths ending in `/`
+        - `size` - size of the file in bytes when it was indexed
+        - `redirect` - the path names a directory and should be redirected to the same path with a trailing `/`
+        """
+        self.file_path = file_path
+        self.size = size
+        self.redirect = redirect
+        extension = os.path.basename(file_path).rsplit('.', 1)[-1] if '.' in os.path.basename(file_path) else None
+        self.extension = extension if extension in TEXT_CONTENT_TYPES else None
+        self.content_type = text_content_type(extension) if self.extension is not None else 'application/octet-stream'
+
+
+class FileIndex:
+    """
+    In-memory index of a document root, mapping each URL path to an `IndexEntry` so `FileServer` resolves
+    a request with one dict lookup instead of `isdir`, `join` and `relpath` calls.
+
+    Only paths that exist under the directory are in the index, so `..` segments, encoded tricks and
+    symlinks leading out of the directory simply aren't found. The index is kept up to date incrementally
+    with inotify where available, and otherwise by rescanning the directory every `poll_interval` seconds,
+    in which case paths missing from the index are checked on disk in case they appeared since. The watcher
+    runs in a background thread, each process forked after the index was built starts its own.
+    """
+
+    def __init__(self, directory_path: str, refresh: str = 'auto', poll_interval: float = DEFAULT_POLL_INTERVAL):
+        """
+        Params:
+        - `directory_path` - the document root to index
+        - `refresh` - `inotify`, `poll`, or `auto` to use inotify when the platform supports it
+        - `poll_interval` - seconds between rescans when polling
+        """
+        if refresh not in INDEX_REFRESH_MODES:
+            raise ValueError(f'Unknown index refresh mode: {refresh}')
+        self.directory_path = directory_path
+        self.root_path = os.path.realpath(directory_path)
+        self.poll_interval = poll_interval
+        self.libc = load_inotify() if refresh != 'poll' else None
+        if refresh == 'inotify' and self.libc is None:
+            raise OSError('inotify is not supported on this platform')
+
+        self.entries = self.__scan(directory_path, '/')
+        self.__watching = False
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        # Fork handlers can't be unregistered, so only hold a weak reference to an index a reload replaces
+        after_fork = weakref.WeakMethod(self.__after_fork)
+        os.register_at_fork(after_in_child=lambda: after_fork() and after_fork()())
+
+    def lookup(self, path: str) -> IndexEntry:
+        """
+        Params:
+        - `path` - the URL path relative to the document root, starting with `/`
+
+        Returns:
+        The entry for the path, or None if nothing is served there
+        """
+        if not self.__watching:
+            self.__start_watching()
+        entry = self.entries.get(path)
+        if entry is None and self.libc is None:
+            # A polled index lags behind the disk, check whether the path appeared since the last scan
+            entry = self.__resolve(path)
+        return entry
+
+    def stop(self):
+        """
+        Stops refreshing the index
+        """
+        self.__stop.set()
+
+    def __after_fork(self):
+        # The watcher thread doesn't survive fork, the child starts its own on first lookup
+        self.__watching = False
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+
+    def __start_watching(self):
+        with self.__lock:
+            if self.__watching:
+                return
+            self.__watching = True
+            target = self.__watch_inotify if self.libc is not None else self.__poll
+            threading.Thread(target=target, name='file-index', daemon=True).start()
+
+    def __scan(self, directory_path: str, url_path: str) -> dict:
+        """
+        Walks a directory into index entries
+
+        Params:
+        - `directory_path` - the directory to walk
+        - `url_path` - the URL path of `directory_path`, ending in `/`
+
+        Returns:
+        Mapping of URL path to `IndexEntry` for the directory and everything under it
+        """
+        entries = {}
+        for current_path, directory_names, file_names in os.walk(directory_path):
+            relative = os.path.relpath(current_path, directory_path)
+            current_url = url_path if relative == '.' else f'{url_path}{relative.replace(os.sep, "/")}/'
+            if not self.__is_inside(current_path):
+                directory_names.clear()
+                continue
+            if current_url != '/':
+                entries[current_url[:-1]] = IndexEntry(current_path, redirect=True)
+            for file_name in file_names:
+                entry = self.__file_entry(os.path.join(current_path, file_name))
+                if entry is None:
+                    continue
+                entries[current_url + file_name] = entry
+                if file_name == 'index.html':
+                    entries[current_url] = entry
+        return entries
+
+    def __resolve(self, path: str) -> IndexEntry:
+        """
+        Resolves a URL path on disk the way the index would have
+
+        Returns:
+        The entry for the path, or None if nothing is served there
+        """
+        file_path = os.path.join(self.directory_path, path.lstrip('/'))
+        if path.endswith('/'):
+            return self.__file_entry(os.path.join(file_path, 'index.html'))
+        if os.path.isdir(file_path):
+            return IndexEntry(file_path, redirect=True) if self.__is_inside(file_path) else None
+        return self.__file_entry(file_path)
+
+    def __file_entry(self, file_path: str) -> IndexEntry:
+        """
+        Returns:
+        The entry for a regular file, or None if it isn't one or it resolves outside the document root
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        if not os.path.isfile(file_path) or not self.__is_inside(file_path):
+            return None
+        return IndexEntry(file_path, stat.st_size)
+
+    def __is_inside(self, path: str) -> bool:
+        """
+        Exact containment check on resolved paths, only done while indexing
+        """
+        resolved = os.path.realpath(path)
+        return resolved == self.root_path or resolved.startswith(self.root_path + os.sep)
+
+    def __poll(self):
+        """
+        Fallback refresh, rescans the whole directory and swaps the index in one assignment
+        """
+        while not self.__stop.wait(self.poll_interval):
+            self.entries = self.__scan(self.directory_path, '/')
+
+    def __watch_inotify(self):
+        """
+        Applies inotify events to the index as they arrive, every event from one read to the same copy of the
+        index, so a burst of changes such as a deploy copies and publishes the index once rather than per event
+        """
+        fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if fd < 0:
+            self.__poll()
+            return
+        watches = {}
+        try:
+            self.__add_watches(fd, watches, self.directory_path, '/')
+            # Pick up anything that changed between building the index and watching it
+            self.entries = self.__scan(self.directory_path, '/')
+            while not self.__stop.is_set():
+                readable, _, _ = select.select([fd], [], [], 1.0)
+                if not readable:
+                    continue
+                data = os.read(fd, INOTIFY_READ_SIZE)
+                entries = dict(self.entries)
+                offset = 0
+                while offset < len(data):
+                    wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                    name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length]
+                    offset += INOTIFY_EVENT.size + length
+                    entries = self.__apply_event(fd, watches, entries, wd, mask, os.fsdecode(name.rstrip(b'\0')))
+                # Readers always see either the old or the new index, never one half updated
+                self.entries = entries
+        finally:
+            os.close(fd)
+
+    def __add_watches(self, fd: int, watches: dict, directory_path: str, url_path: str):
+        """
+        Watches a directory and every directory under it
+
+        Params:
+        - `watches` - mapping of watch descriptor to `(directory path, URL path)`, updated in place
+        """
+        for current_path, _, _ in os.walk(directory_path):
+            relative = os.path.relpath(current_path, directory_path)
+            current_url = url_path if relative == '.' else f'{url_path}{relative.replace(os.sep, "/")}/'
+            wd = self.libc.inotify_add_watch(fd, os.fsencode(current_path), WATCH_MASK)
+            if wd >= 0:
+                watches[wd] = (current_path, current_url)
+
+    def __apply_event(self, fd: int, watches: dict, entries: dict, wd: int, mask: int, name: str) -> dict:
+        """
+        Updates the entries affected by one inotify event
+
+        Params:
+        - `entries` - private copy of the index, updated in place
+
+        Returns:
+        The updated entries, a new rescan of the directory if events were lost
+        """
+        if mask & IN_Q_OVERFLOW:
+            # Events were lost, start over
+            return self.__scan(self.directory_path, '/')
+        if mask & IN_IGNORED:
+            watches.pop(wd, None)
+            return entries
+        if wd not in watches or name == '':
+            return entries
+
+        directory_path, directory_url = watches[wd]
+        path = os.path.join(directory_path, name)
+        url = directory_url + name
+
+        if mask & IN_ISDIR:
+            for key in [key for key in entries if key == url or key.startswith(url + '/')]:
+                del entries[key]
+            if not mask & REMOVED_MASK and os.path.isdir(path):
+                # Watch before scanning, what is created in between would otherwise never be indexed
+                self.__add_watches(fd, watches, path, url + '/')
+                entries.update(self.__scan(path, url + '/'))
+        else:
+            entry = None if mask & REMOVED_MASK else self.__file_entry(path)
+            for key in [url, directory_url] if name == 'index.html' else [url]:
+                if entry is None:
+                    entries.pop(key, None)
+                else:
+                    entries[key] = entry
+        return entries
@@ -1,14 +1,39 @@
+import errno
 import json
-from constants import TEXT_CONTENT_TYPES, DEFAULT_ENCODING
-from helpers import is_path_under_directory, remove_prefix, to_bytearray
+import time
+from urllib.parse import unquote
+from autoindex import AutoIndex, parse_listing_query
+from bundle import IDENTITY, BundleStore
+from byte_ranges import (RangeNotSatisfiable, content_range_header, if_range_matches, multipart_byteranges,
+                         parse_range_header, unsatisfiable_range_header)
+from cache_control import CacheControlRules, is_not_modified, make_etag, validator_headers
+from compression import ENCODING_EXTENSIONS, Compression, compress, parse_accept_encoding
+from constants import TEXT_CONTENT_TYPES
+from file_cache import FileCache
+from file_index import FileIndex
+from helpers import is_path_under_directory, remove_prefix, text_content_type
+from mmap_pool import MmapPool
 from request import Request
+from response import JSON_CONTENT_TYPE, encode_response_head, prebuilt_json
 import os
 
+# Methods the file server answers, HEAD never reads file contents. OPTIONS is answered by the router in
+# front of it with the same `Allow` list
+ALLOWED_METHODS = ['GET', 'HEAD']
+ALLOW_HEADER = f'Allow: {", ".join(ALLOWED_METHODS)}, OPTIONS'
+
+# The common error replies, encoded once
+NOT_FOUND = prebuilt_json({'err': os.strerror(errno.ENOENT)}, 404)
+METHOD_NOT_ALLOWED = prebuilt_json({'err': 'File server only supports HTTP GET, HEAD and OPTIONS'}, 405,
+                                   ALLOW_HEADER)
+
 
 class FileServer:
     """Serves files in directory using HTTP"""
 
-    def __init__(self, base_path: str, directory_path: str):
+    def __init__(self, base_path: str, directory_path: str, cache: FileCache = None,
+                 cache_control: CacheControlRules = None, compression: Compression = None, index: FileIndex = None,
+                 mmap_pool: MmapPool = None, autoindex: AutoIndex = None, bundle: BundleStore = None):
         """
         Creates a new file server that can serve files under directory_path
         through HTTP routes with prefix base_path
@@ -16,9 +41,26 @@ class FileServer:
         Params:
         - `base_path` - HTTP URI prefix to listen to (e.g. `/www/`)
         - `directory_path` - Relative path to directory to serve files from
+        - `cache` - optional in-memory cache of small file responses, files are always read from disk without one
+        - `cache_control` - optional rules for the `Cache-Control` header sent with files
+        - `compression` - optional content negotiation settings, text files are always sent uncompressed without
+        - `index` - optional precomputed index of `directory_path`, paths are resolved on disk for every request without
+        - `mmap_pool` - optional pool of memory maps serving files too large for `cache`, they are streamed
+           with sendfile without
+        - `autoindex` - optional generator of listings for directories without an `index.html`, which get a
+           404 without
+        - `bundle` - optional bundle of the directory (see `bundle.py`) to serve instead of `directory_path`,
+           files are then neither opened, cached nor listed
         """
         self.base_path = base_path
         self.directory_path = directory_path
+        self.cache = cache
+        self.cache_control = cache_control
+        self.compression = compression
+        self.index = index
+        self.mmap_pool = mmap_pool
+        self.autoindex = autoindex
+        self.bundle = bundle
 
     def handle(self, request: Request) -> bool:
         """
@@ -30,27 +72,52 @@ class FileServer:
         Returns:
         True if the request was handled, False otherwise        
         """
+        path, _, query = request.path.partition('?')
+        try:
+            path = unquote(path, errors='strict')
+        except UnicodeDecodeError:
+            request.reply_response(NOT_FOUND)
+            return True
+        if '\0' in path:
+            # No file name holds a null byte, and `os` functions raise on one
+            request.reply_response(NOT_FOUND)
+            return True
+
         # Match route
-        if not request.path.startswith(self.base_path):
+        if path + '/' == self.base_path:
+            self.__redirect_to_directory(request)
+            return True
+        if not path.startswith(self.base_path):
             return False
 
-        if request.method != 'GET':
-            request.reply_json({'err': 'File server only supports HTTP GET'}, status_code=405)
+        if request.method not in ALLOWED_METHODS:
+            request.reply_response(METHOD_NOT_ALLOWED)
+            return True
+
+        relative_path = remove_prefix(path, self.base_path)
+        if self.bundle is not None:
+            self.__send_bundled(request, relative_path)
+            return True
+        if self.index is not None:
+            self.__send_indexed(request, relative_path, query)
             return True
 
         # https://www.geeksforgeeks.org/python-os-path-join-method/
-        file_path = os.path.join(self.directory_path, remove_prefix(request.path, self.base_path))
-        if os.path.isdir(file_path) and not file_path.endswith('/'):
-            original_host = request.headers['Host']
-            absolute_path = f'http://{original_host}{request.path}/'
-            request.reply_json({'msg': f'Redirecting you to {absolute_path}'},
-                               status_code=301,
-                               extra_headers=f'Location: {absolute_path}')
+        file_path = os.path.join(self.directory_path, relative_path)
+        started = time.perf_counter()
+        is_directory = os.path.isdir(file_path)
+        request.add_phase('open', time.perf_counter() - started)
+        if is_directory and not file_path.endswith('/'):
+            self.__redirect_to_directory(request)
             return True
         if file_path.endswith('/'):
+            directory_path = file_path
             file_path = os.path.join(file_path, 'index.html')
+            if self.autoindex is not None and not os.path.isfile(file_path) and os.path.isdir(directory_path):
+                self.__send_listing(request, relative_path, query)
+                return True
         if not is_path_under_directory(file_path, self.directory_path):
-            request.reply_json({'err': FileNotFoundError().strerror}, status_code=404)
+            request.reply_response(NOT_FOUND)
             return True
 
         extension = file_path.split('.')[-1] if len(file_path.split('.')) > 0 else None
@@ -62,6 +129,122 @@ class FileServer:
         self.__send_text_file(request, file_path, extension)
         return True
 
+    def __send_indexed(self, request: Request, relative_path: str, query: str):
+        """
+        Respond to a request using the file index, resolving the path with a single dict lookup
+
+        Params:
+        - `request` - the HTTP request object
+        - `relative_path` - the decoded request path relative to `base_path`
+        - `query` - the query string of the request
+        """
+        entry = self.index.lookup('/' + relative_path)
+        if entry is None and self.autoindex is not None and (relative_path == '' or relative_path.endswith('/')):
+            self.__send_listing(request, relative_path, query)
+        elif entry is None:
+            request.reply_response(NOT_FOUND)
+        elif entry.redirect:
+            self.__redirect_to_directory(request)
+        elif entry.extension is not None:
+            self.__send_text_file(request, entry.file_path, entry.extension)
+        else:
+            self.__send_file(request, entry.file_path, entry.content_type)
+
+    def __send_bundled(self, request: Request, relative_path: str):
+        """
+        Respond to a request from the bundle, resolving the path with a single hash probe and sending the
+        body as a zero-copy slice of the bundle's memory map. A precompressed variant is sent if the client
+        accepts it, unless it asks for ranges, which always refer to the uncompressed file.
+
+        Params:
+        - `request` - the HTTP request object
+        - `relative_path` - the decoded request path relative to `base_path`
+        """
+        started = time.perf_counter()
+        entry = self.bundle.lookup('/' + relative_path)
+        request.add_phase('open', time.perf_counter() - started)
+        if entry is None:
+            request.reply_response(NOT_FOUND)
+            return
+        if entry.redirect:
+            self.__redirect_to_directory(request)
+            return
+
+        encoding = None
+        vary = self.compression is not None and len(entry.variants) > 1
+        if vary and request.get_header('Range') is None:
+            for accepted in parse_accept_encoding(request.get_header('Accept-Encoding')):
+                if accepted in entry.variants:
+                    encoding = accepted
+                    break
+        body = entry.variants[encoding or IDENTITY]
+        etag = entry.etag(encoding)
+        # Cache-Control rules match the path of the file, not of its directory
+        file_path = entry.path + 'index.html' if entry.path.endswith('/') else entry.path
+        file_headers = self.__resource_headers(file_path, etag, entry.mtime, encoding, vary)
+        if self.__is_not_modified(request, etag, entry.mtime):
+            request.reply_empty(304, extra_headers=file_headers)
+            return
+
+        try:
+            ranges = self.__requested_ranges(request, len(body), etag, entry.mtime)
+        except RangeNotSatisfiable:
+            self.__reply_range_not_satisfiable(request, len(body), file_headers)
+            return
+        if ranges is not None:
+            self.__send_ranges(request, ranges, len(body), entry.content_type, file_headers, body=body)
+            return
+
+        request.reply_segments(200, [body], len(body), entry.content_type, extra_headers=file_headers)
+
+    def __redirect_to_directory(self, request: Request):
+        """
+        Respond to a request for a directory without a trailing `/` by redirecting to the path with one
+        """
+        original_host = request.get_header('Host', '')
+        path, separator, query = request.path.partition('?')
+        absolute_path = f'http://{original_host}{path}/{separator}{query}'
+        request.reply_json({'msg': f'Redirecting you to {absolute_path}'},
+                           status_code=301,
+                           extra_headers=f'Location: {absolute_path}')
+
+    def __send_listing(self, request: Request, relative_path: str, query: str):
+        """
+        Respond to a request for a directory without an `index.html` with a listing of its entries,
+        streamed as HTML or JSON
+
+        Params:
+        - `request` - the HTTP request object
+        - `relative_path` - the decoded path of the directory relative to `base_path`, empty or ending in `/`
+        - `query` - the query string of the request, giving the order, page and format of the listing
+        """
+        directory_path = os.path.join(self.directory_path, relative_path)
+        root_path = os.path.realpath(self.directory_path)
+        resolved_path = os.path.realpath(directory_path)
+        if resolved_path != root_path and not resolved_path.startswith(root_path + os.sep):
+            request.reply_response(NOT_FOUND)
+            return
+
+        try:
+            listing_query = parse_listing_query(query, request.get_header('Accept'), self.autoindex.page_size)
+        except ValueError as err:
+            request.reply_json({'err': str(err)}, status_code=400)
+            return
+        started = time.perf_counter()
+        try:
+            listing = self.autoindex.listing(directory_path)
+        except (FileNotFoundError, NotADirectoryError):
+            request.reply_response(NOT_FOUND)
+            return
+        except Exception as err:
+            request.reply_json({'err': str(err)}, status_code=500)
+            return
+        request.add_phase('read', time.perf_counter() - started)
+
+        content_type = JSON_CONTENT_TYPE if listing_query.listing_format == 'json' else text_content_type('html')
+        pieces = self.autoindex.render(listing, self.base_path + relative_path, listing_query)
+        request.reply_stream(200, pieces, content_type, extra_headers='Vary: Accept')
+
     def __send_binary(self, request: Request, file_path: str):
         """
         Respond to a request by sending the binary contents of a file (e.g. images) at the given filepath.
@@ -70,16 +253,307 @@ class FileServer:
         - `request` - the HTTP request object
         - `file_path` - the relative path to file
         """
+        self.__send_file(request, file_path, 'application/octet-stream')
+
+    def __send_file(self, request: Request, file_path: str, content_type: str, encoding: str = None,
+                    vary: bool = False):
+        """
+        Respond to a request by streaming the file at the given filepath, whatever its size
+        the file is never read into memory as a whole.
+
+        Params:
+        - `request` - the HTTP request object
+        - `file_path` - the relative path to file
+        - `content_type` - the value of the 'Content-Type' header
+        - `encoding` - the content coding if `file_path` is a precompressed sibling (e.g. `base.css.gz`)
+        - `vary` - whether the response depends on the `Accept-Encoding` request header
+        """
+        if request.method == 'HEAD':
+            self.__send_head(request, file_path, content_type, encoding, vary)
+            return
+        if self.cache is not None and self.__send_cached(request, file_path, content_type, encoding, vary):
+            return
+        if self.mmap_pool is not None and self.__send_mapped(request, file_path, content_type, encoding, vary):
+            return
+
+        started = time.perf_counter()
         try:
+            # https://www.w3schools.com/python/python_file_open.asp
             file = open(file_path, 'br')
-            payload = file.read()
+        except FileNotFoundError:
+            request.reply_response(NOT_FOUND)
+            return
+        except Exception as err:
+            request.reply_json({'err': str(err)}, status_code=500)
+            return
+
+        try:
+            stat = os.fstat(file.fileno())
+        except Exception as err:
+            file.close()
+            request.reply_json({'err': str(err)}, status_code=500)
+            return
+        request.add_phase('open', time.perf_counter() - started)
+
+        etag = make_etag(stat)
+        file_headers = self.__file_headers(file_path, etag, stat.st_mtime, encoding, vary)
+        if self.__is_not_modified(request, etag, stat.st_mtime):
             file.close()
+            request.reply_empty(304, extra_headers=file_headers)
+            return
+
+        try:
+            ranges = self.__requested_ranges(request, stat.st_size, etag, stat.st_mtime)
+        except RangeNotSatisfiable:
+            file.close()
+            self.__reply_range_not_satisfiable(request, stat.st_size, file_headers)
+            return
+        if ranges is not None:
+            self.__send_ranges(request, ranges, stat.st_size, content_type, file_headers, file=file)
+            return
+
+        # The request owns the file from here and closes it once the body has been sent
+        request.reply_file(200, file, 0, stat.st_size, content_type=content_type, extra_headers=file_headers)
+
+    def __send_head(self, request: Request, file_path: str, content_type: str, encoding: str = None,
+                    vary: bool = False, variant: str = None):
+        """
+        Respond to a HEAD request with the headers a GET would get, from a single `os.stat` of the file.
+        Ranges are ignored, as for any request other than GET.
 
-            request.reply(message_body=payload, content_type='application/octet-stream', status_code=200)
-        except FileNotFoundError as err:
-            request.reply_json({'err': err.strerror}, status_code=404)
+        Params:
+        - see `__send_file`
+        - `variant` - the content coding applied on the fly, if any, the `Content-Length` of the coded
+           body isn't known without coding the file so it is left out
+        """
+        started = time.perf_counter()
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            request.reply_response(NOT_FOUND)
+            return
         except Exception as err:
             request.reply_json({'err': str(err)}, status_code=500)
+            return
+        request.add_phase('open', time.perf_counter() - started)
+
+        etag = make_etag(stat, variant)
+        file_headers = self.__file_headers(file_path, etag, stat.st_mtime, encoding, vary)
+        if self.__is_not_modified(request, etag, stat.st_mtime):
+            request.reply_empty(304, extra_headers=file_headers)
+            return
+        request.reply_head(200, None if variant is not None else stat.st_size, content_type,
+                           extra_headers=file_headers)
+
+    def __send_cached(self, request: Request, file_path: str, content_type: str, encoding: str = None,
+                      vary: bool = False, cache: FileCache = None, transform=None) -> bool:
+        """
+        Respond to a request from a file cache, loading the file into the cache if needed.
+
+        Params:
+        - `request` - the HTTP request object
+        - `file_path` - the relative path to file
+        - `content_type` - the value of the 'Content-Type' header
+        - `encoding` - the content coding of the cached body, if any
+        - `vary` - whether the response depends on the `Accept-Encoding` request header
+        - `cache` - the cache to use, `self.cache` by default
+        - `transform` - function encoding the file contents with `encoding` before caching,
+           None if `file_path` holds the body as-is
+
+        Returns:
+        True if the request was replied to, False if the file is too large to cache and should be streamed
+        """
+        if cache is None:
+            cache = self.cache
+        variant = encoding if transform is not None else None
+
+        def build_head(length: int, stat: os.stat_result) -> bytes:
+            file_headers = self.__file_headers(file_path, make_etag(stat, variant), stat.st_mtime, encoding, vary)
+            return encode_response_head(200, length, content_type, extra_headers=file_headers)
+
+        try:
+            entry = cache.get(file_path, build_head, variant, transform, on_phase=request.add_phase)
+        except FileNotFoundError:
+            request.reply_response(NOT_FOUND)
+            return True
+        except Exception as err:
+            request.reply_json({'err': str(err)}, status_code=500)
+            return True
+
+        if entry is None:
+            return False
+        if self.__is_not_modified(request, entry.etag, entry.mtime):
+            file_headers = self.__file_headers(file_path, entry.etag, entry.mtime, encoding, vary)
+            request.reply_empty(304, extra_headers=file_headers)
+            return True
+
+        try:
+            ranges = self.__requested_ranges(request, len(entry.body), entry.etag, entry.mtime)
+        except RangeNotSatisfiable:
+            file_headers = self.__file_headers(file_path, entry.etag, entry.mtime, encoding, vary)
+            self.__reply_range_not_satisfiable(request, len(entry.body), file_headers)
+            return True
+        if ranges is not None:
+            file_headers = self.__file_headers(file_path, entry.etag, entry.mtime, encoding, vary)
+            self.__send_ranges(request, ranges, len(entry.body), content_type, file_headers, body=entry.body)
+            return True
+
+        request.reply_prebuilt(entry.head, entry.body)
+        return True
+
+    def __send_mapped(self, request: Request, file_path: str, content_type: str, encoding: str = None,
+                      vary: bool = False) -> bool:
+        """
+        Respond to a request with `memoryview` slices of a memory-mapped file, so neither the whole body
+        nor requested ranges are ever copied into the Python heap.
+
+        Params:
+        - see `__send_file`
+
+        Returns:
+        True if the request was replied to, False if the file can't be mapped and should be streamed
+        """
+        started = time.perf_counter()
+        try:
+            mapped = self.mmap_pool.acquire(file_path)
+        except FileNotFoundError:
+            request.reply_response(NOT_FOUND)
+            return True
+        except (OSError, ValueError):
+            # Let the streaming path report the error
+            return False
+        request.add_phase('open', time.perf_counter() - started)
+        if mapped is None:
+            return False
+
+        try:
+            file_headers = self.__file_headers(file_path, mapped.etag, mapped.mtime, encoding, vary)
+            if self.__is_not_modified(request, mapped.etag, mapped.mtime):
+                request.reply_empty(304, extra_headers=file_headers)
+                return True
+
+            try:
+                ranges = self.__requested_ranges(request, mapped.size, mapped.etag, mapped.mtime)
+            except RangeNotSatisfiable:
+                self.__reply_range_not_satisfiable(request, mapped.size, file_headers)
+                return True
+            if ranges is not None:
+                self.__send_ranges(request, ranges, mapped.size, content_type, file_headers, body=mapped.map)
+                return True
+
+            request.reply_segments(200, [mapped.view()], mapped.size, content_type, extra_headers=file_headers)
+            return True
+        finally:
+            self.mmap_pool.release(mapped)
+
+    def __requested_ranges(self, request: Request, size: int, etag: str, mtime: float) -> list:
+        """
+        Helper function to find which byte ranges of a file the client asked for
+
+        Params:
+        - `request` - the HTTP request object
+        - `size` - the size of the file in bytes
+        - `etag` - the current ETag of the file
+        - `mtime` - the modification time of the file in seconds since the epoch
+
+        Returns:
+        List of inclusive `(start, end)` byte positions, or None to send the whole file
+
+        Raises:
+        RangeNotSatisfiable if no requested range overlaps the file
+        """
+        range_header = request.get_header('Range')
+        if range_header is None or not if_range_matches(request.get_header('If-Range'), etag, mtime):
+            return None
+        return parse_range_header(range_header, size)
+
+    def __send_ranges(self, request: Request, ranges: list, size: int, content_type: str, file_headers: str,
+                      body: bytes = None, file=None):
+        """
+        Respond to a request with 206 Partial Content, as a single range or as `multipart/byteranges`.
+        Ranges are sliced out of `body` if the file is cached, and streamed from `file` otherwise.
+
+        Params:
+        - `request` - the HTTP request object
+        - `ranges` - list of inclusive `(start, end)` byte positions
+        - `size` - the size of the file in bytes
+        - `content_type` - the value of the 'Content-Type' header of the file
+        - `file_headers` - the validator and caching headers of the file
+        - `body` - the contents of the file, if cached or memory-mapped
+        - `file` - the open file, if not cached, the request takes ownership of it
+        """
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            response_content_type = content_type
+            segments = [(start, end - start + 1)]
+            content_length = end - start + 1
+            headers = f'{file_headers}\r\n{content_range_header(start, end, size)}'
+        else:
+            response_content_type, segments, content_length = multipart_byteranges(ranges, size, content_type)
+            headers = file_headers
+
+        if body is not None:
+            view = memoryview(body)
+            segments = [view[segment[0]:segment[0] + segment[1]] if isinstance(segment, tuple) else segment
+                        for segment in segments]
+
+        request.reply_segments(206, segments, content_length, response_content_type,
+                               extra_headers=headers, file=file)
+
+    def __reply_range_not_satisfiable(self, request: Request, size: int, file_headers: str):
+        """
+        Respond to a request whose ranges all lie outside of the file with 416
+        """
+        request.reply_json({'err': 'Requested range not satisfiable'}, status_code=416,
+                           extra_headers=f'{file_headers}\r\n{unsatisfiable_range_header(size)}')
+
+    def __file_headers(self, file_path: str, etag: str, mtime: float, encoding: str = None,
+                       vary: bool = False) -> str:
+        """
+        Helper function to build the `Accept-Ranges`, validator, content coding and `Cache-Control` headers
+        of a file response
+
+        Params:
+        - `file_path` - the relative path to file
+        - `etag` - the current ETag of the file
+        - `mtime` - the modification time of the file in seconds since the epoch
+        - `encoding` - the content coding of the body, if any
+        - `vary` - whether the response depends on the `Accept-Encoding` request header
+        """
+        if encoding is not None:
+            # Cache-Control rules apply to the original file, not its precompressed sibling
+            extension = ENCODING_EXTENSIONS[encoding]
+            if file_path.endswith(extension):
+                file_path = file_path[:-len(extension)]
+        relative_path = '/' + remove_prefix(file_path, self.directory_path).lstrip('/')
+        return self.__resource_headers(relative_path, etag, mtime, encoding, vary)
+
+    def __resource_headers(self, relative_path: str, etag: str, mtime: float, encoding: str = None,
+                           vary: bool = False) -> str:
+        """
+        Helper function to build the headers of `__file_headers` for a file known by its URL path
+
+        Params:
+        - `relative_path` - the URL path of the file relative to the served directory, starting with `/`
+        - see `__file_headers` for the others
+        """
+        headers = f'Accept-Ranges: bytes\r\n{validator_headers(etag, mtime)}'
+        if vary:
+            headers = f'{headers}\r\nVary: Accept-Encoding'
+        if encoding is not None:
+            headers = f'{headers}\r\nContent-Encoding: {encoding}'
+        if self.cache_control is not None:
+            cache_control = self.cache_control.header(relative_path)
+            if cache_control is not None:
+                headers = f'{headers}\r\n{cache_control}'
+        return headers
+
+    def __is_not_modified(self, request: Request, etag: str, mtime: float) -> bool:
+        """
+        Helper function to check whether the client already has the current version of a file
+        """
+        return is_not_modified(request.get_header('If-None-Match'), request.get_header('If-Modified-Since'),
+                               etag, mtime)
 
     def __send_text_file(self, request: Request, file_path: str, extension: str):
         """
@@ -92,16 +566,76 @@ class FileServer:
         - `extension` - the file extension at the end of the file_path,
                         this is used to determine the content type in the HTTP header
         """
+        # Files are stored in DEFAULT_ENCODING already, so they are sent as-is instead of being decoded and re-encoded
+        content_type = text_content_type(extension)
+        if self.compression is None:
+            self.__send_file(request, file_path, content_type)
+            return
+
+        # Ranges always refer to the uncompressed file
+        if request.get_header('Range') is None:
+            for encoding in parse_accept_encoding(request.get_header('Accept-Encoding')):
+                if self.__send_compressed(request, file_path, content_type, encoding):
+                    return
+        self.__send_file(request, file_path, content_type, vary=True)
+
+    def __send_compressed(self, request: Request, file_path: str, content_type: str, encoding: str) -> bool:
+        """
+        Respond to a request with a compressed version of a text file, preferring a precompressed sibling
+        (e.g. `base.css.gz`) that is at least as new as the file, and otherwise compressing the file
+        once per version into the compression cache.
+
+        Params:
+        - `request` - the HTTP request object
+        - `file_path` - the relative path to file
+        - `content_type` - the value of the 'Content-Type' header
+        - `encoding` - the content coding to use
+
+        Returns:
+        True if the request was replied to, False if the file can't be sent with this coding
+        """
+        started = time.perf_counter()
         try:
-            # https://www.w3schools.com/python/python_file_open.asp
-            file = open(file_path, 'r', encoding=DEFAULT_ENCODING)
-            payload = file.read()
-            file.close()
+            stat = os.stat(file_path)
+        except OSError:
+            # Let the uncompressed path report the error
+            return False
 
-            content_type = content_type = f'{TEXT_CONTENT_TYPES[extension]}; charset={DEFAULT_ENCODING}'
+        sibling_path = file_path + ENCODING_EXTENSIONS[encoding]
+        try:
+            sibling_stat = os.stat(sibling_path)
+        except OSError:
+            sibling_stat = None
+        request.add_phase('open', time.perf_counter() - started)
+        if sibling_stat is not None and sibling_stat.st_mtime_ns >= stat.st_mtime_ns:
+            self.__send_file(request, sibling_path, content_type, encoding=encoding, vary=True)
+            return True
 
-            request.reply(message_body=to_bytearray(payload), content_type=content_type, status_code=200)
-        except FileNotFoundError as err:
-            request.reply_json({'err': err.strerror}, status_code=404)
-        except Exception as err:
-            request.reply_json({'err': str(err)}, status_code=500)
+        if not self.compression.should_compress(encoding, stat.st_size):
+            return False
+        if request.method == 'HEAD':
+            self.__send_compressed_head(request, file_path, content_type, encoding)
+            return True
+        return self.__send_cached(request, file_path, content_type, encoding=encoding, vary=True,
+                                  cache=self.compression.cache,
+                                  transform=lambda body: compress(body, encoding))
+
+    def __send_compressed_head(self, request: Request, file_path: str, content_type: str, encoding: str):
+        """
+        Respond to a HEAD request for a file compressed on the fly with the cached head of the compressed
+        response, or without `Content-Length` if it hasn't been compressed yet, the file is never read.
+
+        Params:
+        - see `__send_compressed`
+        """
+        try:
+            entry = self.compression.cache.peek(file_path, encoding)
+        except OSError:
+            entry = None
+        if entry is None:
+            self.__send_head(request, file_path, content_type, encoding, vary=True, variant=encoding)
+        elif self.__is_not_modified(request, entry.etag, entry.mtime):
+            request.reply_empty(304, extra_headers=self.__file_headers(file_path, entry.etag, entry.mtime,
+                                                                       encoding, vary=True))
+        else:
+            request.reply_prebuilt(entry.head, entry.body)
@@ -1,5 +1,5 @@
 import os
-from constants import DEFAULT_ENCODING
+from constants import DEFAULT_ENCODING, TEXT_CONTENT_TYPES
 
 
 def remove_prefix(string: str, prefix: str) -> str:
@@ -39,3 +39,27 @@ def to_bytearray(string: str) -> bytearray:
     - `string` - The text to encode
     """
     return bytearray(string, DEFAULT_ENCODING)
+
+
+def text_content_type(extension: str) -> str:
+    """
+    Returns the `Content-Type` of a text file, files are stored in DEFAULT_ENCODING
+
+    Params:
+    - `extension` - a file extension listed in TEXT_CONTENT_TYPES (e.g. `css`)
+    """
+    return f'{TEXT_CONTENT_TYPES[extension]}; charset={DEFAULT_ENCODING}'
+
+
+def is_decimal(string: str) -> bool:
+    """
+    Checks if a string is made of ASCII digits only, `str.isdigit` alone accepts digits such as `²` that
+    `int` rejects
+
+    Params:
+    - `string` - the text to check (e.g. a header value)
+
+    Returns:
+    True if `int(string)` gives a non-negative integer, False otherwise
+    """
+    return string.isascii() and string.isdigit()
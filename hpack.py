@@ -0,0 +1,528 @@
+from http_parser import HEADER_ENCODING
+
+# Size of the dynamic table both sides start with, https://datatracker.ietf.org/doc/html/rfc7541#section-4.2
+DEFAULT_TABLE_SIZE = 4096
+
+# Bytes each dynamic table entry counts for on top of its name and value,
+# https://datatracker.ietf.org/doc/html/rfc7541#section-4.1
+ENTRY_OVERHEAD = 32
+
+# Longest integer accepted in a header block, so a peer can't make the decoder build a huge number
+MAX_INTEGER_BYTES = 6
+
+# https://datatracker.ietf.org/doc/html/rfc7541#appendix-A
+STATIC_TABLE = [
+    (':authority', ''),
+    (':method', 'GET'),
+    (':method', 'POST'),
+    (':path', '/'),
+    (':path', '/index.html'),
+    (':scheme', 'http'),
+    (':scheme', 'https'),
+    (':status', '200'),
+    (':status', '204'),
+    (':status', '206'),
+    (':status', '304'),
+    (':status', '400'),
+    (':status', '404'),
+    (':status', '500'),
+    ('accept-charset', ''),
+    ('accept-encoding', 'gzip, deflate'),
+    ('accept-language', ''),
+    ('accept-ranges', ''),
+    ('accept', ''),
+    ('access-control-allow-origin', ''),
+    ('age', ''),
+    ('allow', ''),
+    ('authorization', ''),
+    ('cache-control', ''),
+    ('content-disposition', ''),
+    ('content-encoding', ''),
+    ('content-language', ''),
+    ('content-length', ''),
+    ('content-location', ''),
+    ('content-range', ''),
+    ('content-type', ''),
+    ('cookie', ''),
+    ('date', ''),
+    ('etag', ''),
+    ('expect', ''),
+    ('expires', ''),
+    ('from', ''),
+    ('host', ''),
+    ('if-match', ''),
+    ('if-modified-since', ''),
+    ('if-none-match', ''),
+    ('if-range', ''),
+    ('if-unmodified-since', ''),
+    ('last-modified', ''),
+    ('link', ''),
+    ('location', ''),
+    ('max-forwards', ''),
+    ('proxy-authenticate', ''),
+    ('proxy-authorization', ''),
+    ('range', ''),
+    ('referer', ''),
+    ('refresh', ''),
+    ('retry-after', ''),
+    ('server', ''),
+    ('set-cookie', ''),
+    ('strict-transport-security', ''),
+    ('transfer-encoding', ''),
+    ('user-agent', ''),
+    ('vary', ''),
+    ('via', ''),
+    ('www-authenticate', ''),
+]
+
+# 1-based static table index of each field, and of the first field with each name
+STATIC_FIELDS = {}
+STATIC_NAMES = {}
+for index, (name, value) in enumerate(STATIC_TABLE, 1):
+    STATIC_FIELDS.setdefault((name, value), index)
+    STATIC_NAMES.setdefault(name, index)
+
+# Fields whose values differ from one response to the next, indexing them would only churn the dynamic table
+UNINDEXED_NAMES = frozenset(['content-length', 'content-range', 'etag', 'last-modified', 'location', 'date',
+                             'set-cookie', 'age', 'expires'])
+
+# Encoded values of fields in `UNINDEXED_NAMES`, filled in as values are first sent since dates repeat within a
+# second and validators for every reply of a file, emptied once it holds `LITERAL_CACHE_ENTRIES`
+ENCODED_LITERALS = {}
+LITERAL_CACHE_ENTRIES = 1024
+
+# Bit length of the Huffman code of every byte value and of EOS (256),
+# https://datatracker.ietf.org/doc/html/rfc7541#appendix-B. The code is canonical: codes of the same length are
+# consecutive in symbol order, so the lengths are enough to rebuild it.
+HUFFMAN_CODE_LENGTHS = [
+    13, 23, 28, 28, 28, 28, 28, 28, 28, 24, 30, 28, 28, 30, 28, 28, 28, 28, 28, 28, 28, 28, 30, 28, 28, 28, 28, 28,
+    28, 28, 28, 28, 6, 10, 10, 12, 13, 6, 8, 11, 10, 10, 8, 11, 8, 6, 6, 6, 5, 5, 5, 6, 6, 6, 6, 6, 6, 6, 7, 8, 15, 6,
+    12, 10, 13, 6, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 8, 7, 8, 13, 19, 13, 14, 6, 15,
+    5, 6, 5, 6, 5, 6, 6, 6, 5, 7, 7, 6, 6, 6, 5, 6, 7, 6, 5, 5, 6, 7, 7, 7, 7, 7, 15, 11, 14, 13, 28, 20, 22, 20, 20,
+    22, 22, 22, 23, 22, 23, 23, 23, 23, 23, 24, 23, 24, 24, 22, 23, 24, 23, 23, 23, 23, 21, 22, 23, 22, 23, 23, 24,
+    22, 21, 20, 22, 22, 23, 23, 21, 23, 22, 22, 24, 21, 22, 23, 23, 21, 21, 22, 21, 23, 22, 23, 23, 20, 22, 22, 22,
+    23, 22, 22, 23, 26, 26, 20, 19, 22, 23, 22, 25, 26, 26, 26, 27, 27, 26, 24, 25, 19, 21, 26, 27, 27, 26, 27, 24,
+    21, 21, 26, 26, 28, 27, 27, 27, 20, 24, 20, 21, 22, 21, 21, 23, 22, 22, 25, 25, 24, 24, 26, 23, 26, 27, 26, 26,
+    27, 27, 27, 27, 27, 28, 27, 27, 27, 27, 27, 26, 30,
+]
+
+HUFFMAN_EOS = 256
+
+
+def build_huffman_codes(lengths: list) -> list:
+    """
+    Rebuilds a canonical Huffman code from its code lengths
+
+    Returns:
+    The code of each symbol, as an integer to be read `lengths[symbol]` bits wide
+    """
+    codes = [0] * len(lengths)
+    code = 0
+    previous_length = 0
+    for symbol in sorted(range(len(lengths)), key=lambda symbol: (lengths[symbol], symbol)):
+        code <<= lengths[symbol] - previous_length
+        previous_length = lengths[symbol]
+        codes[symbol] = code
+        code += 1
+    return codes
+
+
+def build_huffman_decoder(lengths: list, codes: list) -> tuple:
+    """
+    Builds a state machine decoding Huffman coded strings 4 bits at a time. Its states are the inner nodes
+    of the code tree, the root being state 0.
+
+    Returns:
+    A `(transitions, accepting)` tuple: `transitions[state << 4 | nibble]` is the next state and the symbols
+    decoded on the way, the next state being -1 if EOS was decoded, and `accepting` holds the states a string
+    may end in, reached from the root through up to 7 one bits of padding
+    """
+    # Inner nodes as [child for a 0 bit, child for a 1 bit], leaves as the complement of their symbol
+    tree = [[None, None]]
+    for symbol, code in enumerate(codes):
+        node = 0
+        for shift in range(lengths[symbol] - 1, 0, -1):
+            bit = (code >> shift) & 1
+            if tree[node][bit] is None:
+                tree[node][bit] = len(tree)
+                tree.append([None, None])
+            node = tree[node][bit]
+        tree[node][code & 1] = ~symbol
+    transitions = []
+    for state in range(len(tree)):
+        for nibble in range(16):
+            node = state
+            decoded = bytearray()
+            for shift in (3, 2, 1, 0):
+                child = tree[node][(nibble >> shift) & 1]
+                if child >= 0:
+                    node = child
+                elif ~child == HUFFMAN_EOS:
+                    node = -1
+                    break
+                else:
+                    decoded.append(~child)
+                    node = 0
+            transitions.append((node, bytes(decoded)))
+    accepting = {0}
+    node = 0
+    for _ in range(7):
+        node = tree[node][1]
+        accepting.add(node)
+    return transitions, frozenset(accepting)
+
+
+HUFFMAN_CODES = build_huffman_codes(HUFFMAN_CODE_LENGTHS)
+
+HUFFMAN_TRANSITIONS, HUFFMAN_ACCEPTING = build_huffman_decoder(HUFFMAN_CODE_LENGTHS, HUFFMAN_CODES)
+
+
+class HpackError(Exception):
+    """Raised when a header block can't be decoded, which is a connection error of type COMPRESSION_ERROR"""
+
+
+def huffman_encode(data: bytes) -> bytes:
+    """
+    Returns:
+    `data` Huffman coded, padded with the most significant bits of EOS to a whole number of bytes
+    """
+    value = 0
+    bits = 0
+    for byte in data:
+        length = HUFFMAN_CODE_LENGTHS[byte]
+        value = (value << length) | HUFFMAN_CODES[byte]
+        bits += length
+    padding = -bits % 8
+    value = (value << padding) | ((1 << padding) - 1)
+    return value.to_bytes((bits + padding) // 8, 'big')
+
+
+def huffman_decode(data: bytes) -> bytes:
+    """
+    Decodes a Huffman coded string
+
+    Raises:
+    HpackError if it holds EOS or is padded with anything but up to 7 one bits
+    """
+    transitions = HUFFMAN_TRANSITIONS
+    decoded = bytearray()
+    state = 0
+    for byte in data:
+        state, symbols = transitions[(state << 4) | (byte >> 4)]
+        if state < 0:
+            raise HpackError('EOS in Huffman coded string')
+        decoded += symbols
+        state, symbols = transitions[(state << 4) | (byte & 0xf)]
+        if state < 0:
+            raise HpackError('EOS in Huffman coded string')
+        decoded += symbols
+    if state not in HUFFMAN_ACCEPTING:
+        # https://datatracker.ietf.org/doc/html/rfc7541#section-5.2
+        raise HpackError('Invalid Huffman padding')
+    return bytes(decoded)
+
+
+def encode_integer(value: int, prefix_bits: int, flags: int = 0) -> bytearray:
+    """
+    Encodes an integer with an N-bit prefix, https://datatracker.ietf.org/doc/html/rfc7541#section-5.1
+
+    Params:
+    - `value` - the integer
+    - `prefix_bits` - bits of the first byte available to the integer
+    - `flags` - the bits of the first byte above the prefix
+    """
+    limit = (1 << prefix_bits) - 1
+    if value < limit:
+        return bytearray([flags | value])
+    encoded = bytearray([flags | limit])
+    value -= limit
+    while value >= 0x80:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return encoded
+
+
+def decode_integer(data: bytes, offset: int, prefix_bits: int) -> tuple:
+    """
+    Decodes an integer with an N-bit prefix starting at `data[offset]`
+
+    Returns:
+    The integer and the offset following it
+
+    Raises:
+    HpackError if it is truncated or too long
+    """
+    limit = (1 << prefix_bits) - 1
+    value = data[offset] & limit
+    offset += 1
+    if value < limit:
+        return value, offset
+    shift = 0
+    while True:
+        if offset >= len(data):
+            raise HpackError('Truncated integer')
+        if shift >= 7 * MAX_INTEGER_BYTES:
+            raise HpackError('Integer too long')
+        byte = data[offset]
+        offset += 1
+        value += (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, offset
+
+
+def encode_string(value: str) -> bytearray:
+    """
+    Encodes a string literal, Huffman coded when that makes it shorter
+    """
+    data = value.encode(HEADER_ENCODING)
+    huffman_coded = huffman_encode(data)
+    if len(huffman_coded) < len(data):
+        encoded = encode_integer(len(huffman_coded), 7, 0x80)
+        encoded += huffman_coded
+    else:
+        encoded = encode_integer(len(data), 7)
+        encoded += data
+    return encoded
+
+
+def decode_string(data: bytes, offset: int) -> tuple:
+    """
+    Decodes a string literal starting at `data[offset]`
+
+    Returns:
+    The string and the offset following it
+    """
+    if offset >= len(data):
+        raise HpackError('Truncated string')
+    huffman = data[offset] & 0x80
+    length, offset = decode_integer(data, offset, 7)
+    end = offset + length
+    if end > len(data):
+        raise HpackError('Truncated string')
+    raw = bytes(data[offset:end])
+    if huffman:
+        raw = huffman_decode(raw)
+    return raw.decode(HEADER_ENCODING), end
+
+
+class DynamicTable:
+    """
+    The header fields both ends of a connection have added in order, newest first, evicted oldest first
+    once their sizes add up to more than `max_size`
+    """
+
+    def __init__(self, max_size: int = DEFAULT_TABLE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        # Newest entry last, so adding one doesn't shift the others
+        self.__entries = []
+
+    def add(self, name: str, value: str):
+        """
+        Adds a field, evicting older ones to make room. A field larger than the whole table empties it.
+        """
+        entry_size = len(name) + len(value) + ENTRY_OVERHEAD
+        if entry_size > self.max_size:
+            self.__entries.clear()
+            self.size = 0
+            return
+        self.size += entry_size
+        self.__entries.append((name, value))
+        self.__evict()
+
+    def resize(self, max_size: int):
+        self.max_size = max_size
+        self.__evict()
+
+    def get(self, index: int) -> tuple:
+        """
+        Params:
+        - `index` - position from the newest entry, 0 for the newest
+
+        Returns:
+        The name and value of the entry, None if there is no such entry
+        """
+        if index >= len(self.__entries):
+            return None
+        return self.__entries[-1 - index]
+
+    def find(self, name: str, value: str) -> tuple:
+        """
+        Returns:
+        The position of the newest entry for the field and whether its value matches too,
+        (None, False) if there is no entry with that name
+        """
+        name_match = None
+        for position in range(len(self.__entries) - 1, -1, -1):
+            entry_name, entry_value = self.__entries[position]
+            if entry_name == name:
+                index = len(self.__entries) - 1 - position
+                if entry_value == value:
+                    return index, True
+                if name_match is None:
+                    name_match = index
+        return name_match, False
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def __evict(self):
+        entries = self.__entries
+        evicted = 0
+        while self.size > self.max_size:
+            name, value = entries[evicted]
+            self.size -= len(name) + len(value) + ENTRY_OVERHEAD
+            evicted += 1
+        if evicted:
+            del entries[:evicted]
+
+
+class Encoder:
+    """
+    Encodes the header lists of one connection's responses into HPACK header blocks.
+
+    Fields found in the static or dynamic table are sent as an index. Other fields are added to the dynamic
+    table, so they cost one byte the next time, but for those in `UNINDEXED_NAMES`, which are sent as literals.
+    Blocks must be sent in the order they are encoded, as each one changes the table the next one is decoded with.
+    """
+
+    def __init__(self):
+        self.table = DynamicTable()
+        # Smallest table size the peer asked for since the last block, to announce in the next one
+        self.__pending_size = None
+
+    def set_max_table_size(self, max_size: int):
+        """
+        Applies the peer's SETTINGS_HEADER_TABLE_SIZE, announced at the start of the next header block
+        """
+        max_size = min(max_size, DEFAULT_TABLE_SIZE)
+        if self.__pending_size is None or max_size < self.__pending_size:
+            self.__pending_size = max_size
+        self.table.resize(max_size)
+
+    def encode(self, headers: list) -> bytes:
+        """
+        Params:
+        - `headers` - list of `(name, value)` pairs, names lower-cased
+
+        Returns:
+        The header block
+        """
+        block = bytearray()
+        if self.__pending_size is not None:
+            # Dynamic table size update, https://datatracker.ietf.org/doc/html/rfc7541#section-6.3
+            block += encode_integer(self.__pending_size, 5, 0x20)
+            if self.__pending_size != self.table.max_size:
+                block += encode_integer(self.table.max_size, 5, 0x20)
+            self.__pending_size = None
+        table = self.table
+        for name, value in headers:
+            index = STATIC_FIELDS.get((name, value))
+            if index is not None:
+                block += encode_integer(index, 7, 0x80)
+                continue
+            dynamic_index, value_matches = table.find(name, value)
+            if value_matches:
+                block += encode_integer(len(STATIC_TABLE) + 1 + dynamic_index, 7, 0x80)
+                continue
+            name_index = STATIC_NAMES.get(name)
+            if name_index is None and dynamic_index is not None:
+                name_index = len(STATIC_TABLE) + 1 + dynamic_index
+            if name in UNINDEXED_NAMES:
+                # Literal without indexing, https://datatracker.ietf.org/doc/html/rfc7541#section-6.2.2
+                prefix_bits, flags = 4, 0x00
+            else:
+                # Literal with incremental indexing, https://datatracker.ietf.org/doc/html/rfc7541#section-6.2.1
+                prefix_bits, flags = 6, 0x40
+            if name_index is not None:
+                block += encode_integer(name_index, prefix_bits, flags)
+            else:
+                block += encode_integer(0, prefix_bits, flags)
+                block += encode_string(name)
+            if flags:
+                block += encode_string(value)
+                table.add(name, value)
+                continue
+            encoded = ENCODED_LITERALS.get(value)
+            if encoded is None:
+                if len(ENCODED_LITERALS) >= LITERAL_CACHE_ENTRIES:
+                    ENCODED_LITERALS.clear()
+                encoded = ENCODED_LITERALS[value] = bytes(encode_string(value))
+            block += encoded
+        return bytes(block)
+
+
+class Decoder:
+    """Decodes the HPACK header blocks of one connection's requests, in the order they were received"""
+
+    def __init__(self, max_table_size: int = DEFAULT_TABLE_SIZE):
+        """
+        Params:
+        - `max_table_size` - largest dynamic table the peer may use, as advertised in SETTINGS_HEADER_TABLE_SIZE
+        """
+        self.max_table_size = max_table_size
+        self.table = DynamicTable(max_table_size)
+
+    def decode(self, block: bytes, max_bytes: int = None) -> list:
+        """
+        Params:
+        - `block` - a complete header block
+        - `max_bytes` - largest header list accepted, counted as in SETTINGS_MAX_HEADER_LIST_SIZE. The whole
+          block is still decoded past it, to keep the dynamic table in step with the peer's.
+
+        Returns:
+        List of `(name, value)` pairs, None if they add up to more than `max_bytes`
+
+        Raises:
+        HpackError if the block is malformed
+        """
+        headers = []
+        list_size = 0
+        offset = 0
+        length = len(block)
+        table = self.table
+        seen_field = False
+        while offset < length:
+            byte = block[offset]
+            if byte & 0x80:
+                # Indexed field, https://datatracker.ietf.org/doc/html/rfc7541#section-6.1
+                index, offset = decode_integer(block, offset, 7)
+                name, value = self.__field(index)
+            elif byte & 0xe0 == 0x20:
+                # Size updates are only allowed at the start of a block
+                if seen_field:
+                    raise HpackError('Dynamic table size update after a header field')
+                max_size, offset = decode_integer(block, offset, 5)
+                if max_size > self.max_table_size:
+                    raise HpackError('Dynamic table size update above the advertised limit')
+                table.resize(max_size)
+                continue
+            else:
+                # Literal with incremental indexing (01), without indexing (0000) or never indexed (0001)
+                indexing = byte & 0x40
+                index, offset = decode_integer(block, offset, 6 if indexing else 4)
+                if index:
+                    name = self.__field(index)[0]
+                else:
+                    name, offset = decode_string(block, offset)
+                value, offset = decode_string(block, offset)
+                if indexing:
+                    table.add(name, value)
+            seen_field = True
+            list_size += len(name) + len(value) + ENTRY_OVERHEAD
+            headers.append((name, value))
+        if max_bytes is not None and list_size > max_bytes:
+            return None
+        return headers
+
+    def __field(self, index: int) -> tuple:
+        if index == 0:
+            raise HpackError('Header field index 0')
+        if index <= len(STATIC_TABLE):
+            return STATIC_TABLE[index - 1]
+        field = self.table.get(index - len(STATIC_TABLE) - 1)
+        if field is None:
+            raise HpackError(f'Header field index {index} out of range')
+        return field
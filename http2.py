@@ -0,0 +1,1227 @@
+import asyncio
+import base64
+import binascii
+import os
+import select
+import socket
+import struct
+import time
+from collections import deque
+from connection import CONNECTION_STATS, OPEN_CONNECTIONS, BaseConnection, Connection
+from constants import DEFAULT_ENCODING, DEFAULT_MAX_KEEP_ALIVE_REQUESTS
+from helpers import is_decimal
+from hpack import Decoder, Encoder, HpackError
+from http_parser import DEFAULT_MAX_BODY_BYTES, DEFAULT_MAX_HEADER_BYTES, DEFAULT_MAX_HEADER_COUNT, \
+    HEADER_ENCODING, ParseError, ParsedRequest
+from request import Request
+from response import ChunkedEncoder
+
+# Sent by a client starting HTTP/2 with prior knowledge, https://datatracker.ietf.org/doc/html/rfc9113#section-3.4.
+# Its first 18 bytes parse as an HTTP/1.1 request head (`PRI * HTTP/2.0`), which is how it is spotted.
+CLIENT_PREFACE = b'PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n'
+
+# The rest of the client preface, once the HTTP/1.1 parser has taken its request head
+PREFACE_TAIL = b'SM\r\n\r\n'
+
+# Sent in reply to an `Upgrade: h2c` request, https://datatracker.ietf.org/doc/html/rfc7540#section-3.2
+UPGRADE_RESPONSE = b'HTTP/1.1 101 Switching Protocols\r\nConnection: Upgrade\r\nUpgrade: h2c\r\n\r\n'
+
+# How a client asked for HTTP/2, see `detect_http2`
+PRIOR_KNOWLEDGE = 'prior-knowledge'
+UPGRADE = 'h2c'
+
+# Length (as a high byte and a low 16 bits), type, flags and stream identifier of a frame
+FRAME_HEADER = struct.Struct('>BHBBI')
+
+# Frame types, https://datatracker.ietf.org/doc/html/rfc9113#section-6
+DATA = 0x0
+HEADERS = 0x1
+PRIORITY = 0x2
+RST_STREAM = 0x3
+SETTINGS = 0x4
+PUSH_PROMISE = 0x5
+PING = 0x6
+GOAWAY = 0x7
+WINDOW_UPDATE = 0x8
+CONTINUATION = 0x9
+
+# Frame flags
+FLAG_END_STREAM = 0x1
+FLAG_ACK = 0x1
+FLAG_END_HEADERS = 0x4
+FLAG_PADDED = 0x8
+FLAG_PRIORITY = 0x20
+
+# Settings, https://datatracker.ietf.org/doc/html/rfc9113#section-6.5.2
+SETTINGS_HEADER_TABLE_SIZE = 0x1
+SETTINGS_ENABLE_PUSH = 0x2
+SETTINGS_MAX_CONCURRENT_STREAMS = 0x3
+SETTINGS_INITIAL_WINDOW_SIZE = 0x4
+SETTINGS_MAX_FRAME_SIZE = 0x5
+SETTINGS_MAX_HEADER_LIST_SIZE = 0x6
+
+SETTING = struct.Struct('>HI')
+
+# Error codes, https://datatracker.ietf.org/doc/html/rfc9113#section-7
+NO_ERROR = 0x0
+PROTOCOL_ERROR = 0x1
+INTERNAL_ERROR = 0x2
+FLOW_CONTROL_ERROR = 0x3
+STREAM_CLOSED = 0x5
+FRAME_SIZE_ERROR = 0x6
+REFUSED_STREAM = 0x7
+COMPRESSION_ERROR = 0x9
+ENHANCE_YOUR_CALM = 0xb
+
+# Flow control window every stream and the connection start with, and the largest one allowed
+DEFAULT_WINDOW_SIZE = 65535
+MAX_WINDOW_SIZE = 2 ** 31 - 1
+
+# Largest frame payload either side may send until told otherwise, and the largest that can be allowed
+DEFAULT_MAX_FRAME_SIZE = 16384
+MAX_FRAME_SIZE_LIMIT = 2 ** 24 - 1
+
+# Streams a client may have open at once unless configured otherwise
+DEFAULT_MAX_CONCURRENT_STREAMS = 100
+
+# Frame bytes produced for one write, after which the driver checks for frames the client sent meanwhile
+WRITE_BATCH_BYTES = 64 * 1024
+
+# Response headers describing the HTTP/1.1 connection, meaningless (and forbidden) in HTTP/2
+HOP_BY_HOP_HEADERS = frozenset(['connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'upgrade'])
+
+# Request headers that make an HTTP/2 request malformed, https://datatracker.ietf.org/doc/html/rfc9113#section-8.2.2
+CONNECTION_SPECIFIC_HEADERS = HOP_BY_HOP_HEADERS | {'http2-settings'}
+
+REQUEST_PSEUDO_HEADERS = frozenset([':method', ':scheme', ':path', ':authority'])
+
+
+class Http2Error(Exception):
+    """A connection error, answered with GOAWAY before the connection is closed"""
+
+    def __init__(self, code: int, message: str):
+        """
+        Params:
+        - `code` - the error code sent in GOAWAY
+        - `message` - description of what the client got wrong, sent as GOAWAY debug data
+        """
+        super().__init__(message)
+        self.code = code
+
+
+class StreamError(Exception):
+    """A stream error, answered with RST_STREAM while the other streams of the connection carry on"""
+
+    def __init__(self, stream_id: int, code: int, message: str):
+        """
+        Params:
+        - `stream_id` - the stream to reset
+        - `code` - the error code sent in RST_STREAM
+        - `message` - description of what the client got wrong
+        """
+        super().__init__(message)
+        self.stream_id = stream_id
+        self.code = code
+
+
+class FileSlice:
+    """Part of an open file queued as (part of) a response body"""
+
+    __slots__ = ['file', 'offset', 'count', 'close_file']
+
+    def __init__(self, file, offset: int, count: int, close_file: bool):
+        self.file = file
+        self.offset = offset
+        self.count = count
+        self.close_file = close_file
+
+
+class StreamedBody:
+    """A body produced piece by piece, queued as (part of) a response body"""
+
+    __slots__ = ['chunks', 'external', 'pending']
+
+    def __init__(self, chunks, external: bool):
+        """
+        Params:
+        - `chunks` - iterator or async iterator of bytes-like pieces of the body
+        - `external` - whether pulling a piece may block, so the driver pulls it (see `Http2Session.take_pulls`)
+          unless the session pulls everything inline
+        """
+        self.chunks = chunks
+        self.external = external
+        # What is left of the last piece pulled, when it didn't fit in one frame
+        self.pending = None
+
+
+class Http2Stream:
+    """One request and its response, multiplexed with others on an HTTP/2 connection"""
+
+    __slots__ = ['id', 'request', 'error', 'body', 'parse_time', 'upgraded', 'dispatched', 'remote_closed',
+                 'local_closed', 'reset', 'send_window', 'head', 'head_buffer', 'head_sent', 'outgoing', 'queued',
+                 'pulling']
+
+    def __init__(self, stream_id: int, send_window: int):
+        """
+        Params:
+        - `stream_id` - the stream identifier chosen by the client
+        - `send_window` - bytes of response body the client accepts before sending WINDOW_UPDATE
+        """
+        self.id = stream_id
+        # The parsed request once its head has been received, or the error to reply to it with
+        self.request = None
+        self.error = None
+        self.body = bytearray()
+        self.parse_time = 0.0
+        # Whether the request arrived as HTTP/1.1 asking to upgrade to HTTP/2
+        self.upgraded = False
+        # Whether the request has been handed to the driver to be replied to
+        self.dispatched = False
+        # Whether the client has finished sending, and the server has
+        self.remote_closed = False
+        self.local_closed = False
+        # Set once the stream was reset by either side, later writes to it are dropped
+        self.reset = False
+        self.send_window = send_window
+        # Status and header list of the response, once its HTTP/1.1 head has been written in full
+        self.head = None
+        self.head_buffer = bytearray()
+        self.head_sent = False
+        # Response body buffers, `FileSlice`s and `StreamedBody`s waiting to be framed, None ends the stream
+        self.outgoing = deque()
+        # Whether the stream is in the session's round robin of streams with something to send
+        self.queued = False
+        # Whether the driver is pulling the next piece of a `StreamedBody`
+        self.pulling = False
+
+
+def frame(frame_type: int, flags: int, stream_id: int, payload: bytes = b'') -> bytes:
+    """
+    Returns:
+    The encoded frame
+    """
+    length = len(payload)
+    return FRAME_HEADER.pack(length >> 16, length & 0xffff, frame_type, flags, stream_id) + payload
+
+
+def frame_header(frame_type: int, flags: int, stream_id: int, length: int) -> bytes:
+    """
+    Returns:
+    The header of a frame whose `length` bytes of payload are sent as a buffer of their own
+    """
+    return FRAME_HEADER.pack(length >> 16, length & 0xffff, frame_type, flags, stream_id)
+
+
+def strip_padding(flags: int, payload: bytes) -> bytes:
+    """
+    Returns:
+    The payload of a DATA or HEADERS frame without its padding, if it has the PADDED flag
+    """
+    if not flags & FLAG_PADDED:
+        return payload
+    if not payload or payload[0] >= len(payload):
+        raise Http2Error(PROTOCOL_ERROR, 'Padding longer than the frame')
+    return payload[1:len(payload) - payload[0]]
+
+
+def parse_response_head(head: bytes) -> tuple:
+    """
+    Translates the HTTP/1.1 head a handler wrote into the status and header list of an HTTP/2 response
+
+    Params:
+    - `head` - status line and header lines, without the blank line ending them
+
+    Returns:
+    The status code and the list of `(name, value)` pairs, names lower-cased and hop-by-hop headers left out
+    """
+    lines = head.decode(HEADER_ENCODING).split('\r\n')
+    status_code = int(lines[0].split(' ', 2)[1])
+    headers = []
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        name = name.strip().lower()
+        if name not in HOP_BY_HOP_HEADERS:
+            headers.append((name, value.strip()))
+    return status_code, headers
+
+
+def decode_settings_header(value: str) -> bytes:
+    """
+    Returns:
+    The SETTINGS payload carried by an `HTTP2-Settings` header (base64url without padding), None if it
+    isn't valid
+    """
+    try:
+        payload = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+    except (binascii.Error, ValueError):
+        return None
+    return payload if len(payload) % SETTING.size == 0 else None
+
+
+def detect_http2(request) -> str:
+    """
+    Tells whether a request read by the HTTP/1.1 parser is a client switching the connection to HTTP/2
+
+    Params:
+    - `request` - a `Request`
+
+    Returns:
+    `PRIOR_KNOWLEDGE` if it is the start of the client preface, `UPGRADE` if it asks to upgrade to h2c with
+    valid settings, None otherwise
+    """
+    if request.connection_closed or request.headers is None:
+        return None
+    if request.method == 'PRI' and request.path == '*' and request.http_version == 'HTTP/2.0':
+        return PRIOR_KNOWLEDGE
+    if not request.valid or request.http_version != 'HTTP/1.1':
+        return None
+    upgrade = request.get_header('Upgrade', '')
+    if 'h2c' not in [protocol.strip().lower() for protocol in upgrade.split(',')]:
+        return None
+    settings = request.get_header('HTTP2-Settings')
+    if settings is None or decode_settings_header(settings) is None:
+        return None
+    return UPGRADE
+
+
+class Http2Session:
+    """
+    The HTTP/2 protocol state of one connection, without any I/O: bytes received are passed to `receive`,
+    which returns the streams whose requests are complete, and `output` returns the frames to send.
+
+    Responses are written to a stream as the HTTP/1.1 bytes `Request` produces (see `StreamConnection`), the
+    head being translated into a HEADERS frame. Their bodies are framed as DATA frames only as the client's
+    flow control windows allow, so nothing beyond a file slice or the last streamed piece is held in memory.
+    Streams with something to send take turns one frame at a time, so a large response doesn't hold back the
+    small ones requested alongside it. File slices are read with `os.pread` a frame at a time, as `sendfile`
+    can't interleave frame headers.
+
+    Requests are buffered whole, as with HTTP/1.1, and the client's windows are topped up as soon as their
+    bytes arrive.
+    """
+
+    def __init__(self, max_concurrent_streams: int = DEFAULT_MAX_CONCURRENT_STREAMS,
+                 max_header_bytes: int = DEFAULT_MAX_HEADER_BYTES,
+                 max_header_count: int = DEFAULT_MAX_HEADER_COUNT,
+                 max_body_bytes: int = DEFAULT_MAX_BODY_BYTES,
+                 max_requests: int = DEFAULT_MAX_KEEP_ALIVE_REQUESTS,
+                 inline_pulls: bool = True):
+        """
+        Params:
+        - `max_concurrent_streams` - streams the client may have open at once, more are refused
+        - `max_header_bytes` - largest header list accepted, larger ones get 431
+        - `max_header_count` - most header fields accepted, more get 431
+        - `max_body_bytes` - largest request body accepted, larger ones get 413
+        - `max_requests` - streams served before the connection is wound down with GOAWAY
+        - `inline_pulls` - pull the pieces of every streamed body from `output`, even those that may block.
+          False leaves pulling those to the driver.
+        """
+        self.max_concurrent_streams = max_concurrent_streams
+        self.max_header_bytes = max_header_bytes
+        self.max_header_count = max_header_count
+        self.max_body_bytes = max_body_bytes
+        self.max_requests = max_requests
+        self.inline_pulls = inline_pulls
+
+        self.encoder = Encoder()
+        self.decoder = Decoder()
+        # Open streams by identifier
+        self.streams = {}
+        self.last_stream_id = 0
+        self.streams_opened = 0
+        # Set once GOAWAY has been sent, no new streams are accepted after it
+        self.going_away = False
+        # Set once a connection error has been found, the connection is closed once GOAWAY is sent
+        self.closed = False
+        # The client's settings that shape what is sent
+        self.initial_window = DEFAULT_WINDOW_SIZE
+        self.max_frame_size = DEFAULT_MAX_FRAME_SIZE
+        self.send_window = DEFAULT_WINDOW_SIZE
+
+        self.__buffer = bytearray()
+        self.__preface = b''
+        # Frames sent ahead of any DATA
+        self.__control = []
+        # Streams with something to send, taking turns
+        self.__ready = deque()
+        # Streams with body bytes to send but no room left in the connection window
+        self.__blocked = []
+        # Stream identifier, END_STREAM flag and header block of a HEADERS frame continued by CONTINUATION
+        self.__continued = None
+        self.__pulls = []
+        # Event loop async bodies are pulled on when pulling inline
+        self.__loop = None
+
+    def start(self, request, received: bytes = b'') -> list:
+        """
+        Takes over the connection a `Request` switched to HTTP/2 (see `detect_http2`), sending the server's
+        SETTINGS. A request upgrading with h2c becomes stream 1, which is replied to over HTTP/2.
+
+        Params:
+        - `request` - the request that started HTTP/2
+        - `received` - bytes the HTTP/1.1 parser had buffered past the request
+
+        Returns:
+        The streams ready to be replied to, see `receive`
+        """
+        CONNECTION_STATS.increment('http2_connections')
+        streams = []
+        if detect_http2(request) == PRIOR_KNOWLEDGE:
+            self.__preface = PREFACE_TAIL
+        else:
+            self.__control.append(UPGRADE_RESPONSE)
+            self.__preface = CLIENT_PREFACE
+        self.__control.append(frame(SETTINGS, 0, 0, b''.join([
+            SETTING.pack(SETTINGS_MAX_CONCURRENT_STREAMS, self.max_concurrent_streams),
+            SETTING.pack(SETTINGS_MAX_HEADER_LIST_SIZE, self.max_header_bytes),
+        ])))
+        if self.__preface == CLIENT_PREFACE:
+            try:
+                self.__apply_settings(decode_settings_header(request.get_header('HTTP2-Settings')))
+            except Http2Error as err:
+                self.__fail(err.code, str(err))
+                return streams
+            streams.append(self.__open_upgraded_stream(request))
+        return streams + self.receive(received)
+
+    def __open_upgraded_stream(self, request) -> Http2Stream:
+        """
+        Opens stream 1, half closed as its request was received whole over HTTP/1.1
+        """
+        headers = {}
+        header_index = {}
+        for name, value in request.headers.items():
+            lowered = name.lower()
+            if lowered not in CONNECTION_SPECIFIC_HEADERS:
+                headers[name] = value
+                header_index[lowered] = value
+        parsed = ParsedRequest(request.method, request.path, 'HTTP/2.0', headers, header_index)
+        parsed.body = request.body
+        stream = Http2Stream(1, self.initial_window)
+        stream.request = parsed
+        stream.upgraded = True
+        stream.remote_closed = True
+        stream.dispatched = True
+        self.streams[1] = stream
+        self.last_stream_id = 1
+        self.streams_opened = 1
+        return stream
+
+    def receive(self, data: bytes) -> list:
+        """
+        Processes bytes received from the client
+
+        Returns:
+        The streams whose requests have been received in full (or failed in a way answered with an error
+        status), in the order they completed. Each must be replied to through a `StreamConnection`.
+        After a connection error, GOAWAY is queued, `closed` is set and nothing is returned.
+        """
+        completed = []
+        if self.closed:
+            return completed
+        buffer = self.__buffer
+        buffer += data
+        try:
+            if self.__preface:
+                size = min(len(self.__preface), len(buffer))
+                if buffer[:size] != self.__preface[:size]:
+                    raise Http2Error(PROTOCOL_ERROR, 'Invalid connection preface')
+                del buffer[:size]
+                self.__preface = self.__preface[size:]
+            while not self.__preface and len(buffer) >= FRAME_HEADER.size:
+                length_high, length_low, frame_type, flags, stream_id = FRAME_HEADER.unpack_from(buffer)
+                length = length_high << 16 | length_low
+                if length > DEFAULT_MAX_FRAME_SIZE:
+                    raise Http2Error(FRAME_SIZE_ERROR, 'Frame larger than SETTINGS_MAX_FRAME_SIZE')
+                end = FRAME_HEADER.size + length
+                if len(buffer) < end:
+                    break
+                payload = bytes(buffer[FRAME_HEADER.size:end])
+                del buffer[:end]
+                try:
+                    self.__on_frame(frame_type, flags, stream_id & 0x7fffffff, payload, completed)
+                except StreamError as err:
+                    stream = self.streams.get(err.stream_id)
+                    if stream is not None:
+                        self.reset_stream(stream, err.code)
+                    else:
+                        self.__control.append(frame(RST_STREAM, 0, err.stream_id, struct.pack('>I', err.code)))
+        except HpackError as err:
+            self.__fail(COMPRESSION_ERROR, str(err))
+            return []
+        except Http2Error as err:
+            self.__fail(err.code, str(err))
+            return []
+        return completed
+
+    def __on_frame(self, frame_type: int, flags: int, stream_id: int, payload: bytes, completed: list):
+        if self.__continued is not None and (frame_type != CONTINUATION or stream_id != self.__continued[0]):
+            raise Http2Error(PROTOCOL_ERROR, 'Header block interrupted')
+        if frame_type == DATA:
+            self.__on_data(flags, stream_id, payload, completed)
+        elif frame_type == HEADERS:
+            if stream_id == 0 or stream_id % 2 == 0:
+                raise Http2Error(PROTOCOL_ERROR, 'HEADERS on a stream the client can\'t open')
+            payload = strip_padding(flags, payload)
+            if flags & FLAG_PRIORITY:
+                if len(payload) < 5:
+                    raise Http2Error(FRAME_SIZE_ERROR, 'HEADERS too short for its priority')
+                payload = payload[5:]
+            self.__continued = (stream_id, flags & FLAG_END_STREAM, bytearray(payload))
+            if flags & FLAG_END_HEADERS:
+                self.__on_header_block(completed)
+        elif frame_type == CONTINUATION:
+            if self.__continued is None:
+                raise Http2Error(PROTOCOL_ERROR, 'CONTINUATION without HEADERS')
+            block = self.__continued[2]
+            block += payload
+            # HPACK never encodes a field list in much less than its decoded size, so a block this large
+            # can only decode to a list over the limit
+            if len(block) > 2 * self.max_header_bytes:
+                raise Http2Error(ENHANCE_YOUR_CALM, 'Header block too large')
+            if flags & FLAG_END_HEADERS:
+                self.__on_header_block(completed)
+        elif frame_type == SETTINGS:
+            if stream_id != 0:
+                raise Http2Error(PROTOCOL_ERROR, 'SETTINGS on a stream')
+            if flags & FLAG_ACK:
+                if payload:
+                    raise Http2Error(FRAME_SIZE_ERROR, 'SETTINGS acknowledgement with a payload')
+                return
+            if len(payload) % SETTING.size:
+                raise Http2Error(FRAME_SIZE_ERROR, 'SETTINGS of an invalid size')
+            self.__apply_settings(payload)
+            self.__control.append(frame(SETTINGS, FLAG_ACK, 0))
+        elif frame_type == WINDOW_UPDATE:
+            self.__on_window_update(stream_id, payload)
+        elif frame_type == PING:
+            if stream_id != 0:
+                raise Http2Error(PROTOCOL_ERROR, 'PING on a stream')
+            if len(payload) != 8:
+                raise Http2Error(FRAME_SIZE_ERROR, 'PING of an invalid size')
+            if not flags & FLAG_ACK:
+                self.__control.append(frame(PING, FLAG_ACK, 0, payload))
+        elif frame_type == RST_STREAM:
+            if stream_id == 0 or stream_id > self.last_stream_id:
+                raise Http2Error(PROTOCOL_ERROR, 'RST_STREAM on an idle stream')
+            if len(payload) != 4:
+                raise Http2Error(FRAME_SIZE_ERROR, 'RST_STREAM of an invalid size')
+            stream = self.streams.get(stream_id)
+            if stream is not None:
+                self.__release(stream)
+        elif frame_type == PRIORITY:
+            if stream_id == 0:
+                raise Http2Error(PROTOCOL_ERROR, 'PRIORITY on stream 0')
+            if len(payload) != 5:
+                raise StreamError(stream_id, FRAME_SIZE_ERROR, 'PRIORITY of an invalid size')
+        elif frame_type == GOAWAY:
+            if stream_id != 0:
+                raise Http2Error(PROTOCOL_ERROR, 'GOAWAY on a stream')
+            # The client won't open more streams, finish those open and close
+            self.go_away()
+        elif frame_type == PUSH_PROMISE:
+            raise Http2Error(PROTOCOL_ERROR, 'PUSH_PROMISE sent by a client')
+        # Frames of unknown types are ignored, https://datatracker.ietf.org/doc/html/rfc9113#section-5.5
+
+    def __on_header_block(self, completed: list):
+        """
+        Handles a complete header block, opening a stream or ending one with trailers
+        """
+        stream_id, end_stream, block = self.__continued
+        self.__continued = None
+        started = time.perf_counter()
+        # Decoded even if the stream is then refused, to keep the dynamic table in step with the client's
+        headers = self.decoder.decode(bytes(block), self.max_header_bytes)
+
+        stream = self.streams.get(stream_id)
+        if stream is not None:
+            # Trailers, which are read and discarded
+            if stream.remote_closed:
+                raise StreamError(stream_id, STREAM_CLOSED, 'HEADERS on a half closed stream')
+            if not end_stream:
+                raise StreamError(stream_id, PROTOCOL_ERROR, 'Trailers without END_STREAM')
+            self.__end_of_request(stream, completed)
+            return
+        if stream_id <= self.last_stream_id:
+            raise Http2Error(STREAM_CLOSED, 'HEADERS on a closed stream')
+        self.last_stream_id = stream_id
+        if self.going_away:
+            return
+        if len(self.streams) >= self.max_concurrent_streams:
+            raise StreamError(stream_id, REFUSED_STREAM, 'Too many concurrent streams')
+
+        stream = Http2Stream(stream_id, self.initial_window)
+        self.streams[stream_id] = stream
+        self.streams_opened += 1
+        if self.streams_opened >= self.max_requests:
+            self.go_away()
+        try:
+            stream.request = self.__parse_request(stream_id, headers)
+        except ParseError as err:
+            stream.error = err
+        stream.parse_time = time.perf_counter() - started
+        if end_stream:
+            self.__end_of_request(stream, completed)
+        elif stream.error is not None:
+            stream.dispatched = True
+            completed.append(stream)
+
+    def __parse_request(self, stream_id: int, headers: list) -> ParsedRequest:
+        """
+        Builds the request of a stream from its header list
+
+        Raises:
+        ParseError if the headers exceed a limit, StreamError if they are malformed
+        """
+        if headers is None:
+            raise ParseError(431, 'Request header fields too large')
+        if len(headers) > self.max_header_count + len(REQUEST_PSEUDO_HEADERS):
+            raise ParseError(431, 'Too many request header fields')
+        pseudo = {}
+        fields = {}
+        for name, value in headers:
+            if name.startswith(':'):
+                if fields or name not in REQUEST_PSEUDO_HEADERS or name in pseudo:
+                    raise StreamError(stream_id, PROTOCOL_ERROR, f'Misplaced or unknown pseudo-header {name}')
+                pseudo[name] = value
+                continue
+            if name != name.lower() or name in CONNECTION_SPECIFIC_HEADERS or \
+                    (name == 'te' and value.lower() != 'trailers'):
+                raise StreamError(stream_id, PROTOCOL_ERROR, f'Invalid header field {name}')
+            if name in fields:
+                # Cookies may be split into one field per crumb,
+                # https://datatracker.ietf.org/doc/html/rfc9113#section-8.2.3
+                value = f'{fields[name]}{"; " if name == "cookie" else ", "}{value}'
+            fields[name] = value
+
+        method = pseudo.get(':method')
+        path = pseudo.get(':path')
+        if not method or not path or ':scheme' not in pseudo:
+            raise StreamError(stream_id, PROTOCOL_ERROR, 'Missing pseudo-header')
+        if ':authority' in pseudo and 'host' not in fields:
+            fields['host'] = pseudo[':authority']
+        if not path.isascii():
+            try:
+                path = path.encode(HEADER_ENCODING).decode(DEFAULT_ENCODING)
+            except UnicodeDecodeError:
+                raise ParseError(400, 'Malformed request path')
+        content_length = fields.get('content-length')
+        if content_length is not None:
+            if not is_decimal(content_length):
+                raise StreamError(stream_id, PROTOCOL_ERROR, 'Invalid content-length')
+            if int(content_length) > self.max_body_bytes:
+                raise ParseError(413, 'Request body too large')
+        return ParsedRequest(method, path, 'HTTP/2.0', fields, dict(fields))
+
+    def __end_of_request(self, stream: Http2Stream, completed: list):
+        """
+        Handles the END_STREAM flag of a stream, handing its request over if it hasn't been already
+        """
+        stream.remote_closed = True
+        if stream.dispatched:
+            return
+        if stream.request is not None:
+            content_length = stream.request.header_index.get('content-length')
+            if content_length is not None and int(content_length) != len(stream.body):
+                raise StreamError(stream.id, PROTOCOL_ERROR, 'Body length differs from content-length')
+            stream.request.body = bytes(stream.body)
+        stream.body = None
+        stream.dispatched = True
+        completed.append(stream)
+
+    def __on_data(self, flags: int, stream_id: int, payload: bytes, completed: list):
+        if stream_id == 0:
+            raise Http2Error(PROTOCOL_ERROR, 'DATA on stream 0')
+        # Padding counts against the window too
+        if payload:
+            self.__control.append(frame(WINDOW_UPDATE, 0, 0, struct.pack('>I', len(payload))))
+        data = strip_padding(flags, payload)
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            if stream_id > self.last_stream_id:
+                raise Http2Error(PROTOCOL_ERROR, 'DATA on an idle stream')
+            raise StreamError(stream_id, STREAM_CLOSED, 'DATA on a closed stream')
+        if stream.remote_closed:
+            raise StreamError(stream_id, STREAM_CLOSED, 'DATA on a half closed stream')
+
+        end_stream = flags & FLAG_END_STREAM
+        if not stream.dispatched:
+            stream.body += data
+            if len(stream.body) > self.max_body_bytes:
+                # Replied to right away, the rest of the body is dropped as it arrives
+                stream.error = ParseError(413, 'Request body too large')
+                stream.body = None
+                stream.dispatched = True
+                completed.append(stream)
+            elif payload and not end_stream:
+                self.__control.append(frame(WINDOW_UPDATE, 0, stream_id, struct.pack('>I', len(payload))))
+        if end_stream:
+            self.__end_of_request(stream, completed)
+
+    def __on_window_update(self, stream_id: int, payload: bytes):
+        if len(payload) != 4:
+            raise Http2Error(FRAME_SIZE_ERROR, 'WINDOW_UPDATE of an invalid size')
+        increment = struct.unpack('>I', payload)[0] & 0x7fffffff
+        if stream_id == 0:
+            if increment == 0:
+                raise Http2Error(PROTOCOL_ERROR, 'WINDOW_UPDATE of 0')
+            self.send_window += increment
+            if self.send_window > MAX_WINDOW_SIZE:
+                raise Http2Error(FLOW_CONTROL_ERROR, 'Connection window too large')
+            blocked, self.__blocked = self.__blocked, []
+            for stream in blocked:
+                self.__schedule(stream)
+            return
+        if increment == 0:
+            raise StreamError(stream_id, PROTOCOL_ERROR, 'WINDOW_UPDATE of 0')
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            return
+        stream.send_window += increment
+        if stream.send_window > MAX_WINDOW_SIZE:
+            raise StreamError(stream_id, FLOW_CONTROL_ERROR, 'Stream window too large')
+        self.__schedule(stream)
+
+    def __apply_settings(self, payload: bytes):
+        for offset in range(0, len(payload), SETTING.size):
+            setting, value = SETTING.unpack_from(payload, offset)
+            if setting == SETTINGS_HEADER_TABLE_SIZE:
+                self.encoder.set_max_table_size(value)
+            elif setting == SETTINGS_ENABLE_PUSH:
+                if value > 1:
+                    raise Http2Error(PROTOCOL_ERROR, 'Invalid SETTINGS_ENABLE_PUSH')
+            elif setting == SETTINGS_INITIAL_WINDOW_SIZE:
+                if value > MAX_WINDOW_SIZE:
+                    raise Http2Error(FLOW_CONTROL_ERROR, 'Invalid SETTINGS_INITIAL_WINDOW_SIZE')
+                # Applies to the windows of open streams too,
+                # https://datatracker.ietf.org/doc/html/rfc9113#section-6.9.2
+                delta = value - self.initial_window
+                self.initial_window = value
+                for stream in self.streams.values():
+                    stream.send_window += delta
+                    self.__schedule(stream)
+            elif setting == SETTINGS_MAX_FRAME_SIZE:
+                if not DEFAULT_MAX_FRAME_SIZE <= value <= MAX_FRAME_SIZE_LIMIT:
+                    raise Http2Error(PROTOCOL_ERROR, 'Invalid SETTINGS_MAX_FRAME_SIZE')
+                self.max_frame_size = value
+
+    def go_away(self):
+        """
+        Stops accepting new streams, the connection should be closed once `finished`
+        """
+        if self.going_away:
+            return
+        self.going_away = True
+        self.__control.append(frame(GOAWAY, 0, 0, struct.pack('>II', self.last_stream_id, NO_ERROR)))
+
+    def __fail(self, code: int, message: str):
+        if not self.closed:
+            self.closed = True
+            self.going_away = True
+            self.__control.append(frame(GOAWAY, 0, 0, struct.pack('>II', self.last_stream_id, code) +
+                                        message.encode(DEFAULT_ENCODING)))
+
+    def idle(self) -> bool:
+        """
+        Returns:
+        True if no stream is open
+        """
+        return not self.streams
+
+    def finished(self) -> bool:
+        """
+        Returns:
+        True once the connection should be closed, after sending what `output` still returns
+        """
+        return self.closed or (self.going_away and not self.streams)
+
+    def wants_output(self) -> bool:
+        """
+        Returns:
+        True if `output` has frames to return
+        """
+        return bool(self.__control) or bool(self.__ready)
+
+    def send_data(self, stream: Http2Stream, parts: list):
+        """
+        Queues bytes of the HTTP/1.1 response written to a stream: the head until its blank line, then body bytes
+        """
+        if stream.reset or stream.local_closed:
+            return
+        for part in parts:
+            if isinstance(part, bytearray):
+                # May be reused by the handler once it has been written
+                part = bytes(part)
+            if stream.head is not None:
+                if len(part):
+                    stream.outgoing.append(memoryview(part).cast('B'))
+                continue
+            stream.head_buffer += part
+            end = stream.head_buffer.find(b'\r\n\r\n')
+            if end == -1:
+                continue
+            stream.head = parse_response_head(bytes(stream.head_buffer[:end]))
+            if end + 4 < len(stream.head_buffer):
+                stream.outgoing.append(memoryview(bytes(stream.head_buffer[end + 4:])))
+            stream.head_buffer = None
+        self.__schedule(stream)
+
+    def send_file(self, stream: Http2Stream, file, offset: int, count: int, close_file: bool):
+        """
+        Queues part of an open file as response body bytes, closing it once sent unless `close_file` is False
+        """
+        if stream.reset or stream.local_closed or count <= 0:
+            if close_file:
+                file.close()
+            return
+        stream.outgoing.append(FileSlice(file, offset, count, close_file))
+        self.__schedule(stream)
+
+    def send_stream(self, stream: Http2Stream, chunks, external: bool):
+        """
+        Queues a body produced piece by piece, see `StreamedBody`
+        """
+        if stream.reset or stream.local_closed:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            return
+        if hasattr(chunks, '__aiter__'):
+            stream.outgoing.append(StreamedBody(chunks.__aiter__(), True))
+        else:
+            stream.outgoing.append(StreamedBody(iter(chunks), external))
+        self.__schedule(stream)
+
+    def end_stream(self, stream: Http2Stream):
+        """
+        Ends the response of a stream once what was queued before has been sent
+        """
+        if stream.reset or stream.local_closed or (stream.outgoing and stream.outgoing[-1] is None):
+            return
+        if stream.head is None:
+            # Only raw bytes were written (`Request.reply_bytearray`), which are all a client gets for a
+            # request it got badly wrong
+            body = bytes(stream.head_buffer)
+            stream.head = (400, [('content-type', 'text/plain'), ('content-length', str(len(body)))])
+            stream.head_buffer = None
+            if body:
+                stream.outgoing.append(memoryview(body))
+        stream.outgoing.append(None)
+        self.__schedule(stream)
+
+    def reset_stream(self, stream: Http2Stream, code: int):
+        """
+        Sends RST_STREAM and drops what is still queued on the stream
+        """
+        if stream.reset:
+            return
+        self.__control.append(frame(RST_STREAM, 0, stream.id, struct.pack('>I', code)))
+        self.__release(stream)
+
+    def __release(self, stream: Http2Stream):
+        """
+        Closes a stream that was reset, releasing the files and bodies queued on it
+        """
+        stream.reset = True
+        stream.local_closed = stream.remote_closed = True
+        for item in stream.outgoing:
+            if isinstance(item, FileSlice) and item.close_file:
+                item.file.close()
+            elif isinstance(item, StreamedBody) and not stream.pulling and hasattr(item.chunks, 'close'):
+                # A body being pulled on a worker thread is closed by `pulled`
+                item.chunks.close()
+        stream.outgoing.clear()
+        self.__forget(stream)
+
+    def __forget(self, stream: Http2Stream):
+        self.streams.pop(stream.id, None)
+
+    def __close_local(self, stream: Http2Stream):
+        """
+        Records that the end of a response has been framed
+        """
+        stream.local_closed = True
+        if not stream.remote_closed:
+            # Replied to before the whole request arrived, tell the client to stop sending it
+            self.__control.append(frame(RST_STREAM, 0, stream.id, struct.pack('>I', NO_ERROR)))
+            stream.remote_closed = True
+        self.__forget(stream)
+
+    def __schedule(self, stream: Http2Stream):
+        if stream.head is not None and not stream.queued and not stream.reset and not stream.pulling:
+            stream.queued = True
+            self.__ready.append(stream)
+
+    def output(self, max_bytes: int = WRITE_BATCH_BYTES) -> list:
+        """
+        Frames what is ready to be sent, streams taking turns a frame at a time
+
+        Params:
+        - `max_bytes` - frame bytes after which to stop, more may be returned as a turn isn't cut short
+
+        Returns:
+        The buffers to send in order, empty if there is nothing to send
+        """
+        parts = self.__control
+        self.__control = []
+        size = sum(map(len, parts))
+        ready = self.__ready
+        while ready and size < max_bytes:
+            stream = ready.popleft()
+            stream.queued = False
+            if stream.reset:
+                continue
+            framed = self.__frame_turn(stream, parts)
+            size += framed
+            if framed and stream.outgoing and not stream.pulling:
+                self.__schedule(stream)
+            if self.__control:
+                # Stream errors hit while framing
+                parts += self.__control
+                self.__control = []
+        return parts
+
+    def __frame_turn(self, stream: Http2Stream, parts: list) -> int:
+        """
+        Frames the head of a stream's response if it hasn't been sent yet, and at most one DATA frame
+
+        Returns:
+        The number of bytes framed, 0 if the stream has to wait for a window or a piece of its body
+        """
+        framed = 0
+        outgoing = stream.outgoing
+        if not stream.head_sent:
+            stream.head_sent = True
+            status_code, headers = stream.head
+            end_stream = bool(outgoing) and outgoing[0] is None
+            framed += self.__frame_headers(stream.id, [(':status', str(status_code)), *headers], end_stream, parts)
+            if end_stream:
+                outgoing.popleft()
+                self.__close_local(stream)
+                return framed
+
+        while outgoing:
+            item = outgoing[0]
+            if item is None:
+                parts.append(frame(DATA, FLAG_END_STREAM, stream.id))
+                outgoing.popleft()
+                self.__close_local(stream)
+                return framed + FRAME_HEADER.size
+            limit = min(stream.send_window, self.send_window, self.max_frame_size)
+            if limit <= 0:
+                if self.send_window <= 0:
+                    self.__blocked.append(stream)
+                return framed
+            try:
+                data = self.__take(stream, item, limit)
+            except Exception:
+                # Reading the file or producing the body failed, the client sees the stream reset
+                self.reset_stream(stream, INTERNAL_ERROR)
+                return framed
+            if data is None:
+                if stream.pulling:
+                    return framed
+                continue
+            if not data:
+                continue
+            flags = 0
+            if len(outgoing) == 1 and outgoing[0] is None:
+                flags = FLAG_END_STREAM
+                outgoing.popleft()
+            parts.append(frame_header(DATA, flags, stream.id, len(data)))
+            parts.append(data)
+            stream.send_window -= len(data)
+            self.send_window -= len(data)
+            if flags:
+                self.__close_local(stream)
+            return framed + FRAME_HEADER.size + len(data)
+        return framed
+
+    def __frame_headers(self, stream_id: int, headers: list, end_stream: bool, parts: list) -> int:
+        """
+        Encodes a header list as a HEADERS frame, followed by CONTINUATION frames if it doesn't fit in one
+        """
+        block = self.encoder.encode(headers)
+        flags = FLAG_END_STREAM if end_stream else 0
+        frame_type = HEADERS
+        offset = 0
+        while True:
+            fragment = block[offset:offset + self.max_frame_size]
+            offset += len(fragment)
+            if offset >= len(block):
+                flags |= FLAG_END_HEADERS
+            parts.append(frame(frame_type, flags, stream_id, fragment))
+            if flags & FLAG_END_HEADERS:
+                return len(block) + FRAME_HEADER.size * (1 + (len(block) - 1) // self.max_frame_size)
+            frame_type = CONTINUATION
+            flags = 0
+
+    def __take(self, stream: Http2Stream, item, limit: int):
+        """
+        Takes up to `limit` bytes off the first queued body item of a stream, dropping the item once exhausted
+
+        Returns:
+        The bytes, None if the item was exhausted (or the next piece of a streamed body is being pulled)
+        """
+        outgoing = stream.outgoing
+        if isinstance(item, memoryview):
+            if len(item) <= limit:
+                outgoing.popleft()
+                return item
+            outgoing[0] = item[limit:]
+            return item[:limit]
+
+        if isinstance(item, FileSlice):
+            size = min(limit, item.count)
+            data = os.pread(item.file.fileno(), size, item.offset)
+            if not data:
+                raise EOFError('File is shorter than expected')
+            item.offset += len(data)
+            item.count -= len(data)
+            if item.count == 0:
+                outgoing.popleft()
+                if item.close_file:
+                    item.file.close()
+            return data
+
+        if item.pending is None:
+            if item.external and not self.inline_pulls:
+                stream.pulling = True
+                self.__pulls.append((stream, item))
+                return None
+            piece = self.__pull(item)
+            if piece is None:
+                outgoing.popleft()
+                return None
+            item.pending = memoryview(piece).cast('B')
+        data = item.pending
+        if len(data) <= limit:
+            item.pending = None
+            return data
+        item.pending = data[limit:]
+        return data[:limit]
+
+    def __pull(self, body: StreamedBody):
+        """
+        Pulls the next piece of a streamed body on the calling thread
+
+        Returns:
+        The piece, None once the body is exhausted
+        """
+        if not hasattr(body.chunks, '__anext__'):
+            return next(body.chunks, None)
+        if self.__loop is None:
+            self.__loop = asyncio.new_event_loop()
+        try:
+            return self.__loop.run_until_complete(body.chunks.__anext__())
+        except StopAsyncIteration:
+            return None
+
+    def take_pulls(self) -> list:
+        """
+        Returns:
+        The `(stream, body)` pairs whose next piece the driver must pull and hand to `pulled`, see `inline_pulls`
+        """
+        pulls, self.__pulls = self.__pulls, []
+        return pulls
+
+    def pulled(self, stream: Http2Stream, body: StreamedBody, piece, failed: bool = False):
+        """
+        Hands over the next piece of a streamed body pulled by the driver
+
+        Params:
+        - `stream`, `body` - as returned by `take_pulls`
+        - `piece` - the bytes-like piece, None if the body is exhausted
+        - `failed` - whether producing the piece raised, which resets the stream
+        """
+        stream.pulling = False
+        if stream.reset:
+            if hasattr(body.chunks, 'close'):
+                body.chunks.close()
+            return
+        if failed:
+            self.reset_stream(stream, INTERNAL_ERROR)
+            return
+        if piece is None:
+            stream.outgoing.popleft()
+        elif len(piece):
+            body.pending = memoryview(piece).cast('B')
+        self.__schedule(stream)
+
+    def close(self):
+        """
+        Releases what is still queued once the connection is closed
+        """
+        for stream in list(self.streams.values()):
+            self.__release(stream)
+        if self.__loop is not None:
+            self.__loop.close()
+            self.__loop = None
+
+
+class StreamConnection(BaseConnection):
+    """
+    One HTTP/2 stream, presented to `Request` as a connection serving a single request. Replies are
+    written as usual and handed to the `Http2Session` through the driver serving the connection, so
+    handlers work unchanged over HTTP/2.
+
+    The driver must provide `call(function, *args)`, which runs a session method on the thread owning the
+    session, `run_blocking(function, stream)`, see `BaseConnection.run_blocking`, which resets the stream if
+    `function` raises, and `in_worker_thread()`, which tells whether the caller is a `run_blocking` function on
+    a worker thread.
+    """
+
+    def __init__(self, stream: Http2Stream, session: Http2Session, driver, client_address: str = None):
+        """
+        Params:
+        - `stream` - the stream whose request is replied to
+        - `session` - the protocol state of the connection
+        - `driver` - the driver serving the connection
+        - `client_address` - IP address of the peer, if known
+        """
+        # A stream isn't a connection of its own, so the connection counters of `BaseConnection.__init__`
+        # are left alone
+        self.stream = stream
+        self.session = session
+        self.driver = driver
+        self.client_address = client_address
+        self.parser = None
+        self.idle_timeout = 0
+        self.max_requests = 1
+        self.requests_served = 0
+        self.coalesce_bytes = 0
+        self.closed = False
+        self.parse_time = 0.0
+
+    def read_request(self) -> ParsedRequest:
+        self.parse_time = self.stream.parse_time
+        if self.stream.error is not None:
+            raise self.stream.error
+        return self.stream.request
+
+    def has_buffered_data(self) -> bool:
+        return False
+
+    def can_keep_alive(self) -> bool:
+        # Every response ends its stream, which is what closing the connection does for `Request`
+        return False
+
+    def start_request(self, pipelined: bool):
+        CONNECTION_STATS.increment('http2_streams')
+        if self.stream.upgraded:
+            # Already counted when it was read as HTTP/1.1
+            return
+        CONNECTION_STATS.increment('requests_served')
+        if self.session.streams_opened > 1:
+            CONNECTION_STATS.increment('requests_reused')
+
+    def send(self, data: bytes):
+        self.send_parts([data])
+
+    def send_parts(self, parts: list):
+        self.driver.call(self.session.send_data, self.stream, parts)
+
+    def send_file(self, file, offset: int, count: int, close_file: bool = True):
+        self.driver.call(self.session.send_file, self.stream, file, offset, count, close_file)
+
+    def send_stream(self, chunks, encoder: ChunkedEncoder):
+        """
+        Queues a streamed body, unframed as DATA frames carry the pieces. Pieces of bodies queued by a
+        `run_blocking` function are pulled on a worker thread by the asyncio backend.
+        """
+        self.driver.call(self.session.send_stream, self.stream, chunks, self.driver.in_worker_thread())
+
+    def run_blocking(self, function) -> bool:
+        return self.driver.run_blocking(function, self.stream)
+
+    def close_if_idle(self):
+        pass
+
+    def close(self):
+        """
+        Ends the stream once what was written before has been sent
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.driver.call(self.session.end_stream, self.stream)
+
+
+class SocketHttp2Connection:
+    """
+    Serves an HTTP/2 connection over a blocking socket, for the socketserver backends.
+
+    Requests are replied to on the connection's thread as their streams complete, which queues their
+    responses, and the queued frames are then sent a batch at a time, checking for frames from the client
+    between batches, so new requests are picked up while large responses are still being sent. Handlers that
+    block (e.g. a proxied request) hold up the other streams of the connection while they run.
+    """
+
+    def __init__(self, connection: Connection, session: Http2Session, route):
+        """
+        Params:
+        - `connection` - the client connection that switched to HTTP/2
+        - `session` - protocol state for it, pulling streamed bodies inline
+        - `route` - function that replies to a parsed `Request`
+        """
+        self.connection = connection
+        self.session = session
+        self.route = route
+
+    def serve(self, request):
+        """
+        Serves the connection until either side closes it
+
+        Params:
+        - `request` - the request that started HTTP/2
+        """
+        connection = self.connection
+        session = self.session
+        try:
+            streams = session.start(request, connection.parser.take_buffered())
+            while True:
+                for stream in streams:
+                    self.route(Request(StreamConnection(stream, session, self, connection.client_address)))
+                streams = []
+                if OPEN_CONNECTIONS.draining:
+                    session.go_away()
+                parts = session.output()
+                if parts:
+                    connection.send_parts(parts)
+                if session.finished() and not session.wants_output():
+                    break
+                if session.wants_output():
+                    # More to send, but take in what the client has sent meanwhile first
+                    if not select.select([connection.socket], [], [], 0)[0]:
+                        continue
+                    timeout = connection.write_timeout
+                elif session.idle():
+                    timeout = connection.idle_timeout
+                else:
+                    # Waiting for the rest of a request body or for the client to open its window
+                    timeout = max(connection.body_timeout, connection.write_timeout)
+                try:
+                    received = connection.receive(timeout, idle=session.idle())
+                except socket.timeout:
+                    if session.idle():
+                        CONNECTION_STATS.increment('idle_timeouts')
+                        session.go_away()
+                        connection.send_parts(session.output())
+                    break
+                if not received:
+                    if OPEN_CONNECTIONS.draining:
+                        session.go_away()
+                        connection.send_parts(session.output())
+                    break
+                streams = session.receive(received)
+        finally:
+            session.close()
+
+    def call(self, function, *args):
+        function(*args)
+
+    def run_blocking(self, function, stream: Http2Stream) -> bool:
+        function()
+        return False
+
+    def in_worker_thread(self) -> bool:
+        return False
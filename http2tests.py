@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# Tests of HTTP/2 over cleartext: starts the web server and talks to it with a small HTTP/2 client, by prior
+# knowledge and through `Upgrade: h2c`, checking multiplexing, flow control, HPACK, PING and stream resets.
+#
+# run: python http2tests.py
+# (SERVER_MODE=asyncio python http2tests.py to test another serving mode)
+
+import base64
+import os
+import shutil
+import socket
+import struct
+import unittest
+
+import hpack
+
+from protocoltests import ROOT, read_file, start_server, stop_server
+
+PORT = 8082
+PLAIN_PORT = 8083
+LARGE_PATH = '/h2test/large.bin'
+LARGE_BODY = bytes(range(256)) * 1024
+
+PREFACE = b'PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n'
+FRAME_HEADER = struct.Struct('>BHBBI')
+DATA, HEADERS, RST_STREAM, SETTINGS, PING, GOAWAY, WINDOW_UPDATE, CONTINUATION = 0, 1, 3, 4, 6, 7, 8, 9
+END_STREAM, ACK, END_HEADERS = 0x1, 0x1, 0x4
+SETTINGS_INITIAL_WINDOW_SIZE = 0x4
+PROTOCOL_ERROR, CANCEL = 0x1, 0x8
+
+
+class Response:
+    """What the client received on one stream"""
+
+    def __init__(self):
+        self.headers = None
+        self.body = bytearray()
+        self.header_block_sizes = []
+        self.ended = False
+        self.reset = None
+
+    @property
+    def status(self) -> int:
+        return int(self.headers[':status'])
+
+
+class Http2Client:
+    """
+    Minimal HTTP/2 client, just enough to drive the server: every frame received is recorded in `frames`
+    as `(type, flags, stream id)` and DATA is acknowledged with WINDOW_UPDATE frames unless `auto_window`
+    is False.
+    """
+
+    def __init__(self, port: int = PORT, settings: dict = None, upgrade_path: str = None, auto_window=True):
+        self.sock = socket.create_connection(('127.0.0.1', port), timeout=3)
+        self.buffer = b''
+        self.encoder = hpack.Encoder()
+        self.decoder = hpack.Decoder(4096)
+        self.responses = {}
+        self.frames = []
+        self.pings = []
+        self.goaway = None
+        self.auto_window = auto_window
+        self.next_stream = 1
+        payload = b''.join(struct.pack('>HI', setting, value) for setting, value in (settings or {}).items())
+        if upgrade_path is not None:
+            self.upgrade(upgrade_path, payload)
+        self.sock.sendall(PREFACE + self.frame(SETTINGS, 0, 0, payload))
+
+    def upgrade(self, path: str, settings: bytes):
+        """
+        Asks for `path` over HTTP/1.1 with `Upgrade: h2c`, its reply comes on stream 1
+        """
+        self.sock.sendall(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: Upgrade, HTTP2-Settings\r\n'
+                          f'Upgrade: h2c\r\nHTTP2-Settings: {base64.urlsafe_b64encode(settings).decode()}\r\n'
+                          '\r\n'.encode())
+        head = self.read_until(b'\r\n\r\n')
+        self.upgrade_status = int(head.split(b' ', 2)[1])
+        if self.upgrade_status == 101:
+            self.responses[1] = Response()
+            self.next_stream = 3
+
+    @staticmethod
+    def frame(frame_type: int, flags: int, stream_id: int, payload: bytes = b'') -> bytes:
+        return FRAME_HEADER.pack(len(payload) >> 8, len(payload) & 0xff, frame_type, flags, stream_id) + payload
+
+    def send(self, *frames: bytes):
+        self.sock.sendall(b''.join(frames))
+
+    def request_frames(self, method: str, path: str, body: bytes = None, headers: list = ()) -> tuple:
+        """
+        Returns:
+        The id of a new stream and the frames that send the request on it
+        """
+        stream_id = self.next_stream
+        self.next_stream += 2
+        self.responses[stream_id] = Response()
+        fields = [(':method', method), (':scheme', 'http'), (':authority', '127.0.0.1'), (':path', path)]
+        block = self.encoder.encode(fields + list(headers))
+        frames = [self.frame(HEADERS, END_HEADERS | (END_STREAM if body is None else 0), stream_id, block)]
+        if body is not None:
+            frames.append(self.frame(DATA, END_STREAM, stream_id, body))
+        return stream_id, frames
+
+    def request(self, method: str, path: str, body: bytes = None, headers: list = ()) -> int:
+        stream_id, frames = self.request_frames(method, path, body, headers)
+        self.send(*frames)
+        return stream_id
+
+    def get(self, path: str, headers: list = ()) -> Response:
+        stream_id = self.request('GET', path, headers=headers)
+        self.wait(stream_id)
+        return self.responses[stream_id]
+
+    def wait(self, *stream_ids: int):
+        """
+        Reads frames until every stream in `stream_ids` has ended or was reset
+        """
+        while not all(self.responses[stream_id].ended for stream_id in stream_ids):
+            self.read_frame()
+
+    def read_until(self, marker: bytes) -> bytes:
+        while marker not in self.buffer:
+            self.receive()
+        head, self.buffer = self.buffer.split(marker, 1)
+        return head
+
+    def read_exactly(self, count: int) -> bytes:
+        while len(self.buffer) < count:
+            self.receive()
+        data, self.buffer = self.buffer[:count], self.buffer[count:]
+        return data
+
+    def receive(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise ConnectionError('Connection closed by the server')
+        self.buffer += data
+
+    def read_frame(self) -> tuple:
+        length_high, length_low, frame_type, flags, stream_id = FRAME_HEADER.unpack(self.read_exactly(9))
+        payload = self.read_exactly((length_high << 8) | length_low)
+        stream_id &= 0x7fffffff
+        self.frames.append((frame_type, flags, stream_id))
+        if frame_type == SETTINGS and not flags & ACK:
+            self.send(self.frame(SETTINGS, ACK, 0))
+        elif frame_type == PING and flags & ACK:
+            self.pings.append(payload)
+        elif frame_type == GOAWAY:
+            self.goaway = struct.unpack('>II', payload[:8])
+        elif frame_type == HEADERS:
+            block = payload
+            while not flags & END_HEADERS:
+                frame_type, flags, _, continuation = self.read_frame_raw()
+                assert frame_type == CONTINUATION
+                block += continuation
+            response = self.responses[stream_id]
+            response.header_block_sizes.append(len(block))
+            if response.headers is None:
+                response.headers = dict(self.decoder.decode(block))
+            response.ended = bool(flags & END_STREAM)
+        elif frame_type == DATA:
+            response = self.responses[stream_id]
+            response.body += payload
+            response.ended = bool(flags & END_STREAM)
+            if self.auto_window and payload:
+                increment = struct.pack('>I', len(payload))
+                frames = [self.frame(WINDOW_UPDATE, 0, 0, increment)]
+                if not response.ended:
+                    frames.append(self.frame(WINDOW_UPDATE, 0, stream_id, increment))
+                self.send(*frames)
+        elif frame_type == RST_STREAM:
+            response = self.responses[stream_id]
+            response.reset = struct.unpack('>I', payload)[0]
+            response.ended = True
+        return frame_type, flags, stream_id, payload
+
+    def read_frame_raw(self) -> tuple:
+        length_high, length_low, frame_type, flags, stream_id = FRAME_HEADER.unpack(self.read_exactly(9))
+        return frame_type, flags, stream_id, self.read_exactly((length_high << 8) | length_low)
+
+    def close(self):
+        self.sock.close()
+
+
+class TestHttp2(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        os.makedirs(os.path.join(ROOT, 'h2test'), exist_ok=True)
+        with open(os.path.join(ROOT, LARGE_PATH.lstrip('/')), 'wb') as file:
+            file.write(LARGE_BODY)
+        cls.server = start_server(PORT, '--http2')
+        cls.plain_server = start_server(PLAIN_PORT)
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in (cls.server, cls.plain_server):
+            stop_server(server)
+        shutil.rmtree(os.path.join(ROOT, 'h2test'))
+
+    def setUp(self):
+        self.client = Http2Client()
+
+    def own_client(self, **kwargs) -> Http2Client:
+        """
+        Replaces the client of the test, as the `single` mode serves one connection at a time
+        """
+        self.client.close()
+        self.client = Http2Client(**kwargs)
+        return self.client
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_prior_knowledge(self):
+        response = self.client.get('/index.html')
+        self.assertEqual(response.status, 200)
+        self.assertTrue(response.headers['content-type'].startswith('text/html'))
+        self.assertEqual(bytes(response.body), read_file('/index.html'))
+        self.assertNotIn('connection', response.headers)
+
+    def test_upgrade(self):
+        client = self.own_client(upgrade_path='/base.css')
+        self.assertEqual(client.upgrade_status, 101)
+        client.wait(1)
+        self.assertEqual(client.responses[1].status, 200)
+        self.assertEqual(bytes(client.responses[1].body), read_file('/base.css'))
+        self.assertEqual(client.get('/deep/deep.css').status, 200)
+
+    def test_multiplexed_streams(self):
+        paths = ['/', '/base.css', '/deep/', '/deep/deep.css', LARGE_PATH, LARGE_PATH]
+        frames = []
+        for path in paths:
+            frames += self.client.request_frames('GET', path)[1]
+        self.client.send(*frames)
+        stream_ids = list(self.client.responses)
+        self.client.wait(*stream_ids)
+        for stream_id, path in zip(stream_ids, paths):
+            response = self.client.responses[stream_id]
+            self.assertEqual(response.status, 200)
+            self.assertEqual(bytes(response.body), read_file(path + ('index.html' if path.endswith('/') else '')))
+        # The two large bodies are sent side by side, not one after the other
+        large = stream_ids[-2:]
+        order = [stream_id for frame_type, _, stream_id in self.client.frames
+                 if frame_type == DATA and stream_id in large]
+        self.assertLess(order.index(large[1]), len(order) - order[::-1].index(large[0]) - 1)
+
+    def test_flow_control(self):
+        client = self.own_client(settings={SETTINGS_INITIAL_WINDOW_SIZE: 1000}, auto_window=False)
+        stream_id = client.request('GET', LARGE_PATH)
+        client.sock.settimeout(0.5)
+        with self.assertRaises(socket.timeout):
+            while True:
+                client.read_frame()
+        response = client.responses[stream_id]
+        self.assertEqual(len(response.body), 1000)
+        client.sock.settimeout(3)
+        client.auto_window = True
+        remaining = struct.pack('>I', len(LARGE_BODY))
+        client.send(client.frame(WINDOW_UPDATE, 0, stream_id, remaining),
+                    client.frame(WINDOW_UPDATE, 0, 0, remaining))
+        client.wait(stream_id)
+        self.assertEqual(bytes(response.body), LARGE_BODY)
+
+    def test_hpack_dynamic_table(self):
+        first = self.client.get('/base.css')
+        second = self.client.get('/base.css')
+        self.assertEqual(first.headers, second.headers)
+        # Repeated headers are sent as indexes into the dynamic table, dates and validators stay literal
+        self.assertLess(second.header_block_sizes[0], first.header_block_sizes[0] * 2 / 3)
+
+    def test_ping(self):
+        self.client.send(self.client.frame(PING, 0, 0, b'12345678'))
+        while not self.client.pings:
+            self.client.read_frame()
+        self.assertEqual(self.client.pings, [b'12345678'])
+
+    def test_not_found(self):
+        response = self.client.get('/do-not-implement-this-page-it-is-not-found')
+        self.assertEqual(response.status, 404)
+        self.assertEqual(response.headers['content-type'], 'application/json')
+
+    def test_head(self):
+        stream_id = self.client.request('HEAD', '/index.html')
+        self.client.wait(stream_id)
+        response = self.client.responses[stream_id]
+        self.assertEqual(response.status, 200)
+        self.assertEqual(int(response.headers['content-length']), len(read_file('/index.html')))
+        self.assertEqual(response.body, b'')
+
+    def test_post_body(self):
+        stream_id = self.client.request('POST', '/index.html', b'a=1&b=2', [('content-length', '7')])
+        self.client.wait(stream_id)
+        response = self.client.responses[stream_id]
+        self.assertEqual(response.status, 405)
+        self.assertIn('GET', response.headers['allow'])
+
+    def test_invalid_content_length(self):
+        # `²` is a digit to `str.isdigit` but not to `int`
+        stream_id = self.client.request('POST', '/index.html', b'ab', [('content-length', '\u00b2')])
+        self.client.wait(stream_id)
+        self.assertEqual(self.client.responses[stream_id].reset, PROTOCOL_ERROR)
+        # Only the stream is reset, the connection serves the next request
+        self.assertEqual(self.client.get('/base.css').status, 200)
+
+    def test_reset_stream(self):
+        client = self.own_client(settings={SETTINGS_INITIAL_WINDOW_SIZE: 1000}, auto_window=False)
+        stream_id = client.request('GET', LARGE_PATH)
+        while stream_id not in [frame_stream for frame_type, _, frame_stream in client.frames
+                                if frame_type == DATA]:
+            client.read_frame()
+        client.send(client.frame(RST_STREAM, 0, stream_id, struct.pack('>I', CANCEL)))
+        client.auto_window = True
+        self.assertEqual(client.get('/base.css').status, 200)
+        self.assertFalse(client.responses[stream_id].ended)
+
+    def test_http2_off_by_default(self):
+        client = self.own_client(port=PLAIN_PORT, upgrade_path='/base.css')
+        self.assertEqual(client.upgrade_status, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
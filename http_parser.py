@@ -0,0 +1,312 @@
+from constants import DEFAULT_ENCODING
+
+# Largest request line plus headers accepted, larger heads get 431
+DEFAULT_MAX_HEADER_BYTES = 8 * 1024
+
+# Most header fields accepted in one request, more get 431
+DEFAULT_MAX_HEADER_COUNT = 100
+
+# Largest request body accepted, larger bodies get 413
+DEFAULT_MAX_BODY_BYTES = 1024 * 1024
+
+# HTTP header fields are ISO-8859-1, https://datatracker.ietf.org/doc/html/rfc7230#section-3.2.4
+HEADER_ENCODING = 'latin-1'
+
+# Longest chunk size line (size plus chunk extensions) accepted in a chunked body
+MAX_CHUNK_LINE_BYTES = 1024
+
+HEX_DIGITS = frozenset(b'0123456789abcdefABCDEF')
+
+# Parser states
+STATE_HEAD = 0
+STATE_BODY = 1
+STATE_CHUNK_SIZE = 2
+STATE_CHUNK_DATA = 3
+STATE_TRAILERS = 4
+
+
+class ParseError(Exception):
+    """Raised when a request is malformed or exceeds a limit, carrying the status code to reply with"""
+
+    def __init__(self, status_code: int, message: str):
+        """
+        Params:
+        - `status_code` - the HTTP error status to send back (e.g. 400, 413 or 431)
+        - `message` - description of what was wrong with the request
+        """
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+class ParsedRequest:
+    """The request line, headers and body of one request, as produced by `RequestParser`"""
+
+    __slots__ = ['method', 'path', 'http_version', 'headers', 'header_index', 'body']
+
+    def __init__(self, method: str, path: str, http_version: str, headers: dict, header_index: dict):
+        """
+        Params:
+        - `method` - the request method (e.g. `GET`)
+        - `path` - the request target (e.g. `/index.html`)
+        - `http_version` - the protocol version (e.g. `HTTP/1.1`)
+        - `headers` - header values keyed by field name as sent by the client
+        - `header_index` - header values keyed by lower-cased field name
+        """
+        self.method = method
+        self.path = path
+        self.http_version = http_version
+        self.headers = headers
+        self.header_index = header_index
+        self.body = b''
+
+
+class RequestParser:
+    """
+    Incremental HTTP/1.1 request parser.
+
+    Bytes are `feed`-ed in as they arrive and `parse` returns each request once it is complete.
+    The parser remembers how far it has scanned for the end of the head, so every received byte is
+    looked at once, headers are split as bytes, and the body is read by byte count, or chunk by chunk
+    for `Transfer-Encoding: chunked` bodies. Bytes following a complete request are kept for the next one,
+    which is how pipelined requests are handled.
+    """
+
+    def __init__(self, max_header_bytes: int = DEFAULT_MAX_HEADER_BYTES,
+                 max_header_count: int = DEFAULT_MAX_HEADER_COUNT,
+                 max_body_bytes: int = DEFAULT_MAX_BODY_BYTES):
+        """
+        Params:
+        - `max_header_bytes` - largest request line plus headers accepted
+        - `max_header_count` - most header fields accepted
+        - `max_body_bytes` - largest body accepted
+        """
+        self.max_header_bytes = max_header_bytes
+        self.max_header_count = max_header_count
+        self.max_body_bytes = max_body_bytes
+
+        self.__buffer = bytearray()
+        self.__state = STATE_HEAD
+        self.__scan_offset = 0
+        self.__request = None
+        self.__body_length = 0
+        self.__chunked_body = None
+        self.__chunk_remaining = 0
+        self.__trailer_bytes = 0
+
+    def feed(self, data):
+        """
+        Appends received bytes to the parse buffer
+
+        Params:
+        - `data` - a bytes-like object
+        """
+        self.__buffer += data
+
+    def buffered_size(self) -> int:
+        """
+        Returns:
+        The number of received bytes not yet returned as part of a request
+        """
+        return len(self.__buffer)
+
+    def in_progress(self) -> bool:
+        """
+        Returns:
+        True if part of a request has been received
+        """
+        return len(self.__buffer) > 0 or self.__state != STATE_HEAD
+
+    def reading_body(self) -> bool:
+        """
+        Returns:
+        True if the head of a request has been parsed and its body is still being received
+        """
+        return self.__state != STATE_HEAD
+
+    def take_buffered(self) -> bytes:
+        """
+        Takes the received bytes that follow the last request returned, for a protocol taking over the connection
+
+        Returns:
+        The bytes, which the parser then forgets
+        """
+        data = bytes(self.__buffer)
+        self.__buffer.clear()
+        self.__scan_offset = 0
+        return data
+
+    def parse(self) -> ParsedRequest:
+        """
+        Advances the parser over the buffered bytes
+
+        Returns:
+        The next complete request, or None if more bytes are needed
+
+        Raises:
+        ParseError if the request is malformed or exceeds a limit, the connection should be closed
+        after replying as the parser can't find where the next request starts
+        """
+        if self.__state == STATE_HEAD:
+            end = self.__buffer.find(b'\r\n\r\n', self.__scan_offset)
+            if end == -1:
+                if len(self.__buffer) > self.max_header_bytes:
+                    raise ParseError(431, 'Request header fields too large')
+                # The terminator could start in the last three bytes received
+                self.__scan_offset = max(0, len(self.__buffer) - 3)
+                return None
+            if end + 4 > self.max_header_bytes:
+                raise ParseError(431, 'Request header fields too large')
+
+            self.__request = self.__parse_head(bytes(self.__buffer[:end]))
+            del self.__buffer[:end + 4]
+            self.__scan_offset = 0
+            if self.__is_chunked(self.__request):
+                self.__chunked_body = bytearray()
+                self.__trailer_bytes = 0
+                self.__state = STATE_CHUNK_SIZE
+            else:
+                self.__body_length = self.__content_length(self.__request)
+                self.__state = STATE_BODY
+
+        request = self.__request
+        if self.__state == STATE_BODY:
+            if len(self.__buffer) < self.__body_length:
+                return None
+            if self.__body_length > 0:
+                request.body = bytes(self.__buffer[:self.__body_length])
+                del self.__buffer[:self.__body_length]
+        else:
+            if not self.__parse_chunks():
+                return None
+            request.body = bytes(self.__chunked_body)
+            self.__chunked_body = None
+
+        self.__request = None
+        self.__body_length = 0
+        self.__state = STATE_HEAD
+        return request
+
+    def __parse_chunks(self) -> bool:
+        """
+        Advances over the buffered part of a chunked body, appending chunk data to the body read so far
+
+        Returns:
+        True once the last chunk and the trailer section have been read
+        """
+        buffer = self.__buffer
+        while True:
+            if self.__state == STATE_CHUNK_DATA:
+                remaining = self.__chunk_remaining
+                if len(buffer) < remaining + 2:
+                    return False
+                if buffer[remaining:remaining + 2] != b'\r\n':
+                    raise ParseError(400, 'Malformed chunked body')
+                self.__chunked_body += buffer[:remaining]
+                del buffer[:remaining + 2]
+                self.__state = STATE_CHUNK_SIZE
+                continue
+
+            end = buffer.find(b'\r\n')
+            if end == -1:
+                limit = MAX_CHUNK_LINE_BYTES if self.__state == STATE_CHUNK_SIZE else self.max_header_bytes
+                if len(buffer) > limit:
+                    raise ParseError(400 if self.__state == STATE_CHUNK_SIZE else 431, 'Chunk line too long')
+                return False
+
+            if self.__state == STATE_TRAILERS:
+                # Trailer fields are read and discarded, they count against the header size limit
+                del buffer[:end + 2]
+                if end == 0:
+                    return True
+                self.__trailer_bytes += end + 2
+                if self.__trailer_bytes > self.max_header_bytes:
+                    raise ParseError(431, 'Request trailer fields too large')
+                continue
+
+            # chunk-size [ ; chunk-ext ], https://datatracker.ietf.org/doc/html/rfc9112#section-7.1
+            size = bytes(buffer[:end]).partition(b';')[0].rstrip(b' \t')
+            if not size or not HEX_DIGITS.issuperset(size):
+                raise ParseError(400, 'Malformed chunk size')
+            size = int(size, 16)
+            del buffer[:end + 2]
+            if size == 0:
+                self.__state = STATE_TRAILERS
+                continue
+            if len(self.__chunked_body) + size > self.max_body_bytes:
+                raise ParseError(413, 'Request body too large')
+            self.__chunk_remaining = size
+            self.__state = STATE_CHUNK_DATA
+
+    def __parse_head(self, head: bytes) -> ParsedRequest:
+        """
+        Splits the request line and header fields of a request head (without the final blank line)
+        """
+        # One decode of the whole head, latin-1 maps every byte so it can't fail
+        lines = head.decode(HEADER_ENCODING).split('\r\n')
+        if len(lines) - 1 > self.max_header_count:
+            raise ParseError(431, 'Too many request header fields')
+
+        request_line = lines[0].split(' ')
+        if len(request_line) != 3 or not all(request_line):
+            raise ParseError(400, 'Malformed request line')
+        method, path, http_version = request_line
+        if not path.isascii():
+            try:
+                path = path.encode(HEADER_ENCODING).decode(DEFAULT_ENCODING)
+            except UnicodeDecodeError:
+                raise ParseError(400, 'Malformed request line')
+
+        headers = {}
+        header_index = {}
+        for line in lines[1:]:
+            name, separator, value = line.partition(':')
+            # Whitespace before the colon and obsolete line folding are both rejected by RFC 7230
+            if not separator or not name or name[-1] in ' \t' or name[0] in ' \t':
+                raise ParseError(400, 'Malformed request header field')
+            value = value.strip()
+
+            lowered = name.lower()
+            if lowered in header_index:
+                # Repeated fields are equivalent to one comma separated field
+                value = f'{header_index[lowered]}, {value}'
+            headers[name] = value
+            header_index[lowered] = value
+
+        return ParsedRequest(method, path, http_version, headers, header_index)
+
+    def __is_chunked(self, request: ParsedRequest) -> bool:
+        """
+        Validates the `Transfer-Encoding` header of a request
+
+        Returns:
+        True if the body is sent with the chunked transfer coding
+        """
+        transfer_encoding = request.header_index.get('transfer-encoding')
+        if transfer_encoding is None:
+            return False
+        if 'content-length' in request.header_index:
+            # Framing a body both ways is how requests get smuggled past proxies
+            # https://datatracker.ietf.org/doc/html/rfc9112#section-6.1
+            raise ParseError(400, 'Both Transfer-Encoding and Content-Length sent')
+        if [coding.strip().lower() for coding in transfer_encoding.split(',')] != ['chunked']:
+            raise ParseError(501, 'Only the chunked transfer coding is supported')
+        return True
+
+    def __content_length(self, request: ParsedRequest) -> int:
+        """
+        Validates the `Content-Length` header of a request
+
+        Returns:
+        The number of body bytes that follow the head
+        """
+        content_length = request.header_index.get('content-length')
+        if content_length is None:
+            return 0
+        # `isdigit` alone accepts digits such as `²` that `int` rejects
+        if not (content_length.isascii() and content_length.isdigit()):
+            raise ParseError(400, 'Invalid Content-Length')
+        length = int(content_length)
+        if length > self.max_body_bytes:
+            raise ParseError(413, 'Request body too large')
+        return length
@@ -0,0 +1,133 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from connection import CONNECTION_STATS, OPEN_CONNECTIONS
+
+# Environment variables telling a server process started by `hand_off` which inherited file descriptors are
+# its listening socket and the pipe to report it is serving on
+LISTEN_FD_ENV = 'SUMITRO_LISTEN_FD'
+READY_FD_ENV = 'SUMITRO_READY_FD'
+
+# Held while a new server process is starting, so repeated restart signals don't start several
+handoff_lock = threading.Lock()
+
+
+def log(message: str):
+    """
+    Writes a lifecycle event (reload, handoff, drain) to stderr, prefixed with the process id
+    """
+    print(f'[{os.getpid()}] {message}', file=sys.stderr, flush=True)
+
+
+def inherited_socket() -> socket.socket:
+    """
+    Returns:
+    The listening socket handed over by the server process this one replaces, None if this process
+    wasn't started by `hand_off` (or the old process listened with `SO_REUSEPORT` sockets of its own)
+    """
+    fd = os.environ.pop(LISTEN_FD_ENV, None)
+    if fd is None:
+        return None
+    listening_socket = socket.socket(fileno=int(fd))
+    log(f'Took over the listening socket on {listening_socket.getsockname()}')
+    return listening_socket
+
+
+def notify_ready():
+    """
+    Tells the server process this one replaces that it is serving, so the old process stops accepting
+    connections and drains. Does nothing if this process wasn't started by `hand_off`. Safe to call from
+    several forked worker processes, only the first one is heard.
+    """
+    fd = os.environ.get(READY_FD_ENV)
+    if fd is None:
+        return
+    try:
+        os.write(int(fd), b'1')
+    except OSError:
+        # Another worker already reported, and the old process stopped listening
+        pass
+
+
+def hand_off(listening_fd: int, on_ready):
+    """
+    Starts a new server process with the same command line, which inherits the listening socket, and
+    waits for it to serve. Blocks until then, so it should run on a thread of its own.
+
+    If the new process exits before it is ready (e.g. its configuration is invalid), the old process
+    simply carries on serving.
+
+    Params:
+    - `listening_fd` - file descriptor of the listening socket, None if the new process binds its own
+      (`SO_REUSEPORT`)
+    - `on_ready` - called once the new process is serving, should make this process stop accepting and drain
+    """
+    if not handoff_lock.acquire(blocking=False):
+        log('A new server process is already starting')
+        return
+    try:
+        ready_read, ready_write = os.pipe()
+        env = {name: value for name, value in os.environ.items() if name not in (LISTEN_FD_ENV, READY_FD_ENV)}
+        env[READY_FD_ENV] = str(ready_write)
+        inherited = [ready_write]
+        if listening_fd is not None:
+            env[LISTEN_FD_ENV] = str(listening_fd)
+            inherited.append(listening_fd)
+        try:
+            successor = subprocess.Popen([sys.executable, *sys.argv], env=env, pass_fds=inherited)
+        finally:
+            os.close(ready_write)
+        with open(ready_read, 'rb') as ready:
+            started = ready.read(1)
+        if not started:
+            log(f'New server process {successor.pid} exited before serving, carrying on')
+            successor.wait()
+            return
+        log(f'New server process {successor.pid} is serving, handing over')
+        on_ready()
+    finally:
+        handoff_lock.release()
+
+
+class Drain:
+    """
+    Winds down the connections of a server that has stopped accepting, and reports how long they took to
+    finish and how many requests they were served meanwhile
+    """
+
+    def __init__(self):
+        self.started = None
+        self.connections = 0
+        self.requests = 0
+
+    def start(self):
+        """
+        Stops keeping connections alive and closes the idle ones, see `OpenConnections.drain`
+        """
+        if self.started is not None:
+            return
+        self.started = time.monotonic()
+        self.requests = CONNECTION_STATS.snapshot()['requests_served']
+        self.connections = OPEN_CONNECTIONS.drain()
+
+    def finish(self, timeout: float):
+        """
+        Waits for the open connections to close, then logs the drain time and request count.
+        Does nothing if the drain wasn't started.
+
+        Params:
+        - `timeout` - most seconds to wait, counted from `start`
+        """
+        if self.started is None:
+            return
+        drained = OPEN_CONNECTIONS.wait_closed(max(0.0, self.started + timeout - time.monotonic()))
+        elapsed = time.monotonic() - self.started
+        served = CONNECTION_STATS.snapshot()['requests_served'] - self.requests
+        if drained:
+            outcome = f'drained {self.connections} connections in {elapsed:.3f}s'
+        else:
+            outcome = f'{len(OPEN_CONNECTIONS)} of {self.connections} connections still open after {elapsed:.3f}s'
+        log(f'Stopped accepting: {outcome}, serving {served} requests meanwhile')
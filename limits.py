@@ -0,0 +1,165 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from response import CLOSE_HEADERS, prebuilt_json
+
+# Most clients whose request rate is tracked at once, the least recently seen ones are forgotten first
+DEFAULT_MAX_TRACKED_CLIENTS = 65536
+
+# Requests a client may send back to back before its request rate is limited
+DEFAULT_REQUEST_BURST = 20
+
+# Complete replies, connection headers included, sent to connections turned away by `ConnectionLimiter`
+REJECTED_CONNECTION_REPLIES = {
+    status_code: response.head + CLOSE_HEADERS + response.body
+    for status_code, response in [
+        (503, prebuilt_json({'err': 'Too many connections'}, 503, 'Retry-After: 1')),
+        (429, prebuilt_json({'err': 'Too many connections from your address'}, 429, 'Retry-After: 1')),
+    ]
+}
+
+
+class TokenBucket:
+    """The request allowance of one client"""
+
+    __slots__ = ['tokens', 'updated']
+
+    def __init__(self, tokens: float, updated: float):
+        """
+        Params:
+        - `tokens` - requests the client may send right away
+        - `updated` - `time.monotonic` timestamp `tokens` was last brought up to date at
+        """
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    """
+    Thread-safe per-client request rate limit, using a token bucket per client IP address.
+
+    Every client starts with `burst` tokens and gains `rate` tokens per second, up to `burst`. Each request
+    takes a token and requests arriving with no token left are rejected. Buckets are refilled lazily when
+    the client is next seen, so idle clients cost nothing but the memory of their bucket, which is bounded
+    by `max_clients`.
+    """
+
+    def __init__(self, rate: float, burst: int = DEFAULT_REQUEST_BURST,
+                 max_clients: int = DEFAULT_MAX_TRACKED_CLIENTS):
+        """
+        Params:
+        - `rate` - requests per second each client may sustain
+        - `burst` - requests a client may send back to back
+        - `max_clients` - most clients tracked, a forgotten client starts over with a full bucket
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.__buckets = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__rejected = 0
+
+    def take(self, client: str) -> int:
+        """
+        Takes a token from the bucket of a client
+
+        Params:
+        - `client` - IP address of the client
+
+        Returns:
+        0 if the request may proceed, otherwise the whole seconds until the client has a token again
+        """
+        now = time.monotonic()
+        with self.__lock:
+            bucket = self.__buckets.get(client)
+            if bucket is None:
+                bucket = self.__buckets[client] = TokenBucket(self.burst, now)
+                if len(self.__buckets) > self.max_clients:
+                    self.__buckets.popitem(last=False)
+            else:
+                self.__buckets.move_to_end(client)
+                bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+                bucket.updated = now
+
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                return 0
+            self.__rejected += 1
+            return max(1, math.ceil((1 - bucket.tokens) / self.rate))
+
+    def stats(self) -> dict:
+        """
+        Returns:
+        The number of requests rejected and of clients tracked
+        """
+        with self.__lock:
+            return {'requests_rate_limited': self.__rejected, 'clients': len(self.__buckets)}
+
+
+class ConnectionLimiter:
+    """
+    Thread-safe cap on the connections open at once, in total and per client IP address.
+
+    Connections are admitted with `acquire` when they are accepted and must be `release`d once closed.
+    With `prefork`/`reuseport` every worker process enforces the caps on its own connections.
+    """
+
+    def __init__(self, max_connections: int = 0, max_per_client: int = 0):
+        """
+        Params:
+        - `max_connections` - most connections open at once, 0 for no limit
+        - `max_per_client` - most connections open at once from one IP address, 0 for no limit
+        """
+        self.max_connections = max_connections
+        self.max_per_client = max_per_client
+        self.__open = 0
+        self.__open_per_client = {}
+        self.__lock = threading.Lock()
+        self.__stats = {'connections_rejected': 0, 'client_connections_rejected': 0}
+
+    def acquire(self, client: str) -> int:
+        """
+        Admits a new connection if it is within the limits
+
+        Params:
+        - `client` - IP address of the client
+
+        Returns:
+        None if the connection is admitted, otherwise the status to reject it with: 503 if the server is at
+        `max_connections`, 429 if the client is at `max_per_client`
+        """
+        with self.__lock:
+            if 0 < self.max_connections <= self.__open:
+                self.__stats['connections_rejected'] += 1
+                return 503
+            client_open = self.__open_per_client.get(client, 0)
+            if 0 < self.max_per_client <= client_open:
+                self.__stats['client_connections_rejected'] += 1
+                return 429
+            self.__open += 1
+            self.__open_per_client[client] = client_open + 1
+            return None
+
+    def release(self, client: str):
+        """
+        Records that an admitted connection has been closed
+
+        Params:
+        - `client` - IP address the connection was admitted for
+        """
+        with self.__lock:
+            self.__open -= 1
+            client_open = self.__open_per_client[client] - 1
+            if client_open == 0:
+                del self.__open_per_client[client]
+            else:
+                self.__open_per_client[client] = client_open
+
+    def stats(self) -> dict:
+        """
+        Returns:
+        The number of connections rejected by each limit along with the number open
+        """
+        with self.__lock:
+            return {**self.__stats, 'open': self.__open}
@@ -0,0 +1,171 @@
+import threading
+from bisect import bisect_left
+
+# Content type of the Prometheus text exposition format
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Prefix of every metric name
+NAMESPACE = 'sumitro'
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                           1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Cumulative-on-render latency histogram, only the matching bucket is touched per observation"""
+
+    __slots__ = ['counts', 'sum', 'count']
+
+    def __init__(self, bucket_count: int):
+        """
+        Params:
+        - `bucket_count` - number of finite buckets, one more is kept for `+Inf`
+        """
+        self.counts = [0] * (bucket_count + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class Metrics:
+    """
+    Thread-safe request metrics: per-handler latency histograms, per-phase timings, response counters by
+    status code, bytes sent and active connections, rendered in the Prometheus text format.
+
+    Recording a request costs one lock acquisition and a bisect per histogram, so it is left on under load.
+    Each process keeps its own metrics, with `prefork`/`reuseport` a scrape sees the worker that accepted it.
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_LATENCY_BUCKETS):
+        """
+        Params:
+        - `buckets` - ascending upper bounds in seconds of the latency histogram buckets
+        """
+        self.buckets = tuple(buckets)
+        self.__lock = threading.Lock()
+        self.__latency = {}
+        self.__phases = {}
+        self.__responses = {}
+        self.__bytes_sent = {}
+        self.__active_connections = 0
+
+    def connection_opened(self):
+        with self.__lock:
+            self.__active_connections += 1
+
+    def connection_closed(self):
+        with self.__lock:
+            self.__active_connections -= 1
+
+    def observe_phase(self, phase: str, seconds: float):
+        """
+        Records how long one phase of handling a request took
+
+        Params:
+        - `phase` - `accept`, `parse`, `route` or `send`
+        - `seconds` - duration of the phase
+        """
+        with self.__lock:
+            self.__observe(self.__phases, phase, seconds)
+
+    def observe_request(self, handler: str, status_code: int, bytes_sent: int, seconds: float, phases: dict):
+        """
+        Records a request once its response has been sent
+
+        Params:
+        - `handler` - what replied to the request (e.g. `static`), a small fixed set so label cardinality stays low
+        - `status_code` - the response status, None if no HTTP response was sent
+        - `bytes_sent` - size of the response, head included
+        - `seconds` - time from routing the request to finishing the response
+        - `phases` - mapping of phase name to duration in seconds
+        """
+        status = 'none' if status_code is None else str(status_code)
+        with self.__lock:
+            self.__observe(self.__latency, handler, seconds)
+            for phase, duration in phases.items():
+                self.__observe(self.__phases, phase, duration)
+            key = (handler, status)
+            self.__responses[key] = self.__responses.get(key, 0) + 1
+            self.__bytes_sent[handler] = self.__bytes_sent.get(handler, 0) + bytes_sent
+
+    def __observe(self, histograms: dict, label: str, seconds: float):
+        """
+        Adds a sample to the histogram for `label`, the lock must be held
+        """
+        histogram = histograms.get(label)
+        if histogram is None:
+            histogram = histograms[label] = Histogram(len(self.buckets))
+        histogram.counts[bisect_left(self.buckets, seconds)] += 1
+        histogram.sum += seconds
+        histogram.count += 1
+
+    def render(self, counters: dict = None, gauges: dict = None) -> str:
+        """
+        Renders every metric in the
+        [Prometheus text format](https://prometheus.io/docs/instrumenting/exposition_formats/)
+
+        Params:
+        - `counters` - extra monotonic values collected elsewhere (e.g. cache hits), keyed by metric name
+        - `gauges` - extra point-in-time values collected elsewhere (e.g. cache size), keyed by metric name
+
+        Returns:
+        The text of the metrics page
+        """
+        with self.__lock:
+            latency = {label: self.__copy(histogram) for label, histogram in self.__latency.items()}
+            phases = {label: self.__copy(histogram) for label, histogram in self.__phases.items()}
+            responses = dict(self.__responses)
+            bytes_sent = dict(self.__bytes_sent)
+            active_connections = self.__active_connections
+
+        lines = []
+        self.__render_histograms(lines, 'request_duration_seconds', 'handler', latency,
+                                 'Time from routing a request to finishing its response')
+        self.__render_histograms(lines, 'request_phase_seconds', 'phase', phases,
+                                 'Time spent in each phase of handling a request')
+
+        lines.append(f'# HELP {NAMESPACE}_responses_total Responses sent by handler and status code')
+        lines.append(f'# TYPE {NAMESPACE}_responses_total counter')
+        for (handler, status), count in sorted(responses.items()):
+            lines.append(f'{NAMESPACE}_responses_total{{handler="{handler}",code="{status}"}} {count}')
+
+        lines.append(f'# HELP {NAMESPACE}_response_bytes_total Response bytes sent by handler, heads included')
+        lines.append(f'# TYPE {NAMESPACE}_response_bytes_total counter')
+        for handler, count in sorted(bytes_sent.items()):
+            lines.append(f'{NAMESPACE}_response_bytes_total{{handler="{handler}"}} {count}')
+
+        lines.append(f'# HELP {NAMESPACE}_active_connections Client connections currently open')
+        lines.append(f'# TYPE {NAMESPACE}_active_connections gauge')
+        lines.append(f'{NAMESPACE}_active_connections {active_connections}')
+
+        for metric_type, values in [('counter', counters or {}), ('gauge', gauges or {})]:
+            for name, value in values.items():
+                lines.append(f'# TYPE {NAMESPACE}_{name} {metric_type}')
+                lines.append(f'{NAMESPACE}_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def __copy(self, histogram: Histogram) -> Histogram:
+        copy = Histogram(len(self.buckets))
+        copy.counts = list(histogram.counts)
+        copy.sum = histogram.sum
+        copy.count = histogram.count
+        return copy
+
+    def __render_histograms(self, lines: list, name: str, label_name: str, histograms: dict, description: str):
+        """
+        Appends the cumulative `_bucket`, `_sum` and `_count` series of a labelled histogram
+        """
+        metric = f'{NAMESPACE}_{name}'
+        lines.append(f'# HELP {metric} {description}')
+        lines.append(f'# TYPE {metric} histogram')
+        bounds = [repr(bound) for bound in self.buckets] + ['+Inf']
+        for label, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, histogram.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{label_name}="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{{label_name}="{label}"}} {histogram.sum}')
+            lines.append(f'{metric}_count{{{label_name}="{label}"}} {histogram.count}')
+
+
+METRICS = Metrics()
@@ -0,0 +1,192 @@
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from cache_control import make_etag
+
+# Default total size of the files kept mapped, 0 disables the pool
+DEFAULT_MMAP_BYTES = 0
+
+# Files larger than this are streamed with sendfile instead of mapped
+DEFAULT_MAX_MAPPED_FILE_BYTES = 16 * 1024 * 1024
+
+# Most files kept mapped at once, each map holds a file descriptor
+DEFAULT_MAX_MAPPED_FILES = 128
+
+
+class MappedFile:
+    """A read-only memory map of one version of a file, shared by every request serving it"""
+
+    __slots__ = ['map', 'size', 'mtime', 'mtime_ns', 'inode', 'device', 'etag', 'references', 'stale']
+
+    def __init__(self, file_map: mmap.mmap, stat: os.stat_result):
+        """
+        Params:
+        - `file_map` - the read-only map of the whole file
+        - `stat` - result of `os.fstat` on the file when it was mapped
+        """
+        self.map = file_map
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.mtime_ns = stat.st_mtime_ns
+        self.inode = stat.st_ino
+        self.device = stat.st_dev
+        self.etag = make_etag(stat)
+        # Requests currently sending from the map, it is only unmapped once this drops to 0
+        self.references = 0
+        # The file changed or the entry was evicted, unmap once the last request releases it
+        self.stale = False
+
+    def matches(self, stat: os.stat_result) -> bool:
+        """
+        Returns:
+        True if the file described by `stat` is the same version that was mapped
+        """
+        return (self.mtime_ns == stat.st_mtime_ns and self.size == stat.st_size
+                and self.inode == stat.st_ino and self.device == stat.st_dev)
+
+    def view(self) -> memoryview:
+        """
+        Returns:
+        A zero-copy view of the whole file, slice it to send ranges
+        """
+        return memoryview(self.map)
+
+    def unmap(self):
+        """
+        Unmaps the file, if views handed to a connection are still alive the map is released
+        by the garbage collector once they are gone instead
+        """
+        try:
+            self.map.close()
+        except BufferError:
+            pass
+
+
+class MmapPool:
+    """
+    Bounded pool of read-only memory maps, keyed by file path and shared between requests.
+
+    Bodies are sent as `memoryview` slices of the map, so they are never copied into the Python heap, and
+    worker processes mapping the same file share its pages through the page cache. Maps are reference
+    counted while requests use them: when the file changes it is remapped, and the old map is unmapped
+    once its last request releases it. When the pool is over its limits, idle maps are evicted least
+    recently used first.
+    """
+
+    def __init__(self, max_bytes: int, max_file_bytes: int = DEFAULT_MAX_MAPPED_FILE_BYTES,
+                 max_files: int = DEFAULT_MAX_MAPPED_FILES):
+        """
+        Params:
+        - `max_bytes` - total size of the files kept mapped
+        - `max_file_bytes` - largest file that will be mapped
+        - `max_files` - most files kept mapped
+        """
+        self.max_bytes = max_bytes
+        self.max_file_bytes = min(max_file_bytes, max_bytes)
+        self.max_files = max_files
+        self.__entries = OrderedDict()
+        self.__size = 0
+        self.__lock = threading.Lock()
+        self.__stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'remaps': 0}
+
+    def acquire(self, file_path: str) -> MappedFile:
+        """
+        Looks up the map of a file, mapping it if needed. Every successful call must be paired with `release`.
+
+        Params:
+        - `file_path` - path to the file
+
+        Returns:
+        The mapped file, or None if the file is empty, too large, or the pool is full of maps in use
+
+        Raises:
+        OSError (e.g. FileNotFoundError) if the file can't be read
+        """
+        stat = os.stat(file_path)
+        key = os.path.normpath(file_path)
+
+        with self.__lock:
+            mapped = self.__entries.get(key)
+            if mapped is not None:
+                if mapped.matches(stat):
+                    self.__entries.move_to_end(key)
+                    mapped.references += 1
+                    self.__stats['hits'] += 1
+                    return mapped
+                self.__remove(key)
+                self.__stats['remaps'] += 1
+            self.__stats['misses'] += 1
+
+        if stat.st_size == 0 or stat.st_size > self.max_file_bytes:
+            return None
+
+        with open(file_path, 'br') as file:
+            stat = os.fstat(file.fileno())
+            if stat.st_size == 0 or stat.st_size > self.max_file_bytes:
+                return None
+            mapped = MappedFile(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ), stat)
+        mapped.references = 1
+
+        with self.__lock:
+            if key in self.__entries:
+                # Another request mapped it meanwhile, keep whichever is current
+                self.__remove(key)
+            if not self.__make_room(mapped.size):
+                # Every map is in use, serve from this one and unmap it when done
+                mapped.stale = True
+                return mapped
+            self.__entries[key] = mapped
+            self.__size += mapped.size
+        return mapped
+
+    def release(self, mapped: MappedFile):
+        """
+        Marks a request as done with a map returned by `acquire`
+        """
+        with self.__lock:
+            mapped.references -= 1
+            unmap = mapped.stale and mapped.references == 0
+        if unmap:
+            mapped.unmap()
+
+    def clear(self):
+        """
+        Drops every map, maps still in use are unmapped when released
+        """
+        with self.__lock:
+            for key in list(self.__entries):
+                self.__remove(key)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+        Hit, miss, eviction and remap counts along with the current number of maps and bytes mapped
+        """
+        with self.__lock:
+            return {**self.__stats, 'entries': len(self.__entries), 'bytes': self.__size}
+
+    def __make_room(self, size: int) -> bool:
+        """
+        Evicts idle maps, least recently used first, until a map of `size` bytes fits. The lock must be held.
+
+        Returns:
+        True if there is room
+        """
+        for key in list(self.__entries):
+            if self.__size + size <= self.max_bytes and len(self.__entries) < self.max_files:
+                return True
+            if self.__entries[key].references == 0:
+                self.__remove(key)
+                self.__stats['evictions'] += 1
+        return self.__size + size <= self.max_bytes and len(self.__entries) < self.max_files
+
+    def __remove(self, key: str):
+        """
+        Drops a map from the pool, unmapping it now if idle or once released otherwise. The lock must be held.
+        """
+        mapped = self.__entries.pop(key)
+        self.__size -= mapped.size
+        mapped.stale = True
+        if mapped.references == 0:
+            mapped.unmap()
@@ -63,6 +63,16 @@ class TestYourWebserver(unittest.TestCase):
         else:
             self.assertTrue( False, "Another Error was thrown!")
 
+    def test_null_byte(self):
+        """ paths the filesystem can't hold """
+        for path in ["/%00", "/index.html%00.css", "/deep/%ff"]:
+            url = self.baseurl + path
+            try:
+                req = request.urlopen(url, None, 3)
+                self.assertTrue( False, "Should have thrown an HTTP Error for %s!" % path)
+            except request.HTTPError as e:
+                self.assertTrue( e.getcode()  == 404 , ("404 Not FOUND! %d" % e.getcode()))
+
     def test_css(self):
         url = self.baseurl + "/base.css"
         req = request.urlopen(url, None, 3)
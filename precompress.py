@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# Precompresses the text files of a document root at deploy time so FileServer can serve the
+# `.gz`/`.br` siblings instead of compressing on the fly.
+#
+# run: python precompress.py ./www
+import argparse
+import os
+from compression import ENCODING_EXTENSIONS, available_encodings, compress
+from constants import TEXT_CONTENT_TYPES
+
+# Compression levels used offline, slower than the on-the-fly defaults but smaller
+OFFLINE_LEVELS = {
+    'gzip': 9,
+    'br': 11,
+}
+
+
+def precompress_file(file_path: str, encodings: list, force: bool = False) -> list:
+    """
+    Writes a compressed sibling of a file for each coding, skipping siblings that are already up to date.
+    Siblings that wouldn't be smaller than the file are removed instead, so the file is sent as-is.
+
+    Params:
+    - `file_path` - path to the file to compress
+    - `encodings` - content codings to produce
+    - `force` - rewrite siblings even if they are newer than the file
+
+    Returns:
+    The paths of the siblings that were written
+    """
+    written = []
+    source_stat = os.stat(file_path)
+    data = None
+    for encoding in encodings:
+        sibling_path = file_path + ENCODING_EXTENSIONS[encoding]
+        if not force and os.path.exists(sibling_path) and os.stat(sibling_path).st_mtime_ns >= source_stat.st_mtime_ns:
+            continue
+
+        if data is None:
+            with open(file_path, 'br') as file:
+                data = file.read()
+        compressed = compress(data, encoding, OFFLINE_LEVELS[encoding])
+        if len(compressed) >= len(data):
+            if os.path.exists(sibling_path):
+                os.remove(sibling_path)
+            continue
+
+        # Write then rename so the server never sees a partially written sibling
+        temporary_path = f'{sibling_path}.tmp'
+        with open(temporary_path, 'bw') as file:
+            file.write(compressed)
+        os.replace(temporary_path, sibling_path)
+        written.append(sibling_path)
+    return written
+
+
+def precompress_directory(directory_path: str, encodings: list, force: bool = False) -> list:
+    """
+    Precompresses every text file (see `TEXT_CONTENT_TYPES`) under a directory
+
+    Params:
+    - `directory_path` - the document root to walk
+    - `encodings` - content codings to produce
+    - `force` - rewrite siblings even if they are up to date
+
+    Returns:
+    The paths of the siblings that were written
+    """
+    written = []
+    for root, _, file_names in os.walk(directory_path):
+        for file_name in file_names:
+            extension = file_name.rsplit('.', 1)[-1] if '.' in file_name else None
+            if extension in TEXT_CONTENT_TYPES:
+                written += precompress_file(os.path.join(root, file_name), encodings, force)
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write .gz/.br siblings of the text files in a document root')
+    parser.add_argument('directory', nargs='?', default='./www', help='document root (default: ./www)')
+    parser.add_argument('--force', action='store_true', help='rewrite siblings that are already up to date')
+    args = parser.parse_args()
+
+    for path in precompress_directory(args.directory, available_encodings(), args.force):
+        print(path)
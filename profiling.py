@@ -0,0 +1,237 @@
+import cProfile
+import heapq
+import io
+import json
+import os
+import pstats
+import random
+import tempfile
+import threading
+import time
+
+# Path the aggregated profile is served on unless configured otherwise
+DEFAULT_PROFILE_PATH = '/-/profile'
+
+# Path the slowest recent requests are served on unless configured otherwise
+DEFAULT_SLOW_REQUESTS_PATH = '/-/slow-requests'
+
+# Seconds a slow request stays in the slow request log, give or take one window
+DEFAULT_SLOW_REQUESTS_WINDOW = 300
+
+# Files written on SIGUSR1 start with this, followed by the process id and `.prof` or `-slow.json`
+DEFAULT_DUMP_PREFIX = os.path.join(tempfile.gettempdir(), 'sumitro-profile')
+
+# Orders `pstats` can sort the profile by, as accepted by the profile endpoint
+PROFILE_SORT_KEYS = ['cumulative', 'tottime', 'ncalls', 'pcalls', 'filename', 'name']
+
+# Functions listed by the profile endpoint unless the client asks otherwise
+DEFAULT_PROFILE_LIMIT = 40
+
+
+class SamplingProfiler:
+    """
+    Profiles a random fraction of requests with `cProfile` and adds their stats up.
+
+    Requests that aren't sampled cost one call to `random.random`. A sampled request is profiled on the
+    thread serving it, from routing to the end of its handler, which with the blocking backends includes
+    sending the response. Bodies sent later by the asyncio backend aren't covered. A request that can't
+    be profiled because another profiler is running on its thread is skipped.
+    """
+
+    def __init__(self, sample_rate: float):
+        """
+        Params:
+        - `sample_rate` - fraction of requests profiled, in (0, 1]
+        """
+        self.sample_rate = sample_rate
+        self.__stats = None
+        self.__lock = threading.Lock()
+        self.__profiled = 0
+        self.__started = time.time()
+
+    def start(self) -> cProfile.Profile:
+        """
+        Decides whether to profile the request about to be handled, and starts profiling it if so
+
+        Returns:
+        The running profile to pass to `stop` once the request has been handled, None if it isn't sampled
+        """
+        if random.random() >= self.sample_rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already running on this thread
+            return None
+        return profile
+
+    def stop(self, profile: cProfile.Profile):
+        """
+        Stops a profile returned by `start` and adds it to the aggregated stats
+        """
+        profile.disable()
+        with self.__lock:
+            if self.__stats is None:
+                self.__stats = pstats.Stats(profile)
+            else:
+                self.__stats.add(profile)
+            self.__profiled += 1
+
+    def reset(self):
+        """
+        Discards the stats gathered so far
+        """
+        with self.__lock:
+            self.__stats = None
+            self.__profiled = 0
+            self.__started = time.time()
+
+    def render(self, sort: str = 'cumulative', limit: int = DEFAULT_PROFILE_LIMIT) -> str:
+        """
+        Params:
+        - `sort` - one of `PROFILE_SORT_KEYS`
+        - `limit` - most functions listed
+
+        Returns:
+        The aggregated stats as a `pstats` report
+        """
+        output = io.StringIO()
+        with self.__lock:
+            output.write(f'{self.__profiled} requests profiled since '
+                         f'{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.__started))}, '
+                         f'sampling {self.sample_rate:g} of requests\n')
+            if self.__stats is not None:
+                self.__stats.stream = output
+                self.__stats.sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+    def dump(self, path: str) -> bool:
+        """
+        Writes the aggregated stats in the `pstats` binary format, e.g. for `python -m pstats` or snakeviz
+
+        Params:
+        - `path` - file to write
+
+        Returns:
+        True if there were stats to write
+        """
+        with self.__lock:
+            if self.__stats is None:
+                return False
+            self.__stats.dump_stats(path)
+            return True
+
+
+class SlowRequest:
+    """One request kept in the slow request log"""
+
+    __slots__ = ['seconds', 'finished', 'method', 'path', 'handler', 'status_code', 'bytes_sent', 'phases']
+
+    def __init__(self, seconds: float, finished: float, method: str, path: str, handler: str, status_code: int,
+                 bytes_sent: int, phases: dict):
+        """
+        Params:
+        - `seconds` - time from the start of parsing to the end of the response
+        - `finished` - wall clock time the response ended at
+        - `method`, `path` - from the request line, None if the request couldn't be parsed
+        - `handler` - what replied to the request, as labelled in the metrics
+        - `status_code` - the response status, None if no response was sent
+        - `bytes_sent` - size of the response, head included
+        - `phases` - mapping of phase name to duration in seconds
+        """
+        self.seconds = seconds
+        self.finished = finished
+        self.method = method
+        self.path = path
+        self.handler = handler
+        self.status_code = status_code
+        self.bytes_sent = bytes_sent
+        self.phases = phases
+
+    def __lt__(self, other: 'SlowRequest') -> bool:
+        return self.seconds < other.seconds
+
+    def to_json(self) -> dict:
+        return {
+            'seconds': round(self.seconds, 6),
+            'finished': self.finished,
+            'method': self.method,
+            'path': self.path,
+            'handler': self.handler,
+            'status': self.status_code,
+            'bytes_sent': self.bytes_sent,
+            'phases': {phase: round(duration, 6) for phase, duration in self.phases.items()},
+        }
+
+
+class SlowRequestLog:
+    """
+    Thread-safe record of the slowest recent requests along with how long each phase of them took, so a
+    slow request can be blamed on parsing, the filesystem (`open`, `read`), an upstream server or a
+    client slow to take the response (`send`).
+
+    The slowest `size` requests of the current window are kept in a min-heap, so a request faster than all
+    of them costs one comparison. Every `window` seconds the current window becomes the previous one, and
+    the log shows the slowest of both.
+    """
+
+    def __init__(self, size: int, window: float = DEFAULT_SLOW_REQUESTS_WINDOW):
+        """
+        Params:
+        - `size` - slow requests kept
+        - `window` - seconds after which requests start dropping out of the log
+        """
+        self.size = size
+        self.window = window
+        self.__current = []
+        self.__previous = []
+        self.__window_ends = time.monotonic() + window
+        self.__lock = threading.Lock()
+
+    def record(self, seconds: float, method: str, path: str, handler: str, status_code: int, bytes_sent: int,
+               phases: dict):
+        """
+        Offers a finished request to the log, see `SlowRequest` for the params
+        """
+        now = time.monotonic()
+        with self.__lock:
+            if now >= self.__window_ends:
+                self.__rotate(now)
+            heap = self.__current
+            if len(heap) >= self.size and seconds <= heap[0].seconds:
+                return
+            entry = SlowRequest(seconds, time.time(), method, path, handler, status_code, bytes_sent, phases)
+            if len(heap) < self.size:
+                heapq.heappush(heap, entry)
+            else:
+                heapq.heapreplace(heap, entry)
+
+    def slowest(self) -> list:
+        """
+        Returns:
+        The slowest recent requests, slowest first
+        """
+        with self.__lock:
+            if time.monotonic() >= self.__window_ends:
+                self.__rotate(time.monotonic())
+            entries = self.__current + self.__previous
+        return heapq.nlargest(self.size, entries)
+
+    def render(self) -> str:
+        """
+        Returns:
+        The slowest recent requests as a JSON document
+        """
+        return json.dumps({'window_seconds': self.window,
+                           'requests': [entry.to_json() for entry in self.slowest()]}, indent=1)
+
+    def __rotate(self, now: float):
+        """
+        Starts a new window, the lock must be held
+        """
+        # A window that ended long ago holds nothing recent
+        stale = now >= self.__window_ends + self.window
+        self.__previous = [] if stale else self.__current
+        self.__current = []
+        self.__window_ends = now + self.window
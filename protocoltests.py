@@ -0,0 +1,596 @@
+#!/usr/bin/env python
+# Tests of the HTTP/1.1 wire protocol: starts the web server and talks to it over raw sockets, checking
+# persistent connections and pipelining, request parsing, HEAD and OPTIONS, conditional requests, byte ranges,
+# content coding, timeouts and limits, and handing the listening socket to a new server process.
+#
+# run: python protocoltests.py
+# (SERVER_MODE=asyncio python protocoltests.py to test another serving mode)
+
+import gzip
+import os
+import re
+import select
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+PORT = 8084
+SERVER_MODE = os.environ.get('SERVER_MODE', 'threaded')
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'www')
+
+
+def start_server(port: int, *args: str, stderr=None) -> subprocess.Popen:
+    server = subprocess.Popen([
+        sys.executable, 'server.py', '--port', str(port), '--mode', SERVER_MODE, '--workers', '2', *args,
+    ], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=stderr)
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    return server
+
+
+def stop_server(server: subprocess.Popen):
+    server.terminate()
+    server.wait()
+
+
+def read_file(path: str) -> bytes:
+    with open(os.path.join(ROOT, path.lstrip('/')), 'rb') as file:
+        return file.read()
+
+
+def read_response(stream, has_body: bool = True) -> tuple:
+    """
+    Reads one response off `stream`, a file made with `socket.makefile('rb')`
+
+    Params:
+    - `has_body` - False for replies to HEAD, whose `Content-Length` has no body behind it
+
+    Returns:
+    A `(status code, headers with lower-cased names, body)` tuple, `(None, {}, b'')` if the server closed
+    the connection instead
+    """
+    status_line = stream.readline()
+    if status_line == b'':
+        return None, {}, b''
+    status_code = int(status_line.split(b' ', 2)[1])
+    headers = {}
+    while True:
+        line = stream.readline().rstrip(b'\r\n')
+        if line == b'':
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if not has_body or status_code in (204, 304):
+        return status_code, headers, b''
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        body = b''
+        while True:
+            size = int(stream.readline().split(b';')[0], 16)
+            if size == 0:
+                # Trailer section up to the blank line
+                while stream.readline().rstrip(b'\r\n') != b'':
+                    pass
+                return status_code, headers, body
+            body += stream.read(size)
+            stream.readline()
+    if 'content-length' in headers:
+        return status_code, headers, stream.read(int(headers['content-length']))
+    return status_code, headers, stream.read()
+
+
+class RawClient:
+    """One client connection sending hand-written requests"""
+
+    def __init__(self, port: int = PORT, timeout: float = 3):
+        self.sock = socket.create_connection(('127.0.0.1', port), timeout=timeout)
+        self.stream = self.sock.makefile('rb')
+
+    def send(self, data: bytes):
+        self.sock.sendall(data)
+
+    def read_response(self, has_body: bool = True) -> tuple:
+        return read_response(self.stream, has_body)
+
+    def closed_by_server(self) -> bool:
+        """
+        Returns:
+        True if the server closed the connection, with nothing more to read
+        """
+        try:
+            return self.stream.read(1) == b''
+        except ConnectionResetError:
+            return True
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+
+
+def get_request(path: str, *headers: str) -> bytes:
+    return ''.join([f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n', *(header + '\r\n' for header in headers),
+                    '\r\n']).encode()
+
+
+class ServerTestCase(unittest.TestCase):
+    """Runs a server on `PORT` with `SERVER_ARGS` for the tests of the class"""
+
+    PORT = PORT
+    SERVER_ARGS = ()
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = start_server(cls.PORT, *cls.SERVER_ARGS)
+
+    @classmethod
+    def tearDownClass(cls):
+        stop_server(cls.server)
+
+    def setUp(self):
+        self.client = RawClient(self.PORT)
+
+    def tearDown(self):
+        self.client.close()
+
+
+class TestPersistentConnections(ServerTestCase):
+
+    def test_pipelined_requests(self):
+        self.client.send(get_request('/base.css') + get_request('/index.html'))
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 200)
+        self.assertEqual(headers['connection'], 'keep-alive')
+        self.assertEqual(body, read_file('/base.css'))
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 200)
+        self.assertEqual(body, read_file('/index.html'))
+        # Still open for another request
+        self.client.send(get_request('/deep/deep.css'))
+        self.assertEqual(self.client.read_response()[0], 200)
+
+    def test_connection_close(self):
+        self.client.send(get_request('/base.css', 'Connection: close') + get_request('/index.html'))
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 200)
+        self.assertEqual(headers['connection'], 'close')
+        self.assertEqual(body, read_file('/base.css'))
+        # The pipelined request after it is never answered
+        self.assertTrue(self.client.closed_by_server())
+
+
+class TestRequestParsing(ServerTestCase):
+
+    SERVER_ARGS = ('--max-header-bytes', '1024', '--max-body-bytes', '100')
+
+    def assert_rejected(self, request: bytes, status_code: int):
+        """
+        Asserts that `request` is answered with `status_code` and the connection is closed after it
+        """
+        self.client.send(request)
+        self.assertEqual(self.client.read_response()[0], status_code)
+        self.assertTrue(self.client.closed_by_server())
+
+    def test_split_across_reads(self):
+        request = get_request('/base.css', 'Accept: text/css')
+        for start in range(0, len(request), 7):
+            self.client.send(request[start:start + 7])
+            time.sleep(0.01)
+        status_code, _, body = self.client.read_response()
+        self.assertEqual(status_code, 200)
+        self.assertEqual(body, read_file('/base.css'))
+
+    def test_head_too_large(self):
+        self.assert_rejected(get_request('/base.css', 'X-Padding: ' + 'a' * 2000), 431)
+
+    def test_body_too_large(self):
+        self.assert_rejected(b'POST /base.css HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: 1000\r\n\r\n', 413)
+
+    def test_chunked_body_too_large(self):
+        self.assert_rejected(b'POST /base.css HTTP/1.1\r\nHost: 127.0.0.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+                             b'80\r\n' + b'a' * 128 + b'\r\n0\r\n\r\n', 413)
+
+    def test_invalid_content_length(self):
+        for value in (b'abc', b'-1', b'\xb2'):
+            with self.subTest(value=value):
+                self.client.close()
+                self.client = RawClient(self.PORT)
+                self.assert_rejected(b'POST /base.css HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: %s\r\n\r\n'
+                                     % value, 400)
+
+    def test_transfer_encoding_with_content_length(self):
+        self.assert_rejected(b'POST /base.css HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: 5\r\n'
+                             b'Transfer-Encoding: chunked\r\n\r\n0\r\n\r\n', 400)
+
+    def test_unsupported_transfer_coding(self):
+        self.assert_rejected(b'POST /base.css HTTP/1.1\r\nHost: 127.0.0.1\r\nTransfer-Encoding: gzip\r\n\r\n', 501)
+
+    def test_malformed_chunk_size(self):
+        self.assert_rejected(b'POST /base.css HTTP/1.1\r\nHost: 127.0.0.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+                             b'zz\r\nabc\r\n0\r\n\r\n', 400)
+
+    def test_chunked_body_consumed(self):
+        # The whole body is read past, so the pipelined request after it is answered
+        self.client.send(b'POST /base.css HTTP/1.1\r\nHost: 127.0.0.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+                         b'5\r\nhello\r\n6;ext=1\r\n world\r\n0\r\n\r\n' + get_request('/base.css'))
+        self.assertEqual(self.client.read_response()[0], 405)
+        status_code, _, body = self.client.read_response()
+        self.assertEqual(status_code, 200)
+        self.assertEqual(body, read_file('/base.css'))
+
+    def test_malformed_request_line(self):
+        self.assert_rejected(b'GET\r\nHost: 127.0.0.1\r\n\r\n', 400)
+
+
+def request(method: str, path: str, *headers: str) -> bytes:
+    return get_request(path, *headers).replace(b'GET', method.encode(), 1)
+
+
+class TestHeadAndOptions(ServerTestCase):
+
+    def test_head(self):
+        for path in ['/base.css', '/deep/']:
+            with self.subTest(path=path):
+                self.client.send(get_request(path) + request('HEAD', path) + get_request(path))
+                _, headers, body = self.client.read_response()
+                status_code, head_headers, _ = self.client.read_response(has_body=False)
+                self.assertEqual(status_code, 200)
+                self.assertEqual(head_headers['content-length'], str(len(body)))
+                for name in ['content-type', 'etag', 'last-modified']:
+                    self.assertEqual(head_headers[name], headers[name])
+                # No body was sent after the head: the next response on the connection starts right away
+                self.assertEqual(self.client.read_response()[2], body)
+
+    def test_head_not_found(self):
+        self.client.send(request('HEAD', '/missing') + get_request('/base.css'))
+        status_code, headers, _ = self.client.read_response(has_body=False)
+        self.assertEqual(status_code, 404)
+        self.assertEqual(self.client.read_response()[2], read_file('/base.css'))
+
+    def test_options(self):
+        self.client.send(request('OPTIONS', '/base.css') + request('OPTIONS', '/missing'))
+        for _ in range(2):
+            status_code, headers, body = self.client.read_response()
+            self.assertEqual(status_code, 204)
+            self.assertEqual(headers['allow'], 'GET, HEAD, OPTIONS')
+            self.assertEqual(body, b'')
+
+    def test_method_not_allowed(self):
+        self.client.send(request('PUT', '/base.css', 'Content-Length: 0'))
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 405)
+        self.assertEqual(headers['allow'], 'GET, HEAD, OPTIONS')
+
+
+class TestConditionalRequests(ServerTestCase):
+
+    SERVER_ARGS = ('--cache-control', '.css=3600')
+
+    def validators(self, path: str) -> dict:
+        self.client.send(get_request(path))
+        status_code, headers, _ = self.client.read_response()
+        self.assertEqual(status_code, 200)
+        return headers
+
+    def test_if_none_match(self):
+        headers = self.validators('/base.css')
+        self.client.send(get_request('/base.css', f'If-None-Match: {headers["etag"]}'))
+        status_code, not_modified, body = self.client.read_response()
+        self.assertEqual(status_code, 304)
+        self.assertEqual(not_modified['etag'], headers['etag'])
+        self.assertNotIn('content-length', not_modified)
+        self.assertEqual(body, b'')
+        # Nothing was sent after the head: the next response on the connection starts right away
+        self.client.send(get_request('/base.css', 'If-None-Match: "stale", W/"other"'))
+        status_code, _, body = self.client.read_response()
+        self.assertEqual(status_code, 200)
+        self.assertEqual(body, read_file('/base.css'))
+
+    def test_if_modified_since(self):
+        headers = self.validators('/index.html')
+        self.client.send(get_request('/index.html', f'If-Modified-Since: {headers["last-modified"]}'))
+        status_code, _, body = self.client.read_response()
+        self.assertEqual(status_code, 304)
+        self.assertEqual(body, b'')
+        self.client.send(get_request('/index.html', 'If-Modified-Since: Thu, 01 Jan 1970 00:00:00 GMT'))
+        self.assertEqual(self.client.read_response()[0], 200)
+
+    def test_if_none_match_takes_precedence(self):
+        headers = self.validators('/base.css')
+        self.client.send(get_request('/base.css', 'If-None-Match: "stale"',
+                                     f'If-Modified-Since: {headers["last-modified"]}'))
+        self.assertEqual(self.client.read_response()[0], 200)
+
+    def test_cache_control_rule(self):
+        self.assertEqual(self.validators('/base.css')['cache-control'], 'max-age=3600')
+        self.assertNotIn('cache-control', self.validators('/index.html'))
+
+
+class TestByteRanges(ServerTestCase):
+
+    def test_single_range(self):
+        content = read_file('/index.html')
+        self.client.send(get_request('/index.html', 'Range: bytes=10-19'))
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 206)
+        self.assertEqual(headers['content-range'], f'bytes 10-19/{len(content)}')
+        self.assertEqual(body, content[10:20])
+        self.client.send(get_request('/index.html', 'Range: bytes=-5'))
+        self.assertEqual(self.client.read_response()[2], content[-5:])
+
+    def test_multiple_ranges(self):
+        content = read_file('/index.html')
+        self.client.send(get_request('/index.html', 'Range: bytes=0-4,20-29'))
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 206)
+        content_type, _, boundary = headers['content-type'].partition('; boundary=')
+        self.assertEqual(content_type, 'multipart/byteranges')
+        parts = body.split(b'--' + boundary.encode())
+        self.assertEqual(parts[-1].strip(), b'--')
+        self.assertEqual(len(parts), 4)
+        for part, (start, end) in zip(parts[1:3], [(0, 4), (20, 29)]):
+            part_head, _, part_body = part.partition(b'\r\n\r\n')
+            self.assertIn(f'Content-Range: bytes {start}-{end}/{len(content)}'.encode(), part_head)
+            self.assertEqual(part_body[:-2], content[start:end + 1])
+
+    def test_unsatisfiable_range(self):
+        size = len(read_file('/index.html'))
+        self.client.send(get_request('/index.html', f'Range: bytes={size + 10}-'))
+        status_code, headers, _ = self.client.read_response()
+        self.assertEqual(status_code, 416)
+        self.assertEqual(headers['content-range'], f'bytes */{size}')
+
+    def test_if_range(self):
+        content = read_file('/index.html')
+        self.client.send(get_request('/index.html'))
+        etag = self.client.read_response()[1]['etag']
+        self.client.send(get_request('/index.html', 'Range: bytes=0-9', f'If-Range: {etag}'))
+        self.assertEqual(self.client.read_response()[0], 206)
+        # A stale validator gets the whole current file
+        self.client.send(get_request('/index.html', 'Range: bytes=0-9', 'If-Range: "stale"'))
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 200)
+        self.assertNotIn('content-range', headers)
+        self.assertEqual(body, content)
+
+    def test_non_ascii_digits_ignored(self):
+        # `²` is a digit to `str.isdigit` but not to `int`, a header holding one is invalid and ignored
+        for spec in [b'\xb2-', b'0-\xb2', b'-\xb2']:
+            with self.subTest(spec=spec):
+                self.client.send(get_request('/base.css', 'Range: bytes=SPEC').replace(b'SPEC', spec))
+                status_code, headers, body = self.client.read_response()
+                self.assertEqual(status_code, 200)
+                self.assertEqual(body, read_file('/base.css'))
+
+
+class TestCompression(ServerTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # A scratch root with a text file large enough to be compressed and an image
+        cls.directory = tempfile.mkdtemp(prefix='protocoltests-')
+        with open(os.path.join(cls.directory, 'page.html'), 'wb') as file:
+            file.write(b'<p>compress me</p>\n' * 100)
+        shutil.copyfile(os.path.join(ROOT, '..', 'root.png'), os.path.join(cls.directory, 'root.png'))
+        cls.SERVER_ARGS = ('--directory', cls.directory, '--compression')
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(cls.directory)
+
+    def read_file(self, name: str) -> bytes:
+        with open(os.path.join(self.directory, name), 'rb') as file:
+            return file.read()
+
+    def test_gzip(self):
+        self.client.send(get_request('/page.html'))
+        _, identity_headers, _ = self.client.read_response()
+        self.client.send(get_request('/page.html', 'Accept-Encoding: gzip'))
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 200)
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        self.assertEqual(headers['vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(body), self.read_file('page.html'))
+        self.assertLess(len(body), len(self.read_file('page.html')))
+        self.assertEqual(headers['etag'], identity_headers['etag'][:-1] + '-gzip"')
+
+    def test_refused_coding(self):
+        self.client.send(get_request('/page.html', 'Accept-Encoding: gzip;q=0, br;q=0'))
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 200)
+        self.assertNotIn('content-encoding', headers)
+        self.assertEqual(body, self.read_file('page.html'))
+
+    def test_binary_file_uncompressed(self):
+        self.client.send(get_request('/root.png', 'Accept-Encoding: gzip'))
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 200)
+        self.assertNotIn('content-encoding', headers)
+        self.assertEqual(body, self.read_file('root.png'))
+
+
+class TestCompressionOff(ServerTestCase):
+
+    def test_uncompressed_by_default(self):
+        self.client.send(get_request('/index.html', 'Accept-Encoding: gzip'))
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 200)
+        self.assertNotIn('content-encoding', headers)
+        self.assertEqual(body, read_file('/index.html'))
+
+
+class TestTimeouts(ServerTestCase):
+
+    SERVER_ARGS = ('--header-timeout', '0.5', '--body-timeout', '0.5')
+
+    def assert_timed_out(self, partial_request: bytes):
+        started = time.monotonic()
+        self.client.send(partial_request)
+        status_code, _, body = self.client.read_response()
+        self.assertEqual(status_code, 408)
+        self.assertIn(b'Timed out', body)
+        self.assertLess(time.monotonic() - started, 2.5)
+        self.assertTrue(self.client.closed_by_server())
+
+    def test_stalled_head(self):
+        self.assert_timed_out(b'GET /base.css HTTP/1.1\r\nHost: 127.0.0.1\r\n')
+
+    def test_stalled_body(self):
+        self.assert_timed_out(b'POST /base.css HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: 10\r\n\r\nabc')
+
+
+@unittest.skipIf(SERVER_MODE in ('single', 'prefork', 'reuseport'),
+                 'each process serves one connection at a time, so others wait instead of being counted')
+class TestConnectionLimits(ServerTestCase):
+
+    SERVER_ARGS = ('--max-connections', '2', '--max-connections-per-ip', '1')
+
+    def setUp(self):
+        self.client = self.admitted_client()
+
+    def admitted_client(self) -> RawClient:
+        """
+        Connects once the server has let go of earlier connections from this address, including the one
+        probing for the server to start, which it only notices shortly after they are closed
+
+        Returns:
+        A client whose first request has been answered with 200
+        """
+        deadline = time.monotonic() + 3
+        while True:
+            client = RawClient(self.PORT)
+            client.send(get_request('/base.css'))
+            if client.read_response()[0] == 200:
+                return client
+            client.close()
+            self.assertLess(time.monotonic(), deadline, 'Earlier connections were never released')
+            time.sleep(0.05)
+
+    def test_too_many_connections_from_one_address(self):
+        second = RawClient(self.PORT)
+        try:
+            status_code, headers, body = second.read_response()
+            self.assertEqual(status_code, 429)
+            self.assertEqual(headers['retry-after'], '1')
+            self.assertTrue(second.closed_by_server())
+        finally:
+            second.close()
+        # Served again once the first connection is closed
+        self.client.close()
+        self.client = self.admitted_client()
+
+    def test_too_many_connections(self):
+        # Another local address counts against the server's cap but not the first address's
+        other = socket.create_connection(('127.0.0.1', self.PORT), source_address=('127.0.0.2', 0))
+        third = socket.create_connection(('127.0.0.1', self.PORT), source_address=('127.0.0.3', 0))
+        try:
+            other.sendall(get_request('/base.css'))
+            self.assertEqual(read_response(other.makefile('rb'))[0], 200)
+            third.settimeout(3)
+            status_code, headers, _ = read_response(third.makefile('rb'))
+            self.assertEqual(status_code, 503)
+            self.assertEqual(headers['retry-after'], '1')
+        finally:
+            other.close()
+            third.close()
+
+
+class TestRateLimit(ServerTestCase):
+
+    SERVER_ARGS = ('--request-rate', '0.2', '--request-burst', '2')
+
+    def test_burst(self):
+        self.client.send(get_request('/base.css') * 3)
+        self.assertEqual(self.client.read_response()[0], 200)
+        self.assertEqual(self.client.read_response()[0], 200)
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 429)
+        self.assertGreaterEqual(int(headers['retry-after']), 1)
+        self.assertIn(b'Too many requests', body)
+
+    @unittest.skipIf(SERVER_MODE in ('prefork', 'reuseport'),
+                     'reloading restarts the worker processes, whose buckets are their own')
+    def test_reload_keeps_buckets(self):
+        # Runs after test_burst as tests run in name order, the bucket of this address is still empty
+        self.server.send_signal(signal.SIGHUP)
+        time.sleep(1)
+        self.client.send(get_request('/base.css'))
+        self.assertEqual(self.client.read_response()[0], 429)
+
+
+class TestHandoff(ServerTestCase):
+    """`SIGUSR2` starts a new server process on the same port, then the old one drains and exits"""
+
+    @classmethod
+    def setUpClass(cls):
+        # The lifecycle log on stderr names the new server process
+        cls.server = start_server(cls.PORT, stderr=subprocess.PIPE)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.server.stderr.close()
+
+    def successor_pid(self) -> int:
+        """
+        Returns:
+        The id of the new server process, once the old one logged that it is serving
+        """
+        log = b''
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            readable, _, _ = select.select([self.server.stderr], [], [], 0.1)
+            if readable:
+                log += os.read(self.server.stderr.fileno(), 4096)
+            match = re.search(rb'New server process (\d+) is serving', log)
+            if match is not None:
+                return int(match.group(1))
+        self.fail(f'No new server process was started, logged: {log!r}')
+
+    def stop_successor(self, pid: int):
+        os.kill(pid, signal.SIGTERM)
+        # It isn't a child of the tests, so wait for the port to be released rather than for the process
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', self.PORT)).close()
+            except OSError:
+                return
+            time.sleep(0.1)
+
+    def test_handoff(self):
+        # A request the old process is still receiving when the new one takes over
+        self.client.send(b'GET /base.css HTTP/1.1\r\nHost: 127.0.0.1\r\n')
+        time.sleep(0.2)
+        self.server.send_signal(signal.SIGUSR2)
+        self.addCleanup(self.stop_successor, self.successor_pid())
+
+        # The old process still answers it, then closes the connection as it drains
+        self.client.send(b'\r\n')
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 200)
+        self.assertEqual(body, read_file('/base.css'))
+        self.assertTrue(self.client.closed_by_server())
+        self.server.wait(timeout=10)
+
+        # Only the new process is left listening
+        client = RawClient(self.PORT)
+        try:
+            client.send(get_request('/base.css'))
+            self.assertEqual(client.read_response()[0], 200)
+        finally:
+            client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
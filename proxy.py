@@ -0,0 +1,744 @@
+import socket
+import threading
+import time
+from constants import DEFAULT_ENCODING
+from helpers import is_decimal
+from http_parser import HEADER_ENCODING
+from request import Request
+from response import prebuilt_json
+
+BALANCING_METHODS = ['round_robin', 'least_conn']
+
+# Seconds allowed to open a connection to an upstream server
+DEFAULT_CONNECT_TIMEOUT = 5
+
+# Seconds an upstream server may go without sending anything while a response is awaited or read
+DEFAULT_READ_TIMEOUT = 60
+
+# Idle keep-alive connections kept open per upstream server
+DEFAULT_MAX_IDLE_CONNECTIONS = 16
+
+# Consecutive failures after which an upstream server is taken out of rotation
+DEFAULT_MAX_FAILS = 3
+
+# Seconds a failing upstream server is left out of rotation before it is tried again
+DEFAULT_FAIL_TIMEOUT = 10
+
+# Seconds between active health checks of every upstream server
+DEFAULT_HEALTH_CHECK_INTERVAL = 5
+
+# Most bytes read from an upstream server at once
+UPSTREAM_READ_BYTES = 64 * 1024
+
+# Largest response head accepted from an upstream server
+MAX_UPSTREAM_HEAD_BYTES = 64 * 1024
+
+# Longest chunk size line accepted in a chunked upstream response
+MAX_CHUNK_LINE_BYTES = 1024
+
+# Headers describing a single connection, never forwarded in either direction
+# https://datatracker.ietf.org/doc/html/rfc9110#section-7.6.1
+HOP_BY_HOP_HEADERS = frozenset(['connection', 'keep-alive', 'proxy-connection', 'te', 'trailer',
+                                'transfer-encoding', 'upgrade'])
+
+# Request headers not forwarded: the body has been read in full, so its framing is redone
+DROPPED_REQUEST_HEADERS = HOP_BY_HOP_HEADERS | {'content-length', 'expect', 'x-forwarded-for',
+                                                'x-forwarded-proto'}
+
+# Response headers not forwarded: the framing is redone and `Server` is always this server's
+DROPPED_RESPONSE_HEADERS = HOP_BY_HOP_HEADERS | {'content-length', 'server'}
+
+# Methods whose requests can be resent on a fresh connection if a pooled one turns out to be closed
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'TRACE'])
+
+BAD_GATEWAY = prebuilt_json({'err': 'Bad gateway'}, 502)
+GATEWAY_TIMEOUT = prebuilt_json({'err': 'Gateway timeout'}, 504)
+NO_HEALTHY_UPSTREAM = prebuilt_json({'err': 'No healthy upstream server'}, 502)
+
+
+class UpstreamError(Exception):
+    """Raised when an upstream server can't be reached or sends an invalid response"""
+
+    def __init__(self, message: str, timed_out: bool = False, connecting: bool = False):
+        """
+        Params:
+        - `message` - description of what went wrong
+        - `timed_out` - the server didn't answer in time (504) rather than failing outright (502)
+        - `connecting` - the request wasn't sent, so another server can be tried
+        """
+        super().__init__(message)
+        self.timed_out = timed_out
+        self.connecting = connecting
+
+
+class UpstreamResponse:
+    """The status and headers of a response from an upstream server"""
+
+    __slots__ = ['status_code', 'headers', 'header_index', 'keep_alive']
+
+    def __init__(self, status_code: int, headers: list, header_index: dict, keep_alive: bool):
+        """
+        Params:
+        - `status_code` - the response status
+        - `headers` - `(name, value)` pairs in the order received
+        - `header_index` - header values keyed by lower-cased field name
+        - `keep_alive` - whether the server keeps the connection open after the response
+        """
+        self.status_code = status_code
+        self.headers = headers
+        self.header_index = header_index
+        self.keep_alive = keep_alive
+
+
+class UpstreamConnection:
+    """A keep-alive connection to an upstream server, buffering the bytes received past the current read"""
+
+    __slots__ = ['socket', 'reused', 'buffer']
+
+    def __init__(self, upstream_socket: socket.socket):
+        self.socket = upstream_socket
+        self.reused = False
+        self.buffer = bytearray()
+
+    def is_stale(self) -> bool:
+        """
+        Returns:
+        True if the server closed the connection (or sent something unexpected) while it sat in the pool
+        """
+        timeout = self.socket.gettimeout()
+        # A socket with a timeout would wait for something to arrive before peeking
+        self.socket.setblocking(False)
+        try:
+            self.socket.recv(1, socket.MSG_PEEK)
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+        finally:
+            self.socket.settimeout(timeout)
+        return True
+
+    def receive(self) -> bool:
+        """
+        Reads more bytes into `buffer`
+
+        Returns:
+        False if the server closed the connection
+
+        Raises:
+        socket.timeout if nothing arrived within the read timeout
+        """
+        data = self.socket.recv(UPSTREAM_READ_BYTES)
+        self.buffer += data
+        return len(data) > 0
+
+    def read_head(self) -> UpstreamResponse:
+        """
+        Reads the head of the next final (non 1xx) response
+
+        Raises:
+        UpstreamError if the response is malformed, ConnectionError if the server closed the connection,
+        socket.timeout if it didn't answer in time
+        """
+        while True:
+            end = self.buffer.find(b'\r\n\r\n')
+            while end == -1:
+                if len(self.buffer) > MAX_UPSTREAM_HEAD_BYTES:
+                    raise UpstreamError('Upstream response head too large')
+                if not self.receive():
+                    raise ConnectionError('Upstream server closed the connection')
+                end = self.buffer.find(b'\r\n\r\n')
+            lines = bytes(self.buffer[:end]).decode(HEADER_ENCODING).split('\r\n')
+            del self.buffer[:end + 4]
+
+            version, _, rest = lines[0].partition(' ')
+            status = rest[:3]
+            if not version.startswith('HTTP/1.') or not is_decimal(status):
+                raise UpstreamError('Malformed upstream status line')
+            status_code = int(status)
+            if status_code == 101:
+                raise UpstreamError('Protocol upgrades are not supported')
+            if status_code < 200:
+                # Interim responses (e.g. 103 Early Hints) aren't relayed
+                continue
+
+            headers = []
+            header_index = {}
+            for line in lines[1:]:
+                name, separator, value = line.partition(':')
+                if not separator or not name:
+                    raise UpstreamError('Malformed upstream header field')
+                value = value.strip()
+                headers.append((name, value))
+                lowered = name.lower()
+                header_index[lowered] = f'{header_index[lowered]}, {value}' if lowered in header_index else value
+            keep_alive = version == 'HTTP/1.1' and 'close' not in header_index.get('connection', '').lower()
+            return UpstreamResponse(status_code, headers, header_index, keep_alive)
+
+    def read_exactly(self, count: int):
+        """
+        Generates the next `count` bytes received, in pieces as they arrive
+
+        Raises:
+        ConnectionError if the server closed the connection first
+        """
+        while count > 0:
+            if self.buffer:
+                piece = bytes(self.buffer[:count])
+                del self.buffer[:len(piece)]
+            else:
+                # Nothing buffered, hand over what is received without copying it into the buffer
+                piece = self.socket.recv(min(count, UPSTREAM_READ_BYTES))
+                if not piece:
+                    raise ConnectionError('Upstream server closed the connection mid-body')
+            count -= len(piece)
+            yield piece
+
+    def read_until_closed(self):
+        """
+        Generates the bytes received until the server closes the connection
+        """
+        if self.buffer:
+            yield bytes(self.buffer)
+            self.buffer.clear()
+        while True:
+            data = self.socket.recv(UPSTREAM_READ_BYTES)
+            if not data:
+                return
+            yield data
+
+    def read_chunked(self):
+        """
+        Generates the decoded data of a chunked body, the trailer section is read and dropped
+        """
+        while True:
+            size_line = self.__read_line()
+            size = size_line.partition(b';')[0].strip()
+            try:
+                size = int(size, 16)
+            except ValueError:
+                raise UpstreamError('Malformed chunk size in upstream response')
+            if size == 0:
+                while self.__read_line():
+                    pass
+                return
+            yield from self.read_exactly(size)
+            if self.__read_line():
+                raise UpstreamError('Malformed chunk in upstream response')
+
+    def __read_line(self) -> bytes:
+        end = self.buffer.find(b'\r\n')
+        while end == -1:
+            if len(self.buffer) > MAX_CHUNK_LINE_BYTES:
+                raise UpstreamError('Chunk line too long in upstream response')
+            if not self.receive():
+                raise ConnectionError('Upstream server closed the connection mid-body')
+            end = self.buffer.find(b'\r\n')
+        line = bytes(self.buffer[:end])
+        del self.buffer[:end + 2]
+        return line
+
+    def close(self):
+        try:
+            self.socket.close()
+        except OSError:
+            pass
+
+
+class UpstreamBody:
+    """
+    Iterator over the body of an upstream response as it arrives. The connection goes back to the pool
+    once the body has been read in full, and is closed if the body is abandoned (`close`) or the server
+    fails part way through, in which case the client's connection is ended too.
+    """
+
+    __slots__ = ['upstream', 'connection', 'pieces', 'reusable', 'on_done', 'done']
+
+    def __init__(self, upstream: 'Upstream', connection: UpstreamConnection, pieces, reusable: bool, on_done):
+        """
+        Params:
+        - `upstream` - the server sending the response
+        - `connection` - the connection the response arrives on
+        - `pieces` - generator of the decoded body, from one of the `UpstreamConnection` read methods
+        - `reusable` - whether the connection can carry another request once the body has been read
+        - `on_done` - called with whether the server failed once the body is finished or abandoned
+        """
+        self.upstream = upstream
+        self.connection = connection
+        self.pieces = pieces
+        self.reusable = reusable
+        self.on_done = on_done
+        self.done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        try:
+            return next(self.pieces)
+        except StopIteration:
+            self.__finish(finished=True)
+            raise
+        except socket.timeout:
+            self.__finish(finished=False)
+            raise ConnectionError(f'Timed out reading the response of {self.upstream.address}')
+        except (UpstreamError, OSError) as err:
+            self.__finish(finished=False)
+            raise ConnectionError(f'Reading the response of {self.upstream.address} failed: {err}')
+
+    def close(self):
+        """
+        Abandons the rest of the body, e.g. because the client went away
+        """
+        self.__finish(finished=False, failed=False)
+
+    def __finish(self, finished: bool, failed: bool = True):
+        if self.done:
+            return
+        self.done = True
+        if finished:
+            self.upstream.release(self.connection, self.reusable)
+        else:
+            self.pieces.close()
+            self.connection.close()
+        self.on_done(failed and not finished)
+
+
+class Upstream:
+    """
+    One upstream server of a `Proxy`: its pool of idle keep-alive connections, the number of requests in
+    flight to it, and its health
+    """
+
+    def __init__(self, host: str, port: int, max_idle: int, connect_timeout: float, read_timeout: float):
+        """
+        Params:
+        - `host` - host name or IP address of the server
+        - `port` - TCP port of the server
+        - `max_idle` - idle connections kept open, more are closed once their response has been read
+        - `connect_timeout` - seconds allowed to open a connection
+        - `read_timeout` - seconds the server may go without sending anything
+        """
+        self.host = host
+        self.port = port
+        self.address = f'{host}:{port}'
+        self.max_idle = max_idle
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        # Requests in flight, the least-connections balancing key. Changed under the `Proxy` lock
+        self.active = 0
+        # Consecutive failures, and until when the server is left out of rotation because of them
+        self.failures = 0
+        self.ejected_until = 0.0
+        # Set by the active health check
+        self.healthy = True
+        self.__idle = []
+        self.__closed = False
+        self.__lock = threading.Lock()
+        self.__stats = {'connections_opened': 0, 'connections_reused': 0, 'failures': 0, 'timeouts': 0}
+
+    def is_available(self, now: float) -> bool:
+        """
+        Returns:
+        True if the server is in rotation at `now` (a `time.monotonic` timestamp)
+        """
+        return self.healthy and now >= self.ejected_until
+
+    def acquire(self) -> UpstreamConnection:
+        """
+        Returns:
+        A pooled connection if one is still open, otherwise a new connection
+
+        Raises:
+        UpstreamError if a new connection can't be opened
+        """
+        while True:
+            with self.__lock:
+                connection = self.__idle.pop() if self.__idle else None
+            if connection is None:
+                break
+            if connection.is_stale():
+                connection.close()
+                continue
+            connection.reused = True
+            self.count('connections_reused')
+            return connection
+        return self.connect()
+
+    def connect(self) -> UpstreamConnection:
+        """
+        Opens a new connection to the server
+
+        Raises:
+        UpstreamError if the server can't be reached within `connect_timeout`
+        """
+        try:
+            upstream_socket = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+        except socket.timeout:
+            raise UpstreamError(f'Timed out connecting to {self.address}', timed_out=True, connecting=True)
+        except OSError as err:
+            raise UpstreamError(f'Could not connect to {self.address}: {err}', connecting=True)
+        upstream_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        upstream_socket.settimeout(self.read_timeout)
+        self.count('connections_opened')
+        return UpstreamConnection(upstream_socket)
+
+    def release(self, connection: UpstreamConnection, reusable: bool):
+        """
+        Returns a connection to the pool once its response has been read in full, or closes it
+
+        Params:
+        - `connection` - the connection
+        - `reusable` - whether the connection can carry another request
+        """
+        if reusable and not connection.buffer:
+            with self.__lock:
+                if len(self.__idle) < self.max_idle and not self.__closed:
+                    self.__idle.append(connection)
+                    return
+        connection.close()
+
+    def close(self):
+        """
+        Closes the pooled connections, connections released from now on are closed instead of pooled
+        """
+        with self.__lock:
+            self.__closed = True
+            idle, self.__idle = self.__idle, []
+        for connection in idle:
+            connection.close()
+
+    def count(self, counter: str):
+        with self.__lock:
+            self.__stats[counter] += 1
+
+    def stats(self) -> dict:
+        """
+        Returns:
+        The connection and failure counters of the server, along with the number of idle connections
+        """
+        with self.__lock:
+            return {**self.__stats, 'idle_connections': len(self.__idle)}
+
+
+class Proxy:
+    """
+    Forwards requests to a group of upstream HTTP/1.1 servers.
+
+    Each upstream server has its own pool of keep-alive connections, which are checked for having been
+    closed before they are reused. Servers are picked round-robin or by fewest requests in flight.
+    A server failing `max_fails` times in a row is left out for `fail_timeout` seconds, and with a
+    `health_check_path` every server is probed in the background and left out while its probes fail.
+    Requests that couldn't be sent because a server was unreachable are tried on the next server.
+
+    Request bodies have already been read in full by the request parser, within its body size limit.
+    Response bodies are streamed to the client as they arrive, never buffered whole.
+    Unreachable servers and invalid responses get 502, servers not answering in time 504.
+    """
+
+    def __init__(self, upstreams: list, balance: str = 'round_robin',
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT, read_timeout: float = DEFAULT_READ_TIMEOUT,
+                 max_idle: int = DEFAULT_MAX_IDLE_CONNECTIONS, max_fails: int = DEFAULT_MAX_FAILS,
+                 fail_timeout: float = DEFAULT_FAIL_TIMEOUT, health_check_path: str = None,
+                 health_check_interval: float = DEFAULT_HEALTH_CHECK_INTERVAL):
+        """
+        Params:
+        - `upstreams` - `(host, port)` of every upstream server, see `parse_upstreams`
+        - `balance` - one of `BALANCING_METHODS`
+        - `connect_timeout` - seconds allowed to open a connection to a server
+        - `read_timeout` - seconds a server may go without sending anything
+        - `max_idle` - idle connections kept open per server
+        - `max_fails` - consecutive failures after which a server is left out
+        - `fail_timeout` - seconds a failing server is left out
+        - `health_check_path` - path probed with GET on every server, None disables active health checks
+        - `health_check_interval` - seconds between health checks
+        """
+        self.upstreams = [Upstream(host, port, max_idle, connect_timeout, read_timeout) for host, port in upstreams]
+        self.balance = balance
+        self.max_fails = max_fails
+        self.fail_timeout = fail_timeout
+        self.health_check_path = health_check_path
+        self.health_check_interval = health_check_interval
+        self.__next = 0
+        self.__lock = threading.Lock()
+        self.__health_checker = None
+        # Set once the proxy is closed, stops the health checks
+        self.__closed = threading.Event()
+
+    def handle(self, request: Request):
+        """
+        Forwards a request to an upstream server and relays its response
+
+        Params:
+        - `request` - a valid HTTP request
+        """
+        if self.health_check_path is not None and not self.__closed.is_set():
+            self.__start_health_checks()
+        request.run_blocking(lambda: self.forward(request))
+
+    def forward(self, request: Request):
+        """
+        Forwards a request and relays the response, blocking until it has been sent (or, on the asyncio
+        backend, queued)
+
+        Params:
+        - `request` - a valid HTTP request
+        """
+        head = encode_request_head(request)
+        tried = set()
+        error = None
+        while True:
+            upstream = self.__pick(tried)
+            if upstream is None:
+                break
+            tried.add(upstream)
+            started = time.perf_counter()
+            try:
+                connection, response = self.__exchange(upstream, request.method, head, request.body)
+            except UpstreamError as err:
+                request.add_phase('upstream', time.perf_counter() - started)
+                self.__finish(upstream, failed=True, timed_out=err.timed_out)
+                error = err
+                if err.connecting:
+                    continue
+                break
+            # Time until the head of the response arrived, its body is relayed as part of `send`
+            request.add_phase('upstream', time.perf_counter() - started)
+            self.__relay(request, upstream, connection, response)
+            return
+
+        if error is None:
+            request.reply_response(NO_HEALTHY_UPSTREAM)
+        elif error.timed_out:
+            request.reply_response(GATEWAY_TIMEOUT)
+        else:
+            request.reply_response(BAD_GATEWAY)
+
+    def __exchange(self, upstream: Upstream, method: str, head: bytes, body: bytes) -> tuple:
+        """
+        Sends a request to a server and reads the head of its response, resending it once on a new
+        connection if a pooled connection turns out to have been closed by the server
+
+        Returns:
+        The connection and the response head
+
+        Raises:
+        UpstreamError if the server couldn't be reached, didn't answer in time or answered nonsense
+        """
+        connection = upstream.acquire()
+        while True:
+            try:
+                connection.socket.sendall(head)
+                if body:
+                    connection.socket.sendall(body)
+                return connection, connection.read_head()
+            except socket.timeout:
+                connection.close()
+                raise UpstreamError(f'Timed out waiting for {upstream.address}', timed_out=True)
+            except UpstreamError:
+                connection.close()
+                raise
+            except OSError as err:
+                connection.close()
+                if not connection.reused or method not in IDEMPOTENT_METHODS:
+                    raise UpstreamError(f'Connection to {upstream.address} failed: {err}')
+                connection = upstream.connect()
+
+    def __relay(self, request: Request, upstream: Upstream, connection: UpstreamConnection,
+                response: UpstreamResponse):
+        """
+        Replies to the client with the response of a server, streaming its body
+        """
+        status_code = response.status_code
+        index = response.header_index
+        dropped = DROPPED_RESPONSE_HEADERS | connection_tokens(index.get('connection'))
+        extra_headers = '\r\n'.join(f'{name}: {value}' for name, value in response.headers
+                                    if name.lower() not in dropped) or None
+
+        content_length = index.get('content-length')
+        if content_length is not None:
+            if not is_decimal(content_length):
+                connection.close()
+                self.__finish(upstream, failed=True)
+                request.reply_response(BAD_GATEWAY)
+                return
+            content_length = int(content_length)
+
+        if request.method == 'HEAD' or status_code in (204, 304):
+            upstream.release(connection, response.keep_alive)
+            self.__finish(upstream)
+            if request.method == 'HEAD' and status_code not in (204, 304):
+                request.reply_head(status_code, content_length, None, extra_headers)
+            else:
+                request.reply_empty(status_code, extra_headers)
+            return
+
+        chunked = index.get('transfer-encoding', '').lower().rstrip().endswith('chunked')
+        if chunked:
+            content_length = None
+            pieces = connection.read_chunked()
+        elif content_length is not None:
+            pieces = connection.read_exactly(content_length)
+        else:
+            pieces = connection.read_until_closed()
+        reusable = response.keep_alive and (chunked or content_length is not None)
+        body = UpstreamBody(upstream, connection, pieces, reusable,
+                            lambda failed: self.__finish(upstream, failed=failed))
+        request.reply_stream(status_code, body, None, extra_headers, coalesce_bytes=0,
+                             content_length=content_length)
+
+    def __pick(self, exclude: set) -> Upstream:
+        """
+        Picks the server the next request goes to, and counts the request as in flight to it
+
+        Params:
+        - `exclude` - servers already tried for this request
+
+        Returns:
+        The server, or None if no server is available
+        """
+        now = time.monotonic()
+        with self.__lock:
+            count = len(self.upstreams)
+            candidates = [self.upstreams[(self.__next + offset) % count] for offset in range(count)]
+            candidates = [upstream for upstream in candidates
+                          if upstream not in exclude and upstream.is_available(now)]
+            if not candidates:
+                return None
+            if self.balance == 'least_conn':
+                # Ties go to the server next in round-robin order
+                upstream = min(candidates, key=lambda candidate: candidate.active)
+            else:
+                upstream = candidates[0]
+            self.__next = (self.upstreams.index(upstream) + 1) % count
+            upstream.active += 1
+            return upstream
+
+    def __finish(self, upstream: Upstream, failed: bool = False, timed_out: bool = False):
+        """
+        Records the end of a request to a server, leaving the server out of rotation once it has failed
+        `max_fails` times in a row
+        """
+        if failed:
+            upstream.count('timeouts' if timed_out else 'failures')
+        with self.__lock:
+            upstream.active -= 1
+            if not failed:
+                upstream.failures = 0
+                return
+            upstream.failures += 1
+            if upstream.failures >= self.max_fails:
+                upstream.ejected_until = time.monotonic() + self.fail_timeout
+
+    def __start_health_checks(self):
+        """
+        Starts the health check thread, unless it is running. Started on first use rather than on creation
+        so it also runs in forked worker processes.
+        """
+        if self.__health_checker is not None and self.__health_checker.is_alive():
+            return
+        with self.__lock:
+            if self.__health_checker is not None and self.__health_checker.is_alive():
+                return
+            self.__health_checker = threading.Thread(target=self.__check_health, name='proxy-health-check',
+                                                     daemon=True)
+            self.__health_checker.start()
+
+    def __check_health(self):
+        """
+        Health check thread loop: probes every server with a GET of `health_check_path` on a new connection,
+        a server stays out of rotation until it answers with a status below 400
+        """
+        head = (f'GET {self.health_check_path} HTTP/1.1\r\nHost: {{}}\r\nConnection: close\r\n'
+                f'User-Agent: sumitro-server/1.0 health check\r\n\r\n')
+        while not self.__closed.is_set():
+            for upstream in self.upstreams:
+                try:
+                    connection = upstream.connect()
+                    try:
+                        connection.socket.sendall(head.format(upstream.address).encode(HEADER_ENCODING))
+                        healthy = connection.read_head().status_code < 400
+                    finally:
+                        connection.close()
+                except (UpstreamError, OSError):
+                    healthy = False
+                upstream.healthy = healthy
+            self.__closed.wait(self.health_check_interval)
+
+    def close(self):
+        """
+        Stops the health checks and closes the pooled connections, e.g. once a configuration reload has
+        replaced the proxy. Requests still in flight are finished, their connections are then closed.
+        """
+        self.__closed.set()
+        for upstream in self.upstreams:
+            upstream.close()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+        The counters of every server added up, along with the number of servers in rotation
+        """
+        totals = {}
+        for upstream in self.upstreams:
+            for name, value in upstream.stats().items():
+                totals[name] = totals.get(name, 0) + value
+        now = time.monotonic()
+        totals['upstreams_available'] = sum(upstream.is_available(now) for upstream in self.upstreams)
+        return totals
+
+
+def encode_request_head(request: Request) -> bytes:
+    """
+    Encodes the head of a request as forwarded to an upstream server: hop-by-hop headers are dropped,
+    the client is added to `X-Forwarded-For` and the body, already read in full, is sent with a `Content-Length`
+
+    Params:
+    - `request` - the client's request
+    """
+    dropped = DROPPED_REQUEST_HEADERS | connection_tokens(request.get_header('Connection'))
+    lines = [f'{name}: {value}' for name, value in request.headers.items() if name.lower() not in dropped]
+    forwarded_for = request.get_header('X-Forwarded-For')
+    if request.client_address is not None:
+        forwarded_for = request.client_address if forwarded_for is None \
+            else f'{forwarded_for}, {request.client_address}'
+    if forwarded_for is not None:
+        lines.append(f'X-Forwarded-For: {forwarded_for}')
+    lines.append('X-Forwarded-Proto: http')
+    if request.body or request.method in ('POST', 'PUT'):
+        lines.append(f'Content-Length: {len(request.body)}')
+
+    request_line = f'{request.method} {request.path} HTTP/1.1\r\n'.encode(DEFAULT_ENCODING)
+    return request_line + '\r\n'.join([*lines, '', '']).encode(HEADER_ENCODING, 'replace')
+
+
+def connection_tokens(connection_header: str) -> set:
+    """
+    Returns:
+    The lower-cased header names listed in a `Connection` header, which are hop-by-hop as well
+    """
+    if not connection_header:
+        return set()
+    return {token.strip().lower() for token in connection_header.split(',')}
+
+
+def parse_upstreams(upstreams: str) -> list:
+    """
+    Parses the upstream servers of a proxied prefix
+
+    Params:
+    - `upstreams` - comma separated `HOST:PORT` addresses, e.g. `127.0.0.1:9000,127.0.0.1:9001`
+
+    Returns:
+    The list of `(host, port)` tuples
+
+    Raises:
+    ValueError if an address is invalid
+    """
+    parsed = []
+    for address in upstreams.split(','):
+        host, separator, port = address.strip().rpartition(':')
+        if not separator or not host or not is_decimal(port):
+            raise ValueError(f'Invalid upstream server, expected HOST:PORT: {address}')
+        parsed.append((host.strip('[]'), int(port)))
+    return parsed
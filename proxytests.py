@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# Tests of the reverse proxy: starts two stand-in backend servers and the web server with prefixes
+# proxied to them, then checks forwarding, chunked bodies, connection reuse, balancing and upstream failures.
+#
+# run: python proxytests.py
+# (SERVER_MODE=asyncio python proxytests.py to test another serving mode)
+
+import http.client
+import http.server
+import json
+import socket
+import threading
+import time
+import unittest
+from urllib import request
+
+from protocoltests import RawClient, get_request, start_server, stop_server
+
+PROXY_PORT = 8081
+BASEURL = f"http://127.0.0.1:{PROXY_PORT}"
+
+
+class Backend(http.server.BaseHTTPRequestHandler):
+    """Stand-in upstream server answering with what it saw, its name and the port of the proxy's connection"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path.endswith('/bad-status'):
+            # `²` is a digit to `str.isdigit` but not to `int`
+            self.wfile.write(b'HTTP/1.1 \xb200 OK\r\nContent-Length: 0\r\n\r\n')
+            return
+        if self.path.endswith('/bad-length'):
+            self.wfile.write(b'HTTP/1.1 200 OK\r\nContent-Length: \xb2\r\n\r\n')
+            return
+        if self.path.endswith('/slow'):
+            time.sleep(1)
+        if self.path.endswith('/chunked'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for index in range(5):
+                piece = f'piece {index}\n'.encode()
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(piece), piece))
+            self.wfile.write(b'0\r\n\r\n')
+            return
+        self.reply()
+
+    def do_POST(self):
+        self.reply(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+
+    def reply(self, body: bytes = b''):
+        payload = json.dumps({
+            'backend': self.server.name,
+            'method': self.command,
+            'path': self.path,
+            'port': self.client_address[1],
+            'forwarded_for': self.headers.get('X-Forwarded-For'),
+            'body': body.decode(),
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionError:
+            # The proxy gave up on a slow reply
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_backend(name: str) -> http.server.ThreadingHTTPServer:
+    backend = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Backend)
+    backend.name = name
+    threading.Thread(target=backend.serve_forever, daemon=True).start()
+    return backend
+
+
+def unused_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def get_json(path: str, data: bytes = None) -> dict:
+    with request.urlopen(BASEURL + path, data, 3) as response:
+        return json.loads(response.read())
+
+
+def get_json_sequence(path: str, count: int) -> list:
+    """
+    Sends `count` requests on one client connection, so that with `prefork`/`reuseport` they are all
+    proxied by the same worker process
+    """
+    connection = http.client.HTTPConnection('127.0.0.1', PROXY_PORT, timeout=3)
+    replies = []
+    for _ in range(count):
+        connection.request('GET', path)
+        response = connection.getresponse()
+        assert response.status == 200
+        replies.append(json.loads(response.read()))
+    connection.close()
+    return replies
+
+
+class TestReverseProxy(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.first = start_backend('first')
+        cls.second = start_backend('second')
+        first = f'127.0.0.1:{cls.first.server_address[1]}'
+        second = f'127.0.0.1:{cls.second.server_address[1]}'
+        dead = f'127.0.0.1:{unused_port()}'
+        cls.server = start_server(
+            PROXY_PORT,
+            '--proxy', f'/api={first},{second}',
+            '--proxy', f'/single={first}',
+            '--proxy', f'/dead={dead}',
+            '--proxy', f'/mixed={dead},{first}',
+            '--proxy-read-timeout', '0.5',
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        stop_server(cls.server)
+        cls.first.shutdown()
+        cls.second.shutdown()
+
+    def test_get_forwarded(self):
+        reply = get_json('/single/echo?x=1')
+        self.assertEqual(reply['backend'], 'first')
+        self.assertEqual(reply['path'], '/single/echo?x=1')
+        self.assertEqual(reply['forwarded_for'], '127.0.0.1')
+
+    def test_post_body_forwarded(self):
+        reply = get_json('/single/echo', b'hello upstream')
+        self.assertEqual(reply['method'], 'POST')
+        self.assertEqual(reply['body'], 'hello upstream')
+
+    def test_upstream_connections_reused(self):
+        ports = {reply['port'] for reply in get_json_sequence('/single/echo', 10)}
+        self.assertEqual(len(ports), 1, "Sequential requests should share one pooled upstream connection")
+
+    def test_chunked_response_streamed(self):
+        with request.urlopen(BASEURL + '/single/chunked', None, 3) as response:
+            self.assertEqual(response.headers.get('Transfer-Encoding'), 'chunked')
+            self.assertEqual(response.read(), b''.join(f'piece {index}\n'.encode() for index in range(5)))
+
+    def test_chunked_response_framing(self):
+        client = RawClient(PROXY_PORT)
+        try:
+            # The next response only parses if the chunked body ended exactly at its last chunk
+            client.send(get_request('/single/chunked') + get_request('/single/echo'))
+            status_code, headers, body = client.read_response()
+            self.assertEqual(status_code, 200)
+            self.assertEqual(headers['transfer-encoding'], 'chunked')
+            self.assertNotIn('content-length', headers)
+            self.assertEqual(body, b''.join(f'piece {index}\n'.encode() for index in range(5)))
+            status_code, _, body = client.read_response()
+            self.assertEqual(status_code, 200)
+            self.assertEqual(json.loads(body)['path'], '/single/echo')
+        finally:
+            client.close()
+
+    def test_chunked_request_body_with_trailers(self):
+        client = RawClient(PROXY_PORT)
+        try:
+            client.send(b'POST /single/echo HTTP/1.1\r\nHost: 127.0.0.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+                        b'6;name=value\r\nhello \r\n8\r\nupstream\r\n0\r\nX-Checksum: 1234\r\n\r\n' +
+                        get_request('/single/echo'))
+            status_code, _, body = client.read_response()
+            self.assertEqual(status_code, 200)
+            reply = json.loads(body)
+            self.assertEqual((reply['method'], reply['body']), ('POST', 'hello upstream'))
+            # The trailer section was consumed along with the body
+            status_code, _, body = client.read_response()
+            self.assertEqual(status_code, 200)
+            self.assertEqual(json.loads(body)['method'], 'GET')
+        finally:
+            client.close()
+
+    def test_malformed_upstream_response(self):
+        for path in ['/single/bad-status', '/single/bad-length']:
+            with self.subTest(path=path):
+                with self.assertRaises(request.HTTPError) as context:
+                    request.urlopen(BASEURL + path, None, 3)
+                self.assertEqual(context.exception.getcode(), 502)
+        self.assertEqual(get_json('/single/echo')['backend'], 'first')
+
+    def test_round_robin(self):
+        backends = [reply['backend'] for reply in get_json_sequence('/api/echo', 4)]
+        self.assertEqual(sorted(backends), ['first', 'first', 'second', 'second'])
+
+    def test_unreachable_upstream(self):
+        with self.assertRaises(request.HTTPError) as context:
+            request.urlopen(BASEURL + '/dead/echo', None, 3)
+        self.assertEqual(context.exception.getcode(), 502)
+
+    def test_upstream_timeout(self):
+        with self.assertRaises(request.HTTPError) as context:
+            request.urlopen(BASEURL + '/single/slow', None, 3)
+        self.assertEqual(context.exception.getcode(), 504)
+
+    def test_unreachable_upstream_skipped(self):
+        for _ in range(5):
+            self.assertEqual(get_json('/mixed/echo')['backend'], 'first')
+
+
+if __name__ == '__main__':
+    unittest.main()
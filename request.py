@@ -1,9 +1,10 @@
 import json
-from socket import SHUT_WR, SocketType
-from constants import DEFAULT_ENCODING, HTTP_METHODS, STATUS_CODES, TEXT_CONTENT_TYPES
-from helpers import to_bytearray
-
-BUFFER_SIZE = 1024
+import time
+from connection import BaseConnection, IncompleteRequest
+from http_parser import ParseError, ParsedRequest
+from constants import DEFAULT_ENCODING, HTTP_METHODS, HTTP_VERSIONS
+from response import CHUNKED_HEADER, JSON_CONTENT_TYPE, ChunkedEncoder, IdentityEncoder, PrebuiltResponse, \
+    connection_headers, encode_response_head
 
 
 class Request:
@@ -11,118 +12,168 @@ class Request:
     Wrapper class for HTTP requests that can be used to read and reply to requests
     """
 
-    def __init__(self, request_socket: SocketType):
+    def __init__(self, connection: BaseConnection):
         """
-        Create a new HTTP request wrapper from a TCP socket request
+        Create a new HTTP request wrapper by reading the next request off a client connection.
+        Parsing and replying only go through the `BaseConnection` interface, so the same code
+        serves both the blocking socket and the asyncio backends.
+
+        If the peer closes the connection (or stays idle) before sending anything,
+        `connection_closed` is set and the request should not be replied to.
+        If the request is malformed or exceeds a parser limit, `valid` is False and `error`
+        holds the `ParseError` describing the status to reply with.
+
+        Responses to HEAD requests go through the same reply methods, which then send the head only.
+
+        Once replied to, `status_code`, `bytes_sent`, `response_started` and `response_finished`
+        (`time.perf_counter` timestamps) describe the response for metrics, and `phases` holds the time
+        handlers spent in phases of their own (see `add_phase`). Requests replied to later through
+        `run_blocking` have `deferred` set and call `on_finish` once they are.
         """
         self.headers = None
         self.body = None
-
-        self.__request = request_socket
+        self.connection_closed = False
+        self.keep_alive = False
+        self.error = None
+        self.client_address = connection.client_address
+        self.parse_time = 0.0
+        self.status_code = None
+        self.bytes_sent = 0
+        self.response_started = None
+        self.response_finished = None
+        self.phases = {}
+        self.deferred = False
+        self.on_finish = None
+        self.__header_index = {}
+        self.__head_only = False
+
+        self.__connection = connection
 
         try:
-            self.__parse_request(request_socket)
+            pipelined = connection.has_buffered_data()
+            parsed = connection.read_request()
+            self.parse_time = connection.parse_time
+            if parsed is None:
+                self.connection_closed = True
+                self.valid = False
+                self.__close_connection()
+                return
+            self.__populate(parsed)
+            connection.start_request(pipelined)
             self.valid = self.__validate()
+            self.keep_alive = self.valid and self.__wants_keep_alive() and connection.can_keep_alive()
+        except IncompleteRequest:
+            # Non-blocking connections retry once more bytes have arrived
+            raise
+        except ParseError as err:
+            self.error = err
+            self.valid = False
         except Exception:
             self.valid = False
 
-    def __parse_request(self, socket: SocketType) -> bytes:
+    def __populate(self, parsed: ParsedRequest):
         """
-        Parses the entire request and populates the following `self` fields: `method`, `uri`, `http_version`, `headers`, `body`
+        Fills in the following `self` fields from a parsed request: `method`, `path`, `http_version`,
+        `headers` and `body` (the raw bytes of the message body)
         """
-        raw_payload = b''
-        while True:
-            chunk = socket.recv(BUFFER_SIZE)
-            raw_payload += chunk
+        self.method = parsed.method
+        self.path = parsed.path
+        self.http_version = parsed.http_version
+        self.headers = parsed.headers
+        self.body = parsed.body
+        self.__header_index = parsed.header_index
+        self.__head_only = parsed.method == 'HEAD'
 
-            if raw_payload.find(b'\r\n\r\n') == -1:
-                # Haven't seen end of HTTP header, keep reading
-                continue
-
-            # https://stackoverflow.com/questions/606191/convert-bytes-to-a-string
-            payload = raw_payload.decode(DEFAULT_ENCODING)
-
-            if self.headers == None:
-                headers_and_body = payload.split('\r\n\r\n')
-                self.__initialize_headers(headers_and_body[0])
+    def __validate(self) -> bool:
+        """
+        Helper function to ensure the TCP payload is HTTP/1.1 (or HTTP/2) compliant
 
-            if 'Content-Length' not in self.headers:
-                return
+        Returns:
+        True if the request is compliant, False otherwise
+        """
+        if self.method not in HTTP_METHODS:
+            return False
+        if self.http_version not in HTTP_VERSIONS:
+            return False
 
-            body = headers_and_body[1]
-            if len(body) == int(self.headers['Content-Length']):
-                self.body = body
-                return
+        return True
 
-    def __initialize_headers(self, headers: str):
+    def __wants_keep_alive(self) -> bool:
         """
-        Takes a string holding all the characters up to the final CLRF just before the HTTP message body
-        and populates the corresponding fields in the Request object.
+        Helper function to check whether the client allows the connection to persist after this request.
+        HTTP/1.1 connections are persistent unless the client sends `Connection: close`.
         """
-        self.headers = {}
-        headers_split = headers.split('\r\n')
-
-        self.__parse_status_line(headers_split[0])
-        self.__parse_headers(headers_split[1:])
+        connection_header = self.get_header('Connection', '')
+        return 'close' not in connection_header.lower()
 
-    def __parse_status_line(self, status_line: str):
+    def add_phase(self, phase: str, seconds: float):
         """
-        Parses through the given status line to fill in `self.method`, `self.path`, `self.http_version`
-        
-        Params:
-        - `status_line` - the status line string to get the method, path, and http version from
-       """
-        method, path, http_version = status_line.split(' ')
-        self.method = method
-        self.path = path
-        self.http_version = http_version
+        Records time a handler spent in one phase of replying, e.g. `open` for resolving, stat-ing and
+        opening a file or `read` for reading it, reported in the metrics and the slow request log
 
-    def __parse_headers(self, headers):
-        """
-        Parses through the given array of HTTP headers to fill in the dictionary `self.headers`
-        
         Params:
-        - `headers` - an array of strings after the status line but before the final CLRF before the payload
+        - `phase` - name of the phase, time spent in a phase several times is added up
+        - `seconds` - duration
         """
-        for header in headers:
-            key, value = header.split(': ')
-            self.headers[key] = value
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
 
-    def __validate(self) -> bool:
+    def get_header(self, name: str, default: str = None) -> str:
         """
-        Helper function to ensure the TCP payload is HTTP/1.1 compliant
+        Case-insensitive lookup of a request header
 
-        Returns:
-        True if the request is HTTP/1.1 compliant, False otherwise
+        Params:
+        - `name` - the header field name (e.g. `Connection`)
+        - `default` - value returned if the header is missing
         """
-        if self.method not in HTTP_METHODS:
-            return False
-        if self.http_version != 'HTTP/1.1':
-            return False
-
-        return True
+        return self.__header_index.get(name.lower(), default)
 
-    def __status_line(self, status_code: int) -> str:
+    def __close_connection(self):
+        """
+        Closes socket connection associated with request.
         """
-        Helper function to generate the [status line](https://datatracker.ietf.org/doc/html/rfc2616#section-6.1)
-        field in a HTTP/1.1 header
+        self.__connection.close()
 
-        Params:
-        - `status_code` - A valid HTTP/1.1 status code
+    def __connection_headers(self) -> bytes:
+        """
+        Helper function to encode the headers that tell the client whether the connection persists,
+        followed by the blank line that ends the response head
+        """
+        if not self.keep_alive:
+            return connection_headers(False)
+        connection = self.__connection
+        return connection_headers(True, int(connection.idle_timeout),
+                                  connection.max_requests - connection.requests_served - 1)
 
-        Returns:
-        A single line string representing the HTTP status line
+    def __start_response(self, status_code: int, byte_count: int):
+        """
+        Records the status and size of the response about to be sent
         """
-        http_version = 'HTTP/1.1'
-        reason_phrase = STATUS_CODES[status_code]
-        return f'{http_version} {status_code} {reason_phrase}'
+        if self.response_started is None:
+            self.response_started = time.perf_counter()
+        self.status_code = status_code
+        self.bytes_sent += byte_count
 
-    def __close_connection(self):
+    def __finish(self):
         """
-        Closes socket connection associated with request.
+        Completes the request once the response has been sent, closing the connection unless it is kept alive
+        """
+        self.response_finished = time.perf_counter()
+        self.__connection.finish_request()
+        if not self.keep_alive:
+            self.__close_connection()
+        if self.on_finish is not None:
+            self.on_finish()
+
+    def run_blocking(self, function):
+        """
+        Replies to the request from `function()`, which may block on I/O of its own (e.g. a request to
+        another server). The blocking backends call it right away. The asyncio backend calls it on a worker
+        thread once earlier responses on the connection have been sent, and sets `deferred`.
+
+        Params:
+        - `function` - callable taking no arguments that calls one of the reply methods
         """
-        self.__request.shutdown(SHUT_WR)
-        self.__request.close()
+        self.deferred = self.__connection.run_blocking(function)
 
     def reply_json(self, obj: dict, status_code: int, extra_headers: str = None):
         """
@@ -136,8 +187,8 @@ class Request:
         """
         # https://www.geeksforgeeks.org/how-to-convert-python-dictionary-to-json/
         self.reply(status_code,
-                   message_body=to_bytearray(json.dumps(obj)),
-                   content_type=TEXT_CONTENT_TYPES['json'],
+                   message_body=json.dumps(obj).encode(DEFAULT_ENCODING),
+                   content_type=JSON_CONTENT_TYPE,
                    extra_headers=extra_headers)
 
     def reply(self, status_code: int, message_body: bytearray, content_type: str, extra_headers: str = None):
@@ -146,27 +197,190 @@ class Request:
 
         Params:
         - `status_code` - the HTTP response that should be sent to the client
-        - `message_body` - a bytearray representing the encoded text or binary contents of a file
+        - `message_body` - bytes-like encoded text or binary contents of a file, sent without being copied
         - `content_type` - the value to be used in the 'Content-Type' field of the HTTP header (possibly including character encoding)
         - `extra_headers` - additional headers that should be attached (use `'\r\n'.join`
            if you have multiple headers that need to be attached)
         """
-        entity_headers = [
-            f'Content-Length: {len(message_body)}',
-            'Server: sumitro-server/1.0',
-            'Connection: close'
-        ]
+        self.reply_prebuilt(encode_response_head(status_code, len(message_body), content_type, extra_headers),
+                            message_body, status_code)
 
-        if content_type != None:
-            entity_headers.append(f'Content-Type: {content_type}')
+    def __response_head(self, status_code: int, content_length: int, content_type: str,
+                        extra_headers: str = None) -> list:
+        """
+        Helper function to encode the status line and headers of a response, up to and including the blank line
 
-        if extra_headers != None:
-            entity_headers.append(extra_headers)
+        Params:
+        - see `reply`
+        - `content_length` - the size of the message body in bytes, None leaves out `Content-Length`
 
-        self.__request.sendall(
-            bytearray('\r\n'.join([self.__status_line(status_code), '\r\n'.join(entity_headers), f'\r\n']),
-                    DEFAULT_ENCODING) + message_body)
-        self.__close_connection()
+        Returns:
+        The head as a list of buffers, to be sent with `send_parts` rather than joined
+        """
+        return [encode_response_head(status_code, content_length, content_type, extra_headers),
+                self.__connection_headers()]
+
+    def reply_file(self, status_code: int, file, offset: int, count: int, content_type: str,
+                   extra_headers: str = None):
+        """
+        Respond to a HTTP request by streaming part of an open file, the body is never read into memory.
+        Ownership of `file` passes to the connection, which closes it once sent.
+
+        Params:
+        - `status_code` - the HTTP response that should be sent to the client
+        - `file` - a file object opened in binary mode
+        - `offset` - position in the file where the body starts
+        - `count` - number of bytes of the file to send
+        - `content_type` - the value to be used in the 'Content-Type' field of the HTTP header
+        - `extra_headers` - additional headers that should be attached (use `'\r\n'.join`
+           if you have multiple headers that need to be attached)
+        """
+        if self.__head_only:
+            file.close()
+            self.reply_head(status_code, count, content_type, extra_headers)
+            return
+        head = self.__response_head(status_code, count, content_type, extra_headers)
+        self.__start_response(status_code, sum(map(len, head)) + count)
+        self.__connection.send_parts(head)
+        self.__connection.send_file(file, offset, count)
+        self.__finish()
+
+    def reply_segments(self, status_code: int, segments: list, content_length: int, content_type: str,
+                       extra_headers: str = None, file=None):
+        """
+        Respond to a HTTP request with a body made of several segments, each either an in-memory buffer
+        or a slice of an open file (e.g. the parts of a `multipart/byteranges` response).
+        File slices are streamed, and ownership of `file` passes to the connection, which closes it once sent.
+
+        Params:
+        - `status_code` - the HTTP response that should be sent to the client
+        - `segments` - list of bytes-like objects and `(offset, count)` tuples of `file`, in order
+        - `content_length` - total size of all segments in bytes
+        - `content_type` - the value to be used in the 'Content-Type' field of the HTTP header
+        - `extra_headers` - additional headers that should be attached (use `'\r\n'.join`
+           if you have multiple headers that need to be attached)
+        - `file` - a file object opened in binary mode, required if `segments` holds file slices
+        """
+        if self.__head_only:
+            if file is not None:
+                file.close()
+            self.reply_head(status_code, content_length, content_type, extra_headers)
+            return
+        buffered = self.__response_head(status_code, content_length, content_type, extra_headers)
+        self.__start_response(status_code, sum(map(len, buffered)) + content_length)
+        last_file_segment = max((index for index, segment in enumerate(segments) if isinstance(segment, tuple)),
+                                default=-1)
+        for index, segment in enumerate(segments):
+            if not isinstance(segment, tuple):
+                buffered.append(segment)
+                continue
+            self.__connection.send_parts(buffered)
+            buffered = []
+            offset, count = segment
+            self.__connection.send_file(file, offset, count, close_file=index == last_file_segment)
+        if buffered:
+            self.__connection.send_parts(buffered)
+        if file is not None and last_file_segment == -1:
+            file.close()
+        self.__finish()
+
+    def reply_stream(self, status_code: int, chunks, content_type: str, extra_headers: str = None,
+                     coalesce_bytes: int = None, content_length: int = None):
+        """
+        Respond to a HTTP request with a body produced while it is sent, with `Transfer-Encoding: chunked`
+        unless its length is known ahead. Pieces are pulled from `chunks` as the client takes them, and
+        small pieces are gathered into one chunk, so they must not be modified once yielded. If `chunks`
+        raises, the connection is closed without ending the body.
+
+        On the asyncio backend the body is sent after this returns, and isn't counted in `bytes_sent`.
+
+        Params:
+        - `status_code` - the HTTP response that should be sent to the client
+        - `chunks` - generator, iterable or async iterator of bytes-like pieces of the body
+        - `content_type` - the value to be used in the 'Content-Type' field of the HTTP header
+        - `extra_headers` - additional headers that should be attached (use `'\r\n'.join`
+           if you have multiple headers that need to be attached)
+        - `coalesce_bytes` - smallest chunk sent before the end of the body, the connection's
+           setting by default, 0 sends every piece as soon as it is produced
+        - `content_length` - the exact size of the body if known, it is then sent unframed with a
+           `Content-Length` header and pieces aren't coalesced
+        """
+        headers = extra_headers
+        if content_length is None:
+            headers = CHUNKED_HEADER if extra_headers is None else f'{extra_headers}\r\n{CHUNKED_HEADER}'
+        if self.__head_only:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            self.reply_head(status_code, content_length, content_type, headers)
+            return
+        connection = self.__connection
+        if content_length is None:
+            encoder = ChunkedEncoder(connection.coalesce_bytes if coalesce_bytes is None else coalesce_bytes)
+        else:
+            encoder = IdentityEncoder(content_length)
+        head = self.__response_head(status_code, content_length, content_type, headers)
+        self.__start_response(status_code, sum(map(len, head)))
+        connection.send_parts(head)
+        connection.send_stream(chunks, encoder)
+        self.bytes_sent += encoder.bytes_framed
+        self.__finish()
+
+    def reply_prebuilt(self, head: bytes, body: bytes, status_code: int = 200):
+        """
+        Respond to a HTTP request with a response built ahead of time (e.g. by `FileCache`).
+        Head and body are written with scatter/gather I/O so neither is copied.
+
+        Params:
+        - `head` - output of `encode_response_head`
+        - `body` - the encoded message body
+        - `status_code` - the status encoded in `head`
+        """
+        connection_headers = self.__connection_headers()
+        if self.__head_only:
+            body = b''
+        self.__start_response(status_code, len(head) + len(connection_headers) + len(body))
+        self.__connection.send_parts([head, connection_headers, body])
+        self.__finish()
+
+    def reply_response(self, response: PrebuiltResponse):
+        """
+        Respond to a HTTP request with a response encoded once ahead of time (e.g. a common error)
+
+        Params:
+        - `response` - the prebuilt response
+        """
+        self.reply_prebuilt(response.head, response.body, response.status_code)
+
+    def reply_head(self, status_code: int, content_length: int, content_type: str, extra_headers: str = None):
+        """
+        Respond to a HTTP request with the head of a response but no message body, e.g. to answer HEAD
+        with the headers a GET would get without reading the file
+
+        Params:
+        - `status_code` - the HTTP response that should be sent to the client
+        - `content_length` - the size of the body a GET would get, None if it isn't known without building it
+        - `content_type` - the value to be used in the 'Content-Type' field of the HTTP header
+        - `extra_headers` - additional headers that should be attached (use `'\r\n'.join`
+           if you have multiple headers that need to be attached)
+        """
+        head = self.__response_head(status_code, content_length, content_type, extra_headers)
+        self.__start_response(status_code, sum(map(len, head)))
+        self.__connection.send_parts(head)
+        self.__finish()
+
+    def reply_empty(self, status_code: int, extra_headers: str = None):
+        """
+        Respond to a HTTP request with a status that never has a message body (e.g. 304 Not Modified)
+
+        Params:
+        - `status_code` - the HTTP response that should be sent to the client
+        - `extra_headers` - additional headers that should be attached (use `'\r\n'.join`
+           if you have multiple headers that need to be attached)
+        """
+        head = self.__response_head(status_code, None, None, extra_headers)
+        self.__start_response(status_code, sum(map(len, head)))
+        self.__connection.send_parts(head)
+        self.__finish()
 
     def reply_bytearray(self, byte_array: bytearray):
         """
@@ -175,5 +389,7 @@ class Request:
         Params:
         - `byte_array` - bytearray representation of the TCP payload
         """
-        self.__request.sendall(byte_array)
+        self.__start_response(None, len(byte_array))
+        self.__connection.send(byte_array)
+        self.response_finished = time.perf_counter()
         self.__close_connection()
@@ -0,0 +1,213 @@
+import json
+from constants import DEFAULT_ENCODING, STATUS_CODES, TEXT_CONTENT_TYPES
+
+# Encoded status line of every known status, e.g. `HTTP/1.1 404 Not Found`
+STATUS_LINES = {code: f'HTTP/1.1 {code} {reason}'.encode(DEFAULT_ENCODING) for code, reason in STATUS_CODES.items()}
+
+SERVER_HEADER = b'\r\nServer: sumitro-server/1.0'
+
+JSON_CONTENT_TYPE = TEXT_CONTENT_TYPES['json']
+
+# Encoded `Content-Type` header lines, filled in as content types are first used
+CONTENT_TYPE_HEADERS = {}
+
+# Connection headers of responses ending their connection, see `connection_headers`
+CLOSE_HEADERS = b'\r\nConnection: close\r\n\r\n'
+
+CHUNKED_HEADER = 'Transfer-Encoding: chunked'
+
+# Streamed body bytes gathered into one chunk before it is sent, so small writes don't each become a packet
+DEFAULT_COALESCE_BYTES = 8 * 1024
+
+# Ends a chunked body, with an empty trailer section
+LAST_CHUNK = b'0\r\n\r\n'
+
+
+def encode_response_head(status_code: int, content_length: int, content_type: str, extra_headers: str = None) -> bytes:
+    """
+    Encodes the status line and entity headers of a response. The connection headers and the blank line
+    ending the head are left off as they depend on the connection the response is sent on.
+    The status line and the `Server` and `Content-Type` headers come from precomputed bytes, only
+    `Content-Length` and `extra_headers` are encoded per response.
+
+    Params:
+    - `status_code` - the HTTP response that should be sent to the client, statuses missing from
+       `STATUS_CODES` (e.g. relayed from a proxied server) are sent without a reason phrase
+    - `content_length` - the size of the message body in bytes, None leaves out `Content-Length`
+    - `content_type` - the value to be used in the 'Content-Type' field of the HTTP header
+    - `extra_headers` - additional headers that should be attached (use `'\r\n'.join`
+       if you have multiple headers that need to be attached)
+    """
+    status_line = STATUS_LINES.get(status_code)
+    parts = [status_line if status_line is not None else b'HTTP/1.1 %d ' % status_code]
+    if content_length is not None:
+        parts.append(b'\r\nContent-Length: %d' % content_length)
+    parts.append(SERVER_HEADER)
+    if content_type is not None:
+        parts.append(content_type_header(content_type))
+    if extra_headers is not None:
+        parts.append(b'\r\n')
+        parts.append(extra_headers.encode(DEFAULT_ENCODING))
+    return b''.join(parts)
+
+
+def content_type_header(content_type: str) -> bytes:
+    """
+    Returns:
+    The encoded `Content-Type` header line, preceded by the line break ending the previous header
+    """
+    header = CONTENT_TYPE_HEADERS.get(content_type)
+    if header is None:
+        header = f'\r\nContent-Type: {content_type}'.encode(DEFAULT_ENCODING)
+        CONTENT_TYPE_HEADERS[content_type] = header
+    return header
+
+
+def connection_headers(keep_alive: bool, timeout: int = 0, remaining: int = 0) -> bytes:
+    """
+    Encodes the headers that tell the client whether the connection persists, followed by the blank line
+    that ends the response head
+
+    Params:
+    - `keep_alive` - whether the connection stays open after the response
+    - `timeout` - seconds the idle connection is kept open
+    - `remaining` - requests the client may still send on the connection
+    """
+    if not keep_alive:
+        return CLOSE_HEADERS
+    return b'\r\nConnection: keep-alive\r\nKeep-Alive: timeout=%d, max=%d\r\n\r\n' % (timeout, remaining)
+
+
+class PrebuiltResponse:
+    """A complete response, but for its connection headers, encoded once and sent as-is to every request"""
+
+    __slots__ = ['status_code', 'head', 'body']
+
+    def __init__(self, status_code: int, body: bytes, content_type: str, extra_headers: str = None):
+        """
+        Params:
+        - `status_code` - the HTTP response status
+        - `body` - the encoded message body
+        - `content_type` - the value of the `Content-Type` header
+        - `extra_headers` - additional headers, see `encode_response_head`
+        """
+        self.status_code = status_code
+        self.head = encode_response_head(status_code, len(body), content_type, extra_headers)
+        self.body = body
+
+
+def prebuilt_json(obj: dict, status_code: int, extra_headers: str = None) -> PrebuiltResponse:
+    """
+    Encodes a JSON reply once, for replies whose body never changes (e.g. common errors)
+
+    Params:
+    - see `Request.reply_json`
+    """
+    return PrebuiltResponse(status_code, json.dumps(obj).encode(DEFAULT_ENCODING), JSON_CONTENT_TYPE, extra_headers)
+
+
+class IdentityEncoder:
+    """
+    Passes the pieces of a streamed body whose `Content-Length` was sent ahead through unframed,
+    with the same interface as `ChunkedEncoder`
+    """
+
+    __slots__ = ['content_length', 'bytes_framed']
+
+    def __init__(self, content_length: int):
+        """
+        Params:
+        - `content_length` - the length announced in the response head
+        """
+        self.content_length = content_length
+        self.bytes_framed = 0
+
+    def write(self, data) -> list:
+        """
+        Params:
+        - `data` - the next bytes-like piece of the body
+
+        Returns:
+        The buffers to send now
+
+        Raises:
+        ValueError if the body grows past `content_length`
+        """
+        if len(data) == 0:
+            return []
+        self.bytes_framed += len(data)
+        if self.bytes_framed > self.content_length:
+            raise ValueError('Streamed body is longer than its Content-Length')
+        return [data]
+
+    def flush(self) -> list:
+        return []
+
+    def finish(self) -> list:
+        """
+        Raises:
+        ValueError if the body ended short of `content_length`
+        """
+        if self.bytes_framed != self.content_length:
+            raise ValueError('Streamed body is shorter than its Content-Length')
+        return []
+
+
+class ChunkedEncoder:
+    """
+    Frames the pieces of a streamed body with the chunked transfer coding, gathering small pieces into
+    one chunk of at least `coalesce_bytes` bytes. Frames are returned as lists of buffers for `send_parts`,
+    so the body pieces themselves are never copied.
+    """
+
+    __slots__ = ['coalesce_bytes', 'bytes_framed', '__pending', '__pending_size']
+
+    def __init__(self, coalesce_bytes: int = DEFAULT_COALESCE_BYTES):
+        """
+        Params:
+        - `coalesce_bytes` - smallest chunk sent before the end of the body, 0 sends every piece as its own chunk
+        """
+        self.coalesce_bytes = coalesce_bytes
+        # Bytes returned so far, framing included
+        self.bytes_framed = 0
+        self.__pending = []
+        self.__pending_size = 0
+
+    def write(self, data) -> list:
+        """
+        Params:
+        - `data` - the next bytes-like piece of the body
+
+        Returns:
+        The buffers of a chunk to send now, or an empty list if `data` is held back to coalesce with later pieces
+        """
+        if len(data) == 0:
+            return []
+        self.__pending.append(data)
+        self.__pending_size += len(data)
+        if self.__pending_size < self.coalesce_bytes:
+            return []
+        return self.flush()
+
+    def flush(self) -> list:
+        """
+        Returns:
+        The buffers of a chunk holding every piece held back so far, empty if there are none
+        """
+        if self.__pending_size == 0:
+            return []
+        parts = [b'%x\r\n' % self.__pending_size, *self.__pending, b'\r\n']
+        self.bytes_framed += self.__pending_size + len(parts[0]) + 2
+        self.__pending = []
+        self.__pending_size = 0
+        return parts
+
+    def finish(self) -> list:
+        """
+        Returns:
+        The buffers ending the body, the held back pieces followed by the last chunk
+        """
+        parts = self.flush()
+        parts.append(LAST_CHUNK)
+        self.bytes_framed += len(LAST_CHUNK)
+        return parts
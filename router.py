@@ -0,0 +1,158 @@
+from request import Request
+from response import prebuilt_json
+
+
+class Route:
+    """A handler mounted on a path prefix (or an exact path) of the site"""
+
+    __slots__ = ['prefix', 'handler', 'methods', 'name', 'exact', 'allow_header', 'method_not_allowed']
+
+    def __init__(self, prefix: str, handler, methods: list = None, name: str = None, exact: bool = False):
+        """
+        Params:
+        - `prefix` - the mounted path (e.g. `/static`), matched on whole path segments
+        - `handler` - callable receiving the `Request`, returning False if it didn't reply so shorter
+           prefixes get a chance to
+        - `methods` - methods the route accepts, None accepts any method. OPTIONS is answered with the
+           `Allow` list unless the route accepts it itself
+        - `name` - label used in metrics and the access log, the prefix by default
+        - `exact` - only match the path itself, not the paths under it
+        """
+        self.prefix = prefix
+        self.handler = handler
+        self.methods = frozenset(methods) if methods is not None else None
+        self.name = name if name is not None else prefix
+        self.exact = exact
+        self.allow_header = None
+        self.method_not_allowed = None
+        if methods is not None:
+            self.allow_header = f'Allow: {", ".join(sorted(self.methods | {"OPTIONS"}))}'
+            self.method_not_allowed = prebuilt_json({'err': 'Method not allowed'}, 405, self.allow_header)
+
+
+class RouteNode:
+    """One path segment of the routing trie"""
+
+    __slots__ = ['children', 'prefix_route', 'exact_route']
+
+    def __init__(self):
+        self.children = {}
+        self.prefix_route = None
+        self.exact_route = None
+
+
+class Router:
+    """
+    Dispatches requests to mounted handlers by longest matching path prefix.
+
+    Mounts are stored in a trie keyed by path segment, so finding the handlers for a path walks one node
+    per segment of the request path whatever the number of mounts. `/static` matches `/static` and
+    `/static/app.css` but not `/staticfiles`. A handler returning False passes the request on to the next
+    shorter matching mount.
+    """
+
+    def __init__(self):
+        self.__root = RouteNode()
+        self.routes = []
+
+    def add(self, prefix: str, handler, methods: list = None, name: str = None, exact: bool = False) -> Route:
+        """
+        Mounts a handler, replacing any handler mounted on the same prefix
+
+        Params:
+        - see `Route`
+
+        Returns:
+        The new route
+        """
+        route = Route(prefix, handler, methods, name, exact)
+        node = self.__root
+        for segment in split_path(prefix):
+            node = node.children.setdefault(segment, RouteNode())
+        if exact:
+            node.exact_route = route
+        else:
+            node.prefix_route = route
+        self.routes.append(route)
+        return route
+
+    def add_redirect(self, prefix: str, location: str, status_code: int = 301, name: str = 'redirect') -> Route:
+        """
+        Mounts a redirect of a prefix to another location, the rest of the path is appended to `location`
+
+        Params:
+        - `prefix` - the path prefix to redirect
+        - `location` - where to redirect to (e.g. `https://example.com/docs`)
+        - `status_code` - 301, 302, 307 or 308
+        """
+        def redirect(request: Request):
+            target = location + request.path[len(prefix.rstrip('/')):]
+            request.reply_json({'msg': f'Redirecting you to {target}'}, status_code=status_code,
+                               extra_headers=f'Location: {target}')
+
+        return self.add(prefix, redirect, name=name)
+
+    def add_json(self, path: str, function, methods: list = None, name: str = None) -> Route:
+        """
+        Mounts a function returning a dict, which is sent back as a 200 JSON response
+
+        Params:
+        - `path` - the exact path of the handler
+        - `function` - callable receiving the `Request` and returning the object to send
+        - `methods` - methods the handler accepts, `GET` and `HEAD` by default
+        """
+        def reply(request: Request):
+            request.reply_json(function(request), status_code=200)
+
+        return self.add(path, reply, methods or ['GET', 'HEAD'], name, exact=True)
+
+    def match(self, path: str) -> list:
+        """
+        Params:
+        - `path` - the request path, a query string is ignored
+
+        Returns:
+        The routes matching the path, longest prefix first
+        """
+        node = self.__root
+        matches = [node.prefix_route] if node.prefix_route is not None else []
+        for segment in split_path(path.partition('?')[0]):
+            node = node.children.get(segment)
+            if node is None:
+                break
+            if node.prefix_route is not None:
+                matches.append(node.prefix_route)
+        else:
+            if node.exact_route is not None:
+                matches.append(node.exact_route)
+        matches.reverse()
+        return matches
+
+    def dispatch(self, request: Request) -> str:
+        """
+        Replies to a request with the longest matching route that accepts it
+
+        Params:
+        - `request` - a valid HTTP request
+
+        Returns:
+        The name of the route that replied, or None if no route did
+        """
+        for route in self.match(request.path):
+            if route.methods is not None and request.method not in route.methods:
+                if request.method == 'OPTIONS':
+                    request.reply_empty(204, extra_headers=route.allow_header)
+                    return route.name
+                request.reply_response(route.method_not_allowed)
+                return route.name
+            if route.handler(request) is not False:
+                return route.name
+        return None
+
+
+def split_path(path: str) -> list:
+    """
+    Returns:
+    The non-empty segments of a path, `/a//b/` gives `['a', 'b']`
+    """
+    return [segment for segment in path.split('/') if segment]
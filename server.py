@@ -1,8 +1,33 @@
 # coding: utf-8
+import os
 import socketserver
+import threading
+import time
+from urllib.parse import parse_qs
+from access_log import AccessLogger
+from async_server import serve_async
+from autoindex import AutoIndex
+from bundle import BundleStore
+from cache_control import CacheControlRules
+from compression import Compression
+from concurrency import serve
+from config import STARTUP_SETTINGS, ServerConfig, parse_args
+from connection import CONNECTION_STATS, OPEN_CONNECTIONS, Connection
 from constants import DEFAULT_ENCODING
-from file_server import FileServer
+from file_cache import FileCache
+from file_index import FileIndex
+from file_server import ALLOWED_METHODS, FileServer
+from http2 import Http2Session, SocketHttp2Connection, detect_http2
+from http_parser import RequestParser
+from lifecycle import log
+from limits import ConnectionLimiter, RateLimiter
+from metrics import METRICS, METRICS_CONTENT_TYPE
+from mmap_pool import MmapPool
+from profiling import DEFAULT_PROFILE_LIMIT, PROFILE_SORT_KEYS, SamplingProfiler, SlowRequestLog
+from proxy import Proxy, parse_upstreams
 from request import Request
+from response import prebuilt_json
+from router import Router
 
 # Copyright 2022 Armianto Sumitro
 # Copyright 2013 Abram Hindle, Eddie Antonio Santos
@@ -30,30 +55,477 @@ from request import Request
 
 # try: curl -v -X GET http://127.0.0.1:8080/
 
-file_server = FileServer('/', './www')
+
+NO_MATCHING_ROUTE = prebuilt_json({'err': 'No matching route'}, 404)
+
+
+def build_file_server(config: ServerConfig) -> FileServer:
+    """
+    Creates the file server serving `config.directory`, or `config.bundle` if set, at the site root
+
+    Params:
+    - `config` - the server configuration
+
+    Raises:
+    OSError if the bundle can't be read, ValueError if it isn't a bundle
+    """
+    cache_control = CacheControlRules(config.cache_control, config.default_max_age)
+    compression = None
+    if config.compression:
+        compression = Compression(config.compression_min_bytes, config.compression_max_bytes,
+                                  config.compression_cache_bytes)
+    if config.bundle is not None:
+        bundle = BundleStore(config.bundle, config.bundle_check_interval)
+        return FileServer('/', config.directory, cache_control=cache_control, compression=compression, bundle=bundle)
+    cache = None
+    if config.cache_bytes > 0:
+        cache = FileCache(config.cache_bytes, config.cache_max_entry_bytes)
+    mmap_pool = None
+    if config.mmap_bytes > 0:
+        mmap_pool = MmapPool(config.mmap_bytes, config.mmap_max_file_bytes, config.mmap_max_files)
+    index = None
+    if config.file_index is not None:
+        index = FileIndex(config.directory, config.file_index, config.file_index_poll_interval)
+    autoindex = None
+    if config.autoindex:
+        autoindex = AutoIndex(page_size=config.autoindex_page_size)
+    return FileServer('/', config.directory, cache, cache_control, compression, index, mmap_pool, autoindex)
+
+
+def build_router(config: ServerConfig, file_server: FileServer, mounted: list) -> Router:
+    """
+    Mounts every handler of the site: the metrics and profiling endpoints, redirects, proxied prefixes and the
+    static file servers
+
+    Params:
+    - `config` - the server configuration
+    - `file_server` - the file server of the site root, its caches are shared with the other mounts
+    - `mounted` - list the other file servers and the proxies are appended to
+    """
+    router = Router()
+    router.add('/', file_server.handle, ALLOWED_METHODS, name='static')
+    for prefix, directory in config.mounts.items():
+        index = None
+        if config.file_index is not None:
+            index = FileIndex(directory, config.file_index, config.file_index_poll_interval)
+        base_path = prefix.rstrip('/') + '/'
+        mount = FileServer(base_path, directory, file_server.cache, file_server.cache_control,
+                           file_server.compression, index, file_server.mmap_pool, file_server.autoindex)
+        mounted.append(mount)
+        router.add(prefix, mount.handle, ALLOWED_METHODS, name=f'static:{base_path}')
+    for prefix, location in config.redirects.items():
+        router.add_redirect(prefix, location)
+    for prefix, upstreams in config.proxies.items():
+        proxy = Proxy(parse_upstreams(upstreams), config.proxy_balance, config.proxy_connect_timeout,
+                      config.proxy_read_timeout, config.proxy_max_idle_connections, config.proxy_max_fails,
+                      config.proxy_fail_timeout, config.proxy_health_check_path, config.proxy_health_check_interval)
+        mounted.append(proxy)
+        router.add(prefix, proxy.handle, name=f'proxy:{prefix}')
+    if config.metrics_path:
+        router.add(config.metrics_path, reply_metrics, ['GET', 'HEAD'], name='metrics', exact=True)
+    if profiler is not None:
+        router.add(config.profile_path, reply_profile, ['GET', 'HEAD'], name='profile', exact=True)
+    if slow_requests is not None:
+        router.add(config.slow_requests_path, reply_slow_requests, ['GET', 'HEAD'], name='slow_requests', exact=True)
+    return router
+
+
+class Site:
+    """
+    Everything built from the configuration that replies to requests. A reload builds a new site and
+    replaces the current one with a single assignment, so each request is served entirely by either the old
+    or the new configuration.
+    """
+
+    __slots__ = ['config', 'file_server', 'router', 'file_servers', 'proxies', 'rate_limiter']
+
+    def __init__(self, config: ServerConfig, previous: 'Site' = None):
+        """
+        Params:
+        - `config` - the configuration to build the site from
+        - `previous` - the site this one replaces on a reload, whose rate limiter is kept if its limits are unchanged
+
+        Raises:
+        OSError if a served directory can't be read
+        """
+        self.config = config
+        self.file_server = build_file_server(config)
+        mounted = []
+        self.router = build_router(config, self.file_server, mounted)
+        self.file_servers = [self.file_server, *(item for item in mounted if isinstance(item, FileServer))]
+        self.proxies = [item for item in mounted if isinstance(item, Proxy)]
+        limiter = previous.rate_limiter if previous is not None else None
+        if limiter is not None and (limiter.rate, limiter.burst) == (config.request_rate, config.request_burst):
+            # Keep the buckets, or every reload would hand each client a full burst again
+            self.rate_limiter = limiter
+        else:
+            self.rate_limiter = build_rate_limiter(config)
+
+    def close(self):
+        """
+        Stops the background work of a replaced site: file index refreshes and proxy health checks.
+        Requests it is still serving are unaffected.
+        """
+        for server in self.file_servers:
+            if server.index is not None:
+                server.index.stop()
+        for proxy in self.proxies:
+            proxy.close()
+
+
+def build_access_log(config: ServerConfig) -> AccessLogger:
+    """
+    Creates the access logger, or returns None if `config.access_log` isn't set
+
+    Params:
+    - `config` - the server configuration
+    """
+    if config.access_log is None:
+        return None
+    return AccessLogger(config.access_log, config.access_log_format, config.access_log_queue_size,
+                        max_bytes=config.access_log_max_bytes, rotate_interval=config.access_log_rotate_seconds,
+                        backup_count=config.access_log_backups, sample_rate=config.access_log_sample_rate)
+
+
+def build_rate_limiter(config: ServerConfig) -> RateLimiter:
+    """
+    Creates the per-IP request rate limiter, or returns None if `config.request_rate` is 0
+
+    Params:
+    - `config` - the server configuration
+    """
+    if config.request_rate == 0:
+        return None
+    return RateLimiter(config.request_rate, config.request_burst)
+
+
+def build_profiler(config: ServerConfig) -> SamplingProfiler:
+    """
+    Creates the request profiler, or returns None if `config.profile_sample_rate` is 0
+
+    Params:
+    - `config` - the server configuration
+    """
+    if config.profile_sample_rate == 0:
+        return None
+    return SamplingProfiler(config.profile_sample_rate)
+
+
+def build_slow_request_log(config: ServerConfig) -> SlowRequestLog:
+    """
+    Creates the log of the slowest recent requests, or returns None if `config.slow_requests` is 0
+
+    Params:
+    - `config` - the server configuration
+    """
+    if config.slow_requests == 0:
+        return None
+    return SlowRequestLog(config.slow_requests, config.slow_requests_window)
+
+
+def build_connection_limiter(config: ServerConfig) -> ConnectionLimiter:
+    """
+    Creates the cap on open connections, or returns None if neither `max_connections` nor
+    `max_connections_per_ip` is set
+
+    Params:
+    - `config` - the server configuration
+    """
+    if config.max_connections == 0 and config.max_connections_per_ip == 0:
+        return None
+    return ConnectionLimiter(config.max_connections, config.max_connections_per_ip)
+
+
+def reload_site():
+    """
+    Re-reads the command line configuration (and config file), builds a new site from it and swaps it in.
+    If the new configuration is invalid the current site is kept. Settings in `STARTUP_SETTINGS` keep their
+    current values until the server is restarted.
+    """
+    global site
+    with reload_lock:
+        started = time.perf_counter()
+        try:
+            new_config = parse_args()
+            restart_only = [name for name in STARTUP_SETTINGS if getattr(new_config, name) != getattr(config, name)]
+            for name in restart_only:
+                setattr(new_config, name, getattr(config, name))
+            new_site = Site(new_config, site)
+        except (ValueError, OSError) as err:
+            log(f'Reload failed, keeping the current configuration: {err}')
+            return
+        old_site, site = site, new_site
+        old_site.close()
+        log(f'Reloaded the configuration in {time.perf_counter() - started:.3f}s')
+        if restart_only:
+            log(f'Changed settings that only apply after a restart (SIGUSR2): {", ".join(restart_only)}')
+
+
+def dump_profile():
+    """
+    Writes the aggregated profile and the slowest recent requests of this process to files starting with
+    `config.profile_dump_prefix`, on SIGUSR1
+    """
+    prefix = f'{config.profile_dump_prefix}-{os.getpid()}'
+    try:
+        if profiler is not None:
+            if profiler.dump(f'{prefix}.prof'):
+                log(f'Wrote the request profile to {prefix}.prof')
+            else:
+                log('No request has been profiled yet')
+        if slow_requests is not None:
+            with open(f'{prefix}-slow.json', 'w', encoding=DEFAULT_ENCODING) as dump:
+                dump.write(slow_requests.render())
+            log(f'Wrote the slowest requests to {prefix}-slow.json')
+    except OSError as err:
+        log(f'Could not write the profile: {err}')
+
+
+def close_access_log():
+    """
+    Writes out the records still queued for the access log
+    """
+    if access_log is not None:
+        access_log.close()
 
 
 class MyWebServer(socketserver.BaseRequestHandler):
 
     def handle(self):
-        request = Request(self.request)
-        if not request.valid:
-            request.reply_bytearray(bytearray("Request doesn't follow HTTP/1.1 protocol", DEFAULT_ENCODING))
-            return
+        parser = RequestParser(config.max_header_bytes, config.max_header_count, config.max_body_bytes)
+        connection = Connection(self.request,
+                                idle_timeout=config.keep_alive_timeout,
+                                max_requests=config.max_keep_alive_requests,
+                                parser=parser,
+                                client_address=self.client_address[0],
+                                coalesce_bytes=config.stream_coalesce_bytes,
+                                header_timeout=config.header_timeout,
+                                body_timeout=config.body_timeout,
+                                write_timeout=config.write_timeout)
+        OPEN_CONNECTIONS.add(connection)
+        METRICS.connection_opened()
+        try:
+            # Serve requests until the client or the keep-alive policy closes the connection
+            while not connection.closed:
+                request = Request(connection)
+                if config.http2 and detect_http2(request) is not None:
+                    self.serve_http2(connection, request)
+                    break
+                self.handle_request(request)
+        except ConnectionError:
+            # The client went away or stopped reading the response
+            pass
+        finally:
+            connection.close()
+            OPEN_CONNECTIONS.discard(connection)
+            METRICS.connection_closed()
 
-        if file_server.handle(request):
-            return
+    def handle_request(self, request: Request):
+        route(request)
 
-        request.reply_json({'err': 'No matching route'}, status_code=404)
+    def serve_http2(self, connection: Connection, request: Request):
+        """
+        Serves the rest of the connection over HTTP/2, which `request` started
+        """
+        session = Http2Session(config.http2_max_streams, config.max_header_bytes, config.max_header_count,
+                               config.max_body_bytes, config.max_keep_alive_requests)
+        SocketHttp2Connection(connection, session, route).serve(request)
 
 
-if __name__ == "__main__":
-    HOST, PORT = "localhost", 8080
+def route(request: Request):
+    """
+    Replies to a single parsed request, shared by every serving backend, and records its metrics
+
+    Params:
+    - `request` - the HTTP request object
+    """
+    if request.connection_closed:
+        return
+
+    started = time.perf_counter()
+    profile = profiler.start() if profiler is not None else None
+    try:
+        handler = dispatch(request, site)
+    finally:
+        if profile is not None:
+            profiler.stop(profile)
+    if request.deferred:
+        # Replied to later on a worker thread, see `Request.run_blocking`
+        request.on_finish = lambda: record_request(request, handler, started)
+        return
+    record_request(request, handler, started)
+
+
+def record_request(request: Request, handler: str, started: float):
+    """
+    Records the metrics, access log entry and slow request log entry of a request once it has been replied to
+
+    Params:
+    - `request` - the HTTP request object
+    - `handler` - the name of the handler that replied
+    - `started` - `time.perf_counter` timestamp routing started at
+    """
+    finished = request.response_finished or time.perf_counter()
+
+    phases = {'parse': request.parse_time}
+    if request.response_started is not None:
+        # Routing covers resolving the path and opening, stat-ing or caching the file
+        phases['route'] = request.response_started - started
+        phases['send'] = finished - request.response_started
+    METRICS.observe_request(handler, request.status_code, request.bytes_sent, finished - started, phases)
+    if access_log is not None:
+        access_log.log(request, handler, finished - started)
+    if slow_requests is not None:
+        # Handlers time their own phases (`open`, `read`, `upstream`), which happen while routing
+        slow_requests.record(request.parse_time + finished - started, getattr(request, 'method', None),
+                             getattr(request, 'path', None), handler, request.status_code, request.bytes_sent,
+                             {**phases, **request.phases})
+
+
+def dispatch(request: Request, current: Site) -> str:
+    """
+    Picks what replies to a request and replies to it
+
+    Params:
+    - `request` - the HTTP request object
+    - `current` - the site serving the request
+
+    Returns:
+    The name of the handler that replied, used to label metrics
+    """
+    if request.error is not None:
+        request.reply_json({'err': request.error.message}, status_code=request.error.status_code)
+        return 'error'
+
+    if not request.valid:
+        request.reply_bytearray(bytearray("Request doesn't follow HTTP/1.1 protocol", DEFAULT_ENCODING))
+        return 'invalid'
+
+    if current.rate_limiter is not None:
+        retry_after = current.rate_limiter.take(request.client_address)
+        if retry_after > 0:
+            request.reply_json({'err': 'Too many requests'}, status_code=429,
+                               extra_headers=f'Retry-After: {retry_after}')
+            return 'rate_limited'
 
-    socketserver.TCPServer.allow_reuse_address = True
-    # Create the server, binding to localhost on port 8080
-    server = socketserver.TCPServer((HOST, PORT), MyWebServer)
+    handler = current.router.dispatch(request)
+    if handler is not None:
+        return handler
+
+    request.reply_response(NO_MATCHING_ROUTE)
+    return 'not_found'
+
+
+def reply_metrics(request: Request):
+    """
+    Replies with the server metrics in the Prometheus text format, along with the connection and cache counters
+
+    Params:
+    - `request` - the HTTP request object
+    """
+    current = site
+    file_server = current.file_server
+    counters = {f'{name}_total': value for name, value in CONNECTION_STATS.snapshot().items()}
+    gauges = {}
+    caches = [('file_cache', file_server.cache), ('mmap_pool', file_server.mmap_pool), ('bundle', file_server.bundle)]
+    if file_server.compression is not None:
+        caches.append(('compression_cache', file_server.compression.cache))
+    for prefix, cache in caches:
+        if cache is None:
+            continue
+        stats = cache.stats()
+        gauges[f'{prefix}_entries'] = stats.pop('entries')
+        gauges[f'{prefix}_bytes'] = stats.pop('bytes')
+        counters.update({f'{prefix}_{name}_total': value for name, value in stats.items()})
+    if file_server.autoindex is not None:
+        stats = file_server.autoindex.stats()
+        gauges['autoindex_listings'] = stats.pop('listings')
+        counters.update({f'autoindex_{name}_total': value for name, value in stats.items()})
+    if access_log is not None:
+        counters.update({f'access_log_{name}_total': value for name, value in access_log.stats().items()})
+    if current.proxies:
+        totals = {}
+        for proxy in current.proxies:
+            for name, value in proxy.stats().items():
+                totals[name] = totals.get(name, 0) + value
+        gauges['proxy_upstreams_available'] = totals.pop('upstreams_available')
+        gauges['proxy_idle_connections'] = totals.pop('idle_connections')
+        counters.update({f'proxy_{name}_total': value for name, value in totals.items()})
+    if connection_limiter is not None:
+        stats = connection_limiter.stats()
+        gauges['limited_connections_open'] = stats.pop('open')
+        counters.update({f'{name}_total': value for name, value in stats.items()})
+    if current.rate_limiter is not None:
+        stats = current.rate_limiter.stats()
+        gauges['rate_limited_clients'] = stats.pop('clients')
+        counters.update({f'{name}_total': value for name, value in stats.items()})
+
+    body = METRICS.render(counters, gauges).encode(DEFAULT_ENCODING)
+    request.reply(200, message_body=body, content_type=METRICS_CONTENT_TYPE)
+
+
+def reply_profile(request: Request):
+    """
+    Replies with the aggregated request profile as a `pstats` report. The query string may pick the order
+    (`sort`, one of `PROFILE_SORT_KEYS`), the functions listed (`limit`) and discard the stats once
+    reported (`reset=1`).
+
+    Params:
+    - `request` - the HTTP request object
+    """
+    fields = {name: values[-1] for name, values in parse_qs(request.path.partition('?')[2]).items()}
+    sort = fields.get('sort', 'cumulative')
+    try:
+        limit = int(fields.get('limit', DEFAULT_PROFILE_LIMIT))
+    except ValueError:
+        limit = -1
+    if sort not in PROFILE_SORT_KEYS or limit < 1:
+        request.reply_json({'err': f'sort must be one of {", ".join(PROFILE_SORT_KEYS)} and limit a positive integer'},
+                           status_code=400)
+        return
+    body = profiler.render(sort, limit).encode(DEFAULT_ENCODING)
+    if fields.get('reset') == '1':
+        profiler.reset()
+    request.reply(200, message_body=body, content_type='text/plain; charset=utf-8')
+
+
+def reply_slow_requests(request: Request):
+    """
+    Replies with the slowest recent requests and the time each of their phases took, as JSON
+
+    Params:
+    - `request` - the HTTP request object
+    """
+    body = slow_requests.render().encode(DEFAULT_ENCODING)
+    request.reply(200, message_body=body, content_type='application/json')
+
+
+config = ServerConfig()
+profiler = build_profiler(config)
+slow_requests = build_slow_request_log(config)
+site = Site(config)
+access_log = build_access_log(config)
+connection_limiter = build_connection_limiter(config)
+# Held while a reload builds the new site, so overlapping reloads apply in order
+reload_lock = threading.Lock()
+
+
+if __name__ == "__main__":
+    # Defaults to binding to localhost on port 8080, see `python server.py --help`
+    config = parse_args()
+    profiler = build_profiler(config)
+    slow_requests = build_slow_request_log(config)
+    site = Site(config)
+    access_log = build_access_log(config)
+    connection_limiter = build_connection_limiter(config)
 
     # Activate the server; this will keep running until you
     # interrupt the program with Ctrl-C
-    server.serve_forever()
+    try:
+        if config.mode == 'asyncio':
+            serve_async(config, route, connection_limiter, on_reload=reload_site, on_dump=dump_profile)
+        else:
+            serve(config, MyWebServer, on_worker_exit=close_access_log, connection_limiter=connection_limiter,
+                  on_reload=reload_site, on_dump=dump_profile)
+    finally:
+        close_access_log()
@@ -0,0 +1,575 @@
+#!/usr/bin/env python
+# Tests of the site features around the file server: starts the web server with the options under test,
+# serving a scratch directory where a test needs particular files, and checks what clients see of them.
+#
+# run: python sitetests.py
+# (SERVER_MODE=asyncio python sitetests.py to test another serving mode)
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from bundle import build_bundle
+from file_cache import FileCache
+from protocoltests import RawClient, ServerTestCase, get_request, start_server, stop_server
+
+PORT = 8085
+
+
+class SiteTestCase(ServerTestCase):
+    """Serves `FILES`, a mapping of relative path to contents, from a scratch directory if set"""
+
+    PORT = PORT
+    FILES = None
+
+    @classmethod
+    def setUpClass(cls):
+        if cls.FILES is None:
+            super().setUpClass()
+            return
+        cls.directory = tempfile.mkdtemp(prefix='sitetests-')
+        for path, content in cls.FILES.items():
+            cls.write_file(path, content)
+        cls.server = start_server(cls.PORT, '--directory', cls.directory, *cls.server_args())
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if cls.FILES is not None:
+            shutil.rmtree(cls.directory, ignore_errors=True)
+
+    @classmethod
+    def server_args(cls) -> tuple:
+        """`SERVER_ARGS`, overridden by tests that name paths in the scratch directory or prepare more in it"""
+        return cls.SERVER_ARGS
+
+    @classmethod
+    def write_file(cls, path: str, content: bytes):
+        file_path = os.path.join(cls.directory, path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'wb') as file:
+            file.write(content)
+
+
+class TestMetricsDisabled(SiteTestCase):
+
+    def test_not_served_by_default(self):
+        self.client.send(get_request('/-/metrics'))
+        self.assertEqual(self.client.read_response()[0], 404)
+
+
+class TestMetrics(SiteTestCase):
+
+    SERVER_ARGS = ('--metrics-path', '/-/metrics')
+
+    def test_served_when_configured(self):
+        self.client.send(get_request('/base.css') + get_request('/-/metrics'))
+        self.assertEqual(self.client.read_response()[0], 200)
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 200)
+        self.assertTrue(headers['content-type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn(b'# TYPE ', body)
+
+
+class TestMemoryMappedFiles(SiteTestCase):
+
+    FILES = {'large.bin': bytes(range(256)) * 1024}
+    # Without a file cache every file goes through the pool of memory maps
+    SERVER_ARGS = ('--cache-bytes', '0', '--mmap-bytes', str(1024 * 1024))
+
+    def test_whole_file(self):
+        self.client.send(get_request('/large.bin') * 2)
+        for _ in range(2):
+            status_code, headers, body = self.client.read_response()
+            self.assertEqual(status_code, 200)
+            self.assertEqual(headers['content-length'], str(len(self.FILES['large.bin'])))
+            self.assertEqual(body, self.FILES['large.bin'])
+
+    def test_range(self):
+        self.client.send(get_request('/large.bin', 'Range: bytes=1000-1999'))
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 206)
+        self.assertEqual(headers['content-range'], f'bytes 1000-1999/{len(self.FILES["large.bin"])}')
+        self.assertEqual(body, self.FILES['large.bin'][1000:2000])
+
+    def test_changed_file_is_remapped(self):
+        self.write_file('changed.bin', b'a' * 100000)
+        self.client.send(get_request('/changed.bin'))
+        self.assertEqual(self.client.read_response()[2], b'a' * 100000)
+        self.write_file('changed.bin', b'b' * 120000)
+        self.client.send(get_request('/changed.bin'))
+        self.assertEqual(self.client.read_response()[2], b'b' * 120000)
+
+
+class TestFileCache(SiteTestCase):
+
+    FILES = {'cached.txt': b'first version'}
+
+    def test_changed_file_is_reread(self):
+        self.client.send(get_request('/cached.txt') * 2)
+        for _ in range(2):
+            self.assertEqual(self.client.read_response()[2], b'first version')
+        # Same size, only the modification time tells the versions apart
+        self.write_file('cached.txt', b'other version')
+        self.client.send(get_request('/cached.txt'))
+        self.assertEqual(self.client.read_response()[2], b'other version')
+        self.write_file('cached.txt', b'third, longer version')
+        self.client.send(get_request('/cached.txt'))
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(headers['content-length'], '21')
+        self.assertEqual(body, b'third, longer version')
+
+
+class TestFileCacheEviction(unittest.TestCase):
+    """Checks the limits of `FileCache` directly, with heads left empty so each entry costs its file size"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='sitetests-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def file(self, name: str, size: int) -> str:
+        file_path = os.path.join(self.directory, name)
+        with open(file_path, 'wb') as file:
+            file.write(b'x' * size)
+        return file_path
+
+    def test_byte_budget(self):
+        cache = FileCache(max_bytes=100)
+        first, second, third = self.file('first', 40), self.file('second', 40), self.file('third', 40)
+        for file_path in [first, second, first, third]:
+            cache.get(file_path, lambda length, stat: b'')
+        # `first` was used after `second`, so `second` is the least recently used
+        self.assertIsNotNone(cache.peek(first))
+        self.assertIsNone(cache.peek(second))
+        self.assertIsNotNone(cache.peek(third))
+        stats = cache.stats()
+        self.assertEqual((stats['entries'], stats['bytes'], stats['evictions']), (2, 80, 1))
+
+    def test_max_entry_bytes(self):
+        cache = FileCache(max_bytes=100, max_entry_bytes=50)
+        self.assertIsNone(cache.get(self.file('large', 51), lambda length, stat: b''))
+        self.assertEqual(cache.get(self.file('small', 50), lambda length, stat: b'').body, b'x' * 50)
+        stats = cache.stats()
+        self.assertEqual((stats['entries'], stats['bytes'], stats['evictions']), (1, 50, 0))
+
+
+class TestRouter(SiteTestCase):
+
+    FILES = {'index.html': b'root', 'docs/page.txt': b'root docs', 'mounted/page.txt': b'mounted docs'}
+
+    @classmethod
+    def server_args(cls) -> tuple:
+        return ('--mount', '/docs=' + os.path.join(cls.directory, 'mounted'), '--redirect', '/old=/docs')
+
+    def test_longest_prefix_wins(self):
+        self.client.send(get_request('/docs/page.txt') + get_request('/docs-page.txt') + get_request('/'))
+        self.assertEqual(self.client.read_response()[2], b'mounted docs')
+        self.assertEqual(self.client.read_response()[0], 404)
+        self.assertEqual(self.client.read_response()[2], b'root')
+
+    def test_redirect(self):
+        self.client.send(get_request('/old/page.txt'))
+        status_code, headers, _ = self.client.read_response()
+        self.assertEqual(status_code, 301)
+        self.assertEqual(headers['location'], '/docs/page.txt')
+
+    def test_method_not_allowed(self):
+        self.client.send(b'DELETE /docs/page.txt HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n')
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 405)
+        self.assertEqual(headers['allow'], 'GET, HEAD, OPTIONS')
+        self.assertIn(b'Method not allowed', body)
+
+    def test_options(self):
+        self.client.send(b'OPTIONS /docs/page.txt HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n')
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 204)
+        self.assertEqual(headers['allow'], 'GET, HEAD, OPTIONS')
+        self.assertEqual(body, b'')
+
+
+class TestResponseHeads(SiteTestCase):
+
+    def read_head(self) -> list:
+        """
+        Returns:
+        The lines of the next response head, the status line first
+        """
+        lines = []
+        while True:
+            line = self.client.stream.readline().rstrip(b'\r\n')
+            if line == b'':
+                return lines
+            lines.append(line.decode('latin-1'))
+
+    def test_status_lines(self):
+        self.client.send(get_request('/base.css') + get_request('/missing') +
+                         b'DELETE / HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n')
+        for status_line in ['HTTP/1.1 200 OK', 'HTTP/1.1 404 Not Found', 'HTTP/1.1 405 Method Not Allowed']:
+            head = self.read_head()
+            self.assertEqual(head[0], status_line)
+            length = [line for line in head if line.lower().startswith('content-length:')]
+            self.assertEqual(len(length), 1)
+            self.client.stream.read(int(length[0].partition(':')[2]))
+
+    def test_prebuilt_replies_keep_connection_headers(self):
+        self.client.send(get_request('/missing') * 2 + get_request('/missing', 'Connection: close'))
+        keep_alive = []
+        for _ in range(2):
+            status_code, headers, body = self.client.read_response()
+            self.assertEqual(status_code, 404)
+            self.assertEqual(headers['content-type'], 'application/json')
+            self.assertIn('err', json.loads(body))
+            self.assertEqual(headers['connection'], 'keep-alive')
+            keep_alive.append(headers['keep-alive'])
+        # Each reply counts down the requests left on the connection
+        self.assertNotEqual(keep_alive[0], keep_alive[1])
+        status_code, headers, _ = self.client.read_response()
+        self.assertEqual(status_code, 404)
+        self.assertEqual(headers['connection'], 'close')
+        self.assertTrue(self.client.closed_by_server())
+
+
+class TestAutoIndex(SiteTestCase):
+
+    FILES = {'list/a.txt': b'a' * 3, 'list/b.txt': b'b' * 1, 'list/c.txt': b'c' * 2, 'list/sub/d.txt': b'd',
+             'indexed/index.html': b'index page'}
+    SERVER_ARGS = ('--autoindex', '--autoindex-page-size', '2')
+
+    def get_listing(self, path: str) -> dict:
+        self.client.send(get_request(path, 'Accept: application/json'))
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 200)
+        self.assertEqual(headers['content-type'], 'application/json')
+        return json.loads(body)
+
+    def test_html_listing(self):
+        self.client.send(get_request('/list/'))
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 200)
+        self.assertTrue(headers['content-type'].startswith('text/html'))
+        # Listings are generated while they are sent
+        self.assertEqual(headers['transfer-encoding'], 'chunked')
+        self.assertIn(b'Index of /list/', body)
+        self.assertIn(b'<a href="a.txt">a.txt</a>', body)
+        self.assertIn(b'Page 1 of 2, 4 entries', body)
+        self.assertIn(b'>Next</a>', body)
+
+    def test_pagination(self):
+        listing = self.get_listing('/list/?page=2')
+        self.assertEqual((listing['total'], listing['page'], listing['per_page']), (4, 2, 2))
+        self.assertEqual([entry['name'] for entry in listing['entries']], ['c.txt', 'sub'])
+        self.assertEqual(listing['entries'][1]['type'], 'directory')
+        listing = self.get_listing('/list/?sort=size&order=desc&per_page=3')
+        self.assertEqual([entry['name'] for entry in listing['entries']], ['a.txt', 'c.txt', 'b.txt'])
+
+    def test_listing_follows_changes(self):
+        self.assertEqual(self.get_listing('/list/sub/')['total'], 1)
+        self.write_file('list/sub/e.txt', b'e')
+        self.assertEqual([entry['name'] for entry in self.get_listing('/list/sub/')['entries']], ['d.txt', 'e.txt'])
+
+    def test_index_html_wins(self):
+        self.client.send(get_request('/indexed/'))
+        self.assertEqual(self.client.read_response()[2], b'index page')
+
+    def test_invalid_query(self):
+        self.client.send(get_request('/list/?page=0') + get_request('/list/?sort=colour'))
+        self.assertEqual(self.client.read_response()[0], 400)
+        self.assertEqual(self.client.read_response()[0], 400)
+
+
+class TestProfilingDisabled(SiteTestCase):
+
+    def test_not_served_by_default(self):
+        self.client.send(get_request('/-/slow-requests') + get_request('/-/profile'))
+        self.assertEqual(self.client.read_response()[0], 404)
+        self.assertEqual(self.client.read_response()[0], 404)
+
+
+class TestSlowRequests(SiteTestCase):
+
+    SERVER_ARGS = ('--slow-requests', '2')
+
+    def test_slow_requests(self):
+        # One connection is served by one process, whose log the last request reads
+        self.client.send(get_request('/base.css') + get_request('/index.html') + get_request('/deep/') +
+                         get_request('/-/slow-requests'))
+        for _ in range(3):
+            self.assertEqual(self.client.read_response()[0], 200)
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 200)
+        self.assertEqual(headers['content-type'], 'application/json')
+        slowest = json.loads(body)['requests']
+        self.assertEqual(len(slowest), 2)
+        self.assertGreaterEqual(slowest[0]['seconds'], slowest[1]['seconds'])
+        for entry in slowest:
+            self.assertIn(entry['path'], ['/base.css', '/index.html', '/deep/'])
+            self.assertEqual((entry['method'], entry['status'], entry['handler']), ('GET', 200, 'static'))
+            self.assertIn('send', entry['phases'])
+
+
+class TestProfiler(SiteTestCase):
+
+    SERVER_ARGS = ('--profile-sample-rate', '1')
+
+    def test_profile(self):
+        self.client.send(get_request('/base.css') + get_request('/-/profile?sort=tottime&limit=5') +
+                         get_request('/-/profile?sort=colour'))
+        self.assertEqual(self.client.read_response()[0], 200)
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 200)
+        self.assertTrue(headers['content-type'].startswith('text/plain'))
+        self.assertIn(b'requests profiled since', body)
+        self.assertIn(b'Ordered by: internal time', body)
+        self.assertEqual(self.client.read_response()[0], 400)
+
+
+class TestBundle(SiteTestCase):
+
+    FILES = {'site/index.html': b'<p>bundled</p>\n' * 50, 'site/deep/index.html': b'deep',
+             'site/data.bin': bytes(range(256))}
+
+    @classmethod
+    def server_args(cls) -> tuple:
+        cls.bundle_path = os.path.join(cls.directory, 'site.bundle')
+        build_bundle(os.path.join(cls.directory, 'site'), cls.bundle_path, ['gzip'])
+        return ('--bundle', cls.bundle_path, '--bundle-check-interval', '0.1', '--compression')
+
+    def test_files(self):
+        self.client.send(get_request('/') + get_request('/deep/') + get_request('/missing'))
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 200)
+        self.assertEqual(body, self.FILES['site/index.html'])
+        self.assertEqual(self.client.read_response()[2], b'deep')
+        self.assertEqual(self.client.read_response()[0], 404)
+
+    def test_directory_redirect(self):
+        self.client.send(get_request('/deep'))
+        status_code, headers, _ = self.client.read_response()
+        self.assertEqual(status_code, 301)
+        self.assertTrue(headers['location'].endswith('/deep/'))
+
+    def test_range(self):
+        self.client.send(get_request('/data.bin', 'Range: bytes=10-19'))
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 206)
+        self.assertEqual(headers['content-range'], 'bytes 10-19/256')
+        self.assertEqual(body, bytes(range(10, 20)))
+
+    def test_not_modified(self):
+        self.client.send(get_request('/data.bin'))
+        etag = self.client.read_response()[1]['etag']
+        self.client.send(get_request('/data.bin', f'If-None-Match: {etag}'))
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 304)
+        self.assertEqual(headers['etag'], etag)
+
+    def test_precompressed_variant(self):
+        self.client.send(get_request('/index.html', 'Accept-Encoding: gzip'))
+        status_code, headers, body = self.client.read_response()
+        self.assertEqual(status_code, 200)
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', headers['vary'])
+        self.assertEqual(gzip.decompress(body), self.FILES['site/index.html'])
+
+    def test_swapped_bundle(self):
+        # Runs last as tests run in name order, the others expect the first bundle
+        self.write_file('next/data.bin', b'next')
+        next_path = self.bundle_path + '.next'
+        build_bundle(os.path.join(self.directory, 'next'), next_path, [])
+        os.replace(next_path, self.bundle_path)
+        deadline = time.monotonic() + 3
+        while True:
+            self.client.send(get_request('/data.bin'))
+            body = self.client.read_response()[2]
+            if body == b'next' or time.monotonic() > deadline:
+                break
+            time.sleep(0.1)
+        self.assertEqual(body, b'next')
+
+
+class FileIndexTests:
+    """
+    Tests of a document root in `site/` under the scratch directory, served with `--file-index REFRESH`.
+    Next to it is a file the server must never serve, which symbolic links inside the root point to.
+    """
+
+    FILES = {'site/page.txt': b'page', 'site/dir/other.txt': b'other', 'secret.txt': b'secret'}
+    REFRESH = None
+
+    @classmethod
+    def server_args(cls) -> tuple:
+        root = os.path.join(cls.directory, 'site')
+        os.symlink(os.path.join(cls.directory, 'secret.txt'), os.path.join(root, 'link.txt'))
+        os.symlink(cls.directory, os.path.join(root, 'outside'))
+        return ('--directory', root, '--file-index', cls.REFRESH, '--file-index-poll-interval', '0.2')
+
+    def wait_for(self, path: str, status_code: int) -> bytes:
+        """
+        Requests `path` until it is answered with `status_code`, as the index picks up changes shortly after
+
+        Returns:
+        The body of that response
+        """
+        deadline = time.monotonic() + 3
+        while True:
+            self.client.send(get_request(path))
+            response = self.client.read_response()
+            if response[0] == status_code:
+                return response[2]
+            self.assertLess(time.monotonic(), deadline, f'{path} still answered with {response[0]}')
+            time.sleep(0.05)
+
+    def test_new_file(self):
+        self.write_file('site/new.txt', b'new')
+        self.assertEqual(self.wait_for('/new.txt', 200), b'new')
+        os.remove(os.path.join(self.directory, 'site/new.txt'))
+        self.wait_for('/new.txt', 404)
+
+    def test_new_directory(self):
+        self.write_file('site/added/deeper/file.txt', b'deeper')
+        self.assertEqual(self.wait_for('/added/deeper/file.txt', 200), b'deeper')
+        self.client.send(get_request('/added'))
+        self.assertEqual(self.client.read_response()[0], 301)
+
+    def test_directory_follows_index_html(self):
+        self.wait_for('/dir/', 404)
+        self.write_file('site/dir/index.html', b'dir index')
+        self.assertEqual(self.wait_for('/dir/', 200), b'dir index')
+        os.remove(os.path.join(self.directory, 'site/dir/index.html'))
+        self.wait_for('/dir/', 404)
+        self.assertEqual(self.wait_for('/dir/other.txt', 200), b'other')
+
+    def test_outside_root(self):
+        for path in ['/../secret.txt', '/%2e%2e/secret.txt', '/dir/../../secret.txt', '/link.txt',
+                     '/outside/secret.txt']:
+            with self.subTest(path=path):
+                self.client.send(get_request(path))
+                self.assertEqual(self.client.read_response()[0], 404)
+        self.client.send(get_request('/page.txt'))
+        self.assertEqual(self.client.read_response()[2], b'page')
+
+
+class TestInotifyFileIndex(FileIndexTests, SiteTestCase):
+
+    REFRESH = 'inotify'
+
+
+class TestPolledFileIndex(FileIndexTests, SiteTestCase):
+
+    REFRESH = 'poll'
+
+
+class AccessLogTestCase(SiteTestCase):
+    """Writes the access log to `access.log` in the scratch directory"""
+
+    FILES = {'page.txt': b'page'}
+    LOG_FORMAT = 'combined'
+
+    @classmethod
+    def server_args(cls) -> tuple:
+        cls.log_path = os.path.join(cls.directory, 'access.log')
+        return ('--access-log', cls.log_path, '--access-log-format', cls.LOG_FORMAT, *cls.SERVER_ARGS)
+
+    def logged_line(self, marker: str) -> str:
+        """
+        Returns:
+        The first line of the log holding `marker`, once the writer has flushed it
+        """
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            if os.path.exists(self.log_path):
+                with open(self.log_path, encoding='utf-8') as file:
+                    for line in file:
+                        if marker in line:
+                            return line.rstrip('\n')
+            time.sleep(0.1)
+        self.fail(f'{marker} never logged')
+
+
+class TestCombinedAccessLog(AccessLogTestCase):
+
+    def test_line(self):
+        self.client.send(get_request('/page.txt?combined', 'Referer: http://example.com/',
+                                     'User-Agent: agent "quoted" \\ name'))
+        self.assertEqual(self.client.read_response()[0], 200)
+        line = self.logged_line('/page.txt?combined')
+        self.assertRegex(line, r'^127\.0\.0\.1 - - \[[^]]+\] "GET /page\.txt\?combined HTTP/1\.1" 200 \d+ ')
+        # Quotes and backslashes sent by the client can't end their field early
+        self.assertTrue(line.endswith(' "http://example.com/" "agent \\"quoted\\" \\\\ name"'), line)
+
+    def test_missing_fields(self):
+        self.client.send(get_request('/missing?combined'))
+        self.assertEqual(self.client.read_response()[0], 404)
+        self.assertRegex(self.logged_line('/missing?combined'), r'" 404 \d+ "-" "-"$')
+
+
+class TestJsonAccessLog(AccessLogTestCase):
+
+    LOG_FORMAT = 'json'
+
+    def test_line(self):
+        self.client.send(get_request('/page.txt?json', 'User-Agent: agent "quoted" \\ name'))
+        status_code, _, body = self.client.read_response()
+        self.assertEqual(status_code, 200)
+        record = json.loads(self.logged_line('/page.txt?json'))
+        self.assertEqual((record['client'], record['method'], record['path'], record['protocol']),
+                         ('127.0.0.1', 'GET', '/page.txt?json', 'HTTP/1.1'))
+        self.assertEqual((record['status'], record['handler'], record['referer']), (200, 'static', None))
+        self.assertEqual(record['user_agent'], 'agent "quoted" \\ name')
+        self.assertGreater(record['bytes'], len(body))
+        self.assertGreaterEqual(record['duration_ms'], 0)
+
+
+class TestAccessLogRotation(AccessLogTestCase):
+
+    # Several worker processes append to the log, each finding it over the size limit at every write
+    SERVER_ARGS = ('--mode', 'prefork', '--workers', '4', '--access-log-max-bytes', '100',
+                   '--access-log-backups', '1000')
+    # One keep-alive client per worker, as each worker serves one connection at a time
+    CLIENTS = 4
+    REQUESTS = 100
+
+    def send_requests(self, client_index: int):
+        client = RawClient(self.PORT)
+        try:
+            for index in range(self.REQUESTS):
+                client.send(get_request(f'/page.txt?client={client_index}&request={index}'))
+                self.statuses.append(client.read_response()[0])
+                # Spread over a few seconds, so every worker writes several batches
+                time.sleep(0.03)
+        finally:
+            client.close()
+
+    def test_backups_shifted_once(self):
+        # Frees the worker serving the client of the test
+        self.client.close()
+        self.statuses = []
+        threads = [threading.Thread(target=self.send_requests, args=(index,)) for index in range(self.CLIENTS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.statuses, [200] * self.CLIENTS * self.REQUESTS)
+        # Stopping the server writes out what the workers still hold
+        stop_server(self.server)
+
+        names = [name for name in os.listdir(self.directory) if name.startswith('access.log')]
+        backups = sorted(int(name.rpartition('.')[2]) for name in names if name != 'access.log')
+        self.assertGreater(len(backups), 1)
+        # A generation shifted twice would leave a gap, or lose the lines of the one it overwrote
+        self.assertEqual(backups, list(range(1, len(backups) + 1)))
+        logged = set()
+        for name in names:
+            with open(os.path.join(self.directory, name), encoding='utf-8') as file:
+                logged.update(line.split('"')[1] for line in file if '?client=' in line)
+        self.assertEqual(len(logged), self.CLIENTS * self.REQUESTS)
+
+
+if __name__ == '__main__':
+    unittest.main()